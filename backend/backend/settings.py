@@ -52,6 +52,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'documents.metrics.MetricsMiddleware',
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True  # For development only
@@ -156,4 +157,170 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 os.makedirs(MEDIA_ROOT, exist_ok=True)
 # File upload settings
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
-DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
\ No newline at end of file
+DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
+
+# Background ingestion
+INGESTION_WORKERS = 2  # Documents processed concurrently per server process
+INGESTION_MAX_QUEUED = 32  # Jobs queued or running per server process
+INGESTION_BACKPRESSURE = 'queue'  # 'queue' leaves overflow pending in the DB, 'reject' returns 503
+INGESTION_STALE_AFTER = 300  # Seconds without a heartbeat before a 'processing' job is re-queued (running jobs beat every third of it)
+
+# Bulk upload (POST /api/documents/upload/bulk/)
+BULK_UPLOAD_MAX_FILES = 5000  # Files per request, counting archive members
+BULK_UPLOAD_MAX_FILE_SIZE = 100 * 1024 * 1024  # Larger files or archive members are skipped
+DATA_UPLOAD_MAX_NUMBER_FILES = BULK_UPLOAD_MAX_FILES  # Django's own per-request cap (default 100)
+BULK_INGEST_WORKERS = None  # Processes extracting and chunking files (None = CPU count)
+BULK_EMBED_BATCH_SIZE = 1024  # Chunks per embedding call, packed across documents
+
+# Local LLM (Ollama)
+OLLAMA_URL = 'http://localhost:11434'
+OLLAMA_MODEL = 'llama2'
+OLLAMA_OPTIONS = {
+    'temperature': 0.3,
+    'top_p': 0.9,
+    'num_predict': 300,  # Maximum number of tokens to generate
+}
+OLLAMA_MAX_IN_FLIGHT = 2  # Concurrent generations sent to Ollama; further requests wait in FIFO order
+OLLAMA_POOL_SIZE = 10  # Keep-alive connections kept open to Ollama
+OLLAMA_TIMEOUT = 60  # Default per-request deadline in seconds, including time spent waiting for a slot
+OLLAMA_CONNECT_TIMEOUT = 5
+OLLAMA_MAX_TIMEOUT = 300  # Upper bound for a client-supplied 'timeout'
+ASYNC_BLOCKING_WORKERS = 8  # Threads for encoding, retrieval and SQLite work of the /api/async/ views
+
+# Document listing (GET /api/documents/): keyset pages, newest first
+DOCUMENT_PAGE_SIZE = 100
+DOCUMENT_PAGE_MAX_SIZE = 1000
+DEBUG_STATUS_DOCUMENTS = 50  # Most recent documents listed by /debug/
+
+# Batch query endpoint
+BATCH_QUERY_MAX_QUESTIONS = 100
+BATCH_QUERY_CONCURRENCY = 4  # Generations started at once per batch; Ollama still sees at most OLLAMA_MAX_IN_FLIGHT
+
+# Context assembly between retrieval and generation
+# Off by default: it changes which chunks reach the model, and so every answer, and its answer quality
+# has not been measured against the plain top chunks (benchmarks.context_packing compares the two)
+CONTEXT_PACKING_ENABLED = False  # False sends the top chunks joined as retrieved
+CONTEXT_FETCH_FACTOR = 4  # Candidates retrieved per context chunk
+CONTEXT_MMR_LAMBDA = 0.7  # 1.0 ranks by relevance only; lower values favour chunks unlike those already picked
+CONTEXT_DEDUPE_SIMILARITY = 0.95  # Cosine similarity at which a candidate counts as a duplicate
+CONTEXT_MERGE_ADJACENT = True  # Join consecutive chunks of a document, without their overlap
+CONTEXT_MAX_TOKENS = 1500  # Context budget; llama2's 4096-token window also holds the prompt and the answer
+CONTEXT_CHARS_PER_TOKEN = 4.0  # Token estimate for the generation model's tokenizer
+
+# Confidence gating after retrieval, by cosine similarity of the question to the best chunk:
+# below NOT_FOUND no LLM call and a "not found" answer; at or above EXTRACTIVE the best matching
+# sentences of the retrieved chunks are returned with chunk references; in between, generation.
+# Off by default: the thresholds depend on the embedding model and corpus, so turn it on once the
+# answer paths have been checked on yours (benchmarks.suite --confidence-gating reports the split)
+CONFIDENCE_GATING_ENABLED = False
+CONFIDENCE_NOT_FOUND_SIMILARITY = 0.15
+CONFIDENCE_EXTRACTIVE_SIMILARITY = 0.8
+CONFIDENCE_SENTENCE_SIMILARITY = 0.7  # An extractive answer also needs a sentence at least this close
+CONFIDENCE_MAX_SENTENCES = 2
+
+# Local data written by the RAG engine (caches, indexes)
+RAG_DATA_DIR = BASE_DIR / 'rag_data'
+
+# The encoder and vector store load on first use. With RAG_WARMUP, server processes (runserver,
+# gunicorn, uvicorn, or any process started with RAG_SERVER_PROCESS=1) load them in the background
+# at boot; GET /api/ready/ returns 200 once warm. Server processes always start the ingestion
+# queue's job recovery at boot, whatever this setting.
+RAG_WARMUP = False
+
+# Answer cache
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_PATH = RAG_DATA_DIR / 'answer_cache.sqlite3'
+# Off by default: a paraphrase above the threshold can still ask something else and get its answer
+ANSWER_CACHE_SEMANTIC = False
+ANSWER_CACHE_SIMILARITY = 0.92  # Cosine similarity above which a paraphrased question is a hit
+ANSWER_CACHE_TTL = 24 * 60 * 60  # Seconds
+ANSWER_CACHE_MAX_ENTRIES = 5000
+ANSWER_CACHE_MAX_BYTES = 50 * 1024 * 1024  # Disk budget; embeddings of live entries are also held in memory
+
+# Per-document chunk counts used by the query path instead of extra vector searches
+DOCUMENT_INDEX_PATH = RAG_DATA_DIR / 'document_index.sqlite3'
+
+# Embeddings
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_PATH = RAG_DATA_DIR / 'embedding_cache.sqlite3'
+EMBEDDING_CACHE_MAX_ENTRIES = 500000  # About 1.6 KB each on disk for 384-dimensional vectors
+EMBEDDING_DIM = 384
+EMBEDDING_BATCH_ENABLED = True  # Micro-batch concurrent query encodes into one encoder call
+EMBEDDING_BATCH_MAX_SIZE = 32  # Questions per batch
+EMBEDDING_BATCH_MAX_WAIT = 0.005  # Seconds the first question waits for others to join
+
+# Vector store: 'chroma' (ChromaDB collection) or 'local' (in-process memory-mapped index).
+# The stores do not share data: re-upload documents and delete DOCUMENT_INDEX_PATH after switching.
+VECTOR_STORE = 'chroma'
+CHROMADB_PATH = './chromadb_data'
+CHROMADB_COLLECTION = 'documents'
+LOCAL_VECTOR_STORE_PATH = RAG_DATA_DIR / 'local_index'
+LOCAL_VECTOR_STORE_DTYPE = 'float32'  # 'float16' or 'int8' (per-vector scales) cut the scored matrix 2x / ~4x
+LOCAL_VECTOR_STORE_RESCORE = 0  # If > 0, keep float32 copies on disk and re-rank the best n_results * N exactly
+
+# Sharding: split chunks over one collection per shard. Document-scoped calls touch their shard only;
+# searches over all documents query the shards in parallel. Turning it on leaves existing chunks in
+# the unsharded collection (still searched) until `python manage.py split_collection` moves them.
+SHARDING_ENABLED = False
+SHARD_KEY = 'hash'  # 'hash' buckets document ids into SHARD_COUNT shards, 'tenant' uses the upload's tenant field
+SHARD_COUNT = 8
+SHARD_QUERY_WORKERS = 8  # Threads fanning a search out over the shards
+
+# Document routing: searches across all documents first pick the documents whose summary vectors
+# (centroid or k-means centres of their chunks) are closest, then score chunks of those only.
+# Off by default: it can return worse chunks without falling back, so turn it on once the routed
+# recall that benchmarks.suite reports for the query scenario is good enough on your corpus
+ROUTING_ENABLED = False
+ROUTING_INDEX_PATH = RAG_DATA_DIR / 'document_router.sqlite3'
+ROUTING_TOP_DOCUMENTS = 16  # Documents searched per question; 0 scores every chunk
+ROUTING_REPRESENTATIVES = 4  # Summary vectors per document at most (one per 16 chunks)
+ROUTING_MIN_DOCUMENTS = 64  # Smaller collections are searched flat
+ROUTING_EXACT_FALLBACK = True  # Search everything when the routed documents return fewer than n_results chunks
+
+# Chunking
+CHUNKER = 'tokens'  # 'tokens' packs sentences up to CHUNK_MAX_TOKENS model tokens, 'chars' uses chunk_text's 500-character rule
+CHUNK_MAX_TOKENS = 256  # Capped at the encoder window; 2 tokens are reserved for [CLS]/[SEP]
+CHUNK_OVERLAP_TOKENS = 32  # Trailing sentences repeated at the start of the next chunk
+CHUNK_ANCHOR_EVERY = 4  # Average paragraphs per content-defined section; edits only re-embed their own section
+
+# Ingestion pipeline
+INGEST_READ_BLOCK_SIZE = 1024 * 1024  # Characters read from the file at a time
+INGEST_BATCH_SIZE = 256  # Chunks per embedding batch and per ChromaDB write
+PDF_EXTRACT_WORKERS = None  # Processes for page-parallel PDF extraction (None = CPU count)
+PDF_PARALLEL_MIN_PAGES = 32  # Smaller PDFs are extracted in-process
+PDF_PAGES_PER_TASK = 16
+
+# Logging and metrics (GET /metrics serves Prometheus text for this process)
+LOG_LEVEL = os.environ.get('DJANGO_LOG_LEVEL', 'INFO')
+LOG_SAMPLE_RATE = 1.0  # Fraction of DEBUG/INFO records kept on hot paths; warnings and errors are always logged
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sampled': {
+            '()': 'documents.metrics.SampledFilter',
+            'rate': LOG_SAMPLE_RATE,
+        },
+    },
+    'formatters': {
+        'plain': {
+            'format': '%(asctime)s %(levelname)s %(name)s: %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'plain',
+            'filters': ['sampled'],
+        },
+    },
+    'loggers': {
+        'documents': {
+            'handlers': ['console'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+    },
+}
@@ -22,5 +22,6 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('documents.urls')),
     path('debug/', views.debug_status),
+    path('metrics', views.metrics),
 
 ]
@@ -0,0 +1,118 @@
+"""Token-aware chunking against the character-based RAGEngine.chunk_text.
+
+Reports chunking throughput and what each chunk set costs the encoder:
+chunk count, tokens actually embedded, and tokens lost to truncation at
+the model window.
+
+Usage (from the backend directory):
+    python -m benchmarks.chunking media/*.txt [--synthetic-mb 5] [--overlap 32] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from sentence_transformers import SentenceTransformer  # noqa: E402
+
+from documents.pipeline import CharChunker, TokenChunker, iter_chunks  # noqa: E402
+
+WORDS = ("system data model report policy energy market quantum network risk value process "
+         "analysis result growth crisis climate research method signal").split()
+
+
+def synthetic_text(megabytes, seed=0):
+    rng = random.Random(seed)
+    paragraphs = []
+    size = 0
+    while size < megabytes * 1e6:
+        sentences = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 40))).capitalize() + rng.choice('.!?')
+                     for _ in range(rng.randint(1, 10))]
+        paragraphs.append(" ".join(sentences))
+        size += len(paragraphs[-1]) + 2
+    return "\n\n".join(paragraphs)
+
+
+def chunk_text_baseline(text):
+    # Same algorithm as RAGEngine.chunk_text, without loading the engine
+    chunker = CharChunker(500)
+    return [chunk for _, chunk in chunker.feed(text) + chunker.finish()]
+
+
+def token_chunks(tokenizer, max_tokens, overlap):
+    def run(text):
+        pieces = [(text, True)]
+        factory = lambda start_offset=0: TokenChunker(tokenizer, max_tokens, overlap, start_offset)  # noqa: E731
+        return [chunk for _, chunk in iter_chunks(pieces, factory)]
+    return run
+
+
+def measure(name, chunker, text, tokenizer, window, batch_size):
+    start = time.perf_counter()
+    chunks = chunker(text)
+    elapsed = time.perf_counter() - start
+
+    lengths = [len(ids) for ids in tokenizer(chunks, add_special_tokens=False)['input_ids']] if chunks else []
+    usable = window - 2
+    return {
+        'chunker': name,
+        'seconds': elapsed,
+        'mb_per_s': len(text.encode('utf-8')) / 1e6 / (elapsed or 1e-9),
+        'chunks': len(chunks),
+        'encoder_batches': -(-len(chunks) // batch_size),
+        'avg_tokens': sum(lengths) / len(lengths) if lengths else 0,
+        'max_tokens': max(lengths, default=0),
+        'truncated_chunks': sum(1 for n in lengths if n > usable),
+        'truncated_tokens': sum(max(n - usable, 0) for n in lengths),
+        'embedded_tokens': sum(min(n, usable) for n in lengths),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--synthetic-mb', type=float, default=0, help='Add a generated document of this size')
+    parser.add_argument('--overlap', type=int, default=getattr(settings, 'CHUNK_OVERLAP_TOKENS', 32))
+    parser.add_argument('--batch-size', type=int, default=32, help='Encoder batch size for the cost estimate')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    args = parser.parse_args()
+
+    texts = []
+    for path in args.files:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            texts.append(f.read())
+    if args.synthetic_mb or not texts:
+        texts.append(synthetic_text(args.synthetic_mb or 2))
+    text = "\n\n".join(texts)
+
+    encoder = SentenceTransformer(getattr(settings, 'EMBEDDING_MODEL', 'all-MiniLM-L6-v2'))
+    window = encoder.max_seq_length or 256
+    max_tokens = min(getattr(settings, 'CHUNK_MAX_TOKENS', 256), window) - 2
+
+    results = [
+        measure('chunk_text (500 chars)', chunk_text_baseline, text, encoder.tokenizer, window, args.batch_size),
+        measure(f'tokens ({max_tokens}, overlap {args.overlap})',
+                token_chunks(encoder.tokenizer, max_tokens, args.overlap), text, encoder.tokenizer, window, args.batch_size),
+    ]
+
+    if args.json:
+        print(json.dumps({'input_mb': len(text.encode('utf-8')) / 1e6, 'window': window, 'results': results}, indent=2))
+        return
+
+    print(f"Input: {len(text.encode('utf-8')) / 1e6:.2f} MB, encoder window {window} tokens")
+    columns = ['seconds', 'mb_per_s', 'chunks', 'encoder_batches', 'avg_tokens', 'max_tokens',
+               'truncated_chunks', 'truncated_tokens', 'embedded_tokens']
+    print(f"{'chunker':<28}" + "".join(f"{column:>18}" for column in columns))
+    for row in results:
+        print(f"{row['chunker']:<28}" + "".join(
+            f"{row[column]:>18.3f}" if isinstance(row[column], float) else f"{row[column]:>18}" for column in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Prompt size and generation latency with and without context packing.
+
+Questions are taken from --questions (one per line) or built from sentences
+of randomly sampled stored chunks, so the documents must be ingested first.
+For every question the candidates are retrieved once; the old context (top
+n_results chunks joined as retrieved) and the packed context (MMR, dedupe,
+merged neighbours, token budget) are then compared by estimated tokens.
+With --generate both prompts are sent to Ollama, alternating which goes
+first, and wall-clock latency plus Ollama's own prompt_eval_count /
+prompt_eval_duration are reported.
+
+Usage (from the backend directory):
+    python -m benchmarks.context_packing [--questions file.txt] [--count 50] [--n-results 3] [--generate] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+django.setup()
+
+import numpy as np  # noqa: E402
+
+from documents.context_packing import ContextPacker  # noqa: E402
+from documents.registry import get_engine  # noqa: E402
+
+
+def sample_questions(engine, count, seed=0):
+    rng = random.Random(seed)
+    ids = engine.store.get(include=[])['ids']
+    if not ids:
+        raise SystemExit("The vector store is empty; ingest some documents first")
+    chunks = engine.store.get(ids=rng.sample(ids, min(count, len(ids))), include=['documents'])['documents']
+    questions = []
+    for chunk in chunks:
+        sentences = [sentence.strip() for sentence in chunk.split('.') if len(sentence.split()) >= 5]
+        if sentences:
+            questions.append(rng.choice(sentences) + "?")
+    return questions
+
+
+def timed_generation(engine, question, context):
+    before = engine.llm.stats()
+    start = time.perf_counter()
+    engine._generate(question, context)
+    elapsed = time.perf_counter() - start
+    after = engine.llm.stats()
+    return elapsed, after['prompt_tokens'] - before['prompt_tokens'], \
+        after['prompt_eval_seconds'] - before['prompt_eval_seconds']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', help='File with one question per line')
+    parser.add_argument('--count', type=int, default=50, help='Questions to sample when --questions is not given')
+    parser.add_argument('--n-results', type=int, default=3)
+    parser.add_argument('--generate', action='store_true', help='Also time generations against Ollama')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    args = parser.parse_args()
+
+    engine = get_engine()
+    packer = engine.context_packer or ContextPacker.from_settings() or ContextPacker()
+    engine.context_packer = packer  # retrieve() over-fetches candidates only when packing is on
+
+    if args.questions:
+        with open(args.questions) as f:
+            questions = [line.strip() for line in f if line.strip()]
+    else:
+        questions = sample_questions(engine, args.count)
+
+    embeddings = engine.encoder.encode(questions)
+    outcomes = engine.retrieve_batch(questions, [None] * len(questions), args.n_results, embeddings)
+
+    rows = {'joined': [], 'packed': []}
+    for question, embedding, (results, message) in zip(questions, embeddings, outcomes):
+        if message:
+            continue
+        contexts = {
+            'joined': "\n\n".join(results['documents'][0][:args.n_results]),
+            'packed': packer.pack(embedding, results, args.n_results)[0],
+        }
+        order = ['joined', 'packed'] if len(rows['joined']) % 2 == 0 else ['packed', 'joined']
+        for mode in order:
+            row = {'tokens': packer.count_tokens(contexts[mode]), 'chars': len(contexts[mode])}
+            if args.generate:
+                row['latency_s'], row['prompt_tokens'], row['prompt_eval_s'] = \
+                    timed_generation(engine, question, contexts[mode])
+            rows[mode].append(row)
+
+    if not rows['joined']:
+        raise SystemExit("No question retrieved any context")
+
+    summary = {'questions': len(rows['joined']), 'n_results': args.n_results,
+               'fetch_factor': packer.fetch_factor, 'max_tokens': packer.max_tokens}
+    for mode, mode_rows in rows.items():
+        summary[mode] = {'mean_tokens': float(np.mean([row['tokens'] for row in mode_rows]))}
+        if args.generate:
+            latencies = [row['latency_s'] for row in mode_rows]
+            summary[mode].update({
+                'p50_latency_ms': float(np.percentile(latencies, 50)) * 1000,
+                'mean_latency_ms': float(np.mean(latencies)) * 1000,
+                'mean_prompt_tokens': float(np.mean([row['prompt_tokens'] for row in mode_rows])),
+                'mean_prompt_eval_ms': float(np.mean([row['prompt_eval_s'] for row in mode_rows])) * 1000,
+            })
+    joined, packed = summary['joined'], summary['packed']
+    summary['tokens_saved_ratio'] = 1 - packed['mean_tokens'] / joined['mean_tokens'] if joined['mean_tokens'] else 0.0
+    if args.generate:
+        summary['latency_change_ratio'] = packed['mean_latency_ms'] / joined['mean_latency_ms'] - 1
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(f"{summary['questions']} questions, n_results={args.n_results}, "
+          f"fetch x{packer.fetch_factor}, budget {packer.max_tokens} tokens")
+    for mode in ('joined', 'packed'):
+        print(f"{mode:<8}" + "".join(f"  {key}={value:.1f}" for key, value in summary[mode].items()))
+    print(f"tokens saved: {summary['tokens_saved_ratio']:.1%}")
+    if args.generate:
+        print(f"latency change: {summary['latency_change_ratio']:+.1%}")
+
+
+if __name__ == '__main__':
+    main()
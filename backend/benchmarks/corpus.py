@@ -0,0 +1,101 @@
+"""Synthetic, seeded document corpus with questions whose source is known.
+
+Each document is written around one topic: its sentences mix that topic's
+vocabulary with common filler, so retrieval has something to find. Questions
+are built from sentences of the documents, and manifest.json records which
+file each question came from, so the suite can report retrieval hit rate
+next to latency.
+
+Usage (from the backend directory):
+    python -m benchmarks.corpus OUTPUT_DIR [--documents 200] [--kb 8] [--questions 200] [--seed 0]
+"""
+import argparse
+import json
+import os
+import random
+
+TOPICS = {
+    'energy': "turbine grid solar wind battery storage megawatt tariff emissions carbon reactor".split(),
+    'finance': "revenue margin dividend liquidity equity bond interest audit ledger forecast".split(),
+    'health': "patient clinic vaccine dosage symptom trial diagnosis therapy nurse hospital".split(),
+    'legal': "contract clause liability indemnity arbitration tenant breach warranty notice court".split(),
+    'computing': "qubit processor compiler cache kernel latency network cluster memory thread".split(),
+    'climate': "glacier drought rainfall ocean warming flood ecosystem forest coastline heatwave".split(),
+    'logistics': "warehouse shipment freight container route pallet customs inventory carrier port".split(),
+    'education': "student curriculum teacher exam lecture campus tuition syllabus grade library".split(),
+}
+FILLER = ("the a of and to in is that for with as on by this which are from was be report "
+          "section figure results shows during under each annual new".split())
+
+
+def _sentence(rng, vocabulary):
+    words = [rng.choice(vocabulary) if rng.random() < 0.35 else rng.choice(FILLER)
+             for _ in range(rng.randint(8, 24))]
+    return " ".join(words).capitalize() + "."
+
+
+def document_text(rng, topic, kilobytes):
+    vocabulary = TOPICS[topic]
+    paragraphs = []
+    size = 0
+    while size < kilobytes * 1024:
+        paragraph = " ".join(_sentence(rng, vocabulary) for _ in range(rng.randint(2, 8)))
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 2
+    return "\n\n".join(paragraphs)
+
+
+def question_from(rng, text):
+    """A question made of the words of one sentence of text"""
+    sentences = [sentence for sentence in text.replace("\n", " ").split(". ") if len(sentence.split()) >= 8]
+    words = rng.choice(sentences).rstrip('.').split()
+    start = rng.randint(0, max(0, len(words) - 8))
+    return "What does the document say about " + " ".join(words[start:start + 8]).lower() + "?"
+
+
+def generate(output_dir, documents=200, kilobytes=8, questions=200, seed=0):
+    """Write the corpus and manifest.json to output_dir; returns the manifest"""
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    files = []
+    texts = []
+    for index in range(documents):
+        topic = rng.choice(sorted(TOPICS))
+        # Sizes vary around the mean so chunk counts differ between documents
+        text = document_text(rng, topic, kilobytes * rng.uniform(0.5, 1.5))
+        name = f"{topic}_{index:05d}.txt"
+        with open(os.path.join(output_dir, name), 'w', encoding='utf-8') as f:
+            f.write(text)
+        files.append({'name': name, 'topic': topic, 'size': len(text.encode('utf-8'))})
+        texts.append(text)
+
+    manifest = {
+        'seed': seed,
+        'documents': files,
+        'questions': [],
+    }
+    for _ in range(questions):
+        index = rng.randrange(documents)
+        manifest['questions'].append({'question': question_from(rng, texts[index]), 'source': files[index]['name']})
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output_dir')
+    parser.add_argument('--documents', type=int, default=200)
+    parser.add_argument('--kb', type=float, default=8, help='Mean document size in KB')
+    parser.add_argument('--questions', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    manifest = generate(args.output_dir, args.documents, args.kb, args.questions, args.seed)
+    size = sum(document['size'] for document in manifest['documents'])
+    print(f"Wrote {len(manifest['documents'])} documents ({size / 1e6:.1f} MB) "
+          f"and {len(manifest['questions'])} questions to {args.output_dir}")
+
+
+if __name__ == '__main__':
+    main()
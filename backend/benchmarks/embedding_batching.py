@@ -0,0 +1,146 @@
+"""Per-request question encoding against the micro-batching EmbeddingDispatcher.
+
+Simulates concurrent /query/ traffic: N clients each encode one question at
+a time, back to back, either with encoder.encode([question]) (the old path)
+or through the dispatcher. Reports throughput, p50/p99 latency and the mean
+batch the encoder actually saw. --asyncio drives the same load from one
+event loop (dispatcher.aencode vs encode in the default executor), as an
+ASGI server would.
+
+Usage (from the backend directory):
+    python -m benchmarks.embedding_batching [--concurrency 1 8 32 64] [--requests 2000] [--max-wait-ms 5] [--json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+django.setup()
+
+import numpy as np  # noqa: E402
+from django.conf import settings  # noqa: E402
+from sentence_transformers import SentenceTransformer  # noqa: E402
+
+from documents.embedding_dispatcher import EmbeddingDispatcher  # noqa: E402
+
+WORDS = ("what which when how does the policy report energy market model risk growth climate "
+         "contract payment term clause revenue table figure section summary").split()
+
+
+def questions(count, seed=0):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 14))) + "?" for _ in range(count)]
+
+
+def summarize(mode, concurrency, latencies, elapsed, dispatcher=None):
+    result = {
+        'mode': mode,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'qps': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)) * 1000,
+        'p99_ms': float(np.percentile(latencies, 99)) * 1000,
+        'mean_batch': dispatcher.stats()['mean_batch_size'] if dispatcher else 1.0,
+    }
+    return result
+
+
+def run_threads(encode, texts, concurrency):
+    latencies = []
+    lock = threading.Lock()
+    position = [0]
+
+    def client():
+        while True:
+            with lock:
+                if position[0] >= len(texts):
+                    return
+                text = texts[position[0]]
+                position[0] += 1
+            began = time.perf_counter()
+            encode([text])
+            elapsed = time.perf_counter() - began
+            with lock:
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - start
+
+
+def run_asyncio(encode_async, texts, concurrency):
+    latencies = []
+
+    async def client(queue):
+        while queue:
+            text = queue.pop()
+            began = time.perf_counter()
+            await encode_async([text])
+            latencies.append(time.perf_counter() - began)
+
+    async def main():
+        queue = list(texts)
+        await asyncio.gather(*(client(queue) for _ in range(concurrency)))
+
+    start = time.perf_counter()
+    asyncio.run(main())
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 64])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--max-batch', type=int, default=getattr(settings, 'EMBEDDING_BATCH_MAX_SIZE', 32))
+    parser.add_argument('--max-wait-ms', type=float, default=getattr(settings, 'EMBEDDING_BATCH_MAX_WAIT', 0.005) * 1000)
+    parser.add_argument('--asyncio', action='store_true', help='Drive the load from an event loop')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    args = parser.parse_args()
+
+    encoder = SentenceTransformer(getattr(settings, 'EMBEDDING_MODEL', 'all-MiniLM-L6-v2'))
+    encoder.encode(questions(8, seed=99))  # Warm up
+    texts = questions(args.requests)
+
+    results = []
+    for concurrency in args.concurrency:
+        dispatcher = EmbeddingDispatcher(lambda: encoder, max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000)
+        if args.asyncio:
+            executor = ThreadPoolExecutor(max_workers=concurrency)
+
+            async def direct(batch):
+                return await asyncio.get_running_loop().run_in_executor(executor, encoder.encode, batch)
+
+            results.append(summarize('per-request', concurrency, *run_asyncio(direct, texts, concurrency)))
+            results.append(summarize('dispatcher', concurrency, *run_asyncio(dispatcher.aencode, texts, concurrency),
+                                     dispatcher=dispatcher))
+            executor.shutdown()
+        else:
+            results.append(summarize('per-request', concurrency, *run_threads(encoder.encode, texts, concurrency)))
+            results.append(summarize('dispatcher', concurrency, *run_threads(dispatcher.encode, texts, concurrency),
+                                     dispatcher=dispatcher))
+
+    if args.json:
+        print(json.dumps({'max_batch': args.max_batch, 'max_wait_ms': args.max_wait_ms,
+                          'asyncio': args.asyncio, 'results': results}, indent=2))
+        return
+
+    columns = ['concurrency', 'qps', 'p50_ms', 'p99_ms', 'mean_batch']
+    print(f"{'mode':<14}" + "".join(f"{column:>14}" for column in columns))
+    for row in results:
+        print(f"{row['mode']:<14}" + "".join(
+            f"{row[column]:>14.2f}" if isinstance(row[column], float) else f"{row[column]:>14}" for column in columns))
+
+
+if __name__ == '__main__':
+    main()
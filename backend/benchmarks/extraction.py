@@ -0,0 +1,80 @@
+"""Per-format extraction throughput.
+
+Usage (from the backend directory):
+    python -m benchmarks.extraction media/*.txt manuals/*.pdf [--pdf-workers 1 4] [--json]
+"""
+import argparse
+import json
+import os
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+django.setup()
+
+from documents.extractors import PdfExtractor, get_extractor  # noqa: E402
+
+
+def measure(extractor, file_path):
+    start = time.perf_counter()
+    pages = set()
+    chars = 0
+    for page, text in extractor.iter_segments(str(file_path)):
+        pages.add(page)
+        chars += len(text)
+    elapsed = time.perf_counter() - start
+    return {
+        'seconds': elapsed,
+        'bytes': os.path.getsize(file_path),
+        'chars': chars,
+        'pages': len(pages - {None}),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--pdf-workers', type=int, nargs='*', default=[],
+                        help='Also run PDFs with these worker counts (1 = serial)')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    args = parser.parse_args()
+
+    totals = defaultdict(lambda: {'files': 0, 'seconds': 0.0, 'bytes': 0, 'chars': 0, 'pages': 0})
+    for file_path in map(Path, args.files):
+        runs = [(get_extractor(file_path).name, get_extractor(file_path))]
+        if file_path.suffix.lower() == '.pdf':
+            runs += [(f"pdf[workers={workers}]", PdfExtractor(workers=workers, parallel_min_pages=1))
+                     for workers in args.pdf_workers]
+        for label, extractor in runs:
+            result = measure(extractor, file_path)
+            total = totals[label]
+            total['files'] += 1
+            for key, value in result.items():
+                total[key] += value
+
+    report = {}
+    for label, total in sorted(totals.items()):
+        seconds = total['seconds'] or 1e-9
+        report[label] = {
+            **total,
+            'mb_per_s': total['bytes'] / 1e6 / seconds,
+            'chars_per_s': total['chars'] / seconds,
+            'pages_per_s': total['pages'] / seconds if total['pages'] else None,
+        }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{'format':<18}{'files':>6}{'MB':>10}{'pages':>8}{'seconds':>10}{'MB/s':>10}{'pages/s':>10}")
+    for label, row in report.items():
+        pages_per_s = f"{row['pages_per_s']:.1f}" if row['pages_per_s'] else '-'
+        print(f"{label:<18}{row['files']:>6}{row['bytes'] / 1e6:>10.2f}{row['pages']:>8}"
+              f"{row['seconds']:>10.3f}{row['mb_per_s']:>10.2f}{pages_per_s:>10}")
+
+
+if __name__ == '__main__':
+    main()
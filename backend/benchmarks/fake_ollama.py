@@ -0,0 +1,189 @@
+"""Local stand-in for the Ollama HTTP API, for benchmarks without a GPU or network.
+
+Serves POST /api/generate (streaming NDJSON and non-streaming) and GET
+/api/tags. A generation costs a prompt-evaluation delay (first token
+latency plus prompt tokens / prompt rate) and then response_tokens tokens
+at tokens_per_second. At most `parallel` generations run at once, like
+OLLAMA_NUM_PARALLEL; the rest wait in line. The usage counters
+(prompt_eval_count, eval_count, durations in ns) are reported the way
+Ollama reports them, with prompt tokens estimated as characters / 4.
+active and peak_active count the generation requests open at once, which
+shows how many requests a backend actually has waiting on the LLM.
+
+Usage (from the backend directory):
+    python -m benchmarks.fake_ollama [--port 11435] [--tokens-per-second 40] [--first-token-ms 150] [--parallel 4]
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("the document states that results depend on the reported figures and "
+         "the policy described in the relevant section").split()
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections (or exiting) are expected here
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+class FakeOllama:
+    def __init__(self, host='127.0.0.1', port=11435, tokens_per_second=40.0, first_token_ms=150.0,
+                 prompt_tokens_per_second=2000.0, response_tokens=40, parallel=4):
+        self.tokens_per_second = tokens_per_second
+        self.first_token_ms = first_token_ms
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.response_tokens = response_tokens
+        self._slots = threading.BoundedSemaphore(parallel)
+        self._lock = threading.Lock()
+        self.generations = 0
+        self.active = 0  # Generation requests open right now, queued or running
+        self.peak_active = 0
+
+        self.server = _Server((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve from a background thread; port 0 picks a free port (see url)"""
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-ollama', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _count_generation(self):
+        # Counted before the final write, so a client that has its answer also sees the count
+        with self._lock:
+            self.generations += 1
+
+    def _tokens(self):
+        return [(" " if i else "") + WORDS[i % len(WORDS)] for i in range(self.response_tokens)]
+
+    def _usage(self, prompt, started, prompt_seconds, eval_seconds):
+        return {
+            'prompt_eval_count': max(1, len(prompt) // 4),
+            'prompt_eval_duration': int(prompt_seconds * 1e9),
+            'eval_count': self.response_tokens,
+            'eval_duration': int(eval_seconds * 1e9),
+            'total_duration': int((time.perf_counter() - started) * 1e9),
+        }
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _write_chunk(self, payload):
+                line = (json.dumps(payload) + "\n").encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path.rstrip('/') == '/api/tags':
+                    self._send_json(200, {'models': [{'name': 'fake:latest'}]})
+                else:
+                    self._send_json(404, {'error': 'not found'})
+
+            def do_POST(self):
+                if self.path.rstrip('/') != '/api/generate':
+                    self._send_json(404, {'error': 'not found'})
+                    return
+                try:
+                    request = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)))
+                except ValueError:
+                    self._send_json(400, {'error': 'invalid JSON'})
+                    return
+                prompt = request.get('prompt', '')
+                token_delay = 1.0 / fake.tokens_per_second if fake.tokens_per_second > 0 else 0.0
+
+                with fake._lock:
+                    fake.active += 1
+                    fake.peak_active = max(fake.peak_active, fake.active)
+                try:
+                    self._generate(request, prompt, token_delay)
+                finally:
+                    with fake._lock:
+                        fake.active -= 1
+
+            def _generate(self, request, prompt, token_delay):
+                with fake._slots:
+                    started = time.perf_counter()
+                    prompt_seconds = (fake.first_token_ms / 1000
+                                      + max(1, len(prompt) // 4) / fake.prompt_tokens_per_second)
+                    time.sleep(prompt_seconds)
+                    tokens = fake._tokens()
+                    eval_start = time.perf_counter()
+                    try:
+                        if request.get('stream', True):
+                            self.send_response(200)
+                            self.send_header('Content-Type', 'application/x-ndjson')
+                            self.send_header('Transfer-Encoding', 'chunked')
+                            self.end_headers()
+                            for token in tokens:
+                                time.sleep(token_delay)
+                                self._write_chunk({'model': request.get('model'), 'response': token, 'done': False})
+                            usage = fake._usage(prompt, started, prompt_seconds, time.perf_counter() - eval_start)
+                            fake._count_generation()
+                            self._write_chunk({'model': request.get('model'), 'response': '', 'done': True, **usage})
+                            self.wfile.write(b"0\r\n\r\n")
+                        else:
+                            time.sleep(token_delay * len(tokens))
+                            usage = fake._usage(prompt, started, prompt_seconds, time.perf_counter() - eval_start)
+                            fake._count_generation()
+                            self._send_json(200, {'model': request.get('model'), 'response': "".join(tokens),
+                                                  'done': True, **usage})
+                    except (BrokenPipeError, ConnectionResetError):
+                        return  # The client cancelled the generation
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--tokens-per-second', type=float, default=40.0)
+    parser.add_argument('--first-token-ms', type=float, default=150.0)
+    parser.add_argument('--prompt-tokens-per-second', type=float, default=2000.0)
+    parser.add_argument('--response-tokens', type=int, default=40)
+    parser.add_argument('--parallel', type=int, default=4, help='Generations served at once')
+    args = parser.parse_args()
+
+    fake = FakeOllama(args.host, args.port, args.tokens_per_second, args.first_token_ms,
+                      args.prompt_tokens_per_second, args.response_tokens, args.parallel)
+    print(f"Fake Ollama listening on {fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
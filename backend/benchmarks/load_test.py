@@ -0,0 +1,238 @@
+"""Concurrent-query load test: a thread-per-request WSGI server against the ASGI async views.
+
+A WSGI worker holds one thread for the whole life of a request, so with a
+slow LLM the number of questions being answered at once is capped by the
+thread count, whatever the LLM could take. The async views
+(/api/async/, documents.async_views) wait for the LLM on the event loop and
+are capped by OLLAMA_MAX_IN_FLIGHT only.
+
+Each server runs in its own process on a real socket, against the fake
+Ollama server (benchmarks.fake_ollama) set to take --llm-seconds per
+answer and to serve any number of generations in parallel:
+  - wsgi: backend.wsgi on a stdlib WSGI server with --threads request
+    threads (like gunicorn's gthread worker), querying /api/documents/query/;
+  - asgi: backend.asgi under uvicorn, one worker, querying
+    /api/async/documents/query/.
+--concurrency clients then post distinct questions at once. Reported per
+server: completed requests, errors, requests/s, p50/p99 latency and the
+peak number of generations the LLM had open at once.
+
+The corpus is ingested once with the hashing encoder (see benchmarks.suite).
+uvicorn must be installed for the asgi server (it is in requirements.txt).
+
+Usage (from the backend directory):
+    python -m benchmarks.load_test [--concurrency 64] [--threads 12] [--llm-seconds 2] [--servers wsgi asgi]
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PATHS = {
+    'wsgi': '/api/documents/query/',
+    'asgi': '/api/async/documents/query/',
+}
+
+
+def serve(kind, port, threads):
+    """Run one server in this process until it is killed"""
+    from benchmarks.scenarios import load_engine
+
+    engine = load_engine('hash')
+    engine.encode_questions(["warm up"])
+    engine.store.count()
+
+    if kind == 'asgi':
+        try:
+            import uvicorn
+        except ImportError:
+            raise SystemExit("The asgi server needs uvicorn: pip install uvicorn") from None
+        from backend.asgi import application
+        uvicorn.run(application, host='127.0.0.1', port=port, log_level='warning', lifespan='off', backlog=2048)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+    from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+    from backend.wsgi import application
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    class PooledWSGIServer(WSGIServer):
+        """Accepts every connection but serves at most `threads` requests at once"""
+        request_queue_size = 2048
+
+        def __init__(self, address, handler):
+            super().__init__(address, handler)
+            self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self._process, request, client_address)
+
+        def _process(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    server = PooledWSGIServer(('127.0.0.1', port), QuietHandler)
+    server.set_app(application)
+    server.serve_forever()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(process, url, timeout=120):
+    import httpx
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Server exited with status {process.returncode}:\n{process.stderr.read()[-3000:]}")
+        try:
+            httpx.get(url, timeout=1)  # Any response, 503 included, means it is serving
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise SystemExit(f"Server did not come up at {url}")
+
+
+async def fire(url, questions, concurrency, timeout):
+    import httpx
+
+    async def ask(client, question):
+        start = time.perf_counter()
+        try:
+            response = await client.post(url, json={'question': question})
+            ok = response.status_code == 200 and not response.json().get('answer', '').startswith('Error')
+        except httpx.HTTPError:
+            ok = False
+        return ok, time.perf_counter() - start
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        return await asyncio.gather(*(ask(client, question) for question in questions))
+
+
+def percentiles(values):
+    # Not benchmarks.scenarios.percentiles: importing that module sets Django up in this process
+    import numpy as np
+    return {f'p{q}_ms': round(float(np.percentile(values, q)) * 1000, 2) for q in (50, 99)} if values else {}
+
+
+def run_server(kind, args, env, fake, questions):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, '-m', 'benchmarks.load_test', '--serve', kind, '--port', str(port),
+                                '--threads', str(args.threads)],
+                               cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    try:
+        base = f"http://127.0.0.1:{port}"
+        wait_until_up(process, f"{base}/api/ready/")
+        fake.peak_active = 0
+        start = time.perf_counter()
+        outcomes = asyncio.run(fire(base + PATHS[kind], questions, args.concurrency, args.timeout))
+        elapsed = time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait()
+
+    latencies = [seconds for ok, seconds in outcomes if ok]
+    return {
+        'server': kind,
+        'requests': len(outcomes),
+        'completed': len(latencies),
+        'errors': len(outcomes) - len(latencies),
+        'wall_s': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 2),
+        **percentiles(latencies),
+        'peak_llm_in_flight': fake.peak_active,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servers', nargs='+', choices=sorted(PATHS), default=['wsgi', 'asgi'])
+    parser.add_argument('--concurrency', type=int, default=64, help='Questions posted at once')
+    parser.add_argument('--threads', type=int, default=12, help='Request threads of the WSGI server')
+    parser.add_argument('--llm-seconds', type=float, default=2.0, help='Fake Ollama time per answer')
+    parser.add_argument('--max-in-flight', type=int, help='OLLAMA_MAX_IN_FLIGHT (default: --concurrency)')
+    parser.add_argument('--documents', type=int, default=20)
+    parser.add_argument('--timeout', type=float, default=300.0, help='Client timeout per request')
+    parser.add_argument('--workdir', help='Keep all data here (default: a temporary directory, removed afterwards)')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    parser.add_argument('--serve', choices=sorted(PATHS), help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.threads)
+        return
+
+    from benchmarks import corpus
+    from benchmarks.fake_ollama import FakeOllama
+    from benchmarks.suite import run_scenario
+
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix='docintell-load-')
+    response_tokens = 20
+    fake = FakeOllama(port=0, first_token_ms=0, response_tokens=response_tokens,
+                      tokens_per_second=response_tokens / args.llm_seconds, parallel=args.concurrency * 2).start()
+    env = dict(os.environ,
+               DJANGO_SETTINGS_MODULE='benchmarks.settings',
+               BENCHMARK_WORKDIR=workdir,
+               BENCHMARK_OLLAMA_URL=fake.url,
+               BENCHMARK_ENCODER='hash',
+               BENCHMARK_VECTOR_STORE=os.environ.get('BENCHMARK_VECTOR_STORE', 'local'),
+               BENCHMARK_OLLAMA_MAX_IN_FLIGHT=str(args.max_in_flight or args.concurrency),
+               HF_HUB_OFFLINE='1',
+               TRANSFORMERS_OFFLINE='1',
+               ANONYMIZED_TELEMETRY='False')
+
+    corpus_dir = os.path.join(workdir, 'corpus')
+    results = {'config': {key: value for key, value in vars(args).items()
+                          if key not in ('json', 'workdir', 'serve', 'port')},
+               'servers': []}
+    try:
+        if not os.path.exists(os.path.join(corpus_dir, 'manifest.json')):
+            corpus.generate(corpus_dir, args.documents, 4, args.concurrency, 0)
+        with open(os.path.join(corpus_dir, 'manifest.json')) as f:
+            manifest = json.load(f)
+        run_scenario('migrate', env)
+        run_scenario('ingest', env, ['--corpus', corpus_dir, '--encoder', 'hash'])
+
+        # Distinct questions, so no two requests share one generation
+        questions = [f"{item['question']} ({index})"
+                     for index, item in zip(range(args.concurrency), manifest['questions'] * args.concurrency)]
+        for kind in args.servers:
+            results['servers'].append(run_server(kind, args, env, fake, questions))
+    finally:
+        fake.stop()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.concurrency} concurrent questions, {args.llm_seconds} s per answer, "
+          f"WSGI threads {args.threads}")
+    for server in results['servers']:
+        print(f"  {server['server']}: {server['completed']}/{server['requests']} completed in {server['wall_s']} s, "
+              f"{server['requests_per_second']} req/s, p50 {server.get('p50_ms', 0):.0f} ms, "
+              f"p99 {server.get('p99_ms', 0):.0f} ms, peak LLM in flight {server['peak_llm_in_flight']}")
+
+
+if __name__ == '__main__':
+    main()
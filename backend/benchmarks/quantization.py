@@ -0,0 +1,171 @@
+"""Quantized local vector storage against the exact float32 index.
+
+Copies the chunks already stored in the configured vector store (or embeds
+the given files) into local stores using float32, float16, int8 and int8
+with float32 rescoring. For each one it reports the memory scoring touches,
+the size on disk, query latency, and recall@k against an exact float32
+search. Queries are spans of the stored chunks, re-encoded with the model.
+
+Usage (from the backend directory):
+    python -m benchmarks.quantization [media/*.pdf ...] [-k 3] [--queries 200] [--rescore 4] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+django.setup()
+
+import numpy as np  # noqa: E402
+from django.conf import settings  # noqa: E402
+from sentence_transformers import SentenceTransformer  # noqa: E402
+
+from documents.extractors import get_extractor  # noqa: E402
+from documents.pipeline import CharChunker  # noqa: E402
+from documents.vector_store import LocalStore, create_vector_store  # noqa: E402
+
+
+def load_stored(page_size=5000):
+    """Every chunk of the configured vector store, with its stored embedding"""
+    store = create_vector_store()
+    ids, embeddings, documents, metadatas = [], [], [], []
+    while True:
+        page = store.get(include=['embeddings', 'documents', 'metadatas'], limit=page_size, offset=len(ids))
+        ids += page['ids']
+        embeddings += [list(embedding) for embedding in page['embeddings']]
+        documents += page['documents']
+        metadatas += page['metadatas']
+        if len(page['ids']) < page_size:
+            break
+    return ids, embeddings, documents, metadatas
+
+
+def load_files(paths, encoder):
+    ids, documents, metadatas = [], [], []
+    for document_id, path in enumerate(paths, 1):
+        chunker = CharChunker(500)
+        text = "".join(text for _, text in get_extractor(path).iter_segments(path))
+        for chunk_index, (_, chunk) in enumerate(chunker.feed(text) + chunker.finish()):
+            ids.append(f"{document_id}_{chunk_index}")
+            documents.append(chunk)
+            metadatas.append({"document_id": str(document_id), "chunk_index": chunk_index})
+    return ids, encoder.encode(documents, batch_size=64).tolist(), documents, metadatas
+
+
+def make_queries(documents, encoder, count, seed=0):
+    rng = random.Random(seed)
+    texts = []
+    for document in rng.sample(documents, min(count, len(documents))):
+        words = document.split()
+        start = rng.randrange(max(len(words) - 12, 1))
+        texts.append(" ".join(words[start:start + 12]))
+    return np.asarray(encoder.encode(texts), dtype=np.float32)
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def recall_at_k(matrix, query, rows, found, k):
+    """Share of the exact top k retrieved; results tied with the k-th exact distance count as hits"""
+    distances = ((matrix[rows] - query) ** 2).sum(axis=1)
+    k = min(k, len(rows))
+    threshold = np.partition(distances, k - 1)[k - 1] + 1e-5
+    found_distances = ((matrix[found] - query) ** 2).sum(axis=1)
+    return float((found_distances <= threshold).sum()) / k
+
+
+def run(name, dtype, rescore, data, queries, scopes, args):
+    ids, embeddings, documents, metadatas = data
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    position = {chunk_id: i for i, chunk_id in enumerate(ids)}
+    path = tempfile.mkdtemp(prefix=f'quantization-{name}-')
+    store = LocalStore(path, dim=matrix.shape[1], dtype=dtype, rescore=rescore)
+    for start in range(0, len(ids), 5000):
+        end = start + 5000
+        store.upsert(ids[start:end], embeddings[start:end], documents[start:end], metadatas[start:end])
+    store.compact()
+
+    all_rows = np.arange(len(ids))
+    by_document = {}
+    for i, metadata in enumerate(metadatas):
+        by_document.setdefault(str(metadata.get('document_id')), []).append(i)
+
+    latencies = []
+    recall = {'all': [], 'document': []}
+    for query, document_id in zip(queries, scopes):
+        for scope in ('all', 'document'):
+            where = {"document_id": document_id} if scope == 'document' else None
+            rows = np.array(by_document[document_id]) if scope == 'document' else all_rows
+            began = time.perf_counter()
+            found = store.query(query_embeddings=[query.tolist()], n_results=args.k, where=where)['ids'][0]
+            latencies.append(time.perf_counter() - began)
+            recall[scope].append(recall_at_k(matrix, query, rows, [position[chunk_id] for chunk_id in found], args.k))
+
+    result = {
+        'storage': name,
+        'chunks': len(ids),
+        'bytes_per_chunk': store.row_bytes(),
+        'scored_mb': store.row_bytes() * len(ids) / 1e6,
+        'disk_mb': sum(os.path.getsize(os.path.join(path, f'{array}.bin')) for array, _, _ in store._layout) / 1e6,
+        'index_dir_mb': directory_size(path) / 1e6,
+        'query_p50_ms': float(np.percentile(latencies, 50)) * 1000,
+        f'recall@{args.k}': float(np.mean(recall['all'])),
+        f'recall@{args.k}_document': float(np.mean(recall['document'])),
+    }
+    del store
+    shutil.rmtree(path, ignore_errors=True)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help='Embed these files instead of reading the configured store')
+    parser.add_argument('-k', type=int, default=3, help='Results per query (the engine uses 3)')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--rescore', type=int, default=4, help='Shortlist multiplier for the rescored int8 run')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    args = parser.parse_args()
+
+    encoder = SentenceTransformer(getattr(settings, 'EMBEDDING_MODEL', 'all-MiniLM-L6-v2'))
+    data = load_files(args.files, encoder) if args.files else load_stored()
+    if not data[0]:
+        parser.error("The vector store is empty; upload documents first or pass files to embed")
+
+    queries = make_queries(data[2], encoder, args.queries)
+    rng = random.Random(1)
+    document_ids = sorted({str(metadata.get('document_id')) for metadata in data[3]})
+    scopes = [rng.choice(document_ids) for _ in queries]
+
+    results = [
+        run('float32', 'float32', 0, data, queries, scopes, args),
+        run('float16', 'float16', 0, data, queries, scopes, args),
+        run('int8', 'int8', 0, data, queries, scopes, args),
+        run(f'int8+rescore x{args.rescore}', 'int8', args.rescore, data, queries, scopes, args),
+    ]
+    baseline = results[0]
+    for row in results:
+        row['scored_reduction'] = baseline['scored_mb'] / row['scored_mb']
+        row['disk_reduction'] = baseline['disk_mb'] / row['disk_mb']
+
+    if args.json:
+        print(json.dumps({'k': args.k, 'queries': len(queries), 'results': results}, indent=2))
+        return
+
+    columns = ['bytes_per_chunk', 'scored_mb', 'scored_reduction', 'disk_mb', 'disk_reduction',
+               'query_p50_ms', f'recall@{args.k}', f'recall@{args.k}_document']
+    print(f"{len(data[0])} chunks in {len(document_ids)} documents, {len(queries)} queries")
+    print(f"{'storage':<20}" + "".join(f"{column:>18}" for column in columns))
+    for row in results:
+        print(f"{row['storage']:<20}" + "".join(
+            f"{row[column]:>18.3f}" if isinstance(row[column], float) else f"{row[column]:>18}" for column in columns))
+
+
+if __name__ == '__main__':
+    main()
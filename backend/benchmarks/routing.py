@@ -0,0 +1,158 @@
+"""Flat against routed search across all documents (documents.document_router).
+
+A synthetic corpus of many small documents is bulk-ingested, which also
+computes every document's summary vectors. Each corpus question is then
+searched for its top --n-results chunks over all documents:
+  - flat: every chunk is scored (the store query the engine runs without routing);
+  - routed, once per --top-documents M: RAGEngine.search_all with the router
+    set to M documents, routing forced on whatever the collection size.
+Reported per mode: p50/p99 latency per question, the share of chunks scored,
+recall@k against the flat top-k chunk ids, source-document hit rate and how
+often the exact fallback ran.
+
+The hashing encoder (see benchmarks.suite) keeps the run offline; pass
+--encoder model for recall figures of the real embeddings.
+
+Usage (from the backend directory):
+    python -m benchmarks.routing [--documents 2000] [--kb 2] [--questions 200] [--top-documents 4 8 16 32 64] [--json]
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+
+def measure(search, embeddings):
+    latencies = []
+    results = []
+    for embedding in embeddings:
+        start = time.perf_counter()
+        results.append(search(embedding))
+        latencies.append(time.perf_counter() - start)
+    return results, latencies
+
+
+def summarise(name, results, latencies, flat, sources, ids_by_title, n_results, **extra):
+    from benchmarks.scenarios import percentiles
+
+    recall = hits = 0
+    for result, flat_result, source in zip(results, flat, sources):
+        ids = result['ids'][0][:n_results]
+        recall += len(set(ids) & set(flat_result['ids'][0][:n_results])) / max(len(flat_result['ids'][0][:n_results]), 1)
+        documents = {str(metadata.get('document_id')) for metadata in result['metadatas'][0][:n_results]}
+        hits += str(ids_by_title.get(source)) in documents
+    return {
+        'mode': name,
+        **percentiles(latencies),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        f'recall_at_{n_results}': round(recall / len(results), 4),
+        'hit_rate': round(hits / len(results), 4),
+        **extra,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=2000)
+    parser.add_argument('--kb', type=float, default=2, help='Mean document size in KB')
+    parser.add_argument('--questions', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--encoder', choices=['model', 'hash'], default='hash')
+    parser.add_argument('--vector-store', choices=['chroma', 'local'], default='local')
+    parser.add_argument('--n-results', type=int, default=5)
+    parser.add_argument('--top-documents', type=int, nargs='+', default=[4, 8, 16, 32, 64])
+    parser.add_argument('--no-fallback', action='store_true', help='Measure routing without ROUTING_EXACT_FALLBACK')
+    parser.add_argument('--workdir', help='Keep all data here (default: a temporary directory, removed afterwards)')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    args = parser.parse_args()
+
+    from benchmarks import corpus
+    from benchmarks.suite import run_scenario
+
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix='docintell-routing-')
+    env = dict(os.environ,
+               DJANGO_SETTINGS_MODULE='benchmarks.settings',
+               BENCHMARK_WORKDIR=workdir,
+               BENCHMARK_VECTOR_STORE=args.vector_store,
+               BENCHMARK_ROUTING='1',
+               HF_HUB_OFFLINE='1',
+               TRANSFORMERS_OFFLINE='1',
+               ANONYMIZED_TELEMETRY='False')
+    if args.encoder == 'hash':
+        env['BENCHMARK_ENCODER'] = 'hash'
+
+    corpus_dir = os.path.join(workdir, 'corpus')
+    try:
+        if not os.path.exists(os.path.join(corpus_dir, 'manifest.json')):
+            corpus.generate(corpus_dir, args.documents, args.kb, args.questions, args.seed)
+            run_scenario('migrate', env)
+            ingest = run_scenario('ingest', env, ['--corpus', corpus_dir, '--encoder', args.encoder, '--mode', 'bulk'])
+        else:
+            ingest = None
+        with open(os.path.join(corpus_dir, 'manifest.json')) as f:
+            manifest = json.load(f)
+
+        # Django is set up on import, against the workdir just filled
+        os.environ.update(env)
+        from benchmarks.scenarios import load_engine
+        from documents.metrics import ROUTED_QUERIES
+        from documents.models import Document
+
+        engine = load_engine(args.encoder)
+        router = engine.router
+        counts = engine.document_index.counts()
+        if router.uncovered(counts):
+            router.bootstrap(engine.store, counts)
+
+        questions = [item['question'] for item in manifest['questions']]
+        sources = [item['source'] for item in manifest['questions']]
+        ids_by_title = dict(Document.objects.values_list('title', 'id'))
+        embeddings = [vector.tolist() for vector in engine.encode_questions(questions)]
+        include = ('metadatas', 'documents', 'distances')
+        total_chunks = sum(counts.values())
+
+        flat, latencies = measure(lambda embedding: engine.store.query(
+            query_embeddings=[embedding], n_results=args.n_results, include=include), embeddings)
+        modes = [summarise('flat', flat, latencies, flat, sources, ids_by_title, args.n_results, scored=1.0)]
+
+        router.min_documents = 0
+        router.exact_fallback = not args.no_fallback
+        for top_documents in args.top_documents:
+            router.top_documents = top_documents
+            routed_documents = router.route(embeddings)
+            scored = sum(sum(counts.get(document_id, 0) for document_id in documents)
+                         for documents in routed_documents) / len(embeddings) / total_chunks
+            fallback_before = ROUTED_QUERIES.value(path='fallback')
+            results, latencies = measure(lambda embedding: engine.search_all([embedding], args.n_results, include),
+                                         embeddings)
+            modes.append(summarise(
+                f'routed M={top_documents}', results, latencies, flat, sources, ids_by_title, args.n_results,
+                scored=round(scored, 4),
+                fallback_rate=round((ROUTED_QUERIES.value(path='fallback') - fallback_before) / len(embeddings), 4),
+            ))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        'config': {key: value for key, value in vars(args).items() if key not in ('json', 'workdir')},
+        'documents': len(counts),
+        'chunks': total_chunks,
+        'ingest': ingest,
+        'modes': modes,
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{len(counts)} documents, {total_chunks} chunks, {len(questions)} questions, top {args.n_results} chunks")
+    recall_key = f'recall_at_{args.n_results}'
+    for mode in modes:
+        print(f"  {mode['mode']:<14} p50 {mode.get('p50_ms', 0):7.2f} ms  p99 {mode.get('p99_ms', 0):7.2f} ms  "
+              f"scored {mode['scored']:6.1%}  recall {mode[recall_key]:.3f}  hit rate {mode['hit_rate']:.3f}"
+              + (f"  fallback {mode['fallback_rate']:.1%}" if 'fallback_rate' in mode else ""))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+"""Single benchmark scenarios, each run in a fresh interpreter by benchmarks.suite.
+
+Every scenario prints one JSON object on its last stdout line, including the
+process's peak resident memory. The settings module (benchmarks.settings by
+default) points all data at BENCHMARK_WORKDIR and the LLM at the fake server.
+
+Scenarios:
+  migrate     create the benchmark database
+  ingest      save the corpus to storage and ingest it (IngestionQueue or BulkIngestion)
+  query       retrieval hit rate, routed against exact top-k recall, then
+              /api/documents/query/ (or /query/stream/) under N concurrent
+              clients: throughput and p50/p90/p99 latency
+  cold_start  Django setup, first answered query, second query (run on an ingested workdir)
+
+Usage (from the backend directory; normally invoked by benchmarks.suite):
+    BENCHMARK_WORKDIR=/tmp/bench python -m benchmarks.scenarios ingest --corpus /tmp/bench/corpus [--mode queue]
+"""
+import time
+
+PROCESS_START = time.perf_counter()
+
+import argparse  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import resource  # noqa: E402
+import sys  # noqa: E402
+import threading  # noqa: E402
+from concurrent.futures import ThreadPoolExecutor  # noqa: E402
+
+import django  # noqa: E402
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+django.setup()
+
+SETUP_DONE = time.perf_counter()
+
+import numpy as np  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.core.files import File  # noqa: E402
+from django.core.files.storage import default_storage  # noqa: E402
+from django.db.models import Count  # noqa: E402
+from django.test import Client  # noqa: E402
+
+from benchmarks.encoders import HashingEncoder  # noqa: E402
+from documents.bulk_ingestion import BulkIngestion  # noqa: E402
+from documents.document_router import DocumentRouter  # noqa: E402
+from documents.metrics import ANSWER_PATHS, LLM_SECONDS_SAVED, ROUTED_QUERIES, STAGE_SECONDS  # noqa: E402
+from documents.models import Document, IngestionBatch  # noqa: E402
+from documents.registry import get_engine, get_ingestion_queue  # noqa: E402
+
+
+def peak_memory_mb():
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    return {f'p{q}_ms': round(float(np.percentile(values, q)) * 1000, 2) for q in (50, 90, 99)}
+
+
+def stage_means(before, after, requests):
+    """Mean exclusive milliseconds per request spent in each stage between two STAGE_SECONDS snapshots"""
+    means = {}
+    for key, (total, _) in after.items():
+        spent = total - before.get(key, (0.0, 0))[0]
+        if spent > 0:
+            means[f'{key[0]}_ms'] = round(spent / max(requests, 1) * 1000, 3)
+    return means
+
+
+def load_engine(encoder):
+    engine = get_engine()
+    if encoder == 'hash':
+        engine.encoder = HashingEncoder()
+    return engine
+
+
+def run_migrate(args):
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+    return {}
+
+
+def run_ingest(args):
+    with open(os.path.join(args.corpus, 'manifest.json')) as f:
+        manifest = json.load(f)
+    engine = load_engine(args.encoder)
+    engine.encoder.encode(["warm up"])  # Model load belongs to cold_start, not to throughput
+    engine.store.count()
+
+    start = time.perf_counter()
+    saved = []
+    for entry in manifest['documents']:
+        with open(os.path.join(args.corpus, entry['name']), 'rb') as f:
+            saved.append((entry['name'], default_storage.save(entry['name'], File(f, name=entry['name'])),
+                          entry['size']))
+    stored = time.perf_counter()
+
+    if args.mode == 'bulk':
+        batch = IngestionBatch.objects.create(total_files=len(saved))
+        Document.objects.bulk_create([
+            Document(title=name, file_path=path, file_type='txt', file_size=size,
+                     processing_status='processing', batch=batch)
+            for name, path, size in saved
+        ], batch_size=500)
+        BulkIngestion(engine).ingest(batch.id)
+    else:
+        documents = Document.objects.bulk_create([
+            Document(title=name, file_path=path, file_type='txt', file_size=size, processing_status='pending')
+            for name, path, size in saved
+        ], batch_size=500)
+        queue = get_ingestion_queue()
+        for document in documents:
+            queue.submit(document.id)  # Rows beyond the queue's capacity stay pending and are drained
+        ids = [document.id for document in documents]
+        while Document.objects.filter(id__in=ids, processing_status__in=('pending', 'processing')).exists():
+            time.sleep(0.05)
+    finished = time.perf_counter()
+
+    counts = dict(Document.objects.values_list('processing_status').annotate(n=Count('id')))
+    seconds = finished - stored
+    size = sum(size for _, _, size in saved)
+    chunks = engine.store.count()
+    return {
+        'mode': args.mode,
+        'documents': len(saved),
+        'completed': counts.get('completed', 0),
+        'failed': counts.get('failed', 0),
+        'chunks': chunks,
+        'bytes': size,
+        'save_seconds': round(stored - start, 3),
+        'ingest_seconds': round(seconds, 3),
+        'docs_per_second': round(len(saved) / seconds, 2),
+        'chunks_per_second': round(chunks / seconds, 2),
+        'mb_per_second': round(size / seconds / 1e6, 3),
+    }
+
+
+def retrieval_hit_rate(engine, questions, n_results):
+    """Share of questions whose source document owns one of the top n_results chunks"""
+    ids_by_title = dict(Document.objects.values_list('title', 'id'))
+    texts = [question['question'] for question in questions]
+    outcomes = engine.retrieve_batch(texts, [None] * len(texts), n_results, engine.encode_questions(texts))
+    hits = 0
+    for question, (results, _) in zip(questions, outcomes):
+        # Candidates come sorted by distance; with context packing there are more than n_results
+        metadatas = (results or {}).get('metadatas', [[]])[0][:n_results]
+        retrieved = {str((metadata or {}).get('document_id')) for metadata in metadatas}
+        hits += str(ids_by_title.get(question['source'])) in retrieved
+    return round(hits / len(questions), 4) if questions else 0.0
+
+
+def routing_recall(engine, questions, n_results):
+    """Routed against exact search over all documents, for the same questions.
+
+    Routing is forced on whatever the collection size, with the configured
+    ROUTING_TOP_DOCUMENTS. With ROUTING_ENABLED off, summaries are computed
+    from the store for the measurement only. recall is the share of the exact
+    top n_results chunk ids that routing returns too, averaged over questions.
+    """
+    router = engine.router or DocumentRouter(
+        os.path.join(settings.RAG_DATA_DIR, 'routing_recall.sqlite3'),
+        top_documents=getattr(settings, 'ROUTING_TOP_DOCUMENTS', 16),
+        representatives=getattr(settings, 'ROUTING_REPRESENTATIVES', 4),
+        exact_fallback=getattr(settings, 'ROUTING_EXACT_FALLBACK', True))
+    counts = engine.document_index.counts()
+    if router.uncovered(counts):
+        router.bootstrap(engine.store, counts)
+
+    ids_by_title = dict(Document.objects.values_list('title', 'id'))
+    texts = [question['question'] for question in questions]
+    embeddings = [vector.tolist() for vector in engine.encode_questions(texts)]
+    include = ('metadatas',)
+    exact = engine.store.query(query_embeddings=embeddings, n_results=n_results, include=include)
+
+    previous, min_documents = engine.router, router.min_documents
+    engine.router, router.min_documents = router, 0
+    fallback_before = ROUTED_QUERIES.value(path='fallback')
+    try:
+        routed = engine.search_all(embeddings, n_results, include)
+    finally:
+        engine.router, router.min_documents = previous, min_documents
+
+    recall = exact_hits = routed_hits = 0
+    for position, question in enumerate(questions):
+        expected = set(exact['ids'][position])
+        recall += len(expected & set(routed['ids'][position])) / max(len(expected), 1)
+        source = str(ids_by_title.get(question['source']))
+        exact_hits += source in {str(metadata.get('document_id')) for metadata in exact['metadatas'][position]}
+        routed_hits += source in {str(metadata.get('document_id')) for metadata in routed['metadatas'][position]}
+    count = max(len(questions), 1)
+    return {
+        'enabled': previous is not None,
+        'top_documents': router.top_documents,
+        f'recall_at_{n_results}': round(recall / count, 4),
+        'exact_hit_rate': round(exact_hits / count, 4),
+        'routed_hit_rate': round(routed_hits / count, 4),
+        'fallback_rate': round((ROUTED_QUERIES.value(path='fallback') - fallback_before) / count, 4),
+    }
+
+
+def run_query(args):
+    with open(os.path.join(args.corpus, 'manifest.json')) as f:
+        questions = json.load(f)['questions']
+    engine = load_engine(args.encoder)
+    engine.encode_questions(["warm up"])
+    result = {'hit_rate': retrieval_hit_rate(engine, questions, args.n_results), 'stream': args.stream,
+              'routing': routing_recall(engine, questions, args.n_results)}
+
+    path = '/api/documents/query/stream/' if args.stream else '/api/documents/query/'
+    local = threading.local()
+
+    def ask(index):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = Client()
+        payload = {'question': questions[index % len(questions)]['question']}
+        start = time.perf_counter()
+        response = client.post(path, payload, content_type='application/json')
+        status, first = response.status_code, None
+        if args.stream and status == 200:
+            for part in response.streaming_content:
+                if first is None and b'event: token' in part:
+                    first = time.perf_counter() - start
+                if b'event: error' in part:
+                    status = 502  # Errors arrive as events on a 200 stream
+        return status, time.perf_counter() - start, first
+
+    levels = []
+    for concurrency in args.concurrency:
+        requests = max(args.requests, concurrency)
+        before = STAGE_SECONDS.totals()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(ask, range(requests)))
+        elapsed = time.perf_counter() - start
+        latencies = [seconds for status, seconds, _ in outcomes if status == 200]
+        level = {
+            'concurrency': concurrency,
+            'requests': requests,
+            'errors': sum(status != 200 for status, _, _ in outcomes),
+            'requests_per_second': round(len(latencies) / elapsed, 2),
+            **percentiles(latencies),
+            'stages': stage_means(before, STAGE_SECONDS.totals(), requests),
+        }
+        if args.stream:
+            level['first_token'] = percentiles([first for _, _, first in outcomes if first is not None])
+        levels.append(level)
+    result['levels'] = levels
+    if engine.confidence_gate:
+        result['answer_paths'] = {path: ANSWER_PATHS.value(path=path) for path in engine.confidence_gate.PATHS}
+        result['llm_seconds_saved'] = round(sum(LLM_SECONDS_SAVED.value(path=path) for path in ('not_found', 'extractive')), 3)
+    return result
+
+
+def run_cold_start(args):
+    with open(os.path.join(args.corpus, 'manifest.json')) as f:
+        questions = json.load(f)['questions']
+    client = Client()
+    start = time.perf_counter()
+    load_engine(args.encoder)  # Installing the hashing encoder skips the model load, as it would be offline
+    first = client.post('/api/documents/query/', {'question': questions[0]['question']},
+                        content_type='application/json')
+    answered = time.perf_counter()
+    client.post('/api/documents/query/', {'question': questions[-1]['question']}, content_type='application/json')
+    second = time.perf_counter()
+    if first.status_code != 200:
+        raise SystemExit(f"First query failed with status {first.status_code}")
+    return {
+        'django_setup_s': round(SETUP_DONE - PROCESS_START, 3),
+        'first_query_s': round(answered - start, 3),
+        'second_query_s': round(second - answered, 3),
+        'to_first_answer_s': round(answered - PROCESS_START, 3),
+    }
+
+
+SCENARIOS = {
+    'migrate': run_migrate,
+    'ingest': run_ingest,
+    'query': run_query,
+    'cold_start': run_cold_start,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenario', choices=sorted(SCENARIOS))
+    parser.add_argument('--corpus', help='Directory written by benchmarks.corpus')
+    parser.add_argument('--encoder', choices=['model', 'hash'], default='model')
+    parser.add_argument('--mode', choices=['queue', 'bulk'], default='queue', help='Ingestion path')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=64, help='Queries per concurrency level')
+    parser.add_argument('--n-results', type=int, default=3)
+    parser.add_argument('--stream', action='store_true', help='Query the SSE endpoint and time the first token')
+    args = parser.parse_args()
+
+    result = SCENARIOS[args.scenario](args)
+    result['peak_rss_mb'] = peak_memory_mb()
+    print(json.dumps(result))
+    sys.stdout.flush()
+    # Background threads (ingestion queue, dispatcher) must not keep the process alive
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Settings for the offline benchmark suite.
+
+Everything the benchmarks write (database, uploads, vector store, caches)
+goes to BENCHMARK_WORKDIR, so a run never touches the development data, and
+the LLM is the stand-in server at BENCHMARK_OLLAMA_URL (see
+benchmarks.fake_ollama).
+"""
+import os
+from pathlib import Path
+
+from backend.settings import *  # noqa: F401,F403
+
+WORKDIR = Path(os.environ.get('BENCHMARK_WORKDIR', '/tmp/docintell-benchmark')).resolve()
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': WORKDIR / 'db.sqlite3',
+        'OPTIONS': {'timeout': 30},
+    }
+}
+
+MEDIA_ROOT = WORKDIR / 'media'
+RAG_DATA_DIR = WORKDIR / 'rag_data'
+ANSWER_CACHE_PATH = RAG_DATA_DIR / 'answer_cache.sqlite3'
+DOCUMENT_INDEX_PATH = RAG_DATA_DIR / 'document_index.sqlite3'
+ROUTING_INDEX_PATH = RAG_DATA_DIR / 'document_router.sqlite3'
+EMBEDDING_CACHE_PATH = RAG_DATA_DIR / 'embedding_cache.sqlite3'
+LOCAL_VECTOR_STORE_PATH = RAG_DATA_DIR / 'local_index'
+CHROMADB_PATH = str(WORKDIR / 'chromadb_data')
+VECTOR_STORE = os.environ.get('BENCHMARK_VECTOR_STORE', VECTOR_STORE)  # noqa: F405
+SHARDING_ENABLED = os.environ.get('BENCHMARK_SHARDING', '0') == '1'
+SHARD_COUNT = int(os.environ.get('BENCHMARK_SHARD_COUNT', SHARD_COUNT))  # noqa: F405
+ROUTING_ENABLED = os.environ.get('BENCHMARK_ROUTING', '0') == '1'
+if os.environ.get('BENCHMARK_ENCODER') == 'hash':
+    # Keeps cached embeddings of the hashing encoder apart from real model vectors
+    EMBEDDING_MODEL = 'benchmark-hashing'
+
+OLLAMA_URL = os.environ.get('BENCHMARK_OLLAMA_URL', 'http://127.0.0.1:11435')
+OLLAMA_MAX_IN_FLIGHT = int(os.environ.get('BENCHMARK_OLLAMA_MAX_IN_FLIGHT', OLLAMA_MAX_IN_FLIGHT))  # noqa: F405
+
+# Repeated questions would otherwise measure the answer cache, not the pipeline
+ANSWER_CACHE_ENABLED = os.environ.get('BENCHMARK_ANSWER_CACHE', '0') == '1'
+# Off unless asked for, so query latency stays comparable with runs from before the gate existed
+CONFIDENCE_GATING_ENABLED = os.environ.get('BENCHMARK_CONFIDENCE_GATING', '0') == '1'
+RAG_WARMUP = False
+
+# Requests are driven in-process through django.test.Client, or over HTTP by benchmarks.load_test
+ALLOWED_HOSTS = [*ALLOWED_HOSTS, 'testserver', '127.0.0.1', 'localhost']  # noqa: F405
+
+LOGGING['loggers']['documents']['level'] = 'WARNING'  # noqa: F405
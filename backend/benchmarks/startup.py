@@ -0,0 +1,108 @@
+"""Process startup cost with the lazily loaded RAG stack.
+
+Each measurement runs in a fresh interpreter:
+  - `manage.py check`, which imports the URLconf and views like every
+    management command and server boot does;
+  - loading the RAG stack (encoder + vector store), which the views used
+    to do at import time;
+  - the first and second encode after loading (what warm-up takes off the
+    first query).
+With --compare-rev, `manage.py check` is also timed on a checkout of that
+revision (e.g. the commit before lazy loading) for a before/after figure.
+
+Usage (from the backend directory):
+    python -m benchmarks.startup [--runs 3] [--compare-rev <git rev>] [--json]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOAD_STACK = """
+import json, os, time
+start = time.perf_counter()
+import django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+django.setup()
+from documents.registry import get_engine
+setup = time.perf_counter()
+engine = get_engine()
+engine.encoder
+engine.store.count()
+loaded = time.perf_counter()
+engine.encoder.encode(["What is this document about?"])
+first = time.perf_counter()
+engine.encoder.encode(["Which topics does it cover?"])
+second = time.perf_counter()
+print(json.dumps({'django_setup_s': setup - start, 'load_stack_s': loaded - setup,
+                  'first_encode_s': first - loaded, 'second_encode_s': second - first}))
+"""
+
+
+def timed(command, cwd, env=None):
+    start = time.perf_counter()
+    completed = subprocess.run(command, cwd=cwd, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f"{' '.join(command)} failed:\n{completed.stderr[-2000:]}")
+    return elapsed, completed.stdout
+
+
+def check_times(backend_dir, runs, env=None):
+    return [timed([sys.executable, 'manage.py', 'check'], backend_dir, env)[0] for _ in range(runs)]
+
+
+def rev_check_times(rev, runs):
+    """Time `manage.py check` on a temporary worktree of rev"""
+    repo = subprocess.run(['git', 'rev-parse', '--show-toplevel'], cwd=BACKEND_DIR,
+                          capture_output=True, text=True, check=True).stdout.strip()
+    worktree = tempfile.mkdtemp(prefix='startup-')
+    subprocess.run(['git', 'worktree', 'add', '--detach', worktree, rev], cwd=repo,
+                   capture_output=True, check=True)
+    try:
+        env = dict(os.environ)
+        # Make sure the checkout's own packages are imported, not this tree's
+        env['PYTHONPATH'] = os.pathsep.join(
+            path for path in env.get('PYTHONPATH', '').split(os.pathsep)
+            if path and os.path.abspath(path) != BACKEND_DIR
+        )
+        backend_dir = os.path.join(worktree, os.path.relpath(BACKEND_DIR, repo))
+        return check_times(backend_dir, runs, env)
+    finally:
+        subprocess.run(['git', 'worktree', 'remove', '--force', worktree], cwd=repo, capture_output=True)
+        shutil.rmtree(worktree, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--compare-rev', help='Also time manage.py check at this git revision')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    args = parser.parse_args()
+
+    results = {'manage_py_check_s': statistics.median(check_times(BACKEND_DIR, args.runs))}
+    loads = [json.loads(timed([sys.executable, '-c', LOAD_STACK], BACKEND_DIR)[1].strip().splitlines()[-1])
+             for _ in range(args.runs)]
+    for key in loads[0]:
+        results[key] = statistics.median(load[key] for load in loads)
+    # What every process paid when the engine was built at import time
+    results['eager_boot_estimate_s'] = results['manage_py_check_s'] + results['load_stack_s']
+    if args.compare_rev:
+        results[f'manage_py_check_s@{args.compare_rev}'] = statistics.median(rev_check_times(args.compare_rev, args.runs))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for key, value in results.items():
+        print(f"{key:<40}{value:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
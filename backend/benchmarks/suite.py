@@ -0,0 +1,209 @@
+"""Offline end-to-end benchmark suite: ingestion, query latency, memory and cold start.
+
+Runs on a CPU-only box without network. It starts the fake Ollama server
+(benchmarks.fake_ollama), writes a seeded synthetic corpus
+(benchmarks.corpus) and runs each scenario of benchmarks.scenarios in a
+fresh interpreter against an isolated work directory (benchmarks.settings),
+so development data is never touched and every figure, including the peak
+resident memory, belongs to one scenario:
+  - ingest: documents/s, chunks/s and MB/s through IngestionQueue (or
+    BulkIngestion with --ingest-mode bulk);
+  - query: retrieval hit rate and routed against exact top-k recall (see
+    documents.document_router), then requests/s and p50/p90/p99 latency of
+    /api/documents/query/ at each --concurrency level, with the mean time
+    per stage (--stream times the first SSE token as well; --routing serves
+    the queries routed);
+  - cold_start: Django setup and time to the first answer in a new process.
+
+The encoder is the configured sentence-transformers model, which must
+already be in the local cache (downloads are disabled); --encoder hash
+swaps in a deterministic hashing encoder that needs no model at all.
+
+Results are written as JSON (--output) with the git commit, so runs on two
+commits can be compared with --compare.
+
+Usage (from the backend directory):
+    python -m benchmarks.suite [--documents 200] [--concurrency 1 8 32] [--encoder hash] [--output run.json]
+    python -m benchmarks.suite --encoder hash --output new.json --compare old.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import corpus
+from benchmarks.fake_ollama import FakeOllama
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ('ingest', 'query', 'cold_start')
+
+
+def git_revision():
+    def git(*command):
+        return subprocess.run(['git', *command], cwd=BACKEND_DIR, capture_output=True, text=True).stdout.strip()
+    return {'commit': git('rev-parse', 'HEAD') or None, 'dirty': bool(git('status', '--porcelain', '--', '.'))}
+
+
+def run_scenario(name, env, extra=()):
+    """Run one scenario in a fresh interpreter; returns its JSON result plus the process wall time"""
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-m', 'benchmarks.scenarios', name, *extra],
+                               cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise SystemExit(f"Scenario {name} failed:\n{completed.stderr[-3000:]}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['process_wall_s'] = round(elapsed, 3)
+    return result
+
+
+def flatten(results, prefix=''):
+    """Numeric leaves of a result tree as {'query.levels.8.p99_ms': value}"""
+    flat = {}
+    if isinstance(results, dict):
+        for key, value in results.items():
+            flat.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(results, list):
+        for item in results:
+            label = item.get('concurrency', len(flat)) if isinstance(item, dict) else len(flat)
+            flat.update(flatten(item, f"{prefix}{label}."))
+    elif isinstance(results, (int, float)) and not isinstance(results, bool):
+        flat[prefix.rstrip('.')] = results
+    return flat
+
+
+def compare(baseline, current):
+    old, new = flatten(baseline['scenarios']), flatten(current['scenarios'])
+    rows = []
+    for key in sorted(old.keys() & new.keys()):
+        change = (new[key] - old[key]) / old[key] if old[key] else 0.0
+        rows.append((key, old[key], new[key], change))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--workdir', help='Keep all data here (default: a temporary directory, removed afterwards)')
+    parser.add_argument('--documents', type=int, default=200)
+    parser.add_argument('--kb', type=float, default=8, help='Mean document size in KB')
+    parser.add_argument('--questions', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--encoder', choices=['model', 'hash'], default='model')
+    parser.add_argument('--vector-store', choices=['chroma', 'local'], help='Override VECTOR_STORE')
+    parser.add_argument('--ingest-mode', choices=['queue', 'bulk'], default='queue')
+    parser.add_argument('--shards', type=int, default=0, help='Shard the vector store into this many collections')
+    parser.add_argument('--routing', action='store_true', help='Serve the queries with document routing on')
+    parser.add_argument('--confidence-gating', action='store_true',
+                        help='Let the confidence gate answer without the LLM (reports answers per path)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=64, help='Queries per concurrency level')
+    parser.add_argument('--stream', action='store_true', help='Query the streaming endpoint')
+    parser.add_argument('--tokens-per-second', type=float, default=40.0, help='Fake Ollama generation rate')
+    parser.add_argument('--first-token-ms', type=float, default=150.0, help='Fake Ollama time to first token')
+    parser.add_argument('--response-tokens', type=int, default=40)
+    parser.add_argument('--ollama-parallel', type=int, default=4, help='Generations the fake server runs at once')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Earlier --output file to compare against')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    args = parser.parse_args()
+
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix='docintell-bench-')
+    fake = FakeOllama(port=0, tokens_per_second=args.tokens_per_second, first_token_ms=args.first_token_ms,
+                      response_tokens=args.response_tokens, parallel=args.ollama_parallel).start()
+    env = dict(os.environ,
+               DJANGO_SETTINGS_MODULE='benchmarks.settings',
+               BENCHMARK_WORKDIR=workdir,
+               BENCHMARK_OLLAMA_URL=fake.url,
+               BENCHMARK_ENCODER=args.encoder,
+               HF_HUB_OFFLINE='1',
+               TRANSFORMERS_OFFLINE='1',
+               ANONYMIZED_TELEMETRY='False')
+    if args.vector_store:
+        env['BENCHMARK_VECTOR_STORE'] = args.vector_store
+    if args.confidence_gating:
+        env['BENCHMARK_CONFIDENCE_GATING'] = '1'
+    if args.shards:
+        env.update(BENCHMARK_SHARDING='1', BENCHMARK_SHARD_COUNT=str(args.shards))
+    if args.routing:
+        env['BENCHMARK_ROUTING'] = '1'
+
+    corpus_dir = os.path.join(workdir, 'corpus')
+    common = ['--corpus', corpus_dir, '--encoder', args.encoder]
+    results = {
+        **git_revision(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'config': {key: value for key, value in vars(args).items()
+                   if key not in ('output', 'compare', 'json', 'workdir')},
+        'scenarios': {},
+    }
+    try:
+        if not os.path.exists(os.path.join(corpus_dir, 'manifest.json')):
+            corpus.generate(corpus_dir, args.documents, args.kb, args.questions, args.seed)
+        run_scenario('migrate', env)
+        if 'ingest' in args.scenarios:
+            results['scenarios']['ingest'] = run_scenario('ingest', env, common + ['--mode', args.ingest_mode])
+        if 'query' in args.scenarios:
+            extra = ['--concurrency', *map(str, args.concurrency), '--requests', str(args.requests)]
+            if args.stream:
+                extra.append('--stream')
+            results['scenarios']['query'] = run_scenario('query', env, common + extra)
+        if 'cold_start' in args.scenarios:
+            results['scenarios']['cold_start'] = run_scenario('cold_start', env, common)
+    finally:
+        fake.stop()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    comparison = None
+    if args.compare:
+        with open(args.compare) as f:
+            comparison = compare(json.load(f), results)
+
+    if args.json:
+        if comparison is not None:
+            results['comparison'] = {key: {'baseline': old, 'current': new, 'change': round(change, 4)}
+                                     for key, old, new, change in comparison}
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"commit {results['commit']}{' (dirty)' if results['dirty'] else ''}, "
+          f"{args.documents} documents, encoder={args.encoder}")
+    ingest = results['scenarios'].get('ingest')
+    if ingest:
+        print(f"ingest ({ingest['mode']}): {ingest['docs_per_second']} docs/s, {ingest['chunks_per_second']} chunks/s, "
+              f"{ingest['mb_per_second']} MB/s, {ingest['failed']} failed, peak {ingest['peak_rss_mb']} MB")
+    query = results['scenarios'].get('query')
+    if query:
+        print(f"query: hit rate {query['hit_rate']:.1%}, peak {query['peak_rss_mb']} MB")
+        routing = query['routing']
+        recall = next(value for key, value in routing.items() if key.startswith('recall_at_'))
+        print(f"  routing ({'on' if routing['enabled'] else 'off'}, M={routing['top_documents']}): "
+              f"recall {recall:.1%} of the exact top-k, hit rate {routing['routed_hit_rate']:.1%} "
+              f"vs {routing['exact_hit_rate']:.1%} exact, fallback {routing['fallback_rate']:.1%}")
+        for level in query['levels']:
+            print(f"  concurrency {level['concurrency']:>4}: {level['requests_per_second']:>8} req/s  "
+                  f"p50 {level.get('p50_ms', 0):>9.1f} ms  p99 {level.get('p99_ms', 0):>9.1f} ms  "
+                  f"errors {level['errors']}")
+    cold = results['scenarios'].get('cold_start')
+    if cold:
+        print(f"cold start: {cold['to_first_answer_s']} s to first answer "
+              f"(setup {cold['django_setup_s']} s, first query {cold['first_query_s']} s), peak {cold['peak_rss_mb']} MB")
+    if comparison:
+        print(f"\n{'metric':<50}{'baseline':>12}{'current':>12}{'change':>9}")
+        for key, old, new, change in comparison:
+            print(f"{key:<50}{old:>12.4g}{new:>12.4g}{change:>+9.1%}")
+
+
+if __name__ == '__main__':
+    main()
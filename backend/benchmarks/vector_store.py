@@ -0,0 +1,129 @@
+"""Vector store backends compared on synthetic chunk collections.
+
+Fills each backend with random unit vectors spread over documents and
+reports load throughput, on-disk size, and per-query latency (p50/p99) for
+document-scoped and collection-wide top-k searches. The local backend is
+also checked for agreement with an exact search.
+
+Usage (from the backend directory):
+    python -m benchmarks.vector_store [--sizes 10000 100000 1000000] [--backends chroma local] [--json]
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+django.setup()
+
+import numpy as np  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+from documents.vector_store import ChromaStore, LocalStore  # noqa: E402
+
+
+def make_store(backend, path, dim):
+    if backend == 'chroma':
+        return ChromaStore(path)
+    return LocalStore(path, dim=dim)
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def percentile(samples, q):
+    return float(np.percentile(samples, q)) * 1000 if samples else 0.0
+
+
+def run(backend, size, args):
+    rng = np.random.default_rng(0)
+    path = tempfile.mkdtemp(prefix=f'vector-store-{backend}-')
+    store = make_store(backend, path, args.dim)
+    documents = max(size // args.chunks_per_document, 1)
+
+    start = time.perf_counter()
+    for first in range(0, size, args.batch_size):
+        count = min(args.batch_size, size - first)
+        vectors = rng.normal(size=(count, args.dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        indexes = range(first, first + count)
+        store.upsert(
+            ids=[f"{i // args.chunks_per_document}_{i % args.chunks_per_document}" for i in indexes],
+            embeddings=vectors.tolist(),
+            documents=[f"chunk {i}" for i in indexes],
+            metadatas=[{"document_id": str(i // args.chunks_per_document),
+                        "chunk_index": i % args.chunks_per_document,
+                        "content_hash": f"{i:040x}"} for i in indexes]
+        )
+    store.flush()
+    load_seconds = time.perf_counter() - start
+
+    queries = rng.normal(size=(args.queries, args.dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    result = {
+        'backend': backend,
+        'chunks': size,
+        'documents': documents,
+        'load_seconds': load_seconds,
+        'load_chunks_per_s': size / (load_seconds or 1e-9),
+        'disk_mb': directory_size(path) / 1e6,
+    }
+
+    for scope in ('document', 'all'):
+        latencies = []
+        for i, query in enumerate(queries):
+            where = {"document_id": str(i % documents)} if scope == 'document' else None
+            began = time.perf_counter()
+            store.query(query_embeddings=[query.tolist()], n_results=args.k, where=where)
+            latencies.append(time.perf_counter() - began)
+        result[f'{scope}_p50_ms'] = percentile(latencies, 50)
+        result[f'{scope}_p99_ms'] = percentile(latencies, 99)
+
+    if backend == 'local':
+        # Exact agreement: the local store is brute force, so it must match numpy's ranking
+        rows = store._all_live_rows()
+        matrix = np.asarray(store._matrix[rows], dtype=np.float32)
+        ids = store.get(include=[])['ids']
+        agree = 0
+        for query in queries[:20]:
+            expected = [ids[i] for i in np.argsort(-(matrix @ query))[:args.k]]
+            agree += store.query(query_embeddings=[query.tolist()], n_results=args.k)['ids'][0] == expected
+        result['exact_agreement'] = agree / min(len(queries), 20)
+
+    del store
+    shutil.rmtree(path, ignore_errors=True)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--backends', nargs='+', default=['chroma', 'local'], choices=['chroma', 'local'])
+    parser.add_argument('--dim', type=int, default=getattr(settings, 'EMBEDDING_DIM', 384))
+    parser.add_argument('--chunks-per-document', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=5000, help='Chunks per upsert while loading')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=3, help='Results per query (the engine uses 3)')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    args = parser.parse_args()
+
+    results = [run(backend, size, args) for size in args.sizes for backend in args.backends]
+
+    if args.json:
+        print(json.dumps({'dim': args.dim, 'k': args.k, 'results': results}, indent=2))
+        return
+
+    columns = ['chunks', 'load_chunks_per_s', 'disk_mb', 'document_p50_ms', 'document_p99_ms', 'all_p50_ms', 'all_p99_ms']
+    print(f"{'backend':<10}" + "".join(f"{column:>18}" for column in columns))
+    for row in results:
+        print(f"{row['backend']:<10}" + "".join(
+            f"{row[column]:>18.3f}" if isinstance(row[column], float) else f"{row[column]:>18}" for column in columns))
+
+
+if __name__ == '__main__':
+    main()
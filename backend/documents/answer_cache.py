@@ -0,0 +1,288 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .metrics import CACHE_LOOKUPS
+
+ALL_DOCUMENTS = '*'
+
+
+def normalize_question(question):
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    question = re.sub(r'\s+', ' ', question.strip().lower())
+    return question.rstrip(' ?!.')
+
+
+class AnswerCache:
+    """Persistent answer cache keyed on the question and the document scope.
+
+    A lookup hits when the normalized question text matches exactly, or, with
+    semantic lookups on, when the question embedding is within the cosine
+    similarity threshold of a cached question in the same scope. Entries live
+    in SQLite; the embeddings of each scope are kept as a normalized float32
+    matrix in memory so a semantic lookup is a single matrix-vector product.
+    Each scope has its own version: this process patches its matrix in place
+    for its own writes and rebuilds it only after another process wrote to
+    that scope. Hits update the LRU order in memory, written out with the
+    next put or every touch_interval seconds.
+
+    Every invalidation bumps the generation of the scopes it clears. Callers
+    read generation() before retrieval and pass it to put(), which drops the
+    answer if the scope was invalidated meanwhile: an answer generated from
+    chunks that a re-ingestion replaced is never stored.
+    """
+
+    def __init__(self, path, similarity=0.92, ttl=86400, max_entries=5000, max_bytes=50 * 1024 * 1024,
+                 semantic=False, touch_interval=30.0):
+        self.path = str(path)
+        self.semantic = semantic
+        self.similarity = similarity
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                scope TEXT NOT NULL,
+                question TEXT NOT NULL,
+                embedding BLOB,
+                answer TEXT NOT NULL,
+                sources TEXT NOT NULL DEFAULT '[]',
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS answers_scope_question ON answers (scope, question);
+            CREATE INDEX IF NOT EXISTS answers_accessed_at ON answers (accessed_at);
+            CREATE TABLE IF NOT EXISTS versions (scope TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS generations (scope TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        """)
+        self._conn.commit()
+
+        # scope -> (version, ids, matrix); rebuilt when another writer bumps the scope's version
+        self._matrices = {}
+        self._touched = {}  # entry id -> last hit time, not written yet
+        self._touched_at = time.monotonic()
+
+    @classmethod
+    def from_settings(cls):
+        if not getattr(settings, 'ANSWER_CACHE_ENABLED', True):
+            return None
+        return cls(
+            path=getattr(settings, 'ANSWER_CACHE_PATH', os.path.join(settings.BASE_DIR, 'rag_data', 'answer_cache.sqlite3')),
+            similarity=getattr(settings, 'ANSWER_CACHE_SIMILARITY', 0.92),
+            semantic=getattr(settings, 'ANSWER_CACHE_SEMANTIC', False),
+            ttl=getattr(settings, 'ANSWER_CACHE_TTL', 86400),
+            max_entries=getattr(settings, 'ANSWER_CACHE_MAX_ENTRIES', 5000),
+            max_bytes=getattr(settings, 'ANSWER_CACHE_MAX_BYTES', 50 * 1024 * 1024),
+        )
+
+    @staticmethod
+    def scope_for(document_id):
+        return str(document_id) if document_id else ALL_DOCUMENTS
+
+    def _version(self, scope):
+        row = self._conn.execute("SELECT value FROM versions WHERE scope = ?", (scope,)).fetchone()
+        return row[0] if row else 0
+
+    def _changed(self, scope, removed=None, added=None):
+        """Bump scope's version and bring this process's matrix along when it was current.
+
+        removed is the set of entry ids deleted from scope; None drops the matrix instead.
+        """
+        version = self._version(scope)
+        self._conn.execute(
+            "INSERT INTO versions (scope, value) VALUES (?, 1) ON CONFLICT (scope) DO UPDATE SET value = value + 1",
+            (scope,)
+        )
+        cached = self._matrices.pop(scope, None)
+        if cached is None or cached[0] != version or removed is None:
+            return
+        ids, matrix = cached[1], cached[2]
+        if removed and ids:
+            keep = [position for position, entry_id in enumerate(ids) if entry_id not in removed]
+            ids, matrix = [ids[position] for position in keep], matrix[keep]
+        if added is not None:
+            entry_id, vector = added
+            ids = ids + [entry_id]
+            matrix = vector[None, :] if matrix is None or not len(matrix) else np.vstack([matrix, vector])
+        self._matrices[scope] = (version + 1, ids, matrix)
+
+    def _generation(self, scope):
+        row = self._conn.execute("SELECT value FROM generations WHERE scope = ?", (scope,)).fetchone()
+        return row[0] if row else 0
+
+    def generation(self, scope):
+        """How many times scope was invalidated; see put()"""
+        with self._lock:
+            return self._generation(scope)
+
+    def _touch(self, entry_id):
+        self._touched[entry_id] = time.time()
+        if time.monotonic() - self._touched_at >= self.touch_interval:
+            self._flush_touches()
+            self._conn.commit()
+
+    def _flush_touches(self):
+        if self._touched:
+            self._conn.executemany("UPDATE answers SET accessed_at = ? WHERE id = ?",
+                                   [(accessed_at, entry_id) for entry_id, accessed_at in self._touched.items()])
+            self._touched.clear()
+        self._touched_at = time.monotonic()
+
+    def get_exact(self, question, scope):
+        """Return (answer, sources) for an exact normalized-text match, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, answer, sources FROM answers WHERE scope = ? AND question = ? AND created_at > ? "
+                "ORDER BY id DESC LIMIT 1",
+                (scope, normalize_question(question), time.time() - self.ttl)
+            ).fetchone()
+            if row is None:
+                if not self.semantic:
+                    self.misses += 1
+                CACHE_LOOKUPS.inc(cache='answer_exact', result='miss')
+                return None
+            self._touch(row[0])
+            self.hits_exact += 1
+            CACHE_LOOKUPS.inc(cache='answer_exact', result='hit')
+            return row[1], json.loads(row[2])
+
+    def get_similar(self, embedding, scope):
+        """Return (answer, sources) for the most similar cached question above the threshold, or None"""
+        with self._lock:
+            ids, matrix = self._scope_matrix(scope)
+            if matrix is not None and len(ids):
+                query = np.asarray(embedding, dtype=np.float32).ravel()
+                query /= (np.linalg.norm(query) or 1.0)
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity:
+                    # The matrix may still hold entries that expired since it was built
+                    row = self._conn.execute(
+                        "SELECT answer, sources FROM answers WHERE id = ? AND created_at > ?",
+                        (ids[best], time.time() - self.ttl)
+                    ).fetchone()
+                    if row is not None:
+                        self._touch(ids[best])
+                        self.hits_semantic += 1
+                        CACHE_LOOKUPS.inc(cache='answer_semantic', result='hit')
+                        return row[0], json.loads(row[1])
+
+            self.misses += 1
+            CACHE_LOOKUPS.inc(cache='answer_semantic', result='miss')
+            return None
+
+    def _scope_matrix(self, scope):
+        version = self._version(scope)
+        cached = self._matrices.get(scope)
+        if cached and cached[0] == version:
+            return cached[1], cached[2]
+
+        rows = self._conn.execute(
+            "SELECT id, embedding FROM answers WHERE scope = ? AND embedding IS NOT NULL AND created_at > ?",
+            (scope, time.time() - self.ttl)
+        ).fetchall()
+        ids = [row[0] for row in rows]
+        matrix = np.frombuffer(b''.join(row[1] for row in rows), dtype=np.float32).reshape(len(rows), -1) if rows else None
+        self._matrices[scope] = (version, ids, matrix)
+        return ids, matrix
+
+    def put(self, question, embedding, answer, scope, sources=None, generation=None):
+        """Store an answer; with generation (read before retrieval), only if scope was not invalidated since.
+
+        Returns whether the answer was stored.
+        """
+        blob = None
+        if embedding is not None:
+            vector = np.asarray(embedding, dtype=np.float32).ravel()
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+            blob = vector.astype(np.float32).tobytes()
+
+        sources = json.dumps(sources or [])
+        size = len(answer.encode('utf-8')) + len(sources) + len(blob or b'')
+        now = time.time()
+        with self._lock:
+            if generation is not None and self._generation(scope) != generation:
+                return False
+            entry_id = self._conn.execute(
+                "INSERT INTO answers (scope, question, embedding, answer, sources, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (scope, normalize_question(question), blob, answer, sources, size, now, now)
+            ).lastrowid
+            # Eviction orders by accessed_at, so the hits recorded since the last write go in first
+            self._flush_touches()
+            evicted = self._evict()
+            for evicted_scope in evicted.keys() - {scope}:
+                self._changed(evicted_scope, removed=evicted[evicted_scope])
+            added = (entry_id, np.frombuffer(blob, dtype=np.float32)) if blob is not None else None
+            self._changed(scope, removed=evicted.get(scope, set()), added=added)
+            self._conn.commit()
+        return True
+
+    def _evict(self):
+        """Drop expired entries, then least recently used ones until within budget; returns {scope: ids}"""
+        doomed = self._conn.execute("SELECT id, scope FROM answers WHERE created_at <= ?",
+                                    (time.time() - self.ttl,)).fetchall()
+        self._conn.executemany("DELETE FROM answers WHERE id = ?", [(entry_id,) for entry_id, _ in doomed])
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM answers").fetchone()
+        if count > self.max_entries or total > self.max_bytes:
+            lru = []
+            for entry_id, scope, size in self._conn.execute(
+                    "SELECT id, scope, size FROM answers ORDER BY accessed_at"):
+                if count <= self.max_entries and total <= self.max_bytes:
+                    break
+                lru.append((entry_id, scope))
+                count -= 1
+                total -= size
+            self._conn.executemany("DELETE FROM answers WHERE id = ?", [(entry_id,) for entry_id, _ in lru])
+            doomed += lru
+
+        evicted = {}
+        for entry_id, scope in doomed:
+            evicted.setdefault(scope, set()).add(entry_id)
+        return evicted
+
+    def invalidate(self, document_id):
+        """Drop answers for a document and for the all-documents scope, which may have used it"""
+        scopes = (self.scope_for(document_id), ALL_DOCUMENTS)
+        with self._lock:
+            self._conn.execute("DELETE FROM answers WHERE scope IN (?, ?)", scopes)
+            self._conn.executemany(
+                "INSERT INTO generations (scope, value) VALUES (?, 1) "
+                "ON CONFLICT (scope) DO UPDATE SET value = value + 1",
+                [(scope,) for scope in scopes]
+            )
+            for scope in scopes:
+                self._changed(scope)
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM answers").fetchone()
+        lookups = self.hits_exact + self.hits_semantic + self.misses
+        return {
+            'entries': count,
+            'bytes': total,
+            'hits_exact': self.hits_exact,
+            'hits_semantic': self.hits_semantic,
+            'misses': self.misses,
+            'hit_rate': (self.hits_exact + self.hits_semantic) / lookups if lookups else 0.0,
+            'semantic': self.semantic,
+            'similarity_threshold': self.similarity
+        }
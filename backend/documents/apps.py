@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class DocumentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'documents'
+
+    def ready(self):
+        from .registry import is_server_process, should_warm_up, start_ingestion, start_warm_up
+        if not is_server_process():
+            return
+        # Jobs left by a previous run are recovered at boot, not on the first upload
+        start_ingestion()
+        # The RAG stack loads lazily; servers can opt in to loading it in the background at boot
+        if should_warm_up():
+            start_warm_up()
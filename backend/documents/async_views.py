@@ -0,0 +1,168 @@
+"""Async versions of the query, upload and status endpoints, for ASGI servers.
+
+Under WSGI every request holds a worker thread until it returns, so a few
+slow generations use up the whole pool. These views await the LLM on the
+event loop instead: a waiting request costs a coroutine, not a thread.
+Work that is blocking by nature (encoding, vector search, SQLite, file
+writes) runs on bounded executors (RAGEngine.blocking_executor and the
+asgiref thread pool), never on the event loop.
+
+They are plain Django async views: DRF's @api_view is synchronous, so
+Django would run them in a thread and nothing would be gained. Requests
+and responses are the same JSON as the DRF views. Served under /api/async/.
+"""
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.core.files.storage import default_storage
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from .ingestion import QueueFull
+from .metrics import collect_timings, span
+from .models import Document
+from .registry import get_engine, get_ingestion_queue
+from .views import _not_modified, _parse_timeout
+
+logger = logging.getLogger(__name__)
+
+
+def _json_body(request):
+    """The parsed JSON body, or None when it is not a JSON object"""
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _wants_timings(request, data):
+    value = data.get('timings', request.GET.get('timings', False))
+    return str(value).lower() in ('true', '1', 'yes')
+
+
+def _parse_query(request):
+    """(data, timeout, error_response) for the query endpoints"""
+    data = _json_body(request)
+    if data is None:
+        return None, None, JsonResponse({'error': 'Request body must be a JSON object'}, status=400)
+    if not data.get('question'):
+        return None, None, JsonResponse({'error': 'Question required'}, status=400)
+    timeout, error = _parse_timeout(data)
+    if error:
+        return None, None, JsonResponse({'error': error}, status=400)
+    return data, timeout, None
+
+
+@csrf_exempt
+@require_POST
+async def query_document(request):
+    data, timeout, error = _parse_query(request)
+    if error:
+        return error
+
+    with collect_timings(_wants_timings(request, data)) as timings:
+        answer = await get_engine().aquery_documents(data['question'], data.get('document_id'), timeout=timeout)
+    if timings:
+        return JsonResponse({'answer': answer, 'timings': timings.as_dict()})
+    return JsonResponse({'answer': answer})
+
+
+@csrf_exempt
+@require_POST
+async def query_document_stream(request):
+    """Stream the answer as server-sent events: sources first, then tokens"""
+    data, timeout, error = _parse_query(request)
+    if error:
+        return error
+
+    async def event_stream():
+        # Django closes this generator when the client disconnects, which closes the Ollama stream
+        events = get_engine().astream_query(data['question'], data.get('document_id'), timeout=timeout)
+        try:
+            async for event, payload in events:
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        finally:
+            await events.aclose()
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _save_upload(file):
+    with span('read'):
+        return default_storage.save(file.name, file)
+
+
+@csrf_exempt
+@require_POST
+async def upload_document(request):
+    """Upload a document and queue it for background processing"""
+    try:
+        # Parsing the multipart body may spool to disk
+        files = await sync_to_async(lambda: request.FILES)()
+        file = files.get('file')
+        if not file:
+            return JsonResponse({'error': 'No file provided'}, status=400)
+
+        ingestion_queue = get_ingestion_queue()
+        if ingestion_queue.policy == 'reject' and ingestion_queue.is_full():
+            return JsonResponse({'error': 'Ingestion queue is full, please retry later'},
+                                status=503, headers={'Retry-After': '30'})
+
+        file_path = await sync_to_async(_save_upload, thread_sensitive=False)(file)
+        document = await Document.objects.acreate(
+            title=file.name,
+            file_path=file_path,
+            file_type=file.name.split('.')[-1],
+            file_size=file.size,
+            processing_status='pending',
+            tenant=request.POST.get('tenant', '')[:64]
+        )
+        logger.info("Created document record ID: %s", document.id)
+
+        try:
+            scheduled = ingestion_queue.submit(document.id)
+        except QueueFull as e:
+            await document.adelete()
+            await sync_to_async(default_storage.delete, thread_sensitive=False)(file_path)
+            return JsonResponse({'error': str(e)}, status=503, headers={'Retry-After': '30'})
+
+        return JsonResponse({
+            'id': document.id,
+            'job_id': document.id,
+            'status': document.processing_status,
+            'queued': scheduled,
+            'status_url': f'/api/async/documents/{document.id}/status/'
+        }, status=202)
+
+    except Exception as e:
+        logger.exception("Upload error: %s", e)
+        return JsonResponse({'error': f'Upload failed: {str(e)}'}, status=500)
+
+
+@csrf_exempt
+@require_GET
+async def document_status(request, document_id):
+    """Poll the ingestion status of a document"""
+    document = await (Document.objects.filter(id=document_id)
+                      .values('id', 'processing_status', 'progress', 'status_message', 'updated_at').afirst())
+    if document is None:
+        return JsonResponse({'error': 'Document not found'}, status=404)
+
+    etag = f'"{document["id"]}-{document["updated_at"].timestamp()}"'
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if _not_modified(request, etag):
+        return HttpResponse(status=304, headers=headers)
+    return JsonResponse({
+        'id': document['id'],
+        'job_id': document['id'],
+        'status': document['processing_status'],
+        'progress': document['progress'],
+        'message': document['status_message'],
+        'updated_at': document['updated_at']
+    }, headers=headers)
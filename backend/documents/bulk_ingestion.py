@@ -0,0 +1,379 @@
+import logging
+import os
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .extractors import _chunk_file, _init_chunk_worker, worker_context
+from .metrics import DOCUMENTS, span
+from .models import Document, IngestionBatch
+from .pipeline import IngestionError
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+QUEUED_MESSAGE = 'Queued for bulk ingestion'
+
+
+def is_archive(name):
+    return name.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def _spool_member(raw, limit, block_size=64 * 1024):
+    """Copy an archive member to a temporary file, counting the bytes actually extracted.
+
+    The size an archive declares for a member is not trusted: copying stops
+    as soon as more than limit bytes come out. Returns (file, size), with
+    file None when the member was too large. Small members stay in memory,
+    larger ones spill to disk, so the archive is never unpacked in memory.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    size = 0
+    while True:
+        block = raw.read(block_size)
+        if not block:
+            break
+        size += len(block)
+        if size > limit:
+            spool.close()
+            return None, size
+        spool.write(block)
+    spool.seek(0)
+    return spool, size
+
+
+def _iter_zip_members(uploaded):
+    # The central directory sits at the end: Django has spooled large uploads to disk, so this seeks the temp file
+    with zipfile.ZipFile(uploaded) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            with archive.open(info) as raw:
+                yield info.filename, info.file_size, raw
+
+
+def _iter_tar_members(uploaded):
+    # Stream mode reads members front to back without seeking
+    with tarfile.open(fileobj=uploaded, mode='r|*') as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            yield member.name, member.size, archive.extractfile(member)
+
+
+def save_upload(uploaded, max_files, max_entry_size):
+    """Save an uploaded file, or every member of an uploaded zip/tar archive, to default_storage.
+
+    Yields ('saved', name, storage_path, size) or ('skipped', name, reason).
+    At most max_files files are saved; the caller stops iterating when its
+    own limit is reached.
+    """
+    if not is_archive(uploaded.name):
+        if uploaded.size > max_entry_size:
+            yield 'skipped', uploaded.name, f'Larger than {max_entry_size} bytes'
+            return
+        with span('read'):
+            path = default_storage.save(uploaded.name, uploaded)
+        yield 'saved', uploaded.name, path, uploaded.size
+        return
+
+    members = _iter_zip_members if uploaded.name.lower().endswith('.zip') else _iter_tar_members
+    saved = 0
+    try:
+        for member_name, size, raw in members(uploaded):
+            name = os.path.basename(member_name)
+            label = f"{uploaded.name}:{member_name}"
+            if not name or name.startswith('.') or '__MACOSX/' in member_name:
+                continue
+            # The declared size rejects obvious cases early; the extracted bytes are what is enforced
+            if size > max_entry_size:
+                yield 'skipped', label, f'Larger than {max_entry_size} bytes'
+                continue
+            if saved >= max_files:
+                yield 'skipped', uploaded.name, f'File limit of {max_files} reached'
+                return
+            spool = path = None
+            try:
+                with span('read'):
+                    spool, size = _spool_member(raw, max_entry_size)
+                    if spool is not None:
+                        with spool:
+                            if size:
+                                path = default_storage.save(name, File(spool, name=name))
+            except (OSError, RuntimeError, zipfile.BadZipFile, tarfile.TarError) as e:
+                # e.g. an encrypted zip member or a corrupt entry; the rest of the archive may be fine
+                yield 'skipped', label, f'Could not extract: {str(e)}'
+                continue
+            if spool is None:
+                yield 'skipped', label, f'Larger than {max_entry_size} bytes'
+                continue
+            if path is None:
+                yield 'skipped', label, 'File is empty'
+                continue
+            saved += 1
+            yield 'saved', name, path, size
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+        yield 'skipped', uploaded.name, f'Invalid archive: {str(e)}'
+
+
+class BulkIngestion:
+    """Ingests bulk uploads many documents at a time.
+
+    Extraction and chunking of whole files are fanned out across a process
+    pool; as files come back, their chunks are packed into large embedding
+    batches shared by many documents (one encoder call for hundreds of small
+    files) and stored per document with the engine's usual diffing. Batches
+    run one at a time, in a single background thread per process.
+
+    Documents of a batch are created in 'processing' state so the regular
+    IngestionQueue leaves them alone. A heartbeat thread refreshes updated_at
+    of every batch submitted to this process, running or still waiting its
+    turn; if the process dies they go stale and IngestionQueue.sweep()
+    re-queues them as ordinary jobs.
+    """
+
+    def __init__(self, engine, workers=None, embed_batch_size=None, heartbeat=None):
+        self.engine = engine
+        self.workers = workers or getattr(settings, 'BULK_INGEST_WORKERS', None) or os.cpu_count() or 1
+        self.embed_batch_size = embed_batch_size or getattr(settings, 'BULK_EMBED_BATCH_SIZE', 1024)
+        # Beat as often as the ingestion queue does, well inside its stale window
+        self.heartbeat = heartbeat or max(getattr(settings, 'INGESTION_STALE_AFTER', 300) / 3, 1)
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bulk-ingestion')
+        self._lock = threading.Lock()
+        self._claimed = set()  # Batches submitted to this process and not finished
+        self._beater = None
+
+    def submit(self, batch_id):
+        with self._lock:
+            self._claimed.add(batch_id)
+            if self._beater is None:
+                self._beater = threading.Thread(target=self._beat_loop, name='bulk-heartbeat', daemon=True)
+                self._beater.start()
+        self._executor.submit(self._run, batch_id)
+
+    def _run(self, batch_id):
+        close_old_connections()
+        try:
+            self.ingest(batch_id)
+        except Exception as e:
+            logger.exception("Bulk ingestion of batch %s crashed", batch_id)
+            Document.objects.filter(batch_id=batch_id, processing_status='processing').update(
+                processing_status='failed',
+                status_message=f"Unexpected error: {str(e)}",
+                updated_at=timezone.now()
+            )
+        finally:
+            with self._lock:
+                self._claimed.discard(batch_id)
+            close_old_connections()
+
+    def _beat_loop(self):
+        while True:
+            time.sleep(self.heartbeat)
+            try:
+                self.keep_alive()
+            except Exception as e:
+                logger.warning("Bulk ingestion heartbeat failed: %s", e)
+            finally:
+                close_old_connections()
+
+    def keep_alive(self):
+        """Refresh the documents of every batch claimed here so a sweep does not take them for abandoned"""
+        with self._lock:
+            batch_ids = list(self._claimed)
+        if batch_ids:
+            Document.objects.filter(batch_id__in=batch_ids, processing_status='processing').update(
+                updated_at=timezone.now()
+            )
+
+    def ingest(self, batch_id):
+        """Process the queued documents of a batch; returns (and stores) the batch summary"""
+        IngestionBatch.objects.filter(id=batch_id).update(started_at=timezone.now())
+        documents = list(Document.objects.filter(batch_id=batch_id, processing_status='processing')
+                         .order_by('id').values_list('id', 'file_path', 'file_size'))
+        run = _BatchRun(self, batch_id, {document_id: file_size for document_id, _, file_size in documents})
+        start = time.perf_counter()
+
+        anchor_every = getattr(settings, 'CHUNK_ANCHOR_EVERY', 4)
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=worker_context(),
+                                 initializer=_init_chunk_worker,
+                                 initargs=(self.engine.chunker_factory(), anchor_every)) as pool:
+            window = self.workers * 2  # Files in flight; bounds the chunks held by finished results
+            pending = set()
+            queued = iter(documents)
+            while True:
+                for document_id, file_path, _ in queued:
+                    pending.add(pool.submit(_chunk_file, document_id, default_storage.path(file_path)))
+                    if len(pending) >= window:
+                        break
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    run.add_file(*future.result())
+        run.flush()
+
+        summary = run.summary(time.perf_counter() - start)
+        IngestionBatch.objects.filter(id=batch_id).update(summary=summary, finished_at=timezone.now())
+        logger.info("Bulk batch %s finished: %s", batch_id, summary)
+        return summary
+
+
+class _BatchRun:
+    """Packs chunks of many documents into shared embedding batches and finishes each document"""
+
+    def __init__(self, ingestion, batch_id, file_sizes):
+        self.engine = ingestion.engine
+        self.batch_size = ingestion.embed_batch_size
+        self.batch_id = batch_id
+        self.file_sizes = file_sizes
+
+        self.buffer = []  # (document_id, chunk_index, chunk, page, offset) awaiting embedding
+        self.totals = {}  # document_id -> chunk count
+        self.remaining = {}  # document_id -> chunks not stored yet
+        self.counts = {}  # document_id -> [unchanged, reused, embedded]
+        self.records = {}  # document_id -> DocumentChunk rows written when it completes
+        self.completed = set()
+        self.failed = set()
+        self.embed_batches = 0
+        self.embedded_texts = 0
+
+    def add_file(self, document_id, chunks, pages, offsets, error):
+        if error or not chunks:
+            if not error:
+                error = "File is empty"
+                try:
+                    # As in RAGEngine.process_document: an emptied file must not stay searchable
+                    self.engine.clear_document(document_id)
+                except IngestionError as e:
+                    error = f"File is empty, and its old chunks could not be removed: {str(e)}"
+            self.fail([document_id], error)
+            return
+
+        # Cached answers may quote the old content
+        self.engine.invalidate_answers(document_id)
+        self.totals[document_id] = self.remaining[document_id] = len(chunks)
+        self.counts[document_id] = [0, 0, 0]
+        self.records[document_id] = []
+        self.buffer.extend((document_id, index, chunk, page, offset)
+                           for index, (chunk, page, offset) in enumerate(zip(chunks, pages, offsets)))
+        Document.objects.filter(id=document_id).update(
+            progress=50,
+            status_message=f"Extracted {len(chunks)} chunks, waiting for embedding",
+            updated_at=timezone.now()
+        )
+        while len(self.buffer) >= self.batch_size:
+            items, self.buffer = self.buffer[:self.batch_size], self.buffer[self.batch_size:]
+            self.store(items)
+
+    def flush(self):
+        if self.buffer:
+            items, self.buffer = self.buffer, []
+            self.store(items)
+
+    def store(self, items):
+        """Diff items of any number of documents against the store, embed what changed in one call, then store them"""
+        groups = []  # (document_id, items, diff)
+        start = 0
+        while start < len(items):
+            document_id = items[start][0]
+            end = start
+            while end < len(items) and items[end][0] == document_id:
+                end += 1
+            group = items[start:end]
+            start = end
+            if document_id in self.failed:
+                continue
+            try:
+                diff = self.engine.diff_chunk_batch(document_id, group[0][1], [item[2] for item in group],
+                                                    [item[3] for item in group])
+            except IngestionError as e:
+                self.fail([document_id], str(e))
+                continue
+            groups.append((document_id, group, diff))
+
+        # Only content with no stored embedding goes to the encoder
+        texts = [group[offset][2] for _, group, (_, _, to_embed) in groups for offset in to_embed]
+        vectors = []
+        if texts:
+            try:
+                vectors = self.engine.embed_chunks(texts)
+            except Exception as e:
+                self.fail({document_id for document_id, _, _ in groups}, f"Error generating embeddings: {str(e)}")
+                return
+            self.embed_batches += 1
+            self.embedded_texts += len(texts)
+
+        position = 0
+        for document_id, group, diff in groups:
+            group_vectors = [None] * len(group)
+            for offset in diff[2]:
+                group_vectors[offset] = vectors[position]
+                position += 1
+            try:
+                counts = self.engine.store_chunk_batch(
+                    document_id, group[0][1], [item[2] for item in group], [item[3] for item in group],
+                    vectors=group_vectors, offsets=[item[4] for item in group],
+                    records=self.records[document_id], diff=diff
+                )
+                self.counts[document_id] = [total + count for total, count in zip(self.counts[document_id], counts)]
+                self.remaining[document_id] -= len(group)
+                if self.remaining[document_id] == 0:
+                    self.finish(document_id)
+            except IngestionError as e:
+                self.fail([document_id], str(e))
+
+    def finish(self, document_id):
+        total = self.totals[document_id]
+        unchanged, reused, embedded = self.counts[document_id]
+        removed = self.engine.finish_document(document_id, total)
+        self.completed.add(document_id)
+        DOCUMENTS.inc(status='completed')
+        Document.mark_completed(document_id, self.records.pop(document_id),
+                                f"Successfully processed {total} chunks "
+                                f"({embedded} embedded, {reused} reused, "
+                                f"{unchanged} unchanged, {removed} removed)")
+
+    def fail(self, document_ids, message):
+        document_ids = [document_id for document_id in document_ids if document_id not in self.failed]
+        self.failed.update(document_ids)
+        for document_id in document_ids:
+            self.records.pop(document_id, None)
+        Document.objects.filter(id__in=document_ids).update(
+            processing_status='failed',
+            status_message=message,
+            updated_at=timezone.now()
+        )
+        DOCUMENTS.inc(len(document_ids), status='failed')
+        logger.warning("Bulk ingestion failed for documents %s: %s", document_ids, message)
+
+    def summary(self, seconds):
+        chunks = sum(self.totals[document_id] for document_id in self.completed)
+        embedded = sum(self.counts[document_id][2] for document_id in self.completed)
+        size = sum(self.file_sizes.get(document_id, 0) for document_id in self.completed)
+        seconds = max(seconds, 1e-9)
+        return {
+            'files': len(self.file_sizes),
+            'completed': len(self.completed),
+            'failed': len(self.failed),
+            'chunks': chunks,
+            'embedded': embedded,
+            'bytes': size,
+            'seconds': round(seconds, 3),
+            'files_per_second': round(len(self.completed) / seconds, 2),
+            'chunks_per_second': round(chunks / seconds, 2),
+            'mb_per_second': round(size / seconds / (1024 * 1024), 3),
+            'embedding_batches': self.embed_batches,
+            'mean_embedding_batch': round(self.embedded_texts / self.embed_batches, 1) if self.embed_batches else 0.0,
+        }
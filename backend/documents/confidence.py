@@ -0,0 +1,136 @@
+import logging
+import re
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .metrics import ANSWER_PATHS, LLM_SECONDS_SAVED
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+class ConfidenceGate:
+    """Decides after retrieval whether a question needs the LLM at all.
+
+    Relevance is the cosine similarity of the question to the best retrieved
+    chunk, read off the store's squared L2 distance (1 - d / 2 for the unit
+    vectors sentence-transformers produces). Three paths:
+      - not_found: below not_found_similarity nothing retrieved is relevant,
+        so the caller answers "not found" without generating;
+      - extractive: at or above extractive_similarity the sentences of the
+        retrieved chunks are embedded and the best max_sentences of them
+        (each at least sentence_similarity to the question) are returned
+        with their chunk references;
+      - generate: everything else, and extractive candidates whose best
+        sentence is not close enough, go to the LLM as before.
+    Each skipped generation is counted with the mean LLM time of the
+    generations so far, as an estimate of the time saved.
+    """
+
+    PATHS = ('not_found', 'extractive', 'generate')
+
+    def __init__(self, not_found_similarity=0.15, extractive_similarity=0.8, sentence_similarity=0.7,
+                 max_sentences=2, min_sentence_words=4, max_scored_sentences=64):
+        self.not_found_similarity = not_found_similarity
+        self.extractive_similarity = extractive_similarity
+        self.sentence_similarity = sentence_similarity
+        self.max_sentences = max(1, max_sentences)
+        self.min_sentence_words = min_sentence_words
+        self.max_scored_sentences = max_scored_sentences
+
+        self._lock = threading.Lock()
+        self._stats = {path: 0 for path in self.PATHS}
+        self._stats['llm_seconds_saved'] = 0.0
+
+    @classmethod
+    def from_settings(cls):
+        if not getattr(settings, 'CONFIDENCE_GATING_ENABLED', False):
+            return None
+        return cls(
+            not_found_similarity=getattr(settings, 'CONFIDENCE_NOT_FOUND_SIMILARITY', 0.15),
+            extractive_similarity=getattr(settings, 'CONFIDENCE_EXTRACTIVE_SIMILARITY', 0.8),
+            sentence_similarity=getattr(settings, 'CONFIDENCE_SENTENCE_SIMILARITY', 0.7),
+            max_sentences=getattr(settings, 'CONFIDENCE_MAX_SENTENCES', 2),
+        )
+
+    @staticmethod
+    def similarity(distance):
+        return 1.0 - float(distance) / 2.0
+
+    def sentences(self, results):
+        """(sentence, chunk position) pairs of the retrieved chunks, in context order, without repeats"""
+        seen = set()
+        found = []
+        for position, text in enumerate(results['documents'][0]):
+            for sentence in _SENTENCE_END.split(text or ''):
+                sentence = ' '.join(sentence.split())
+                if len(sentence.split()) < self.min_sentence_words or sentence in seen:
+                    continue
+                seen.add(sentence)  # Overlapping chunks repeat sentences
+                found.append((sentence, position))
+                if len(found) == self.max_scored_sentences:
+                    return found
+        return found
+
+    def extract(self, question_embedding, results, encode):
+        """(answer, chunk ids) built from the best sentences, or None when none is close enough"""
+        candidates = self.sentences(results)
+        if not candidates:
+            return None
+        vectors = np.asarray(encode([sentence for sentence, _ in candidates]), dtype=np.float32)
+        question = np.asarray(question_embedding, dtype=np.float32).reshape(-1)
+        scores = vectors @ question / np.maximum(np.linalg.norm(vectors, axis=1) * np.linalg.norm(question), 1e-12)
+        best = [index for index in np.argsort(-scores)[:self.max_sentences]
+                if scores[index] >= self.sentence_similarity]
+        if not best:
+            return None
+
+        metadatas = results.get('metadatas') or [[{}] * len(results['ids'][0])]
+        parts, sources = [], []
+        for index in best:
+            sentence, position = candidates[index]
+            metadata = metadatas[0][position] or {}
+            parts.append(f"{sentence} [document {metadata.get('document_id')}, chunk {metadata.get('chunk_index')}]")
+            if results['ids'][0][position] not in sources:
+                sources.append(results['ids'][0][position])
+        return " ".join(parts), sources
+
+    def decide(self, question_embedding, results, encode, llm_seconds=0.0):
+        """Pick the path for one question's retrieval results (single-query shaped).
+
+        Returns (path, extracted): extracted is (answer, chunk ids) on the
+        extractive path and None otherwise. llm_seconds is the current mean
+        generation time, credited as saved when the LLM is skipped.
+        """
+        distances = (results.get('distances') or [[]])[0]
+        top = max((self.similarity(distance) for distance in distances), default=None)
+        extracted = None
+        if top is not None and top < self.not_found_similarity:
+            path = 'not_found'
+        elif top is not None and top >= self.extractive_similarity and question_embedding is not None:
+            extracted = self.extract(question_embedding, results, encode)
+            path = 'extractive' if extracted else 'generate'
+        else:
+            path = 'generate'
+
+        saved = llm_seconds if path != 'generate' else 0.0
+        with self._lock:
+            self._stats[path] += 1
+            self._stats['llm_seconds_saved'] += saved
+        ANSWER_PATHS.inc(path=path)
+        if saved:
+            LLM_SECONDS_SAVED.inc(saved, path=path)
+        logger.debug("Confidence gate: top similarity %s, path %s", top, path)
+        return path, extracted
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        decided = sum(stats[path] for path in self.PATHS)
+        stats['llm_skipped_ratio'] = (stats['not_found'] + stats['extractive']) / decided if decided else 0.0
+        stats['thresholds'] = {'not_found': self.not_found_similarity, 'extractive': self.extractive_similarity,
+                               'sentence': self.sentence_similarity}
+        return stats
@@ -0,0 +1,197 @@
+import logging
+import math
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .metrics import TOKENS
+
+logger = logging.getLogger(__name__)
+
+
+def merge_overlapping(first, second):
+    """Join two consecutive chunks, dropping the text the second repeats from the end of the first"""
+    probe = second[:16]  # Overlaps shorter than this are kept; the chunker repeats whole sentences
+    start = first.find(probe, max(0, len(first) - len(second)))
+    while probe and start != -1:
+        if second.startswith(first[start:]):
+            return first + second[len(first) - start:]
+        start = first.find(probe, start + 1)
+    return first + "\n" + second
+
+
+class ContextPacker:
+    """Assembles the prompt context from retrieved candidates.
+
+    Retrieval over-fetches n_results * fetch_factor candidates with their
+    embeddings. pack() then:
+      - selects up to n_results of them by maximal marginal relevance,
+        trading relevance to the question (mmr_lambda) against similarity to
+        chunks already selected;
+      - drops near-duplicates (cosine similarity >= dedupe_similarity to a
+        selected chunk, or the same content hash). A duplicate uses up its
+        slot rather than pulling in another candidate, so the prompt shrinks;
+      - merges chunks of the same document with consecutive chunk_index into
+        one passage, without the overlap the chunker repeats between them;
+      - adds passages in selection order until max_tokens is reached.
+    Token counts are estimated as characters / chars_per_token, which should
+    be set for the generation model's tokenizer.
+    """
+
+    def __init__(self, fetch_factor=4, mmr_lambda=0.7, dedupe_similarity=0.95, max_tokens=1500,
+                 merge_adjacent=True, chars_per_token=4.0):
+        self.fetch_factor = max(1, fetch_factor)
+        self.mmr_lambda = mmr_lambda
+        self.dedupe_similarity = dedupe_similarity
+        self.max_tokens = max_tokens
+        self.merge_adjacent = merge_adjacent
+        self.chars_per_token = chars_per_token
+
+        self._lock = threading.Lock()
+        self._stats = {'contexts': 0, 'naive_tokens': 0, 'packed_tokens': 0,
+                       'duplicates_dropped': 0, 'chunks_merged': 0, 'chunks_truncated': 0}
+
+    @classmethod
+    def from_settings(cls):
+        if not getattr(settings, 'CONTEXT_PACKING_ENABLED', False):
+            return None
+        return cls(
+            fetch_factor=getattr(settings, 'CONTEXT_FETCH_FACTOR', 4),
+            mmr_lambda=getattr(settings, 'CONTEXT_MMR_LAMBDA', 0.7),
+            dedupe_similarity=getattr(settings, 'CONTEXT_DEDUPE_SIMILARITY', 0.95),
+            max_tokens=getattr(settings, 'CONTEXT_MAX_TOKENS', 1500),
+            merge_adjacent=getattr(settings, 'CONTEXT_MERGE_ADJACENT', True),
+            chars_per_token=getattr(settings, 'CONTEXT_CHARS_PER_TOKEN', 4.0),
+        )
+
+    def candidates(self, n_results):
+        """How many chunks retrieval should fetch for n_results context chunks"""
+        return n_results * self.fetch_factor
+
+    def count_tokens(self, text):
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def _select(self, question_embedding, embeddings, hashes, n_results):
+        """MMR order over the candidates (already sorted by distance), minus near-duplicates"""
+        if embeddings is None or question_embedding is None:
+            # Without vectors only exact duplicates can be spotted
+            selected, seen, dropped = [], set(), 0
+            for position, content_hash in enumerate(hashes):
+                if len(selected) + dropped >= n_results:
+                    break
+                if content_hash is not None and content_hash in seen:
+                    dropped += 1
+                    continue
+                selected.append(position)
+                seen.add(content_hash)
+            return selected, dropped
+
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        query = np.asarray(question_embedding, dtype=np.float32).reshape(-1)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        relevance = vectors @ query
+
+        selected = []
+        dropped = 0
+        seen = set()
+        redundancy = np.full(len(vectors), -np.inf, dtype=np.float32)  # Max similarity to the selection
+        available = np.ones(len(vectors), dtype=bool)
+        while len(selected) + dropped < n_results and available.any():
+            scores = self.mmr_lambda * relevance - (1 - self.mmr_lambda) * np.maximum(redundancy, 0)
+            scores[~available] = -np.inf
+            best = int(np.argmax(scores))
+            available[best] = False
+            if redundancy[best] >= self.dedupe_similarity or (hashes[best] is not None and hashes[best] in seen):
+                dropped += 1
+                continue
+            selected.append(best)
+            seen.add(hashes[best])
+            redundancy = np.maximum(redundancy, vectors @ vectors[best])
+        return selected, dropped
+
+    def pack(self, question_embedding, results, n_results):
+        """Pack one question's candidates (a single-query result) into (context, packed_results).
+
+        packed_results keeps the single-query shape and lists the chunks that
+        made it into the context, in context order.
+        """
+        ids = results['ids'][0]
+        documents = results['documents'][0]
+        metadatas = (results.get('metadatas') or [None])[0] or [{} for _ in ids]
+        embeddings = (results.get('embeddings') or [None])[0]
+        hashes = [(metadata or {}).get('content_hash') for metadata in metadatas]
+
+        selected, dropped = self._select(question_embedding, embeddings, hashes, n_results)
+
+        # Passages: runs of consecutive chunk_index within a document, ranked by their best member
+        passages = []
+        if self.merge_adjacent:
+            by_key = {}
+            for rank, position in enumerate(selected):
+                metadata = metadatas[position] or {}
+                if metadata.get('chunk_index') is None:
+                    passages.append((rank, [position]))
+                else:
+                    by_key[(metadata.get('document_id'), metadata['chunk_index'])] = (rank, position)
+            for (document_id, chunk_index), (rank, position) in by_key.items():
+                if (document_id, chunk_index - 1) in by_key:
+                    continue  # Part of the passage that starts earlier
+                members, best = [position], rank
+                while (document_id, chunk_index + len(members)) in by_key:
+                    next_rank, next_position = by_key[(document_id, chunk_index + len(members))]
+                    members.append(next_position)
+                    best = min(best, next_rank)
+                passages.append((best, members))
+            passages = [members for _, members in sorted(passages, key=lambda passage: passage[0])]
+        else:
+            passages = [[position] for position in selected]
+
+        parts, used = [], []
+        remaining = self.max_tokens
+        separator = self.count_tokens("\n\n")
+        merged = truncated = 0
+        for members in passages:
+            text = documents[members[0]]
+            for position in members[1:]:
+                text = merge_overlapping(text, documents[position])
+            tokens = self.count_tokens(text) + (separator if parts else 0)
+            if tokens > remaining:
+                if parts:
+                    continue  # A shorter passage further down may still fit
+                # Never send an empty context: cut the best passage to the budget
+                text = text[:int(remaining * self.chars_per_token)]
+                tokens = self.count_tokens(text)
+                truncated += 1
+            parts.append(text)
+            used.extend(members)
+            merged += len(members) - 1
+            remaining -= tokens
+
+        context = "\n\n".join(parts)
+        naive_tokens = self.count_tokens("\n\n".join(documents[:n_results]))
+        packed_tokens = self.count_tokens(context)
+        with self._lock:
+            self._stats['contexts'] += 1
+            self._stats['naive_tokens'] += naive_tokens
+            self._stats['packed_tokens'] += packed_tokens
+            self._stats['duplicates_dropped'] += dropped
+            self._stats['chunks_merged'] += merged
+            self._stats['chunks_truncated'] += truncated
+        TOKENS.inc(naive_tokens, kind='context_joined')
+        TOKENS.inc(packed_tokens, kind='context_packed')
+        logger.debug("Packed %d of %d candidates into ~%d tokens (top %d joined: ~%d; %d duplicates dropped, %d merged)",
+                     len(used), len(ids), packed_tokens, n_results, naive_tokens, dropped, merged)
+
+        packed = {key: [[results[key][0][position] for position in used]] if results.get(key) is not None else None
+                  for key in ('ids', 'documents', 'metadatas', 'distances')}
+        return context, packed
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['tokens_saved'] = stats['naive_tokens'] - stats['packed_tokens']
+        stats['tokens_saved_ratio'] = stats['tokens_saved'] / stats['naive_tokens'] if stats['naive_tokens'] else 0.0
+        stats['max_tokens'] = self.max_tokens
+        return stats
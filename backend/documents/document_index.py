@@ -0,0 +1,112 @@
+import logging
+import os
+import sqlite3
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentIndex:
+    """Local per-document chunk counts for the vector collection.
+
+    Kept up to date at ingest time so the query path can answer "is the
+    collection empty?" and "does this document have chunks?" without extra
+    vector searches. Counts live in SQLite so every server process sees
+    ingests done by the others; each process caches them in memory and
+    reloads when the version changes.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS chunk_counts (
+                document_id TEXT PRIMARY KEY,
+                chunk_count INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('bootstrapped', 0);
+        """)
+        self._conn.commit()
+
+        self._version = None
+        self._counts = {}
+        self._total = 0
+
+    @classmethod
+    def from_settings(cls):
+        return cls(getattr(settings, 'DOCUMENT_INDEX_PATH', os.path.join(settings.BASE_DIR, 'rag_data', 'document_index.sqlite3')))
+
+    def _meta(self, key):
+        return self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0]
+
+    def _refresh(self):
+        version = self._meta('version')
+        if version == self._version:
+            return
+        self._counts = dict(self._conn.execute("SELECT document_id, chunk_count FROM chunk_counts"))
+        self._total = sum(self._counts.values())
+        self._version = version
+
+    def is_bootstrapped(self):
+        with self._lock:
+            return bool(self._meta('bootstrapped'))
+
+    def bootstrap(self, collection, page_size=10000):
+        """Build the counts from the metadata already stored in the collection"""
+        counts = {}
+        offset = 0
+        while True:
+            page = collection.get(include=['metadatas'], limit=page_size, offset=offset)
+            metadatas = page.get('metadatas') or []
+            for metadata in metadatas:
+                document_id = str(metadata.get('document_id'))
+                counts[document_id] = counts.get(document_id, 0) + 1
+            if len(metadatas) < page_size:
+                break
+            offset += page_size
+
+        with self._lock:
+            self._conn.execute("DELETE FROM chunk_counts")
+            self._conn.executemany("INSERT INTO chunk_counts (document_id, chunk_count) VALUES (?, ?)", counts.items())
+            self._conn.execute("UPDATE meta SET value = 1 WHERE key = 'bootstrapped'")
+            self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+            self._conn.commit()
+        logger.info("Document index built for %d documents", len(counts))
+
+    def set_count(self, document_id, chunk_count):
+        with self._lock:
+            if chunk_count:
+                self._conn.execute(
+                    "INSERT INTO chunk_counts (document_id, chunk_count) VALUES (?, ?) "
+                    "ON CONFLICT(document_id) DO UPDATE SET chunk_count = excluded.chunk_count",
+                    (str(document_id), chunk_count)
+                )
+            else:
+                self._conn.execute("DELETE FROM chunk_counts WHERE document_id = ?", (str(document_id),))
+            self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+            self._conn.commit()
+
+    def count(self, document_id):
+        with self._lock:
+            self._refresh()
+            return self._counts.get(str(document_id), 0)
+
+    def total(self):
+        with self._lock:
+            self._refresh()
+            return self._total
+
+    def counts(self):
+        """Chunk count of every indexed document, by document id.
+
+        The mapping is replaced, never changed, when the index reloads; callers must not modify it.
+        """
+        with self._lock:
+            self._refresh()
+            return self._counts
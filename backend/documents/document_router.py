@@ -0,0 +1,204 @@
+import logging
+import os
+import sqlite3
+import threading
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentRouter:
+    """Per-document summary vectors for coarse-to-fine retrieval over all documents.
+
+    Each document is summarised by a few representatives: the centroid of its
+    chunk embeddings, or up to `representatives` k-means centres for larger
+    documents. A query across all documents ranks documents by their closest
+    representative (cosine) and searches chunks in the top `top_documents`
+    only. Vectors live in SQLite so every server process sees ingests done by
+    the others; each process keeps them as one in-memory matrix and applies
+    changed rows when the version moves on.
+    """
+
+    CHUNKS_PER_REPRESENTATIVE = 16  # A document gets one more k-means centre per this many chunks
+    SAMPLE_SIZE = 2048  # Chunk embeddings clustered per document, taken at an even stride
+    KMEANS_ITERATIONS = 10
+
+    def __init__(self, path, top_documents=16, representatives=4, min_documents=64, exact_fallback=True):
+        self.path = str(path)
+        self.top_documents = top_documents
+        self.representatives = representatives
+        self.min_documents = min_documents
+        self.exact_fallback = exact_fallback
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS representatives (
+                document_id TEXT PRIMARY KEY,
+                dim INTEGER NOT NULL,
+                vectors BLOB,
+                version INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS representatives_version ON representatives (version);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('bootstrapped', 0);
+        """)
+        self._conn.commit()
+
+        self._version = 0
+        self._vectors = {}  # document_id -> normalised (n, dim) float32
+        self._matrix = None  # Stacked representatives, rebuilt lazily after changes
+        self._starts = None  # First row of each document's block in _matrix
+        self._documents = []
+        self._uncovered = (None, None, [])  # (counts mapping, version, uncovered ids) of the last coverage check
+
+    @classmethod
+    def from_settings(cls):
+        if not getattr(settings, 'ROUTING_ENABLED', False):
+            return None
+        return cls(
+            getattr(settings, 'ROUTING_INDEX_PATH', os.path.join(settings.BASE_DIR, 'rag_data', 'document_router.sqlite3')),
+            top_documents=getattr(settings, 'ROUTING_TOP_DOCUMENTS', 16),
+            representatives=getattr(settings, 'ROUTING_REPRESENTATIVES', 4),
+            min_documents=getattr(settings, 'ROUTING_MIN_DOCUMENTS', 64),
+            exact_fallback=getattr(settings, 'ROUTING_EXACT_FALLBACK', True),
+        )
+
+    # -- building ----------------------------------------------------------
+
+    @staticmethod
+    def _normalise(vectors):
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def summarise(self, embeddings):
+        """Representatives of one document's chunk embeddings (an (n, dim) array)"""
+        embeddings = self._normalise(np.asarray(embeddings, dtype=np.float32))
+        k = min(self.representatives, max(1, len(embeddings) // self.CHUNKS_PER_REPRESENTATIVE))
+        if k <= 1:
+            return self._normalise(embeddings.mean(axis=0, keepdims=True))
+
+        # Farthest-point seeding is deterministic, so re-ingesting the same text gives the same vectors
+        centres = [embeddings[0]]
+        nearest = 1 - embeddings @ embeddings[0]
+        for _ in range(1, k):
+            centres.append(embeddings[int(np.argmax(nearest))])
+            nearest = np.minimum(nearest, 1 - embeddings @ centres[-1])
+        centres = np.vstack(centres)
+
+        for _ in range(self.KMEANS_ITERATIONS):
+            assignment = np.argmax(embeddings @ centres.T, axis=1)
+            for cluster in range(k):
+                members = embeddings[assignment == cluster]
+                if len(members):
+                    centres[cluster] = members.mean(axis=0)
+            centres = self._normalise(centres)
+        return centres
+
+    def update(self, document_id, store, total=None, page_size=5000):
+        """Recompute a document's representatives from its chunks in the vector store"""
+        stride = max(1, -(-(total or 0) // self.SAMPLE_SIZE))
+        sample = []
+        offset = 0
+        while True:
+            page = store.get(where={"document_id": str(document_id)}, include=['embeddings'],
+                             limit=page_size, offset=offset)
+            embeddings = page.get('embeddings')
+            if embeddings is None or not len(embeddings):
+                break
+            sample.extend(embeddings[(-offset) % stride::stride])
+            offset += len(embeddings)
+            if len(embeddings) < page_size:
+                break
+        self.set(document_id, self.summarise(np.asarray(sample, dtype=np.float32)) if sample else None)
+
+    def set(self, document_id, vectors):
+        """Store a document's representatives; None removes the document"""
+        with self._lock:
+            self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+            version = self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO representatives (document_id, dim, vectors, version) VALUES (?, ?, ?, ?)",
+                (str(document_id), vectors.shape[1] if vectors is not None else 0,
+                 np.asarray(vectors, dtype=np.float32).tobytes() if vectors is not None else None, version)
+            )
+            self._conn.commit()
+
+    def is_bootstrapped(self):
+        with self._lock:
+            return bool(self._conn.execute("SELECT value FROM meta WHERE key = 'bootstrapped'").fetchone()[0])
+
+    def bootstrap(self, store, document_counts):
+        """Summarise every document of the store, e.g. for an index built before routing existed.
+
+        document_counts maps document ids to chunk counts (DocumentIndex.counts()); documents
+        missing from it are dropped.
+        """
+        for document_id in self.documents().difference(document_counts):
+            self.set(document_id, None)
+        for document_id, total in document_counts.items():
+            self.update(document_id, store, total)
+        with self._lock:
+            self._conn.execute("UPDATE meta SET value = 1 WHERE key = 'bootstrapped'")
+            self._conn.commit()
+        logger.info("Document router built for %d documents", len(document_counts))
+
+    # -- routing -----------------------------------------------------------
+
+    def _refresh(self):
+        version = self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+        if version == self._version:
+            return
+        for document_id, dim, blob in self._conn.execute(
+                "SELECT document_id, dim, vectors FROM representatives WHERE version > ?", (self._version,)):
+            if blob is None:
+                self._vectors.pop(document_id, None)
+            else:
+                self._vectors[document_id] = np.frombuffer(blob, dtype=np.float32).reshape(-1, dim)
+        self._version = version
+        self._matrix = None
+
+    def _stacked(self):
+        if self._matrix is None:
+            self._documents = list(self._vectors)
+            blocks = [self._vectors[document_id] for document_id in self._documents]
+            self._matrix = np.vstack(blocks) if blocks else np.zeros((0, 0), dtype=np.float32)
+            self._starts = np.cumsum([0] + [len(block) for block in blocks[:-1]])
+        return self._matrix, self._starts, self._documents
+
+    def documents(self):
+        with self._lock:
+            self._refresh()
+            return set(self._vectors)
+
+    def uncovered(self, counts):
+        """Ids among `counts` (DocumentIndex.counts()) that have no representatives yet"""
+        with self._lock:
+            self._refresh()
+            cached_counts, version, uncovered = self._uncovered
+            if cached_counts is not counts or version != self._version:
+                uncovered = [document_id for document_id in counts if document_id not in self._vectors]
+                self._uncovered = (counts, self._version, uncovered)
+            return uncovered
+
+    def route(self, query_embeddings, top_documents=None):
+        """The ids of the top_documents documents closest to each query, best first"""
+        top_documents = top_documents or self.top_documents
+        with self._lock:
+            self._refresh()
+            matrix, starts, documents = self._stacked()
+        if not len(documents):
+            return [[] for _ in query_embeddings]
+
+        queries = self._normalise(np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1))
+        # A document scores as its closest representative; its rows are contiguous in the matrix
+        scores = np.maximum.reduceat(matrix @ queries.T, starts, axis=0)
+        k = min(top_documents, len(documents))
+        routed = []
+        for column in range(len(queries)):
+            top = np.argpartition(-scores[:, column], k - 1)[:k]
+            routed.append([documents[position] for position in top[np.argsort(-scores[top, column])]])
+        return routed
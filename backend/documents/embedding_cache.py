@@ -0,0 +1,137 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .metrics import CACHE_LOOKUPS
+
+
+class EmbeddingCache:
+    """Persistent, content-addressed cache of chunk embeddings.
+
+    Entries are keyed by sha1(model name + chunk text), so identical text is
+    embedded once no matter which document it comes from. Vectors are stored
+    as raw float32 blobs in SQLite and evicted least-recently-used once the
+    entry budget is exceeded.
+    """
+
+    LOOKUP_BATCH = 500  # Stay below SQLite's bound-parameter limit
+
+    def __init__(self, path, model_name, max_entries=500000):
+        self.path = str(path)
+        self.model_name = model_name
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key BLOB PRIMARY KEY,
+                vector BLOB NOT NULL,
+                accessed_at REAL NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS embeddings_accessed_at ON embeddings (accessed_at);
+        """)
+        self._conn.commit()
+
+    @classmethod
+    def from_settings(cls):
+        if not getattr(settings, 'EMBEDDING_CACHE_ENABLED', True):
+            return None
+        return cls(
+            path=getattr(settings, 'EMBEDDING_CACHE_PATH', os.path.join(settings.BASE_DIR, 'rag_data', 'embedding_cache.sqlite3')),
+            model_name=getattr(settings, 'EMBEDDING_MODEL', 'all-MiniLM-L6-v2'),
+            max_entries=getattr(settings, 'EMBEDDING_CACHE_MAX_ENTRIES', 500000),
+        )
+
+    def key(self, text):
+        return hashlib.sha1(f"{self.model_name}\0{text}".encode('utf-8')).digest()
+
+    def lookup(self, texts):
+        """Return {index: vector} for the texts that are cached"""
+        keys = [self.key(text) for text in texts]
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), self.LOOKUP_BATCH):
+                batch = list(set(keys[start:start + self.LOOKUP_BATCH]))
+                placeholders = ','.join('?' * len(batch))
+                for key, vector in self._conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch):
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET accessed_at = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+                self._conn.commit()
+
+        return {i: found[key] for i, key in enumerate(keys) if key in found}
+
+    def store(self, texts, vectors):
+        now = time.time()
+        rows = [(self.key(text), np.asarray(vector, dtype=np.float32).tobytes(), now)
+                for text, vector in zip(texts, vectors)]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, accessed_at) VALUES (?, ?, ?)", rows
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY accessed_at LIMIT ?)",
+                (excess,)
+            )
+
+    def encode(self, texts, encoder):
+        """Embed texts, running the encoder once over the cache misses only"""
+        cached = self.lookup(texts)
+        missing = [i for i in range(len(texts)) if i not in cached]
+
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        CACHE_LOOKUPS.inc(len(texts) - len(missing), cache='embedding', result='hit')
+        CACHE_LOOKUPS.inc(len(missing), cache='embedding', result='miss')
+
+        vectors = [None] * len(texts)
+        for i, vector in cached.items():
+            vectors[i] = vector
+
+        if missing:
+            # Duplicate texts within the batch are encoded once
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            encoded = encoder.encode(unique_texts)
+            by_text = dict(zip(unique_texts, encoded))
+            for i in missing:
+                vectors[i] = by_text[texts[i]]
+            self.store(unique_texts, encoded)
+
+        if not vectors:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.vstack(vectors).astype(np.float32)
+
+    def stats(self):
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'entries': count,
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
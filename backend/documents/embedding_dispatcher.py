@@ -0,0 +1,123 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from django.conf import settings
+
+
+class EmbeddingDispatcher:
+    """Micro-batches concurrent encode calls into shared encoder batches.
+
+    Callers hand in a few texts each (typically one question). A single
+    dispatcher thread runs one encoder.encode over everything that queued up
+    while the previous batch was encoding (up to max_batch texts) and gives
+    every caller its own rows. Under concurrent load it also holds a batch
+    open for up to max_wait seconds so more callers can join; an isolated
+    request is encoded right away.
+    encode() blocks the calling thread; aencode() is the same for asyncio
+    code and never blocks the event loop.
+    """
+
+    def __init__(self, get_encoder, max_batch=32, max_wait=0.005):
+        # Called on the dispatcher thread for every batch, so the model can load lazily
+        self._get_encoder = get_encoder
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+
+        self._pending = []  # (texts, future)
+        self._pending_texts = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._last_requests = 0  # Callers served by the previous batch
+
+        self.batches = 0
+        self.items = 0
+
+    @classmethod
+    def from_settings(cls, get_encoder):
+        if not getattr(settings, 'EMBEDDING_BATCH_ENABLED', True):
+            return None
+        return cls(
+            get_encoder,
+            max_batch=getattr(settings, 'EMBEDDING_BATCH_MAX_SIZE', 32),
+            max_wait=getattr(settings, 'EMBEDDING_BATCH_MAX_WAIT', 0.005),
+        )
+
+    def submit(self, texts):
+        """Queue texts for the next batch; the future resolves to their (len(texts), dim) array"""
+        future = Future()
+        texts = list(texts)
+        if not texts:
+            future.set_result(np.zeros((0, 0), dtype=np.float32))
+            return future
+
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='embedding-dispatcher', daemon=True)
+                self._thread.start()
+            self._pending.append((texts, future))
+            self._pending_texts += len(texts)
+            self._condition.notify()
+        return future
+
+    def encode(self, texts):
+        return self.submit(texts).result()
+
+    async def aencode(self, texts):
+        return await asyncio.wrap_future(self.submit(texts))
+
+    def _take_batch(self):
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+
+            # Under concurrent load, give other callers a short window to join the batch
+            deadline = time.monotonic() + self.max_wait
+            while self._pending_texts < self.max_batch and (self._last_requests > 1 or len(self._pending) > 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            batch = []
+            size = 0
+            while self._pending and (not batch or size + len(self._pending[0][0]) <= self.max_batch):
+                texts, future = self._pending.pop(0)
+                batch.append((texts, future))
+                size += len(texts)
+            self._pending_texts -= size
+            self._last_requests = len(batch)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            requests = [(texts, future) for texts, future in batch if future.set_running_or_notify_cancel()]
+            if not requests:
+                continue
+
+            texts = [text for request_texts, _ in requests for text in request_texts]
+            try:
+                vectors = np.asarray(self._get_encoder().encode(texts), dtype=np.float32)
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(texts)
+            start = 0
+            for request_texts, future in requests:
+                future.set_result(vectors[start:start + len(request_texts)])
+                start += len(request_texts)
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+            'max_batch': self.max_batch,
+            'max_wait_ms': self.max_wait * 1000,
+        }
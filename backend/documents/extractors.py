@@ -0,0 +1,262 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from django.conf import settings
+
+from .metrics import timed_iter
+from .pipeline import IngestionError, PageMap, iter_chunks, iter_section_pieces
+
+
+class Extractor:
+    """Turns a file into a stream of (page_number, text) segments.
+
+    page_number is None for formats without pages. Segments are yielded in
+    document order and are meant to be concatenated, so callers can chunk
+    them incrementally without assembling the whole text.
+    """
+
+    name = 'base'
+
+    def iter_segments(self, file_path, progress=None):
+        raise NotImplementedError
+
+    def page_count(self, file_path):
+        return None
+
+
+class TextExtractor(Extractor):
+    name = 'text'
+
+    def __init__(self, block_size=1024 * 1024, errors='strict'):
+        self.block_size = block_size
+        self.errors = errors
+
+    def iter_segments(self, file_path, progress=None):
+        try:
+            file_size = os.path.getsize(file_path) or 1
+            with open(file_path, 'r', encoding='utf-8', errors=self.errors) as f:
+                while True:
+                    block = f.read(self.block_size)
+                    if not block:
+                        break
+                    if progress:
+                        progress(min(f.buffer.tell() / file_size, 1.0))
+                    yield None, block
+        except (OSError, UnicodeDecodeError) as e:
+            raise IngestionError(f"Error reading file: {str(e)}") from e
+
+
+_pdf_pools = {}  # workers -> ProcessPoolExecutor shared by every PDF extraction in the process
+_pdf_pools_lock = threading.Lock()
+
+
+def worker_context():
+    """Start method for worker processes.
+
+    Workers are spawned, not forked: the server process runs threads
+    (ingestion workers, the sweep, request handlers), and a forked child can
+    inherit a lock one of them was holding.
+    """
+    return multiprocessing.get_context('spawn')
+
+
+def _pdf_pool(workers):
+    with _pdf_pools_lock:
+        pool = _pdf_pools.get(workers)
+        if pool is None:
+            pool = _pdf_pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=worker_context())
+        return pool
+
+
+def _discard_pdf_pool(workers, pool):
+    """Forget a pool whose worker died, so the next PDF gets a fresh one"""
+    with _pdf_pools_lock:
+        if _pdf_pools.get(workers) is pool:
+            del _pdf_pools[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _extract_pdf_range(file_path, start, end):
+    """Extract pages [start, end) of a PDF; runs in a worker process"""
+    import PyPDF2
+    with open(file_path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        return [(reader.pages[i].extract_text() or '') + "\n" for i in range(start, end)]
+
+
+class PdfExtractor(Extractor):
+    """PDF text via PyPDF2, extracted page-parallel across processes for large files.
+
+    The worker processes are started once and shared by every PDF the
+    process extracts.
+    """
+
+    name = 'pdf'
+
+    def __init__(self, workers=None, parallel_min_pages=32, pages_per_task=16):
+        self.workers = workers or os.cpu_count() or 1
+        self.parallel_min_pages = parallel_min_pages
+        self.pages_per_task = pages_per_task
+
+    def _reader(self, f):
+        try:
+            import PyPDF2
+        except ImportError:
+            raise IngestionError("PDF reading requires PyPDF2. Please install: pip install PyPDF2")
+        return PyPDF2.PdfReader(f)
+
+    def page_count(self, file_path):
+        with open(file_path, 'rb') as f:
+            return len(self._reader(f).pages)
+
+    def iter_segments(self, file_path, progress=None):
+        try:
+            total = self.page_count(file_path)
+            if total < self.parallel_min_pages or self.workers < 2:
+                yield from self._iter_serial(file_path, total, progress)
+            else:
+                yield from self._iter_parallel(file_path, total, progress)
+        except IngestionError:
+            raise
+        except Exception as e:
+            raise IngestionError(f"Error reading file: {str(e)}") from e
+
+    def _iter_serial(self, file_path, total, progress):
+        with open(file_path, 'rb') as f:
+            reader = self._reader(f)
+            for i, page in enumerate(reader.pages):
+                if progress:
+                    progress((i + 1) / total)
+                yield i + 1, (page.extract_text() or '') + "\n"
+
+    def _iter_parallel(self, file_path, total, progress):
+        ranges = [(start, min(start + self.pages_per_task, total))
+                  for start in range(0, total, self.pages_per_task)]
+        window = self.workers * 2  # Ranges in flight; bounds memory held by finished results
+
+        executor = _pdf_pool(self.workers)
+        pending = []
+        next_range = 0
+        try:
+            while next_range < len(ranges) or pending:
+                while next_range < len(ranges) and len(pending) < window:
+                    start, end = ranges[next_range]
+                    pending.append((start, executor.submit(_extract_pdf_range, file_path, start, end)))
+                    next_range += 1
+
+                # Consume in page order so the text stream stays sequential
+                start, future = pending.pop(0)
+                for offset, text in enumerate(future.result()):
+                    yield start + offset + 1, text
+                if progress:
+                    progress(min((start + self.pages_per_task) / total, 1.0))
+        except BrokenProcessPool:
+            _discard_pdf_pool(self.workers, executor)
+            raise
+        finally:
+            # The pool outlives this document; don't leave its ranges queued
+            for _, future in pending:
+                future.cancel()
+
+
+class DocxExtractor(Extractor):
+    name = 'docx'
+
+    def __init__(self, paragraphs_per_segment=200):
+        self.paragraphs_per_segment = paragraphs_per_segment
+
+    def iter_segments(self, file_path, progress=None):
+        try:
+            from docx import Document
+        except ImportError:
+            raise IngestionError("Word document reading requires python-docx. Please install: pip install python-docx")
+
+        try:
+            paragraphs = Document(file_path).paragraphs
+        except Exception as e:
+            raise IngestionError(f"Error reading file: {str(e)}") from e
+
+        total = len(paragraphs) or 1
+        for start in range(0, len(paragraphs), self.paragraphs_per_segment):
+            batch = paragraphs[start:start + self.paragraphs_per_segment]
+            if progress:
+                progress(min((start + len(batch)) / total, 1.0))
+            yield None, "".join(paragraph.text + "\n" for paragraph in batch)
+
+
+def get_extractor(file_path):
+    """Pick the extractor for a file from its suffix"""
+    suffix = Path(file_path).suffix.lower()
+    block_size = getattr(settings, 'INGEST_READ_BLOCK_SIZE', 1024 * 1024)
+
+    if suffix == '.txt':
+        return TextExtractor(block_size=block_size)
+    if suffix == '.pdf':
+        return PdfExtractor(
+            workers=getattr(settings, 'PDF_EXTRACT_WORKERS', None),
+            parallel_min_pages=getattr(settings, 'PDF_PARALLEL_MIN_PAGES', 32),
+            pages_per_task=getattr(settings, 'PDF_PAGES_PER_TASK', 16),
+        )
+    if suffix in ['.docx', '.doc']:
+        return DocxExtractor()
+    # Try to read as plain text
+    return TextExtractor(block_size=block_size, errors='ignore')
+
+
+def iter_file_chunks(file_path, chunker_factory, anchor_every=4, progress=None, extractor=None):
+    """Stream (chunk, page_number, offset) triples of a file without holding the whole text in memory.
+
+    offset is the character position in the file's extracted text where the
+    chunk starts (before its surrounding whitespace was stripped).
+    """
+    extractor = extractor or get_extractor(file_path)
+    pages = PageMap()
+
+    def blocks():
+        offset = 0
+        for page, text in timed_iter(extractor.iter_segments(file_path, progress=progress), 'extract'):
+            pages.add(offset, page)
+            offset += len(text)
+            yield text
+
+    pieces = iter_section_pieces(blocks(), anchor_every=anchor_every)
+    for offset, chunk in timed_iter(iter_chunks(pieces, chunker_factory), 'chunk'):
+        yield chunk, pages.page_at(offset), offset
+
+
+_chunk_worker = {}
+
+
+def _init_chunk_worker(chunker_factory, anchor_every):
+    """Process pool initializer: the chunker (and its tokenizer) is shipped once per worker"""
+    _chunk_worker.update(chunker_factory=chunker_factory, anchor_every=anchor_every)
+
+
+def _chunk_file(key, file_path):
+    """Extract and chunk a whole file; runs in a worker process.
+
+    Returns (key, chunks, pages, offsets, error) with error set instead of
+    raising, so one bad file does not fail the others.
+    """
+    try:
+        if not os.path.exists(file_path):
+            return key, [], [], [], f"File not found: {file_path}"
+        extractor = get_extractor(file_path)
+        if isinstance(extractor, PdfExtractor):
+            # Files are already spread across the pool; no nested pools
+            extractor.workers = 1
+        chunks, pages, offsets = [], [], []
+        for chunk, page, offset in iter_file_chunks(file_path, _chunk_worker['chunker_factory'],
+                                                    anchor_every=_chunk_worker['anchor_every'], extractor=extractor):
+            chunks.append(chunk)
+            pages.append(page)
+            offsets.append(offset)
+        return key, chunks, pages, offsets, None
+    except IngestionError as e:
+        return key, [], [], [], str(e)
+    except Exception as e:
+        return key, [], [], [], f"Error reading file: {str(e)}"
@@ -0,0 +1,184 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .metrics import DOCUMENTS
+from .models import Document, DocumentCounter
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised when the ingestion queue is at capacity and the backpressure policy is 'reject'"""
+
+
+class IngestionQueue:
+    """Bounded worker pool that processes uploaded documents in the background.
+
+    The Document table is the durable job store: a job is a Document row in
+    'pending' state. Workers claim rows atomically, so several server processes
+    can share the same table. While a job runs, the sweeper thread refreshes
+    its updated_at every third of stale_after; a job left behind by a crashed
+    process stops being refreshed and is re-queued by whichever process
+    sweeps next, including the same server once it has restarted.
+    """
+
+    def __init__(self, engine, workers=None, max_queued=None, policy=None, stale_after=None):
+        self.engine = engine
+        self.workers = workers or getattr(settings, 'INGESTION_WORKERS', 2)
+        self.max_queued = max_queued or getattr(settings, 'INGESTION_MAX_QUEUED', 32)
+        self.policy = policy or getattr(settings, 'INGESTION_BACKPRESSURE', 'queue')
+        self.stale_after = stale_after or getattr(settings, 'INGESTION_STALE_AFTER', 300)
+
+        self.sweep_every = max(self.stale_after / 3, 1)
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ingestion')
+        self._lock = threading.Lock()
+        self._active = set()  # document ids queued or running in this process
+        self._sweeper = None
+
+    def start(self):
+        """Recover left-over jobs, then sweep periodically from a background thread"""
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='ingestion-sweep', daemon=True)
+        self._sweeper.start()
+
+    def _sweep_loop(self):
+        sweep = self.recover
+        while True:
+            try:
+                sweep()
+            except Exception as e:
+                logger.warning("Ingestion sweep failed: %s", e)
+            finally:
+                close_old_connections()
+            sweep = self.sweep
+            time.sleep(self.sweep_every)
+
+    def is_full(self):
+        with self._lock:
+            return len(self._active) >= self.max_queued
+
+    def submit(self, document_id):
+        """Schedule a pending document. Returns False if it was deferred because the pool is full"""
+        with self._lock:
+            if document_id in self._active:
+                return True
+            if len(self._active) >= self.max_queued:
+                if self.policy == 'reject':
+                    raise QueueFull(f"Ingestion queue is full ({self.max_queued} jobs)")
+                # The row stays 'pending' in the database and is drained later
+                return False
+            self._active.add(document_id)
+
+        self._executor.submit(self._run, document_id)
+        return True
+
+    def recover(self):
+        """Re-queue jobs that were pending or abandoned mid-processing by a previous process"""
+        # Writes made outside the ORM (raw SQL, the admin shell) would leave the cached counts off
+        DocumentCounter.reconcile()
+        self.sweep()
+
+    def sweep(self):
+        """Refresh this process's running jobs, re-queue abandoned ones and drain pending rows"""
+        with self._lock:
+            active = list(self._active)
+        if active:
+            Document.objects.filter(id__in=active, processing_status='processing').update(updated_at=timezone.now())
+
+        stale_before = timezone.now() - timedelta(seconds=self.stale_after)
+        reset = Document.objects.filter(
+            processing_status='processing',
+            updated_at__lt=stale_before
+        ).update(processing_status='pending', progress=0, status_message='Re-queued after an interrupted run')
+        if reset:
+            logger.info("Re-queued %d interrupted ingestion jobs", reset)
+        self._drain()
+
+    def _drain(self):
+        """Fill free worker slots from the pending rows in the database"""
+        with self._lock:
+            free = self.max_queued - len(self._active)
+            active = list(self._active)
+        if free <= 0:
+            return
+
+        pending_ids = (Document.objects
+                       .filter(processing_status='pending')
+                       .exclude(id__in=active)
+                       .order_by('created_at', 'id')
+                       .values_list('id', flat=True)[:free])
+        for document_id in pending_ids:
+            try:
+                if not self.submit(document_id):
+                    break
+            except QueueFull:
+                break
+
+    def _run(self, document_id):
+        close_old_connections()
+        try:
+            self._process(document_id)
+        except Exception as e:
+            logger.exception("Ingestion job %s crashed", document_id)
+            DOCUMENTS.inc(status='failed')
+            Document.objects.filter(id=document_id).update(
+                processing_status='failed',
+                status_message=f"Unexpected error: {str(e)}",
+                updated_at=timezone.now()
+            )
+        finally:
+            with self._lock:
+                self._active.discard(document_id)
+            try:
+                self._drain()
+            finally:
+                close_old_connections()
+
+    def _process(self, document_id):
+        # Claim the job; another process may have picked it up already
+        claimed = Document.objects.filter(id=document_id, processing_status='pending').update(
+            processing_status='processing',
+            progress=0,
+            status_message='',
+            updated_at=timezone.now()
+        )
+        if not claimed:
+            return
+
+        document = Document.objects.get(id=document_id)
+        full_file_path = default_storage.path(document.file_path)
+
+        def report_progress(progress, message=''):
+            Document.objects.filter(id=document_id).update(
+                progress=progress,
+                status_message=message,
+                updated_at=timezone.now()
+            )
+
+        records = []
+        success, message = self.engine.process_document(
+            document_id, full_file_path, progress_callback=report_progress, records=records
+        )
+
+        if success:
+            # The chunk rows become visible together with the 'completed' status
+            Document.mark_completed(document_id, records, message)
+        else:
+            Document.objects.filter(id=document_id).update(
+                processing_status='failed',
+                status_message=message,
+                updated_at=timezone.now()
+            )
+        DOCUMENTS.inc(status='completed' if success else 'failed')
+        logger.info("Ingestion job %s finished - Success: %s, %s", document_id, success, message)
@@ -0,0 +1,376 @@
+import asyncio
+import json
+import threading
+import time
+import weakref
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from .metrics import TOKENS
+
+
+class LLMError(Exception):
+    """Generation failed upstream"""
+
+
+class LLMUnavailable(LLMError):
+    """The LLM server could not be reached"""
+
+
+class LLMTimeout(LLMError):
+    """The request deadline passed before the answer was generated"""
+
+
+class FairSemaphore:
+    """Counting semaphore that grants slots in arrival order.
+
+    threading.Semaphore wakes an arbitrary waiter, so under sustained load a
+    request can starve. Here waiters queue up and are served first come,
+    first served.
+    """
+
+    def __init__(self, value):
+        self._value = value
+        self._lock = threading.Lock()
+        self._waiters = deque()
+
+    def acquire(self, timeout=None):
+        with self._lock:
+            if self._value > 0 and not self._waiters:
+                self._value -= 1
+                return True
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+
+        if waiter.wait(timeout):
+            return True
+
+        with self._lock:
+            if waiter.is_set():
+                # Granted between the timeout and taking the lock
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                # Hand the slot straight to the oldest waiter
+                self._waiters.popleft().set()
+            else:
+                self._value += 1
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+
+class _InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _AsyncState:
+    def __init__(self, client, slots):
+        self.client = client
+        self.slots = slots
+        self.calls = {}  # payload key -> future of the leading request
+
+
+class OllamaClient:
+    """Pooled, concurrency-limited client for the Ollama generate API.
+
+    - one requests.Session with a keep-alive connection pool
+    - at most max_in_flight generations upstream, granted in FIFO order
+    - a deadline per request covering queueing and generation
+    - concurrent identical (prompt, model, options) requests share one upstream call; when the
+      leading request times out, a follower with time left makes the call itself
+
+    agenerate() and astream() are the same for asyncio code: they use an
+    httpx.AsyncClient and never block the event loop. Each event loop gets
+    its own connection pool and its own max_in_flight slots, so a process
+    serving both sync and async views can have twice max_in_flight
+    generations upstream.
+    """
+
+    def __init__(self, base_url, model, options=None, max_in_flight=2, pool_size=10,
+                 timeout=60, connect_timeout=5):
+        self.base_url = base_url.rstrip('/')
+        self.generate_url = f"{self.base_url}/api/generate"
+        self.model = model
+        self.options = options or {}
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.max_in_flight = max_in_flight
+        self.pool_size = pool_size
+        self._slots = FairSemaphore(max_in_flight)
+        self._loops = weakref.WeakKeyDictionary()  # event loop -> _AsyncState
+        self._calls_lock = threading.Lock()
+        self._calls = {}
+
+        # Prompt size and evaluation time as reported by Ollama
+        self._usage_lock = threading.Lock()
+        self._usage = {'generations': 0, 'prompt_tokens': 0, 'prompt_eval_seconds': 0.0,
+                       'completion_tokens': 0, 'total_seconds': 0.0}
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            base_url=getattr(settings, 'OLLAMA_URL', 'http://localhost:11434'),
+            model=getattr(settings, 'OLLAMA_MODEL', 'llama2'),
+            options=getattr(settings, 'OLLAMA_OPTIONS', None),
+            max_in_flight=getattr(settings, 'OLLAMA_MAX_IN_FLIGHT', 2),
+            pool_size=getattr(settings, 'OLLAMA_POOL_SIZE', 10),
+            timeout=getattr(settings, 'OLLAMA_TIMEOUT', 60),
+            connect_timeout=getattr(settings, 'OLLAMA_CONNECT_TIMEOUT', 5),
+        )
+
+    def _payload(self, prompt, model, options, stream):
+        return {
+            "model": model or self.model,
+            "prompt": prompt,
+            "stream": stream,
+            "options": {**self.options, **(options or {})}
+        }
+
+    def _remaining(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LLMTimeout("Request deadline exceeded")
+        return remaining
+
+    def _acquire_slot(self, deadline):
+        if not self._slots.acquire(timeout=self._remaining(deadline)):
+            raise LLMTimeout("Timed out waiting for a free generation slot")
+
+    def _post(self, payload, deadline, stream=False):
+        remaining = self._remaining(deadline)
+        try:
+            response = self.session.post(
+                self.generate_url,
+                json=payload,
+                stream=stream,
+                timeout=(min(self.connect_timeout, remaining), remaining)
+            )
+        except requests.exceptions.ConnectionError as e:
+            raise LLMUnavailable(str(e)) from e
+        except requests.exceptions.Timeout as e:
+            raise LLMTimeout(str(e)) from e
+
+        if response.status_code != 200:
+            response.close()
+            raise LLMError(f"Ollama returned status {response.status_code}")
+        return response
+
+    def generate(self, prompt, model=None, options=None, timeout=None):
+        """Generate a complete answer, sharing the upstream call with identical in-flight requests"""
+        deadline = time.monotonic() + (timeout or self.timeout)
+        payload = self._payload(prompt, model, options, stream=False)
+        key = json.dumps(payload, sort_keys=True)
+
+        while True:
+            with self._calls_lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _InFlightCall()
+            if leader:
+                break
+
+            if not call.done.wait(self._remaining(deadline)):
+                raise LLMTimeout("Request deadline exceeded")
+            if isinstance(call.error, LLMTimeout) and deadline > time.monotonic():
+                # The leader ran out of its own, shorter deadline; this request still has time
+                continue
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            self._acquire_slot(deadline)
+            try:
+                response = self._post(payload, deadline)
+                try:
+                    data = response.json()
+                    call.result = data.get('response', '')
+                    self._record_usage(data)
+                finally:
+                    response.close()
+            finally:
+                self._slots.release()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._calls_lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+        return call.result
+
+    def stream(self, prompt, model=None, options=None, timeout=None):
+        """Yield tokens as Ollama generates them.
+
+        The slot is held until the generator finishes or is closed; closing it
+        closes the upstream connection, which makes Ollama abort the generation.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        payload = self._payload(prompt, model, options, stream=True)
+
+        self._acquire_slot(deadline)
+        try:
+            response = self._post(payload, deadline, stream=True)
+            try:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if data.get('error'):
+                        raise LLMError(data['error'])
+                    token = data.get('response')
+                    if token:
+                        yield token
+                    if data.get('done'):
+                        self._record_usage(data)
+                        break
+                    self._remaining(deadline)
+            except requests.exceptions.ConnectionError as e:
+                raise LLMUnavailable(str(e)) from e
+            except requests.exceptions.Timeout as e:
+                raise LLMTimeout(str(e)) from e
+            finally:
+                response.close()
+        finally:
+            self._slots.release()
+
+    def _async_state(self):
+        """httpx client, slots and in-flight calls of the running event loop (all are bound to it)"""
+        loop = asyncio.get_running_loop()
+        state = self._loops.get(loop)
+        if state is None:
+            import httpx
+            state = self._loops[loop] = _AsyncState(
+                httpx.AsyncClient(limits=httpx.Limits(max_keepalive_connections=self.pool_size)),
+                asyncio.Semaphore(self.max_in_flight)
+            )
+        return state
+
+    async def _aacquire_slot(self, state, deadline):
+        try:
+            await asyncio.wait_for(state.slots.acquire(), self._remaining(deadline))
+        except asyncio.TimeoutError:
+            raise LLMTimeout("Timed out waiting for a free generation slot") from None
+
+    def _httpx_timeout(self, deadline):
+        import httpx
+        remaining = self._remaining(deadline)
+        return httpx.Timeout(remaining, connect=min(self.connect_timeout, remaining))
+
+    async def agenerate(self, prompt, model=None, options=None, timeout=None):
+        """generate() for asyncio code: awaits the answer without holding a thread"""
+        import httpx
+        deadline = time.monotonic() + (timeout or self.timeout)
+        payload = self._payload(prompt, model, options, stream=False)
+        key = json.dumps(payload, sort_keys=True)
+        state = self._async_state()
+
+        while (call := state.calls.get(key)) is not None:
+            try:
+                # shield: a follower giving up must not cancel the leader's request
+                return await asyncio.wait_for(asyncio.shield(call), self._remaining(deadline))
+            except asyncio.TimeoutError:
+                raise LLMTimeout("Request deadline exceeded") from None
+            except LLMTimeout:
+                # The leader ran out of its own, shorter deadline; this request still has time
+                if deadline <= time.monotonic():
+                    raise
+
+        call = state.calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            await self._aacquire_slot(state, deadline)
+            try:
+                response = await state.client.post(self.generate_url, json=payload,
+                                                   timeout=self._httpx_timeout(deadline))
+            except httpx.ConnectError as e:
+                raise LLMUnavailable(str(e)) from e
+            except httpx.TimeoutException as e:
+                raise LLMTimeout(str(e)) from e
+            finally:
+                state.slots.release()
+            if response.status_code != 200:
+                raise LLMError(f"Ollama returned status {response.status_code}")
+            data = response.json()
+            self._record_usage(data)
+            call.set_result(data.get('response', ''))
+        except BaseException as e:
+            # Followers see the leader's error; a cancelled leader fails them rather than hanging them
+            call.set_exception(e if isinstance(e, Exception) else LLMError("Generation was cancelled"))
+            call.exception()  # Retrieved, so an unshared call does not log "never retrieved"
+            raise
+        finally:
+            state.calls.pop(key, None)
+        return call.result()
+
+    async def astream(self, prompt, model=None, options=None, timeout=None):
+        """stream() for asyncio code; closing the async generator closes the upstream connection"""
+        import httpx
+        deadline = time.monotonic() + (timeout or self.timeout)
+        payload = self._payload(prompt, model, options, stream=True)
+        state = self._async_state()
+
+        await self._aacquire_slot(state, deadline)
+        try:
+            async with state.client.stream('POST', self.generate_url, json=payload,
+                                           timeout=self._httpx_timeout(deadline)) as response:
+                if response.status_code != 200:
+                    raise LLMError(f"Ollama returned status {response.status_code}")
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if data.get('error'):
+                        raise LLMError(data['error'])
+                    token = data.get('response')
+                    if token:
+                        yield token
+                    if data.get('done'):
+                        self._record_usage(data)
+                        break
+                    self._remaining(deadline)
+        except httpx.ConnectError as e:
+            raise LLMUnavailable(str(e)) from e
+        except httpx.TimeoutException as e:
+            raise LLMTimeout(str(e)) from e
+        finally:
+            state.slots.release()
+
+    def _record_usage(self, data):
+        """Accumulate the counters Ollama sends with a finished generation (durations are in ns)"""
+        TOKENS.inc(data.get('prompt_eval_count') or 0, kind='prompt')
+        TOKENS.inc(data.get('eval_count') or 0, kind='completion')
+        with self._usage_lock:
+            self._usage['generations'] += 1
+            self._usage['prompt_tokens'] += data.get('prompt_eval_count') or 0
+            self._usage['prompt_eval_seconds'] += (data.get('prompt_eval_duration') or 0) / 1e9
+            self._usage['completion_tokens'] += data.get('eval_count') or 0
+            self._usage['total_seconds'] += (data.get('total_duration') or 0) / 1e9
+
+    def stats(self):
+        with self._usage_lock:
+            usage = dict(self._usage)
+        generations = usage['generations'] or 1
+        usage['mean_prompt_tokens'] = usage['prompt_tokens'] / generations
+        usage['mean_prompt_eval_ms'] = usage['prompt_eval_seconds'] / generations * 1000
+        usage['mean_total_ms'] = usage['total_seconds'] / generations * 1000
+        return usage
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from documents.document_index import DocumentIndex
+from documents.document_router import DocumentRouter
+from documents.vector_store import create_vector_store
+
+
+class Command(BaseCommand):
+    help = ("Compute the routing summary vectors of every indexed document from the embeddings in the "
+            "vector store (no re-embedding), e.g. for documents ingested before routing was enabled")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--representatives', type=int, default=None,
+                            help='Summary vectors per document at most (default: ROUTING_REPRESENTATIVES)')
+
+    def handle(self, *args, **options):
+        router = DocumentRouter.from_settings()
+        if router is None:
+            raise CommandError("Document routing is off; set ROUTING_ENABLED = True first")
+        if options['representatives']:
+            router.representatives = options['representatives']
+
+        store = create_vector_store()
+        index = DocumentIndex.from_settings()
+        if not index.is_bootstrapped():
+            index.bootstrap(store)
+        counts = index.counts()
+
+        start = time.perf_counter()
+        router.bootstrap(store, counts)
+        self.stdout.write(self.style.SUCCESS(
+            f"Summarised {len(counts)} documents ({sum(counts.values())} chunks) in "
+            f"{time.perf_counter() - start:.1f}s. Running servers pick the summaries up on their next query."
+        ))
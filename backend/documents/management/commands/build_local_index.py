@@ -0,0 +1,81 @@
+import os
+import shutil
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from documents.vector_store import DTYPES, ChromaStore, LocalStore
+
+
+class Command(BaseCommand):
+    help = ("Build the local vector index from the existing collection, copying the stored "
+            "embeddings (no re-embedding), e.g. to switch it to float16 or int8 storage")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', choices=['chroma', 'local'], default=getattr(settings, 'VECTOR_STORE', 'chroma'),
+                            help='Store to copy from (default: VECTOR_STORE)')
+        parser.add_argument('--dtype', choices=list(DTYPES), default=getattr(settings, 'LOCAL_VECTOR_STORE_DTYPE', 'float32'))
+        parser.add_argument('--rescore', type=int, default=getattr(settings, 'LOCAL_VECTOR_STORE_RESCORE', 0),
+                            help='Keep float32 copies and re-rank n_results * RESCORE candidates')
+        parser.add_argument('--source-dtype', choices=list(DTYPES), default=None,
+                            help='Storage dtype of a local source (default: --dtype of the current settings)')
+        parser.add_argument('--source-rescore', type=int, default=None)
+        parser.add_argument('--page-size', type=int, default=5000)
+
+    def open_source(self, options, target):
+        if options['source'] == 'chroma':
+            return ChromaStore(
+                path=getattr(settings, 'CHROMADB_PATH', './chromadb_data'),
+                collection_name=getattr(settings, 'CHROMADB_COLLECTION', 'documents'),
+            )
+        if not os.path.exists(target):
+            raise CommandError(f"No local vector store at {target}")
+        return LocalStore(
+            target,
+            dim=getattr(settings, 'EMBEDDING_DIM', 384),
+            dtype=options['source_dtype'] or getattr(settings, 'LOCAL_VECTOR_STORE_DTYPE', 'float32'),
+            rescore=(options['source_rescore'] if options['source_rescore'] is not None
+                     else getattr(settings, 'LOCAL_VECTOR_STORE_RESCORE', 0)),
+        )
+
+    def handle(self, *args, **options):
+        target = str(getattr(settings, 'LOCAL_VECTOR_STORE_PATH', os.path.join(settings.BASE_DIR, 'rag_data', 'local_index')))
+        try:
+            source = self.open_source(options, target)
+        except ValueError as e:
+            raise CommandError(f"{e}. Pass --source-dtype/--source-rescore matching the existing store.")
+
+        building = target + '.building'
+        shutil.rmtree(building, ignore_errors=True)
+        store = LocalStore(building, dim=getattr(settings, 'EMBEDDING_DIM', 384),
+                           dtype=options['dtype'], rescore=options['rescore'])
+
+        total = source.count()
+        copied = 0
+        while True:
+            page = source.get(include=['embeddings', 'documents', 'metadatas'],
+                              limit=options['page_size'], offset=copied)
+            if not page['ids']:
+                break
+            store.upsert(page['ids'], page['embeddings'], page['documents'], page['metadatas'])
+            copied += len(page['ids'])
+            self.stdout.write(f"Copied {copied}/{total} chunks")
+            if len(page['ids']) < options['page_size']:
+                break
+
+        # Lay documents out contiguously before the index goes live
+        store.compact()
+        row_bytes = store.row_bytes()
+        del store, source
+
+        if os.path.exists(target):
+            shutil.move(target, target + '.old')
+        shutil.move(building, target)
+        shutil.rmtree(target + '.old', ignore_errors=True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Built {options['dtype']} local index with {copied} chunks at {target} "
+            f"({row_bytes} bytes/chunk scored{', float32 rescoring on' if options['rescore'] else ''}). "
+            f"Set LOCAL_VECTOR_STORE_DTYPE = '{options['dtype']}' and "
+            f"LOCAL_VECTOR_STORE_RESCORE = {options['rescore']} to use it."
+        ))
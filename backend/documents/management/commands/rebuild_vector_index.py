@@ -0,0 +1,285 @@
+import json
+import os
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from documents.document_index import DocumentIndex
+from documents.document_router import DocumentRouter
+from documents.embedding_cache import EmbeddingCache
+from documents.models import Document, DocumentChunk, ShardAssignment
+from documents.rag_engine import RAGEngine
+from documents.vector_store import DTYPES, ChromaStore, LocalStore, create_vector_store
+
+WRITE_BATCH = 1000  # Chunks per vector store upsert; Chroma caps the size of one write
+
+_worker = {}
+
+
+def _init_encoder(model_name, threads):
+    """Process pool initializer: each worker loads the encoder once"""
+    if threads:
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+    from sentence_transformers import SentenceTransformer
+    _worker['encoder'] = SentenceTransformer(model_name)
+
+
+def _encode(texts, batch_size):
+    start = time.perf_counter()
+    vectors = np.asarray(_worker['encoder'].encode(texts, batch_size=batch_size), dtype=np.float32)
+    return vectors, time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the vector index from the DocumentChunk rows, never reading the uploaded files: "
+            "after a lost or corrupted index, or to re-embed everything with another model or store")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=['chroma', 'local'], default=getattr(settings, 'VECTOR_STORE', 'chroma'),
+                            help='Store to build (default: VECTOR_STORE)')
+        parser.add_argument('--model', default=getattr(settings, 'EMBEDDING_MODEL', 'all-MiniLM-L6-v2'),
+                            help='Encoder to embed with (default: EMBEDDING_MODEL); another one migrates the index')
+        parser.add_argument('--dtype', choices=list(DTYPES), default=getattr(settings, 'LOCAL_VECTOR_STORE_DTYPE', 'float32'))
+        parser.add_argument('--rescore', type=int, default=getattr(settings, 'LOCAL_VECTOR_STORE_RESCORE', 0))
+        parser.add_argument('--batch-size', type=int, default=4096, help='Chunks per embedding task')
+        parser.add_argument('--encode-batch-size', type=int, default=128, help="Encoder's own batch size")
+        parser.add_argument('--workers', type=int, default=2,
+                            help='Encoder processes; 1 encodes in this process')
+        parser.add_argument('--resume', action='store_true', help='Continue an interrupted rebuild from its checkpoint')
+        parser.add_argument('--no-cache', action='store_true', help='Re-embed chunks found in the embedding cache too')
+        parser.add_argument('--seed-from-store', action='store_true',
+                            help='First create the missing chunk rows of completed documents from the current index')
+
+    def target_path(self, options):
+        if options['target'] == 'chroma':
+            return os.path.abspath(getattr(settings, 'CHROMADB_PATH', './chromadb_data'))
+        return str(getattr(settings, 'LOCAL_VECTOR_STORE_PATH', os.path.join(settings.BASE_DIR, 'rag_data', 'local_index')))
+
+    def open_store(self, options, path, dim):
+        if options['target'] == 'chroma':
+            return ChromaStore(path=path, collection_name=getattr(settings, 'CHROMADB_COLLECTION', 'documents'))
+        return LocalStore(path, dim=dim, dtype=options['dtype'], rescore=options['rescore'])
+
+    def seed_from_store(self, document_ids):
+        """Chunk rows for documents ingested before chunks were persisted, copied from the current index"""
+        store = create_vector_store()
+        seeded = 0
+        for document_id in document_ids:
+            page = store.get(where={'document_id': str(document_id)}, include=['documents', 'metadatas'])
+            rows = sorted(zip(page['ids'], page['documents'], page['metadatas']),
+                          key=lambda row: row[2].get('chunk_index', 0))
+            if not rows:
+                continue
+            with transaction.atomic():
+                DocumentChunk.objects.filter(document_id=document_id).delete()
+                DocumentChunk.objects.bulk_create([
+                    DocumentChunk(document_id=document_id, chunk_index=metadata.get('chunk_index', 0),
+                                  chunk_text=text, embedding_id=chunk_id,
+                                  content_hash=metadata.get('content_hash') or RAGEngine.content_hash(text),
+                                  page=metadata.get('page'))
+                    for chunk_id, text, metadata in rows
+                ], batch_size=500)
+            seeded += 1
+        return seeded
+
+    def load_checkpoint(self, path, config):
+        if not os.path.exists(path):
+            raise CommandError(f"No checkpoint at {path}; run without --resume")
+        with open(path) as f:
+            checkpoint = json.load(f)
+        different = [key for key, value in config.items() if checkpoint.get(key) != value]
+        if different:
+            raise CommandError(f"The checkpoint was written with other {', '.join(different)}; "
+                               f"run without --resume to start over")
+        return checkpoint
+
+    def save_checkpoint(self, path, checkpoint):
+        with open(path + '.tmp', 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(path + '.tmp', path)
+
+    def handle(self, *args, **options):
+        completed = Document.objects.filter(processing_status='completed')
+        without_rows = list(completed.exclude(id__in=DocumentChunk.objects.values('document_id'))
+                            .values_list('id', flat=True))
+        if without_rows and options['seed_from_store']:
+            self.stdout.write(f"Seeded chunk rows of {self.seed_from_store(without_rows)} documents from the index")
+            without_rows = list(completed.exclude(id__in=DocumentChunk.objects.values('document_id'))
+                                .values_list('id', flat=True))
+        if without_rows:
+            self.stderr.write(self.style.WARNING(
+                f"{len(without_rows)} completed documents have no chunk rows and will be left out; "
+                f"reprocess them or pass --seed-from-store"))
+
+        target = self.target_path(options)
+        building = target + '.rebuild'
+        checkpoint_path = building + '.checkpoint.json'
+        config = {key: options[key] for key in ('target', 'model')}
+        if options['target'] == 'local':
+            config.update(dtype=options['dtype'], rescore=options['rescore'])
+
+        if options['resume']:
+            checkpoint = self.load_checkpoint(checkpoint_path, config)
+        else:
+            shutil.rmtree(building, ignore_errors=True)
+            checkpoint = {**config, 'dim': None, 'done_through': 0, 'chunks': 0, 'bytes': 0, 'seconds': 0.0}
+        store = self.open_store(options, building, checkpoint['dim']) if checkpoint['dim'] else None
+
+        cache = None if options['no_cache'] else EmbeddingCache.from_settings()
+        if cache:
+            cache.model_name = options['model']  # Vectors of another model are never reused
+        rows = DocumentChunk.objects.filter(document__processing_status='completed')
+        total = rows.count()
+        stats = {'embed_seconds': 0.0, 'write_seconds': 0.0, 'cached': 0}
+
+        workers = max(1, options['workers'])
+        pool = None
+        if workers > 1:
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_encoder,
+                                       initargs=(options['model'], threads))
+        else:
+            _init_encoder(options['model'], 0)
+
+        def fetch(position):
+            document_id, chunk_index = position
+            after = Q(document_id__gt=document_id)
+            if chunk_index is not None:
+                after |= Q(document_id=document_id, chunk_index__gt=chunk_index)
+            return list(rows.filter(after).order_by('document_id', 'chunk_index')
+                        .values_list('document_id', 'chunk_index', 'chunk_text', 'content_hash', 'page',
+                                     'embedding_id')[:options['batch_size']])
+
+        def dispatch(batch):
+            """Look the batch up in the cache and send the misses to the encoder"""
+            texts = [row[2] for row in batch]
+            cached = cache.lookup(texts) if cache else {}
+            missing = [index for index in range(len(texts)) if index not in cached]
+            job = None
+            if missing:
+                args = ([texts[index] for index in missing], options['encode_batch_size'])
+                job = pool.submit(_encode, *args) if pool else _encode(*args)
+            return batch, cached, missing, job
+
+        def collect(batch, cached, missing, job):
+            vectors = [None] * len(batch)
+            for index, vector in cached.items():
+                vectors[index] = vector
+            if missing:
+                encoded, seconds = job.result() if pool else job
+                stats['embed_seconds'] += seconds
+                for index, vector in zip(missing, encoded):
+                    vectors[index] = vector
+                if cache:
+                    cache.store([batch[index][2] for index in missing], encoded)
+            stats['cached'] += len(cached)
+            return np.vstack(vectors).astype(np.float32)
+
+        start = time.perf_counter()
+        previous_seconds = checkpoint['seconds']
+        position = (checkpoint['done_through'], None)
+        tail = [None, 0, 0]  # Document still being written, its chunks and bytes so far (not checkpointed yet)
+        pending = deque()
+        exhausted = False
+        try:
+            while True:
+                # Keep every encoder busy: the next batches are encoded while this one is written
+                while not exhausted and len(pending) < workers * 2:
+                    batch = fetch(position)
+                    if not batch:
+                        exhausted = True
+                        break
+                    position = batch[-1][:2]
+                    pending.append(dispatch(batch))
+                if not pending:
+                    break
+
+                batch, *job = pending.popleft()
+                vectors = collect(batch, *job)
+                if store is None:
+                    checkpoint['dim'] = int(vectors.shape[1])
+                    store = self.open_store(options, building, checkpoint['dim'])
+
+                write_start = time.perf_counter()
+                for first in range(0, len(batch), WRITE_BATCH):
+                    part = batch[first:first + WRITE_BATCH]
+                    store.upsert(
+                        ids=[row[5] for row in part],
+                        embeddings=vectors[first:first + WRITE_BATCH].tolist(),
+                        documents=[row[2] for row in part],
+                        metadatas=[RAGEngine.chunk_metadata(document_id, chunk_index, text, content_hash, page)
+                                   for document_id, chunk_index, text, content_hash, page, _ in part]
+                    )
+                store.flush()
+                stats['write_seconds'] += time.perf_counter() - write_start
+
+                # Rows come in document order, so every document before the last one is complete
+                for row in batch:
+                    if row[0] != tail[0]:
+                        checkpoint['chunks'] += tail[1]
+                        checkpoint['bytes'] += tail[2]
+                        tail[:] = [row[0], 0, 0]
+                    tail[1] += 1
+                    tail[2] += len(row[2].encode('utf-8'))
+                checkpoint['done_through'] = tail[0] - 1
+                checkpoint['seconds'] = previous_seconds + time.perf_counter() - start
+                self.save_checkpoint(checkpoint_path, checkpoint)
+                written = checkpoint['chunks'] + tail[1]
+                self.stdout.write(f"Embedded {written}/{total} chunks "
+                                  f"({written / max(checkpoint['seconds'], 1e-9):.0f} chunks/s)")
+        finally:
+            if pool:
+                pool.shutdown(cancel_futures=True)
+
+        if store is None:
+            raise CommandError("There are no chunk rows to rebuild from")
+        checkpoint['chunks'] += tail[1]
+        checkpoint['bytes'] += tail[2]
+        if options['target'] == 'local':
+            store.compact()
+        del store
+
+        if os.path.exists(target):
+            shutil.move(target, target + '.old')
+        shutil.move(building, target)
+        shutil.rmtree(target + '.old', ignore_errors=True)
+        os.remove(checkpoint_path)
+        store = self.open_store(options, target, checkpoint['dim'])
+        index = DocumentIndex.from_settings()
+        index.bootstrap(store)
+        router = DocumentRouter.from_settings()
+        if router:
+            # Another model puts the vectors in another space; the old summaries would misroute
+            router.bootstrap(store, index.counts())
+        del store
+        if getattr(settings, 'SHARDING_ENABLED', False):
+            # Everything is back in one unsharded collection; the old shards went with the swapped-out index
+            ShardAssignment.reset()
+            shutil.rmtree(target + '_shards', ignore_errors=True)
+            self.stdout.write("Run split_collection to shard the rebuilt index again.")
+
+        seconds = max(previous_seconds + time.perf_counter() - start, 1e-9)
+        documents = rows.values('document_id').distinct().count()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt the {options['target']} index at {target} with {checkpoint['chunks']} chunks of {documents} "
+            f"documents in {seconds:.1f}s: {checkpoint['chunks'] / seconds:.0f} chunks/s, "
+            f"{checkpoint['bytes'] / seconds / (1024 * 1024):.2f} MB/s of text "
+            f"(this run: embedding {stats['embed_seconds']:.1f}s, writing {stats['write_seconds']:.1f}s, "
+            f"{stats['cached']} chunks from the embedding cache)."
+        ))
+        if options['model'] != getattr(settings, 'EMBEDDING_MODEL', 'all-MiniLM-L6-v2') \
+                or checkpoint['dim'] != getattr(settings, 'EMBEDDING_DIM', 384):
+            self.stdout.write(f"Set EMBEDDING_MODEL = '{options['model']}' and EMBEDDING_DIM = {checkpoint['dim']} "
+                              f"to query it.")
+        self.stdout.write("Restart the server processes so they open the new index.")
@@ -0,0 +1,62 @@
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from documents.document_index import DocumentIndex
+from documents.models import ShardAssignment
+from documents.sharding import ShardedStore
+from documents.vector_store import LocalStore, create_vector_store
+
+
+class Command(BaseCommand):
+    help = ("Move the documents of the unsharded collection into their shards, one document at a time, "
+            "while the servers keep answering queries")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=1000,
+                            help='Chunks read at a time to find the next documents to move')
+        parser.add_argument('--limit', type=int, default=None, help='Stop after moving this many documents')
+
+    def handle(self, *args, **options):
+        store = create_vector_store()
+        if not isinstance(store, ShardedStore):
+            raise CommandError("Sharding is off; set SHARDING_ENABLED = True (and SHARD_KEY) first")
+        index = DocumentIndex.from_settings()
+        if not index.is_bootstrapped():
+            index.bootstrap(store)
+
+        legacy = store.legacy
+        total = legacy.count()
+        moved = Counter()
+        chunks = 0
+        seen = set()
+        start = time.perf_counter()
+        while options['limit'] is None or sum(moved.values()) < options['limit']:
+            page = legacy.get(include=['metadatas'], limit=options['page_size'])
+            document_ids = list(dict.fromkeys(str((metadata or {}).get('document_id'))
+                                              for metadata in page['metadatas']))
+            if not document_ids:
+                break
+            for document_id in document_ids:
+                if document_id in seen:
+                    raise CommandError(f"Chunks of document {document_id} are still in the unsharded collection "
+                                       f"after moving it")
+                seen.add(document_id)
+                moved[store.move(document_id)] += 1
+                chunks += index.count(document_id)
+                if options['limit'] is not None and sum(moved.values()) >= options['limit']:
+                    break
+            self.stdout.write(f"Moved {sum(moved.values())} documents, {chunks}/{total} chunks")
+
+        if isinstance(legacy, LocalStore):
+            legacy.compact()
+        seconds = max(time.perf_counter() - start, 1e-9)
+        left = legacy.count()
+        shards = Counter(ShardAssignment.objects.values_list('shard', flat=True))
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {sum(moved.values())} documents ({chunks} chunks) in {seconds:.1f}s; "
+            f"{left} chunks left in the unsharded collection."
+        ))
+        for name, documents in sorted(shards.items()):
+            self.stdout.write(f"  shard {name}: {documents} documents")
@@ -0,0 +1,317 @@
+"""In-process instrumentation: counters, histograms and timing spans.
+
+Metrics live in the memory of each server process and are rendered in the
+Prometheus text format by GET /metrics (scrape every worker process, or run
+one). Spans time pipeline stages with exclusive time: a span nested inside
+another (e.g. extraction pulled by chunking) is not counted twice, so the
+stage times of a request add up to the time spent in them.
+"""
+import contextvars
+import logging
+import math
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._lock = threading.Lock()
+        self._series = {}  # labels -> [bucket counts, sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][position] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def totals(self):
+        """{label values: (sum, count)} for every series observed so far"""
+        with self._lock:
+            return {key: (series[1], series[2]) for key, series in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(float(total))}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'docintell_stage_seconds', 'Exclusive time spent in a pipeline stage', ('stage',))
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'docintell_http_request_seconds', 'Time to produce the response (streamed bodies excluded)',
+    ('route', 'method', 'status'))
+CHUNKS = REGISTRY.counter(
+    'docintell_chunks_total', 'Chunks handled at ingestion by outcome', ('outcome',))
+TOKENS = REGISTRY.counter(
+    'docintell_tokens_total', 'LLM tokens reported by Ollama, and estimated context tokens', ('kind',))
+CACHE_LOOKUPS = REGISTRY.counter(
+    'docintell_cache_lookups_total', 'Cache lookups by cache and result', ('cache', 'result'))
+ERRORS = REGISTRY.counter(
+    'docintell_errors_total', 'Errors by pipeline stage', ('stage',))
+DOCUMENTS = REGISTRY.counter(
+    'docintell_documents_total', 'Ingestion jobs finished by status', ('status',))
+ANSWER_PATHS = REGISTRY.counter(
+    'docintell_answer_paths_total', 'Retrieved questions by confidence gate path (not_found, extractive, generate)',
+    ('path',))
+LLM_SECONDS_SAVED = REGISTRY.counter(
+    'docintell_llm_seconds_saved_total', 'Estimated LLM time saved by answering without generation', ('path',))
+ROUTED_QUERIES = REGISTRY.counter(
+    'docintell_routed_queries_total', 'Searches across all documents by how they ran (routed, fallback, flat)',
+    ('path',))
+
+
+class Timings:
+    """Per-request stage times, filled by the spans that run while it is active"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def as_dict(self):
+        """Milliseconds per stage, plus the total since collection started"""
+        with self._lock:
+            result = {f"{stage}_ms": round(seconds * 1000, 3) for stage, seconds in self.stages.items()}
+        result['total_ms'] = round((time.perf_counter() - self._started) * 1000, 3)
+        return result
+
+
+_timings = contextvars.ContextVar('metrics_timings', default=None)
+_active = contextvars.ContextVar('metrics_active_span', default=None)
+
+
+class _Frame:
+    __slots__ = ('stage', 'children')
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.children = 0.0
+
+
+@contextmanager
+def span(stage):
+    """Time a stage. Must not be held across a yield; wrap iterators with timed_iter instead"""
+    frame = _Frame(stage)
+    parent = _active.get()
+    token = _active.set(frame)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        _active.reset(token)
+        if parent is not None:
+            parent.children += elapsed
+        exclusive = max(elapsed - frame.children, 0.0)
+        STAGE_SECONDS.observe(exclusive, stage=stage)
+        timings = _timings.get()
+        if timings is not None:
+            timings.add(stage, exclusive)
+
+
+def timed_iter(iterable, stage):
+    """Yield from iterable, timing only the work done to produce each item"""
+    iterator = iter(iterable)
+    try:
+        while True:
+            with span(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+    finally:
+        # Closing the wrapper closes the wrapped generator (e.g. the Ollama stream)
+        close = getattr(iterator, 'close', None)
+        if close:
+            close()
+
+
+async def atimed_iter(aiterable, stage):
+    """timed_iter() for async iterables"""
+    iterator = aiterable.__aiter__()
+    try:
+        while True:
+            with span(stage):
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+            yield item
+    finally:
+        close = getattr(iterator, 'aclose', None)
+        if close:
+            await close()
+
+
+@contextmanager
+def collect_timings(enabled=True):
+    """Collect the stage times of the current request; yields a Timings (or None when disabled)"""
+    if not enabled:
+        yield None
+        return
+    timings = Timings()
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def propagate(fn):
+    """Wrap fn to run on another thread while still reporting into the caller's timings"""
+    timings = _timings.get()
+
+    def run(*args, **kwargs):
+        timings_token = _timings.set(timings)
+        active_token = _active.set(None)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _active.reset(active_token)
+            _timings.reset(timings_token)
+
+    return run
+
+
+class SampledFilter(logging.Filter):
+    """Logging filter keeping a random fraction of records below WARNING; warnings and errors always pass"""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1.0 or random.random() < self.rate
+
+
+class MetricsMiddleware:
+    """Observes the time to produce each response, labelled by URL route rather than raw path.
+
+    Sync and async capable, so the async views run on the event loop under
+    ASGI instead of being adapted onto a thread for the whole request.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def _observe(self, request, response, start):
+        match = getattr(request, 'resolver_match', None)
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start,
+                                     route=match.route if match else 'unmatched',
+                                     method=request.method, status=response.status_code)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self._observe(request, response, start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self._observe(request, response, start)
+        return response
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='progress',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='status_message',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
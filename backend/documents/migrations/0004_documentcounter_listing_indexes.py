@@ -0,0 +1,39 @@
+# Generated by Django 5.2.1 on 2026-10-17 21:05
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_documents(apps, schema_editor):
+    Document = apps.get_model('documents', 'Document')
+    DocumentCounter = apps.get_model('documents', 'DocumentCounter')
+    counts = dict(Document.objects.values_list('processing_status').annotate(n=Count('id')).order_by())
+    for status in {'pending', 'processing', 'completed', 'failed'} | set(counts):
+        DocumentCounter.objects.create(key=f'status:{status}', value=counts.get(status, 0))
+    DocumentCounter.objects.create(key='version', value=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0003_ingestionbatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentCounter',
+            fields=[
+                ('key', models.CharField(max_length=40, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['created_at', 'id'], name='document_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['processing_status', 'created_at', 'id'], name='document_status_created_idx'),
+        ),
+        migrations.RunPython(count_documents, migrations.RunPython.noop),
+    ]
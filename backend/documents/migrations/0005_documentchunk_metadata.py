@@ -0,0 +1,32 @@
+# Generated by Django 5.2.1 on 2026-10-17 21:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0004_documentcounter_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='char_offset',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='documentchunk',
+            name='content_hash',
+            field=models.CharField(default='', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='documentchunk',
+            name='page',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='documentchunk',
+            constraint=models.UniqueConstraint(fields=('document', 'chunk_index'), name='document_chunk_position'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.1 on 2026-10-17 21:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_documentchunk_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardAssignment',
+            fields=[
+                ('document_id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('shard', models.CharField(db_index=True, max_length=64)),
+                ('assigned_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VectorShard',
+            fields=[
+                ('name', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='tenant',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -1,4 +1,128 @@
-from django.db import models
+from collections import Counter
+
+from django.db import models, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+DOCUMENT_STATUSES = ('pending', 'processing', 'completed', 'failed')
+
+
+class DocumentCounter(models.Model):
+    """Cached aggregates of the Document table, so listings never count rows per request.
+
+    'version' goes up on every write to documents (it backs the listing
+    ETags); 'status:<name>' is the number of documents in that
+    processing_status. Both are changed in the same transaction as the rows,
+    by DocumentQuerySet and Document.save/delete. ShardAssignment keeps its
+    own version here as well.
+    """
+    key = models.CharField(max_length=40, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    @staticmethod
+    def status_key(status):
+        return f'status:{status}'
+
+    @classmethod
+    def add(cls, deltas=None):
+        """Apply {key: delta} and bump the version"""
+        deltas = dict(deltas or {})
+        deltas['version'] = deltas.get('version', 0) + 1
+        for key, delta in deltas.items():
+            if delta and not cls.objects.filter(key=key).update(value=F('value') + delta):
+                cls.objects.get_or_create(key=key)
+                cls.objects.filter(key=key).update(value=F('value') + delta)
+
+    @classmethod
+    def version(cls):
+        return cls.objects.filter(key='version').values_list('value', flat=True).first() or 0
+
+    @classmethod
+    def status_counts(cls):
+        values = dict(cls.objects.filter(key__startswith='status:').values_list('key', 'value'))
+        return {status: values.get(cls.status_key(status), 0) for status in DOCUMENT_STATUSES}
+
+    @classmethod
+    def reconcile(cls):
+        """Recount from the Document table, e.g. after rows were changed with raw SQL"""
+        with transaction.atomic():
+            # Write first: on SQLite a transaction that reads before writing cannot wait for the lock
+            cls.add()
+            counts = dict(Document.objects.values_list('processing_status').annotate(n=Count('id')).order_by())
+            for status in set(DOCUMENT_STATUSES) | set(counts):
+                cls.objects.update_or_create(key=cls.status_key(status), defaults={'value': counts.get(status, 0)})
+        return counts
+
+
+class DocumentQuerySet(models.QuerySet):
+    """Keeps DocumentCounter in step with bulk updates, deletes and inserts"""
+
+    def _by_status(self):
+        # One statement per previous status: the moved counts come back exact, without reading the rows first
+        for status in DOCUMENT_STATUSES:
+            yield status, self.filter(processing_status=status)
+        yield None, self.exclude(processing_status__in=DOCUMENT_STATUSES)
+
+    def update(self, **kwargs):
+        # As auto_now does on save(): the status endpoint's ETag is derived from updated_at
+        kwargs.setdefault('updated_at', timezone.now())
+        new_status = kwargs.get('processing_status')
+        with transaction.atomic(using=self.db):
+            if new_status is None:
+                updated = super().update(**kwargs)
+                if updated:
+                    DocumentCounter.add()
+                return updated
+            deltas = Counter()
+            updated = 0
+            for status, queryset in self._by_status():
+                moved = models.QuerySet.update(queryset, **kwargs)
+                updated += moved
+                if moved and status != new_status:
+                    if status is not None:
+                        deltas[DocumentCounter.status_key(status)] -= moved
+                    deltas[DocumentCounter.status_key(new_status)] += moved
+            if updated:
+                DocumentCounter.add(deltas)
+            return updated
+
+    update.alters_data = True
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            total, per_model = 0, Counter()
+            deltas = Counter()
+            for status, queryset in self._by_status():
+                deleted, rows = models.QuerySet.delete(queryset)
+                total += deleted
+                per_model.update(rows)
+                if status is not None:
+                    deltas[DocumentCounter.status_key(status)] -= rows.get(self.model._meta.label, 0)
+            if total:
+                DocumentCounter.add(deltas)
+            return total, dict(per_model)
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            created = super().bulk_create(objs, *args, **kwargs)
+            deltas = Counter()
+            for document in created:
+                deltas[DocumentCounter.status_key(document.processing_status)] += 1
+            if created:
+                DocumentCounter.add(deltas)
+        return created
+
+
+class IngestionBatch(models.Model):
+    """A bulk upload: its documents are ingested together by BulkIngestion"""
+    total_files = models.IntegerField(default=0)
+    summary = models.JSONField(default=dict, blank=True)  # Aggregate counts and throughput once finished
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
 
 class Document(models.Model):
     title = models.CharField(max_length=255)
@@ -6,12 +130,111 @@ class Document(models.Model):
     file_type = models.CharField(max_length=10)
     file_size = models.IntegerField()
     processing_status = models.CharField(max_length=20, default='pending')
+    progress = models.IntegerField(default=0)
+    status_message = models.TextField(blank=True, default='')
+    tenant = models.CharField(max_length=64, blank=True, default='')  # Shard key with SHARD_KEY = 'tenant'
+    batch = models.ForeignKey(IngestionBatch, null=True, blank=True, on_delete=models.SET_NULL,
+                              related_name='documents')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = DocumentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the listing, unfiltered and by status
+            models.Index(fields=['created_at', 'id'], name='document_created_idx'),
+            models.Index(fields=['processing_status', 'created_at', 'id'], name='document_status_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        with transaction.atomic(using=kwargs.get('using') or 'default'):
+            # Move the stored status through the queryset first: the counts follow the row,
+            # not the status this instance last read, which a queryset update may have changed since
+            moved = 0
+            if not self._state.adding and (update_fields is None or 'processing_status' in update_fields):
+                moved = type(self).objects.filter(pk=self.pk).update(processing_status=self.processing_status)
+            inserted = self._state.adding or (update_fields is None and not moved)
+            super().save(*args, **kwargs)
+            DocumentCounter.add({DocumentCounter.status_key(self.processing_status): 1} if inserted else None)
+
+    @classmethod
+    def mark_completed(cls, document_id, records, message, batch_size=500):
+        """Replace the document's chunk rows and mark it completed, in one transaction.
+
+        records are DocumentChunk field values as collected by
+        RAGEngine.store_chunk_batch. Returns False (and writes nothing) when
+        the document was deleted while it was being processed.
+        """
+        with transaction.atomic():
+            # Write first: on SQLite a transaction that reads before writing cannot wait for the lock
+            updated = cls.objects.filter(id=document_id).update(
+                processing_status='completed',
+                progress=100,
+                status_message=message,
+                updated_at=timezone.now()
+            )
+            if not updated:
+                return False
+            DocumentChunk.objects.filter(document_id=document_id).delete()
+            DocumentChunk.objects.bulk_create([DocumentChunk(document_id=document_id, **record) for record in records],
+                                              batch_size=batch_size)
+        return True
+
+    def delete(self, using=None, keep_parents=False):
+        # Through the queryset, which counts the row under the status it has in the database
+        result = type(self).objects.using(using or 'default').filter(pk=self.pk).delete()
+        self.pk = None
+        return result
+
 class DocumentChunk(models.Model):
+    """A chunk as it was embedded: the source of truth for rebuilding the vector index without the files"""
     document = models.ForeignKey(Document, on_delete=models.CASCADE)
     chunk_text = models.TextField()
     chunk_index = models.IntegerField()
-    embedding_id = models.CharField(max_length=100)
+    embedding_id = models.CharField(max_length=100)  # Chunk id in the vector store
+    content_hash = models.CharField(max_length=40, default='')  # sha1 of chunk_text
+    page = models.IntegerField(null=True, blank=True)
+    char_offset = models.IntegerField(null=True, blank=True)  # Start in the document's extracted text
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'chunk_index'], name='document_chunk_position'),
+        ]
+
+
+class VectorShard(models.Model):
+    """A vector store collection holding the chunks of some documents (see documents.sharding)"""
+    name = models.CharField(max_length=64, primary_key=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+
+class ShardAssignment(models.Model):
+    """Routing table from documents to shards.
+
+    A document without a row still lives in the unsharded collection; rows
+    are written once its chunks are in the shard. They only change when
+    reset() drops them all, which bumps a version kept in DocumentCounter so
+    every process drops the assignments it has cached.
+    """
+    VERSION_KEY = 'shard_assignments'
+
+    document_id = models.CharField(max_length=64, primary_key=True)  # As in chunk metadata, so not a foreign key
+    shard = models.CharField(max_length=64, db_index=True)
+    assigned_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def version(cls):
+        return DocumentCounter.objects.filter(key=cls.VERSION_KEY).values_list('value', flat=True).first() or 0
+
+    @classmethod
+    def reset(cls):
+        """Forget every assignment and shard, e.g. once the index is back in one unsharded collection"""
+        with transaction.atomic():
+            # Write first: on SQLite a transaction that reads before writing cannot wait for the lock
+            if not DocumentCounter.objects.filter(key=cls.VERSION_KEY).update(value=F('value') + 1):
+                DocumentCounter.objects.create(key=cls.VERSION_KEY, value=1)
+            cls.objects.all().delete()
+            VectorShard.objects.all().delete()
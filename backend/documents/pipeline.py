@@ -0,0 +1,271 @@
+import hashlib
+import re
+from collections import deque
+
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+NON_SPACE = re.compile(r'\S')
+
+
+class IngestionError(Exception):
+    """A pipeline stage failed; the message is reported to the user as-is"""
+
+
+def is_anchor(paragraph, anchor_every):
+    """Whether a paragraph ends a content-defined section"""
+    return int(hashlib.sha1(paragraph.encode('utf-8')).hexdigest()[:8], 16) % anchor_every == 0
+
+
+def iter_section_pieces(blocks, anchor_every=4, max_paragraph=64 * 1024):
+    """Split streamed text into content-defined sections.
+
+    Yields (text, ends_section) pieces. A paragraph break becomes a section
+    boundary when the hash of the paragraph before it is divisible by
+    anchor_every, so boundaries depend only on nearby content: editing one
+    paragraph changes the chunks of its own section while every other section
+    chunks identically. Paragraphs longer than max_paragraph are never
+    anchors, which keeps the buffered text bounded.
+    """
+    buffer = ''
+    paragraph_start = 0  # Start of the paragraph being scanned
+    oversized = False
+
+    for block in blocks:
+        buffer += block
+        emitted = 0
+
+        while True:
+            match = PARAGRAPH_BREAK.search(buffer, paragraph_start)
+            # The break may still grow with the next block unless text follows it
+            if not match or not NON_SPACE.search(buffer, match.end()):
+                break
+
+            paragraph = buffer[paragraph_start:match.start()].strip()
+            anchor = (anchor_every and anchor_every > 1 and not oversized and paragraph
+                      and is_anchor(paragraph, anchor_every))
+            paragraph_start = match.end()
+            oversized = False
+            if anchor:
+                yield buffer[emitted:match.end()], True
+                emitted = match.end()
+
+        if len(buffer) - paragraph_start > max_paragraph:
+            oversized = True
+
+        # Hand over everything that is no longer needed for hashing or break detection
+        keep_from = paragraph_start
+        if oversized:
+            # Only the trailing whitespace is needed to spot the next break
+            keep_from = paragraph_start = max(paragraph_start, len(buffer.rstrip()))
+        if keep_from > emitted:
+            yield buffer[emitted:keep_from], False
+            emitted = keep_from
+        buffer = buffer[emitted:]
+        paragraph_start -= emitted
+
+    if buffer:
+        yield buffer, True
+
+
+class CharChunker:
+    """Incremental form of RAGEngine.chunk_text.
+
+    Text can be fed in pieces; a chunk is cut as soon as more than chunk_size
+    characters are buffered, using the same sentence-boundary rule, so the
+    output matches chunk_text over the concatenated text. feed() and finish()
+    return (offset, chunk) pairs, offset being where the chunk starts in the
+    fed stream (plus start_offset).
+    """
+
+    BOUNDARIES = ['. ', '! ', '? ', '\n\n']
+
+    def __init__(self, chunk_size=500, start_offset=0):
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.offset = start_offset  # Stream offset of buffer[0]
+
+    def feed(self, text):
+        self.buffer += text
+        chunks = []
+        start = 0
+        chunk_size = self.chunk_size
+
+        while len(self.buffer) - start > chunk_size:
+            end = start + chunk_size
+
+            # Trying to find a sentence boundary near the chunk size
+            window = self.buffer[start:end]
+            for punct in self.BOUNDARIES:
+                last_punct = window.rfind(punct)
+                if last_punct > chunk_size * 0.7:  # At least 70% of chunk size
+                    end = start + last_punct + len(punct)
+                    break
+
+            chunk = self.buffer[start:end].strip()
+            if chunk:
+                chunks.append((self.offset + start, chunk))
+            start = end
+
+        self.buffer = self.buffer[start:]
+        self.offset += start
+        return chunks
+
+    def finish(self):
+        rest, self.buffer = self.buffer, ''
+        offset, self.offset = self.offset, self.offset + len(rest)
+        return [(offset, rest)] if rest.strip() else []
+
+
+SENTENCE_BREAK = re.compile(r'[.!?]+["\')\]]*\s+|\n\s*\n')
+
+
+class TokenChunker:
+    """Packs whole sentences into chunks sized in model tokens.
+
+    Sentences are found with one regex pass over the buffered text and
+    measured with a single batched call to the (fast) tokenizer, instead of
+    rescanning every chunk for punctuation. Chunks hold at most max_tokens
+    tokens, so nothing is silently truncated by the encoder, and consecutive
+    chunks share up to overlap_tokens tokens of trailing sentences. Sentences
+    longer than max_tokens are split on token boundaries. Same feed()/finish()
+    interface as CharChunker.
+    """
+
+    def __init__(self, tokenizer, max_tokens=254, overlap_tokens=0, start_offset=0):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap_tokens = min(overlap_tokens, max_tokens // 2)
+        self.buffer = ''
+        self.offset = start_offset  # Stream offset of buffer[0]
+        self.scan = 0  # Buffer index where the next sentence starts
+        self.pending = []  # (start, end, tokens) of sentences in the current chunk
+        self.pending_tokens = 0
+
+    def feed(self, text):
+        self.buffer += text
+        sentences = []
+        for match in SENTENCE_BREAK.finditer(self.buffer, self.scan):
+            if match.end() == len(self.buffer):
+                break  # The whitespace may continue in the next piece
+            sentences.append((self.scan, match.end()))
+            self.scan = match.end()
+        return self._pack(sentences)
+
+    def finish(self):
+        sentences = [(self.scan, len(self.buffer))] if self.buffer[self.scan:].strip() else []
+        chunks = self._pack(sentences, final=True)
+        self.offset += len(self.buffer)
+        self.buffer = ''
+        self.scan = 0
+        return chunks
+
+    def _count_tokens(self, texts):
+        if not texts:
+            return []
+        return [len(ids) for ids in self.tokenizer(texts, add_special_tokens=False)['input_ids']]
+
+    def _emit(self, chunks, keep_overlap=True):
+        start = self.pending[0][0]
+        end = self.pending[-1][1]
+        chunk = self.buffer[start:end].strip()
+        if chunk:
+            chunks.append((self.offset + start, chunk))
+
+        kept = []
+        kept_tokens = 0
+        if keep_overlap and self.overlap_tokens:
+            # Carry trailing sentences over, but never the whole chunk
+            for sentence in reversed(self.pending[1:]):
+                if kept_tokens + sentence[2] > self.overlap_tokens:
+                    break
+                kept.insert(0, sentence)
+                kept_tokens += sentence[2]
+        self.pending = kept
+        self.pending_tokens = kept_tokens
+
+    def _split_long(self, chunks, start, end):
+        """Cut a sentence longer than max_tokens into token windows"""
+        text = self.buffer[start:end]
+        offsets = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)['offset_mapping']
+        step = self.max_tokens - self.overlap_tokens
+        for first in range(0, len(offsets), step):
+            window = offsets[first:first + self.max_tokens]
+            piece = text[window[0][0]:window[-1][1]].strip()
+            if piece:
+                chunks.append((self.offset + start + window[0][0], piece))
+            if first + self.max_tokens >= len(offsets):
+                break
+
+    def _pack(self, sentences, final=False):
+        chunks = []
+        counts = self._count_tokens([self.buffer[start:end] for start, end in sentences])
+        for (start, end), tokens in zip(sentences, counts):
+            if tokens > self.max_tokens:
+                if self.pending:
+                    self._emit(chunks, keep_overlap=False)
+                self._split_long(chunks, start, end)
+                continue
+            if self.pending and self.pending_tokens + tokens > self.max_tokens:
+                self._emit(chunks)
+                # Drop carried-over sentences until this one fits; with none left there is no overlap
+                while self.pending and self.pending_tokens + tokens > self.max_tokens:
+                    self.pending_tokens -= self.pending.pop(0)[2]
+            self.pending.append((start, end, tokens))
+            self.pending_tokens += tokens
+
+        if final and self.pending:
+            self._emit(chunks, keep_overlap=False)
+
+        # Drop buffered text that no pending sentence needs any more
+        keep_from = self.pending[0][0] if self.pending else self.scan
+        if keep_from and not final:
+            self.buffer = self.buffer[keep_from:]
+            self.offset += keep_from
+            self.scan -= keep_from
+            self.pending = [(start - keep_from, end - keep_from, tokens) for start, end, tokens in self.pending]
+        return chunks
+
+
+def iter_chunks(pieces, chunker_factory):
+    """Chunk each section of a stream of (text, ends_section) pieces into (offset, chunk) pairs"""
+    chunker = None
+    position = 0
+    for text, ends_section in pieces:
+        chunker = chunker or chunker_factory(start_offset=position)
+        position += len(text)
+        yield from chunker.feed(text)
+        if ends_section:
+            yield from chunker.finish()
+            chunker = None
+    if chunker:
+        yield from chunker.finish()
+
+
+class PageMap:
+    """Maps stream offsets to page numbers for text streamed page by page.
+
+    Lookups must come in non-decreasing offset order; pages that are behind
+    the last lookup are dropped, so memory stays bounded.
+    """
+
+    def __init__(self):
+        self._starts = deque()  # (start_offset, page_number)
+
+    def add(self, start_offset, page_number):
+        self._starts.append((start_offset, page_number))
+
+    def page_at(self, offset):
+        while len(self._starts) > 1 and self._starts[1][0] <= offset:
+            self._starts.popleft()
+        return self._starts[0][1] if self._starts else None
+
+
+def batched(items, size):
+    """Group an iterable into lists of at most size items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
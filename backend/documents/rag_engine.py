@@ -1,67 +1,100 @@
-import chromadb
-from sentence_transformers import SentenceTransformer
-import requests
+import asyncio
 import json
+import functools
+import hashlib
+import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+import numpy as np
+from django.conf import settings
+from .llm_client import OllamaClient, LLMError, LLMTimeout, LLMUnavailable
+from .metrics import CHUNKS, ERRORS, ROUTED_QUERIES, atimed_iter, propagate, span, timed_iter
+from .answer_cache import AnswerCache
+from .confidence import ConfidenceGate
+from .context_packing import ContextPacker
+from .document_index import DocumentIndex
+from .document_router import DocumentRouter
+from .embedding_cache import EmbeddingCache
+from .embedding_dispatcher import EmbeddingDispatcher
+from .pipeline import IngestionError, CharChunker, TokenChunker, batched
+from .extractors import get_extractor, iter_file_chunks
+from .vector_store import create_vector_store
+
+logger = logging.getLogger(__name__)
 
 class RAGEngine:
-    def __init__(self):
-        try:
-            # Using persistent client instead of in-memory client
-            self.client = chromadb.PersistentClient(path="./chromadb_data")
-            
-            # Getting or creating collection
-            try:
-                self.collection = self.client.get_collection("documents")
-                print("DEBUG: Retrieved existing ChromaDB collection")
-            except:
-                self.collection = self.client.create_collection("documents")
-                print("DEBUG: Created new ChromaDB collection")
-                
-            self.encoder = SentenceTransformer('all-MiniLM-L6-v2')
-            self.ollama_url = "http://localhost:11434/api/generate"
-            
-            initial_count = self.collection.count()
-            print(f"DEBUG: RAG Engine initialized. Collection count: {initial_count}")
-            
-        except Exception as e:
-            print(f"DEBUG: Error initializing RAG engine: {e}")
-            import traceback
-            traceback.print_exc()
-            raise
+    """Retrieval and generation over the uploaded documents.
+
+    Construction is cheap: the sentence encoder and the vector store are
+    loaded on first use (see registry.warm_up to load them ahead of time).
+    """
+
+    def __init__(self, llm=None, answer_cache=None):
+        self._load_lock = threading.Lock()
+        self._encoder = None
+        self._store = None
+        self.embedding_cache = EmbeddingCache.from_settings()
+        self.llm = llm or OllamaClient.from_settings()
+        self.answer_cache = answer_cache if answer_cache is not None else AnswerCache.from_settings()
+        self.document_index = DocumentIndex.from_settings()
+        self.router = DocumentRouter.from_settings()
+        self.context_packer = ContextPacker.from_settings()
+        self.confidence_gate = ConfidenceGate.from_settings()
+        self.query_dispatcher = EmbeddingDispatcher.from_settings(lambda: self.encoder)
+        # Encoder, vector store and SQLite work of async queries; bounded so load cannot spawn threads without limit
+        self.blocking_executor = ThreadPoolExecutor(max_workers=getattr(settings, 'ASYNC_BLOCKING_WORKERS', 8),
+                                                    thread_name_prefix='rag-blocking')
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            with self._load_lock:
+                if self._encoder is None:
+                    start = time.perf_counter()
+                    from sentence_transformers import SentenceTransformer
+                    self._encoder = SentenceTransformer(getattr(settings, 'EMBEDDING_MODEL', 'all-MiniLM-L6-v2'))
+                    logger.info("Loaded sentence encoder in %.2fs", time.perf_counter() - start)
+        return self._encoder
+
+    @encoder.setter
+    def encoder(self, encoder):
+        self._encoder = encoder
+
+    @property
+    def encoder_loaded(self):
+        return self._encoder is not None
+
+    @property
+    def store(self):
+        if self._store is None:
+            with self._load_lock:
+                if self._store is None:
+                    try:
+                        # Chroma collection or the in-process index, per the VECTOR_STORE setting
+                        store = create_vector_store()
+                        if not self.document_index.is_bootstrapped():
+                            self.document_index.bootstrap(store)
+                        logger.info("Using %s vector store. Collection count: %d", store.name, store.count())
+                    except Exception:
+                        logger.exception("Error initializing vector store")
+                        raise
+                    self._store = store
+        return self._store
+
+    @store.setter
+    def store(self, store):
+        self._store = store
 
-        
     def chunk_text(self, text, chunk_size=500):
         """Smart chunking by character count with sentence preservation"""
         if not text or len(text) <= chunk_size:
             return [text] if text else []
             
-        chunks = []
-        start = 0
-        
-        while start < len(text):
-            end = start + chunk_size
-            
-            # If we're at the end, take the rest
-            if end >= len(text):
-                chunks.append(text[start:])
-                break
-                
-            # Trying to find a sentence boundary near the chunk size
-            chunk_text = text[start:end]
-            
-            # Looking for sentence endings
-            for punct in ['. ', '! ', '? ', '\n\n']:
-                last_punct = chunk_text.rfind(punct)
-                if last_punct > chunk_size * 0.7:  # At least 70% of chunk size
-                    end = start + last_punct + len(punct)
-                    break
-            
-            chunks.append(text[start:end].strip())
-            start = end
-            
-        return [chunk for chunk in chunks if chunk.strip()]
+        chunker = CharChunker(chunk_size)
+        return [chunk for _, chunk in chunker.feed(text) + chunker.finish()]
     
     def read_file_content(self, file_path):
         """Read content from uploaded file"""
@@ -71,227 +104,284 @@ class RAGEngine:
             if not file_path.exists():
                 raise FileNotFoundError(f"File not found: {file_path}")
             
-            # Handle different file types
-            if file_path.suffix.lower() == '.txt':
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return f.read()
-            elif file_path.suffix.lower() == '.pdf':
-                # You can add PDF reading here if needed
-                try:
-                    import PyPDF2
-                    with open(file_path, 'rb') as f:
-                        reader = PyPDF2.PdfReader(f)
-                        text = ""
-                        for page in reader.pages:
-                            text += page.extract_text() + "\n"
-                        return text
-                except ImportError:
-                    return "PDF reading requires PyPDF2. Please install: pip install PyPDF2"
-            elif file_path.suffix.lower() in ['.docx', '.doc']:
-                # You can add Word document reading here if needed
-                try:
-                    from docx import Document
-                    doc = Document(file_path)
-                    text = ""
-                    for paragraph in doc.paragraphs:
-                        text += paragraph.text + "\n"
-                    return text
-                except ImportError:
-                    return "Word document reading requires python-docx. Please install: pip install python-docx"
-            else:
-                # Try to read as plain text
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    return f.read()
+            extractor = get_extractor(file_path)
+            return "".join(text for _, text in extractor.iter_segments(str(file_path)))
                     
         except Exception as e:
             return f"Error reading file: {str(e)}"
     
-    def process_document(self, document_id, file_path):
-        """Process and store document chunks from file path"""
+    @staticmethod
+    def content_hash(chunk):
+        return hashlib.sha1(chunk.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def chunk_metadata(document_id, chunk_index, chunk, content_hash, page=None):
+        metadata = {
+            "document_id": str(document_id),
+            "chunk_index": chunk_index,
+            "chunk_length": len(chunk),
+            "content_hash": content_hash
+        }
+        if page is not None:
+            metadata["page"] = page
+        return metadata
+
+    def embed_chunks(self, chunks):
+        """Embed chunk texts, going through the shared embedding cache when enabled"""
+        with span('embed'):
+            if self.embedding_cache:
+                return self.embedding_cache.encode(chunks, self.encoder)
+            return self.encoder.encode(chunks)
+
+    def encode_questions(self, questions):
+        """Embed query texts, micro-batched with other requests' questions when the dispatcher is on"""
+        with span('embed'):
+            if self.query_dispatcher:
+                return self.query_dispatcher.encode(questions)
+            return self.encoder.encode(questions)
+
+    async def aencode_questions(self, questions):
+        """encode_questions() for asyncio callers: waits for its dispatcher batch on the event loop"""
+        with span('embed'):
+            if self.query_dispatcher:
+                return await self.query_dispatcher.aencode(questions)
+            return await self._run_blocking(self.encoder.encode, questions)
+
+    def chunker_factory(self):
+        """Chunker used for ingestion: token-sized when the encoder exposes a fast tokenizer"""
+        tokenizer = getattr(self.encoder, 'tokenizer', None)
+        if getattr(settings, 'CHUNKER', 'tokens') != 'tokens' or tokenizer is None:
+            return CharChunker
+
+        # Leave room for the [CLS] and [SEP] tokens the encoder adds
+        window = getattr(self.encoder, 'max_seq_length', None) or 256
+        max_tokens = min(getattr(settings, 'CHUNK_MAX_TOKENS', 256), window) - 2
+        return functools.partial(
+            TokenChunker, tokenizer, max_tokens, getattr(settings, 'CHUNK_OVERLAP_TOKENS', 32)
+        )
+
+    def iter_document_chunks(self, file_path, progress=None):
+        """Stream (chunk, page_number, offset) triples of a file without holding the whole text in memory"""
+        return iter_file_chunks(file_path, self.chunker_factory(),
+                                anchor_every=getattr(settings, 'CHUNK_ANCHOR_EVERY', 4), progress=progress)
+
+    @staticmethod
+    def chunk_id(document_id, chunk_index):
+        return f"{document_id}_{chunk_index}"
+
+    def diff_chunk_batch(self, document_id, start_index, chunks, pages=None):
+        """Compare a batch of consecutive chunks with what is stored, without embedding anything.
+
+        Returns (changed, reusable, to_embed): offsets whose stored content or
+        page differs, stored embeddings of the document by content hash, and
+        the changed offsets whose content has no stored embedding.
+        """
+        pages = pages or [None] * len(chunks)
+        ids = [self.chunk_id(document_id, start_index + offset) for offset in range(len(chunks))]
+        hashes = [self.content_hash(chunk) for chunk in chunks]
+
         try:
-            print(f"DEBUG: Processing document {document_id} from {file_path}")
-            
-            # Check file existence
-            if not os.path.exists(file_path):
-                error_msg = f"File not found: {file_path}"
-                print(f"DEBUG: {error_msg}")
-                return False, error_msg
-            
-            # Read file content
+            with span('vector_write'):
+                stored = self.store.get(ids=ids, include=['metadatas'])
+            stored_keys = {
+                chunk_id: ((metadata or {}).get('content_hash'), (metadata or {}).get('page'))
+                for chunk_id, metadata in zip(stored['ids'], stored['metadatas'])
+            }
+            changed = [offset for offset, chunk_id in enumerate(ids)
+                       if stored_keys.get(chunk_id) != (hashes[offset], pages[offset])]
+
+            reusable = {}
+            if changed:
+                with span('vector_write'):
+                    moved = self.store.get(
+                        where={"$and": [
+                            {"document_id": str(document_id)},
+                            {"content_hash": {"$in": list({hashes[offset] for offset in changed})}}
+                        ]},
+                        include=['metadatas', 'embeddings']
+                    )
+                for metadata, embedding in zip(moved['metadatas'], moved['embeddings']):
+                    reusable[metadata['content_hash']] = list(embedding)
+        except Exception as e:
+            raise IngestionError(f"Error reading existing chunks: {str(e)}") from e
+
+        return changed, reusable, [offset for offset in changed if hashes[offset] not in reusable]
+
+    def store_chunk_batch(self, document_id, start_index, chunks, pages=None, vectors=None, offsets=None,
+                          records=None, diff=None):
+        """Store one batch of consecutive chunks, embedding only content not stored before.
+
+        Chunk ids are positional ("<document_id>_<index>"). A chunk whose id
+        already holds the same content is left alone, and content stored under
+        another id of the document is moved with its stored embedding. The
+        rest goes through embed_chunks (and so the embedding cache), unless
+        vectors (aligned with chunks, needed at the to_embed offsets only)
+        were computed by the caller from diff, the diff_chunk_batch result.
+        When a records list is given, every chunk of the batch is appended to
+        it as DocumentChunk field values (see Document.mark_completed).
+        Returns counts of unchanged, reused and embedded chunks.
+        """
+        pages = pages or [None] * len(chunks)
+        ids = [self.chunk_id(document_id, start_index + offset) for offset in range(len(chunks))]
+        hashes = [self.content_hash(chunk) for chunk in chunks]
+        changed, reusable, to_embed = diff or self.diff_chunk_batch(document_id, start_index, chunks, pages)
+
+        embeddings = {offset: reusable[hashes[offset]] for offset in changed if hashes[offset] in reusable}
+        if to_embed and vectors is not None:
+            for offset in to_embed:
+                embeddings[offset] = np.asarray(vectors[offset]).tolist()
+        elif to_embed:
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    text = f.read()
-                print(f"DEBUG: Successfully read {len(text)} characters")
+                vectors = self.embed_chunks([chunks[offset] for offset in to_embed])
             except Exception as e:
-                error_msg = f"Error reading file: {str(e)}"
-                print(f"DEBUG: {error_msg}")
-                return False, error_msg
-            
-            if not text.strip():
-                return False, "File is empty"
-            
-            print(f"DEBUG: Content preview: {text[:200]}...")
-            
-            # Clean existing chunks
+                raise IngestionError(f"Error generating embeddings: {str(e)}") from e
+            for offset, vector in zip(to_embed, vectors):
+                embeddings[offset] = vector.tolist()
+
+        if changed:
             try:
-                existing_results = self.collection.query(
-                    query_embeddings=self.encoder.encode(["dummy"]).tolist(),
-                    n_results=1000,
-                    where={"document_id": str(document_id)}
-                )
-                
-                if existing_results.get('ids') and existing_results['ids'][0]:
-                    self.collection.delete(ids=existing_results['ids'][0])
-                    print(f"DEBUG: Deleted {len(existing_results['ids'][0])} existing chunks")
+                with span('vector_write'):
+                    self.store.upsert(
+                        ids=[ids[offset] for offset in changed],
+                        embeddings=[embeddings[offset] for offset in changed],
+                        documents=[chunks[offset] for offset in changed],
+                        metadatas=[self.chunk_metadata(document_id, start_index + offset, chunks[offset],
+                                                       hashes[offset], pages[offset])
+                                   for offset in changed]
+                    )
             except Exception as e:
-                print(f"DEBUG: Error cleaning existing chunks: {e}")
-            
-            # Chunk text
+                raise IngestionError(f"Error storing in vector store: {str(e)}") from e
+
+        if records is not None:
+            offsets = offsets or [None] * len(chunks)
+            records.extend({
+                'chunk_index': start_index + offset,
+                'chunk_text': chunk,
+                'content_hash': hashes[offset],
+                'page': pages[offset],
+                'char_offset': offsets[offset],
+                'embedding_id': ids[offset],
+            } for offset, chunk in enumerate(chunks))
+
+        unchanged, reused, embedded = len(chunks) - len(changed), len(changed) - len(to_embed), len(to_embed)
+        CHUNKS.inc(unchanged, outcome='unchanged')
+        CHUNKS.inc(reused, outcome='reused')
+        CHUNKS.inc(embedded, outcome='embedded')
+        return unchanged, reused, embedded
+
+    def invalidate_answers(self, document_id):
+        """Drop cached answers that may quote a document: when its ingestion starts and when it finishes"""
+        if self.answer_cache:
+            self.answer_cache.invalidate(document_id)
+
+    def finish_document(self, document_id, total):
+        """Drop chunks past the new end of a document (with no result cap) and record its count.
+
+        Returns the number of stale chunks removed.
+        """
+        try:
+            with span('vector_write'):
+                stale_where = {"$and": [
+                    {"document_id": str(document_id)},
+                    {"chunk_index": {"$gte": total}}
+                ]}
+                removed = len(self.store.get(where=stale_where, include=[])['ids'])
+                if removed:
+                    self.store.delete(where=stale_where)
+                    logger.debug("Deleted %d stale chunks of document %s", removed, document_id)
+        except Exception as e:
+            raise IngestionError(f"Error storing in vector store: {str(e)}") from e
+
+        with span('vector_write'):
+            self.store.flush(document_id)
+        self.document_index.set_count(document_id, total)
+        # Questions answered while the document was being rewritten may quote the old or partial chunks
+        self.invalidate_answers(document_id)
+        if self.router:
             try:
-                chunks = self.chunk_text(text)
-                print(f"DEBUG: Created {len(chunks)} chunks")
-                
-                if not chunks:
-                    return False, "No chunks created from text"
-                    
-                # Show sample chunks
-                for i, chunk in enumerate(chunks[:2]):
-                    print(f"DEBUG: Chunk {i}: {chunk[:100]}...")
-                    
+                with span('vector_write'):
+                    self.router.update(document_id, self.store, total)
             except Exception as e:
-                error_msg = f"Error chunking text: {str(e)}"
-                print(f"DEBUG: {error_msg}")
-                return False, error_msg
+                # Not fatal: the stale or missing summary only costs this document some routed recall
+                logger.warning("Could not update the routing summary of document %s: %s", document_id, e)
+        CHUNKS.inc(removed, outcome='removed')
+        return removed
+
+    def clear_document(self, document_id):
+        """Remove a document's chunks, index entry, routing summary, chunk rows and cached answers"""
+        from .models import DocumentChunk
+
+        self.finish_document(document_id, 0)
+        DocumentChunk.objects.filter(document_id=document_id).delete()
+
+    def process_document(self, document_id, file_path, progress_callback=None, records=None):
+        """Process and store document chunks from file path.
+
+        The file flows through a generator pipeline (read blocks -> sections ->
+        chunks -> fixed-size batches -> embed -> upsert), so memory stays flat
+        regardless of file size, apart from the chunk rows collected into
+        records when a list is given (see store_chunk_batch).
+        """
+        def report(progress, message):
+            if progress_callback:
+                progress_callback(progress, message)
+
+        try:
+            logger.info("Processing document %s from %s", document_id, file_path)
+            report(5, "Reading file")
             
-            # Generate embeddings
-            try:
-                embeddings = self.encoder.encode(chunks)
-                print(f"DEBUG: Generated embeddings with shape: {embeddings.shape}")
-            except Exception as e:
-                error_msg = f"Error generating embeddings: {str(e)}"
-                print(f"DEBUG: {error_msg}")
-                return False, error_msg
+            # Cached answers may quote the old content
+            self.invalidate_answers(document_id)
             
-            # Prepare data for ChromaDB
-            try:
-                chunk_ids = []
-                chunk_documents = []
-                chunk_embeddings = []
-                chunk_metadatas = []
-                
-                for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                    if not chunk.strip():  # Skip empty chunks
-                        continue
-                        
-                    chunk_id = f"{document_id}_{i}"
-                    chunk_ids.append(chunk_id)
-                    chunk_documents.append(chunk)
-                    chunk_embeddings.append(embedding.tolist())
-                    chunk_metadatas.append({
-                        "document_id": str(document_id),
-                        "chunk_index": i,
-                        "chunk_length": len(chunk)
-                    })
-                
-                print(f"DEBUG: Prepared {len(chunk_ids)} items for ChromaDB storage")
-                
-                if not chunk_ids:
-                    return False, "No valid chunks to store"
-                    
-            except Exception as e:
-                error_msg = f"Error preparing data: {str(e)}"
-                print(f"DEBUG: {error_msg}")
+            # Check file existence
+            if not os.path.exists(file_path):
+                error_msg = f"File not found: {file_path}"
+                logger.warning(error_msg)
                 return False, error_msg
             
-            # Store in ChromaDB
-            try:
-                print("DEBUG: Attempting to add to ChromaDB...")
-                
-                self.collection.add(
-                    ids=chunk_ids,
-                    embeddings=chunk_embeddings,
-                    documents=chunk_documents,
-                    metadatas=chunk_metadatas
-                )
-                
-                print("DEBUG: Successfully added to ChromaDB")
-                
-            except Exception as e:
-                error_msg = f"Error storing in ChromaDB: {str(e)}"
-                print(f"DEBUG: {error_msg}")
-                import traceback
-                traceback.print_exc()
-                return False, error_msg
+            batch_size = getattr(settings, 'INGEST_BATCH_SIZE', 256)
+            read_fraction = [0.0]
+            chunks = self.iter_document_chunks(file_path, progress=lambda fraction: read_fraction.__setitem__(0, fraction))
             
-            # Verify storage
-            try:
-                final_count = self.collection.count()
-                print(f"DEBUG: Collection now has {final_count} total items")
-                
-                # Test retrieval
-                test_results = self.collection.query(
-                    query_embeddings=self.encoder.encode(["test"]).tolist(),
-                    n_results=1,
-                    where={"document_id": str(document_id)}
+            total = unchanged = reused = embedded = 0
+            for batch in batched(chunks, batch_size):
+                batch_unchanged, batch_reused, batch_embedded = self.store_chunk_batch(
+                    document_id, total, [chunk for chunk, _, _ in batch], [page for _, page, _ in batch],
+                    offsets=[offset for _, _, offset in batch], records=records
                 )
-                
-                retrieved_count = len(test_results['documents'][0]) if test_results['documents'][0] else 0
-                print(f"DEBUG: Can retrieve {retrieved_count} chunks for document {document_id}")
-                
-            except Exception as e:
-                print(f"DEBUG: Error verifying storage: {e}")
+                total += len(batch)
+                unchanged += batch_unchanged
+                reused += batch_reused
+                embedded += batch_embedded
+                report(5 + int(90 * read_fraction[0]), f"Stored {total} chunks")
             
-            return True, f"Successfully processed {len(chunk_ids)} chunks"
+            logger.debug("Created %d chunks (%d embedded, %d reused, %d unchanged)", total, embedded, reused, unchanged)
             
-        except Exception as e:
-            error_msg = f"Unexpected error in process_document: {str(e)}"
-            print(f"DEBUG: {error_msg}")
-            import traceback
-            traceback.print_exc()
-            return False, error_msg
-    
-
-
-    
-    # def query_documents(self, question, document_id=None, n_results=3):
-    #     """Query documents and generate answer"""
-    #     try:
-    #         if not question.strip():
-    #             return "Please provide a valid question."
-            
-    #         # Generate question embedding
-    #         question_embedding = self.encoder.encode([question])
-            
-    #         # Build where clause for filtering
-    #         where_clause = {"document_id": str(document_id)} if document_id else None
-            
-    #         # Query ChromaDB
-    #         results = self.collection.query(
-    #             query_embeddings=question_embedding.tolist(),
-    #             n_results=n_results,
-    #             where=where_clause
-    #         )
-            
-    #         # Check if we found any results
-    #         if not results['documents'] or not results['documents'][0]:
-    #             if document_id:
-    #                 return f"No relevant content found in the selected document for your question: '{question}'"
-    #             else:
-    #                 return f"No relevant documents found to answer your question: '{question}'"
+            if total == 0:
+                # Old content would stay searchable, and be restored by a rebuild, otherwise
+                self.clear_document(document_id)
+                return False, "File is empty"
             
-    #         # Combine context from retrieved chunks
-    #         context_chunks = results['documents'][0]
-    #         context = "\n\n".join(context_chunks)
+            report(95, "Removing stale chunks")
+            removed = self.finish_document(document_id, total)
             
-    #         # Generate answer using the context
-    #         return self.generate_answer(question, context)
+            return True, (f"Successfully processed {total} chunks "
+                          f"({embedded} embedded, {reused} reused, "
+                          f"{unchanged} unchanged, {removed} removed)")
             
-    #     except Exception as e:
-    #         return f"Error querying documents: {str(e)}"
+        except IngestionError as e:
+            logger.warning("Ingestion of document %s failed: %s", document_id, e)
+            ERRORS.inc(stage='ingestion')
+            return False, str(e)
+        except Exception as e:
+            error_msg = f"Unexpected error in process_document: {str(e)}"
+            logger.exception(error_msg)
+            ERRORS.inc(stage='ingestion')
+            return False, error_msg
     
-    def generate_answer(self, question, context):
-        """Generate answer using local Ollama model"""
-        prompt = f"""Based on the following context from the document(s), provide a clear and accurate answer to the question. If the context doesn't contain enough information to answer the question, say so.
+    def build_prompt(self, question, context):
+        """Build the generation prompt from the question and retrieved context"""
+        return f"""Based on the following context from the document(s), provide a clear and accurate answer to the question. If the context doesn't contain enough information to answer the question, say so.
 
         Context:
         {context}
@@ -300,120 +390,616 @@ class RAGEngine:
 
         Answer:"""
 
+    def llm_error_message(self, error):
+        """User-facing message for a failed generation"""
+        if isinstance(error, LLMUnavailable):
+            return f"Error: Cannot connect to Ollama. Make sure Ollama is running on {self.llm.base_url}"
+        if isinstance(error, LLMTimeout):
+            return "Error: Request timed out. The model might be taking too long to respond."
+        if isinstance(error, LLMError):
+            return f"Error: {str(error)}. Make sure Ollama is running with {self.llm.model} model."
+        return f"Error generating answer: {str(error)}"
+
+    def _generate(self, question, context, timeout=None):
+        """Generate an answer, returning (answer, generated) where generated is False on errors"""
+        with span('prompt_build'):
+            prompt = self.build_prompt(question, context)
+
         try:
-                    payload = {
-                        "model": "llama2",
-                        "prompt": prompt,
-                        "stream": False,
-                        "options": {
-                            "temperature": 0.3,
-                            "top_p": 0.9,
-                            "num_tokens": 300
-                        }
-                    }
-                    
-                    response = requests.post(self.ollama_url, json=payload, timeout=60)
-                    
-                    if response.status_code == 200:
-                        result = response.json()
-                        answer = result.get('response', 'No response generated')
-                        
-                        # Clean up the answer
-                        if answer:
-                            return answer.strip()
-                        else:
-                            return "I couldn't generate a proper answer based on the provided context."
-                    else:
-                        return f"Error: Ollama returned status {response.status_code}. Make sure Ollama is running with llama2 model."
-                        
-        except requests.exceptions.ConnectionError:
-                    return "Error: Cannot connect to Ollama. Make sure Ollama is running on localhost:11434"
-        except requests.exceptions.Timeout:
-                    return "Error: Request timed out. The model might be taking too long to respond."
+            with span('llm_generate'):
+                answer = self.llm.generate(prompt, timeout=timeout)
         except Exception as e:
-                    return f"Error generating answer: {str(e)}"
+            logger.warning("Generation failed: %s", e)
+            return self.llm_error_message(e), False
+            
+        # Clean up the answer
+        if answer:
+            return answer.strip(), True
+        else:
+            return "I couldn't generate a proper answer based on the provided context.", False
 
-    def query_documents(self, question, document_id=None, n_results=3):
-        """Query documents and generate answer with debugging"""
-        try:
-            if not question.strip():
-                return "Please provide a valid question."
-            
-            # DEBUG: Check collection status
-            try:
-                collection_count = self.collection.count()
-                print(f"DEBUG: Collection has {collection_count} items")
-            except Exception as e:
-                print(f"DEBUG: Error getting collection count: {e}")
-                return "Error: Cannot access document collection"
-            
-            # If collection is empty, return early
-            if collection_count == 0:
-                return "No documents have been uploaded and processed yet. Please upload a document first."
-            
-            # Generate question embedding
-            question_embedding = self.encoder.encode([question])
-            print(f"DEBUG: Question embedding shape: {question_embedding.shape}")
-            
-            # Build where clause for filtering
-            where_clause = {"document_id": str(document_id)} if document_id else None
-            print(f"DEBUG: Where clause: {where_clause}")
-            
-            # DEBUG: Check if specific document exists in collection
-            if document_id:
-                try:
-                    # Query for any chunks with this document_id
-                    test_results = self.collection.query(
-                        query_embeddings=question_embedding.tolist(),
-                        n_results=1,
-                        where={"document_id": str(document_id)}
-                    )
-                    if not test_results['documents'] or not test_results['documents'][0]:
-                        return f"Document ID {document_id} not found in the collection. The document may not have been processed correctly."
-                except Exception as e:
-                    print(f"DEBUG: Error testing document existence: {e}")
-            
-            # Query ChromaDB
-            results = self.collection.query(
-                query_embeddings=question_embedding.tolist(),
+    def generate_answer(self, question, context, timeout=None):
+        """Generate answer using local Ollama model"""
+        answer, _ = self._generate(question, context, timeout=timeout)
+        return answer
+
+    def stream_answer_tokens(self, question, context, timeout=None):
+        """Yield answer tokens from Ollama's NDJSON stream as they are generated.
+
+        Closing the generator closes the upstream connection, which makes
+        Ollama abort the generation.
+        """
+        with span('prompt_build'):
+            prompt = self.build_prompt(question, context)
+        return timed_iter(self.llm.stream(prompt, timeout=timeout), 'llm_generate')
+
+    def lookup_cached_answer(self, question, document_id=None, question_embedding=None):
+        """Look the question up in the answer cache.
+
+        Returns (cached, question_embedding): cached is (answer, sources) on a
+        hit. The embedding computed for the semantic lookup (or the one passed
+        in) is returned so retrieval does not encode the question again.
+        """
+        if not self.answer_cache:
+            return None, question_embedding
+
+        scope = AnswerCache.scope_for(document_id)
+        cached = self.answer_cache.get_exact(question, scope)
+        if cached:
+            return cached, question_embedding
+        if not self.answer_cache.semantic:
+            return None, question_embedding
+
+        if question_embedding is None:
+            question_embedding = self.encode_questions([question])
+        return self.answer_cache.get_similar(question_embedding[0], scope), question_embedding
+
+    def answer_generation(self, document_id=None):
+        """Answer cache generation of the question's scope, read before retrieval and passed to cache_answer"""
+        if not self.answer_cache:
+            return None
+        return self.answer_cache.generation(AnswerCache.scope_for(document_id))
+
+    def cache_answer(self, question, question_embedding, answer, document_id=None, sources=None, generation=None):
+        if self.answer_cache:
+            self.answer_cache.put(
+                question,
+                question_embedding[0] if question_embedding is not None else None,
+                answer,
+                AnswerCache.scope_for(document_id),
+                sources=sources,
+                generation=generation
+            )
+
+    def build_context(self, results, n_results, question_embedding=None):
+        """Prompt context from one question's retrieval results.
+
+        Returns (context, results) where results is narrowed to the chunks
+        that made it into the context when context packing is on.
+        """
+        with span('prompt_build'):
+            if not self.context_packer:
+                return "\n\n".join(results['documents'][0]), results
+            return self.context_packer.pack(question_embedding, results, n_results)
+
+    def _indexed_total(self):
+        total = self.document_index.total()
+        if total == 0:
+            # Another process may have ingested since the index was read; confirm before
+            # telling the user there is nothing to search
+            total = self.store.count()
+        return total
+
+    def _indexed_count(self, document_id):
+        count = self.document_index.count(document_id)
+        if count == 0:
+            # Rare path: resync the entry with a metadata-only lookup, not a vector search
+            ids = self.store.get(where={"document_id": str(document_id)}, include=[]).get('ids') or []
+            if ids:
+                count = len(ids)
+                self.document_index.set_count(document_id, count)
+        return count
+
+    def search_all(self, query_embeddings, n_results, include=('metadatas', 'documents', 'distances')):
+        """Vector query over all documents, coarse-to-fine through the document router when it is worth it.
+
+        Each question is searched in the ROUTING_TOP_DOCUMENTS documents whose
+        representatives are closest, plus any document not summarised yet.
+        Below ROUTING_MIN_DOCUMENTS documents, or with too many unsummarised
+        ones, every chunk is scored instead. With ROUTING_EXACT_FALLBACK a
+        question that gets fewer than n_results chunks back is searched again
+        over everything. Returns a store query result aligned with query_embeddings.
+        """
+        router = self.router
+        counts = self.document_index.counts() if router and router.top_documents > 0 else None
+        uncovered = router.uncovered(counts) if counts and len(counts) >= router.min_documents else None
+        if uncovered is None or len(uncovered) >= router.top_documents:
+            ROUTED_QUERIES.inc(len(query_embeddings), path='flat')
+            return self.store.query(query_embeddings=query_embeddings, n_results=n_results, include=include)
+
+        # Questions routed to the same documents share one query
+        groups = {}
+        for position, documents in enumerate(router.route(query_embeddings)):
+            candidates = {document_id for document_id in documents if document_id in counts}
+            groups.setdefault(tuple(sorted(candidates.union(uncovered))), []).append(position)
+
+        keys = ('ids', 'documents', 'metadatas', 'distances', 'embeddings')
+        merged = {key: [None] * len(query_embeddings) for key in keys}
+        expected = min(n_results, sum(counts.values()))
+        fallback = []
+        for candidates, positions in groups.items():
+            if not candidates:
+                fallback.extend(positions)
+                continue
+            results = self.store.query(
+                query_embeddings=[query_embeddings[position] for position in positions],
                 n_results=n_results,
-                where=where_clause
+                where={"document_id": {"$in": list(candidates)}},
+                include=include
             )
-            
-            # DEBUG: Print results structure
-            print(f"DEBUG: Query results structure:")
-            print(f"  - documents: {len(results.get('documents', [])) if results.get('documents') else 0}")
-            print(f"  - metadatas: {len(results.get('metadatas', [])) if results.get('metadatas') else 0}")
-            print(f"  - distances: {results.get('distances', [])}")
-            
-            # Check if we found any results
-            if not results.get('documents') or not results['documents'][0]:
-                # Try a broader search without document filter
+            for offset, position in enumerate(positions):
+                if router.exact_fallback and len(results['ids'][offset]) < expected:
+                    fallback.append(position)
+                    continue
+                for key in keys:
+                    if results.get(key) is not None:
+                        merged[key][position] = results[key][offset]
+
+        if fallback:
+            logger.debug("Routed search came up short for %d question(s); searching all documents", len(fallback))
+            results = self.store.query(query_embeddings=[query_embeddings[position] for position in fallback],
+                                       n_results=n_results, include=include)
+            for offset, position in enumerate(fallback):
+                for key in keys:
+                    if results.get(key) is not None:
+                        merged[key][position] = results[key][offset]
+        ROUTED_QUERIES.inc(len(query_embeddings) - len(fallback), path='routed')
+        ROUTED_QUERIES.inc(len(fallback), path='fallback')
+        return {key: None if all(value is None for value in values) else values for key, values in merged.items()}
+
+    def retrieve(self, question, document_id=None, n_results=3, question_embedding=None):
+        """Retrieve context chunks for a question.
+
+        Returns (results, message): message is a user-facing answer when
+        retrieval ends early (empty collection, unknown document, no matches),
+        otherwise results holds the Chroma query result for the question.
+        """
+        return self.retrieve_batch([question], [document_id], n_results, question_embedding)[0]
+
+    def retrieve_batch(self, questions, document_ids, n_results=3, question_embeddings=None):
+        """Retrieve context for several questions, with one vector query per document scope.
+
+        questions[i] is searched in document_ids[i] (None searches all
+        documents); question_embeddings, if given, is aligned with questions.
+        Returns one (results, message) pair per question as retrieve() does,
+        each results shaped like a single-question query result.
+        """
+        outcomes = [None] * len(questions)
+        pending = []
+        for i, question in enumerate(questions):
+            if not question.strip():
+                outcomes[i] = (None, "Please provide a valid question.")
+            else:
+                pending.append(i)
+        if not pending:
+            return outcomes
+
+        # Empty-collection and document-existence checks come from the local
+        # index, so the common case costs a single vector query
+        try:
+            with span('retrieve'):
+                collection_count = self._indexed_total()
+            logger.debug("Collection has %d items", collection_count)
+        except Exception as e:
+            logger.warning("Error getting collection count: %s", e)
+            for i in pending:
+                outcomes[i] = (None, "Error: Cannot access document collection")
+            return outcomes
+
+        # If collection is empty, return early
+        if collection_count == 0:
+            for i in pending:
+                outcomes[i] = (None, "No documents have been uploaded and processed yet. Please upload a document first.")
+            return outcomes
+
+        searchable = []
+        for i in pending:
+            document_id = document_ids[i]
+            with span('retrieve'):
+                missing = document_id and self._indexed_count(document_id) == 0
+            if missing:
+                outcomes[i] = (None, f"Document ID {document_id} not found in the collection. The document may not have been processed correctly.")
+            else:
+                searchable.append(i)
+        if not searchable:
+            return outcomes
+
+        # Generate question embeddings
+        if question_embeddings is None:
+            embeddings = dict(zip(searchable, self.encode_questions([questions[i] for i in searchable])))
+        else:
+            embeddings = {i: question_embeddings[i] for i in searchable}
+
+        # With context packing, over-fetch candidates (with their vectors) for pack() to choose from
+        fetch = self.context_packer.candidates(n_results) if self.context_packer else n_results
+        include = ('metadatas', 'documents', 'distances', 'embeddings') if self.context_packer else \
+            ('metadatas', 'documents', 'distances')
+
+        # One query per document scope, carrying every question of that scope
+        scopes = {}
+        for i in searchable:
+            scopes.setdefault(str(document_ids[i]) if document_ids[i] else None, []).append(i)
+
+        unmatched = []
+        for document_id, indexes in scopes.items():
+            where_clause = {"document_id": document_id} if document_id else None
+            logger.debug("Where clause: %s, %d question(s)", where_clause, len(indexes))
+            with span('retrieve'):
+                query_embeddings = [np.asarray(embeddings[i]).tolist() for i in indexes]
                 if document_id:
-                    print("DEBUG: Trying search without document filter...")
-                    broad_results = self.collection.query(
-                        query_embeddings=question_embedding.tolist(),
-                        n_results=n_results,
-                        where=None  # Remove document filter
+                    results = self.store.query(
+                        query_embeddings=query_embeddings,
+                        n_results=fetch,
+                        where=where_clause,
+                        include=include
                     )
-                    
-                    if broad_results.get('documents') and broad_results['documents'][0]:
-                        return f"No relevant content found in document ID {document_id}, but other documents contain relevant information. Try searching all documents instead."
-                    else:
-                        return "No relevant content found in any documents for your question."
                 else:
-                    return f"No relevant documents found to answer your question: '{question}'"
+                    results = self.search_all(query_embeddings, fetch, include)
+
+            for position, i in enumerate(indexes):
+                if not results.get('documents') or not results['documents'][position]:
+                    unmatched.append(i)
+                    continue
+                outcomes[i] = ({key: [results[key][position]] if results.get(key) is not None else None
+                                for key in ('ids', 'documents', 'metadatas', 'distances', 'embeddings')}, None)
+
+        # Check if we found any results; try a broader search without document filter
+        broad = [i for i in unmatched if document_ids[i]]
+        broad_found = {}
+        if broad:
+            logger.debug("Trying search without document filter")
+            with span('retrieve'):
+                broad_results = self.store.query(
+                    query_embeddings=[np.asarray(embeddings[i]).tolist() for i in broad],
+                    n_results=n_results,
+                    where=None  # Remove document filter
+                )
+            for position, i in enumerate(broad):
+                broad_found[i] = bool(broad_results.get('documents') and broad_results['documents'][position])
+
+        for i in unmatched:
+            if not document_ids[i]:
+                outcomes[i] = (None, f"No relevant documents found to answer your question: '{questions[i]}'")
+            elif broad_found.get(i):
+                outcomes[i] = (None, f"No relevant content found in document ID {document_ids[i]}, but other documents contain relevant information. Try searching all documents instead.")
+            else:
+                outcomes[i] = (None, "No relevant content found in any documents for your question.")
+
+        return outcomes
+
+    def gate_answer(self, question, document_id, question_embedding, results):
+        """(answer, sources) when the confidence gate answers without the LLM, otherwise None"""
+        if not self.confidence_gate:
+            return None
+        embedding = np.asarray(question_embedding).reshape(-1) if question_embedding is not None else None
+        generations = self.llm.stats()
+        llm_seconds = generations['total_seconds'] / generations['generations'] if generations['generations'] else 0.0
+        with span('confidence'):
+            path, extracted = self.confidence_gate.decide(embedding, results, self.embed_chunks, llm_seconds)
+        if path == 'extractive':
+            return extracted
+        if path == 'not_found':
+            if document_id:
+                return f"No relevant content found in document ID {document_id} for your question: '{question}'", []
+            return f"No relevant documents found to answer your question: '{question}'", []
+        return None
+
+    def prepare_query(self, question, document_id=None, n_results=3, question_embedding=None):
+        """Everything a query does before generation.
+
+        question_embedding, if given, is used instead of encoding the question.
+        Returns (early, prepared). early is (answer, sources, cached) when the
+        question is answered without the LLM: invalid question, cache hit,
+        retrieval ending early, or the confidence gate. Otherwise prepared is (context, results,
+        question_embedding, generation) for the generation; generation goes to cache_answer.
+        """
+        if not question.strip():
+            return ("Please provide a valid question.", [], False), None
+        
+        generation = self.answer_generation(document_id)
+        cached, question_embedding = self.lookup_cached_answer(question, document_id, question_embedding)
+        if cached:
+            logger.debug("Answer cache hit")
+            return (cached[0], cached[1] or [], True), None
+        
+        if question_embedding is None and (self.context_packer or self.confidence_gate):
+            question_embedding = self.encode_questions([question])
+        
+        results, message = self.retrieve(question, document_id, n_results, question_embedding)
+        if message:
+            return (message, [], False), None
+        
+        # Combine context from retrieved chunks
+        context, results = self.build_context(results, n_results, question_embedding)
+        logger.debug("Found %d relevant chunks, %d characters of context", len(results['documents'][0]), len(context))
+        gated = self.gate_answer(question, document_id, question_embedding, results)
+        if gated:
+            return (gated[0], gated[1], False), None
+        return None, (context, results, question_embedding, generation)
+
+    def query_documents(self, question, document_id=None, n_results=3, timeout=None):
+        """Query documents and generate answer with debugging"""
+        try:
+            early, prepared = self.prepare_query(question, document_id, n_results)
+            if early:
+                return early[0]
+            context, results, question_embedding, generation = prepared
             
-            # Combine context from retrieved chunks
-            context_chunks = results['documents'][0]
-            context = "\n\n".join(context_chunks)
+            # Generate answer using the context
+            answer, generated = self._generate(question, context, timeout=timeout)
+            if generated:
+                self.cache_answer(question, question_embedding, answer, document_id, sources=results['ids'][0],
+                                  generation=generation)
+            return answer
             
-            print(f"DEBUG: Found {len(context_chunks)} relevant chunks")
-            print(f"DEBUG: Total context length: {len(context)} characters")
+        except Exception as e:
+            logger.exception("Error in query_documents")
+            ERRORS.inc(stage='query')
+            return f"Error querying documents: {str(e)}"
+
+    async def _run_blocking(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.blocking_executor, propagate(fn), *args)
+
+    async def _aprepare_query(self, question, document_id, n_results):
+        # Encode on the event loop first, so waiting for the dispatcher's batch holds no executor thread
+        question_embedding = await self.aencode_questions([question]) if question.strip() else None
+        return await self._run_blocking(self.prepare_query, question, document_id, n_results, question_embedding)
+
+    async def _agenerate(self, question, context, timeout=None):
+        """_generate() for asyncio callers"""
+        with span('prompt_build'):
+            prompt = self.build_prompt(question, context)
+        try:
+            with span('llm_generate'):
+                answer = await self.llm.agenerate(prompt, timeout=timeout)
+        except Exception as e:
+            logger.warning("Generation failed: %s", e)
+            return self.llm_error_message(e), False
+        if answer:
+            return answer.strip(), True
+        return "I couldn't generate a proper answer based on the provided context.", False
+
+    async def aquery_documents(self, question, document_id=None, n_results=3, timeout=None):
+        """query_documents() for asyncio callers.
+
+        The question is encoded through the embedding dispatcher on the event
+        loop, then retrieval and cache access run on the bounded blocking
+        executor; the generation is awaited on the event loop, so a slow
+        answer holds no thread.
+        """
+        try:
+            early, prepared = await self._aprepare_query(question, document_id, n_results)
+            if early:
+                return early[0]
+            context, results, question_embedding, generation = prepared
             
-            # Generate answer using the context
-            return self.generate_answer(question, context)
+            answer, generated = await self._agenerate(question, context, timeout=timeout)
+            if generated:
+                await self._run_blocking(self.cache_answer, question, question_embedding, answer, document_id,
+                                         results['ids'][0], generation)
+            return answer
             
         except Exception as e:
-            print(f"DEBUG: Error in query_documents: {str(e)}")
+            logger.exception("Error in aquery_documents")
+            ERRORS.inc(stage='query')
             return f"Error querying documents: {str(e)}"
+
+    async def astream_query(self, question, document_id=None, n_results=3, timeout=None):
+        """stream_query() for asyncio callers, as an async generator of (event, data)"""
+        try:
+            early, prepared = await self._aprepare_query(question, document_id, n_results)
+        except Exception as e:
+            logger.exception("Error in astream_query")
+            ERRORS.inc(stage='query')
+            yield 'error', {'error': f"Error querying documents: {str(e)}"}
+            return
+
+        if early:
+            for event in self._early_events(*early):
+                yield event
+            return
+
+        context, results, question_embedding, generation = prepared
+        yield 'sources', {
+            'chunk_ids': results['ids'][0],
+            'document_ids': [meta.get('document_id') for meta in results['metadatas'][0]]
+        }
+
+        with span('prompt_build'):
+            prompt = self.build_prompt(question, context)
+        tokens = atimed_iter(self.llm.astream(prompt, timeout=timeout), 'llm_generate')
+        answer_parts = []
+        try:
+            async for token in tokens:
+                answer_parts.append(token)
+                yield 'token', {'token': token}
+        except Exception as e:
+            yield 'error', {'error': self.llm_error_message(e)}
+            return
+        finally:
+            await tokens.aclose()
+
+        answer = "".join(answer_parts).strip()
+        if answer:
+            await self._run_blocking(self.cache_answer, question, question_embedding, answer, document_id,
+                                     results['ids'][0], generation)
+        yield 'done', {}
+
+    @staticmethod
+    def _early_events(answer, sources, cached):
+        yield 'sources', {'chunk_ids': sources, 'cached': True} if cached else {'chunk_ids': sources}
+        yield 'answer', {'answer': answer}
+        yield 'done', {}
+
+    def stream_query(self, question, document_id=None, n_results=3, timeout=None):
+        """Query documents and yield ('sources' | 'token' | 'answer' | 'error' | 'done', data) events.
+
+        The retrieved chunk ids are emitted before any token so clients can
+        render sources while the answer is still being generated.
+        """
+        try:
+            early, prepared = self.prepare_query(question, document_id, n_results)
+        except Exception as e:
+            logger.exception("Error in stream_query")
+            ERRORS.inc(stage='query')
+            yield 'error', {'error': f"Error querying documents: {str(e)}"}
+            return
+
+        if early:
+            # Cache hit, or retrieval ended early and the message is the whole answer
+            yield from self._early_events(*early)
+            return
+
+        context, results, question_embedding, generation = prepared
+        yield 'sources', {
+            'chunk_ids': results['ids'][0],
+            'document_ids': [meta.get('document_id') for meta in results['metadatas'][0]]
+        }
+
+        tokens = self.stream_answer_tokens(question, context, timeout=timeout)
+        answer_parts = []
+        try:
+            for token in tokens:
+                answer_parts.append(token)
+                yield 'token', {'token': token}
+        except Exception as e:
+            yield 'error', {'error': self.llm_error_message(e)}
+            return
+        finally:
+            tokens.close()
+
+        answer = "".join(answer_parts).strip()
+        if answer:
+            self.cache_answer(question, question_embedding, answer, document_id, sources=results['ids'][0],
+                              generation=generation)
+        yield 'done', {}
+
+    def query_batch(self, questions, document_ids=None, n_results=3, timeout=None, max_concurrency=None):
+        """Answer many questions, yielding (index, result) pairs as each answer is ready.
+
+        The answer cache is checked first; the remaining questions are
+        encoded in one batch and retrieved with one multi-question vector
+        query per document (retrieve_batch). Generations then run
+        concurrently on up to max_concurrency threads, still bounded by the
+        Ollama client's in-flight limit. Closing the generator cancels
+        generations that have not started.
+        """
+        document_ids = list(document_ids or [None] * len(questions))
+        max_concurrency = max_concurrency or getattr(settings, 'BATCH_QUERY_CONCURRENCY', 4)
+
+        def result(i, answer, sources=(), cached=False):
+            return i, {
+                'question': questions[i],
+                'document_id': document_ids[i],
+                'answer': answer,
+                'sources': list(sources),
+                'cached': cached
+            }
+
+        def failed(i, e):
+            # One question's failure ends its own result, never the stream
+            logger.exception("Error in query_batch for question %d", i)
+            ERRORS.inc(stage='query')
+            return result(i, f"Error querying documents: {str(e)}")
+
+        # Exact cache hits need no embedding at all
+        pending = []
+        for i, question in enumerate(questions):
+            if not question.strip():
+                yield result(i, "Please provide a valid question.")
+                continue
+            cached = self.answer_cache.get_exact(question, AnswerCache.scope_for(document_ids[i])) if self.answer_cache else None
+            if cached:
+                yield result(i, cached[0], cached[1] or (), cached=True)
+            else:
+                pending.append(i)
+        if not pending:
+            return
+        generations = {i: self.answer_generation(document_ids[i]) for i in pending}
+
+        # One encoder call for every remaining question
+        try:
+            with span('embed'):
+                vectors = self.encoder.encode([questions[i] for i in pending])
+        except Exception as e:
+            for i in pending:
+                yield result(i, f"Error querying documents: {str(e)}")
+            return
+        embeddings = dict(zip(pending, vectors))
+
+        if self.answer_cache and self.answer_cache.semantic:
+            misses = []
+            for i in pending:
+                try:
+                    cached = self.answer_cache.get_similar(embeddings[i], AnswerCache.scope_for(document_ids[i]))
+                except Exception as e:
+                    yield failed(i, e)
+                    continue
+                if cached:
+                    yield result(i, cached[0], cached[1] or (), cached=True)
+                else:
+                    misses.append(i)
+            pending = misses
+            if not pending:
+                return
+
+        try:
+            outcomes = self.retrieve_batch(
+                [questions[i] for i in pending], [document_ids[i] for i in pending], n_results,
+                [embeddings[i] for i in pending]
+            )
+        except Exception as e:
+            logger.exception("Error in query_batch")
+            ERRORS.inc(stage='query')
+            for i in pending:
+                yield result(i, f"Error querying documents: {str(e)}")
+            return
+
+        to_generate = []
+        for i, (results, message) in zip(pending, outcomes):
+            if message:
+                yield result(i, message)
+                continue
+            try:
+                context, results = self.build_context(results, n_results, embeddings[i])
+                gated = self.gate_answer(questions[i], document_ids[i], embeddings[i], results)
+            except Exception as e:
+                yield failed(i, e)
+                continue
+            if gated:
+                yield result(i, gated[0], gated[1])
+            else:
+                to_generate.append((i, context, results))
+        if not to_generate:
+            return
+
+        logger.debug("Generating %d answers, %d at a time", len(to_generate), max_concurrency)
+        executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='batch-query')
+        try:
+            futures = {
+                executor.submit(propagate(self._generate), questions[i], context, timeout): (i, results)
+                for i, context, results in to_generate
+            }
+            for future in as_completed(futures):
+                i, results = futures[future]
+                try:
+                    answer, generated = future.result()
+                    if generated:
+                        self.cache_answer(questions[i], embeddings[i][None, :], answer, document_ids[i],
+                                          sources=results['ids'][0], generation=generations[i])
+                except Exception as e:
+                    yield failed(i, e)
+                    continue
+                yield result(i, answer, results['ids'][0])
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,149 @@
+import logging
+import os
+import sys
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.RLock()
+_engine = None
+_ingestion_queue = None
+_bulk_ingestion = None
+
+# Warm-up state reported by the readiness endpoint
+_warmup = {
+    'state': 'cold',  # cold -> warming -> ready | failed
+    'started_at': None,
+    'seconds': None,
+    'error': None,
+}
+
+
+def get_engine():
+    """The process-wide RAGEngine, created on first use.
+
+    Creating it is cheap: the encoder and vector store are loaded the first
+    time they are needed (or by the background warm-up).
+    """
+    global _engine
+    if _engine is None:
+        with _lock:
+            if _engine is None:
+                from .rag_engine import RAGEngine
+                _engine = RAGEngine()
+    return _engine
+
+
+def get_ingestion_queue():
+    """The process-wide ingestion queue; it recovers jobs left over by a previous run and sweeps for abandoned ones"""
+    global _ingestion_queue
+    if _ingestion_queue is None:
+        with _lock:
+            if _ingestion_queue is None:
+                from .ingestion import IngestionQueue
+                queue = IngestionQueue(get_engine())
+                queue.start()
+                _ingestion_queue = queue
+    return _ingestion_queue
+
+
+def get_bulk_ingestion():
+    """The process-wide runner for bulk uploads"""
+    global _bulk_ingestion
+    if _bulk_ingestion is None:
+        with _lock:
+            if _bulk_ingestion is None:
+                from .bulk_ingestion import BulkIngestion
+                _bulk_ingestion = BulkIngestion(get_engine())
+    return _bulk_ingestion
+
+
+def warm_up():
+    """Load the encoder and vector store and run a dummy encode so the first query is not the slow one"""
+    _warmup.update(state='warming', started_at=time.time(), error=None)
+    start = time.perf_counter()
+    try:
+        engine = get_engine()
+        engine.encoder.encode(["warm up"])
+        engine.store.count()
+        get_ingestion_queue()
+    except Exception as e:
+        logger.warning("RAG engine warm-up failed: %s", e)
+        _warmup.update(state='failed', error=str(e))
+        return
+    _warmup.update(state='ready', seconds=time.perf_counter() - start)
+    logger.info("RAG engine warmed up in %.2fs", _warmup['seconds'])
+
+
+def start_warm_up():
+    threading.Thread(target=warm_up, name='rag-warm-up', daemon=True).start()
+
+
+def is_server_process(argv=None):
+    """Whether this process serves requests: runserver, gunicorn or uvicorn.
+
+    RAG_SERVER_PROCESS=1 (or 0) in the environment overrides the guess, for
+    other servers; management commands, tests and scripts are never servers.
+    """
+    override = os.environ.get('RAG_SERVER_PROCESS')
+    if override in ('0', '1'):
+        return override == '1'
+    argv = sys.argv if argv is None else argv
+    if not argv:
+        return False
+    program = os.path.basename(argv[0])
+    if program == 'manage.py':
+        if len(argv) < 2 or argv[1] != 'runserver':
+            return False
+        # The autoreloader's parent process only watches files
+        return '--noreload' in argv or os.environ.get('RUN_MAIN') == 'true'
+    if program == '__main__.py':
+        # python -m gunicorn / python -m uvicorn
+        program = os.path.basename(os.path.dirname(argv[0]))
+    return program in ('gunicorn', 'uvicorn')
+
+
+def should_warm_up(argv=None):
+    """Warm up in server processes only, and only with RAG_WARMUP"""
+    return getattr(settings, 'RAG_WARMUP', False) and is_server_process(argv)
+
+
+def start_ingestion():
+    """Start the ingestion queue, which recovers left-over jobs and keeps sweeping for abandoned ones"""
+    try:
+        get_ingestion_queue()
+    except Exception as e:
+        logger.warning("Could not start the ingestion queue: %s", e)
+
+
+def _reset_after_fork():
+    """Workers forked from a preloading master (gunicorn --preload) start over.
+
+    Threads, executors and SQLite connections do not survive a fork, so the
+    child drops the master's engine and queue and starts its own.
+    """
+    global _lock, _engine, _ingestion_queue, _bulk_ingestion
+    started, warming = _ingestion_queue is not None, _warmup['state'] != 'cold'
+    _lock = threading.RLock()
+    _engine = _ingestion_queue = _bulk_ingestion = None
+    _warmup.update(state='cold', started_at=None, seconds=None, error=None)
+    if warming:
+        start_warm_up()
+    elif started:
+        start_ingestion()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def readiness():
+    """Whether the model is loaded and warm, plus warm-up details"""
+    status = dict(_warmup)
+    if status['state'] != 'ready' and _engine is not None and _engine.encoder_loaded:
+        # Loaded on demand by a request rather than by the warm-up
+        status['state'] = 'ready'
+    status['ready'] = status['state'] == 'ready'
+    return status
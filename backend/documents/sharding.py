@@ -0,0 +1,331 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .metrics import propagate
+from .vector_store import ChromaStore, LocalStore, VectorStore
+
+logger = logging.getLogger(__name__)
+
+_RESULT_KEYS = ('ids', 'documents', 'metadatas', 'distances', 'embeddings')
+
+
+def shard_name(document_id, key='hash', count=8, tenant=''):
+    """The shard a new document is written to, by SHARD_KEY"""
+    if key == 'tenant':
+        # Chroma collection names: 3-63 characters of [a-zA-Z0-9._-], alphanumeric at both ends
+        return re.sub(r'[^a-z0-9]+', '-', tenant.lower()).strip('-')[:40] or 'default'
+    if key == 'hash':
+        digest = hashlib.blake2b(str(document_id).encode(), digest_size=8).digest()
+        return f"{int.from_bytes(digest, 'little') % count:02d}"
+    raise ValueError(f"Unknown SHARD_KEY: {key}")
+
+
+def _where_documents(where):
+    """Document ids a `where` filter is limited to, or None when it spans all documents"""
+    if not where:
+        return None
+    condition = where.get('document_id')
+    if condition is not None:
+        if not isinstance(condition, dict):
+            return [str(condition)]
+        if set(condition) == {'$in'}:
+            return [str(document_id) for document_id in condition['$in']]
+        if set(condition) == {'$eq'}:
+            return [str(condition['$eq'])]
+    for part in where.get('$and', ()):
+        documents = _where_documents(part)
+        if documents is not None:
+            return documents
+    return None
+
+
+def _restrict(where, document_ids):
+    """`where` with its document_id condition narrowed to document_ids"""
+    if 'document_id' in where:
+        return {**where, 'document_id': document_ids[0] if len(document_ids) == 1 else {'$in': document_ids}}
+    return {'$and': [_restrict(part, document_ids) if _where_documents(part) is not None else part
+                     for part in where['$and']]}
+
+
+class ShardedStore(VectorStore):
+    """Chunks split over several collections, one per shard, behind the VectorStore API.
+
+    New documents are written to the shard picked by SHARD_KEY: a hash
+    bucket of the document id, or the document's tenant. The routing table
+    (ShardAssignment rows in the Django database) maps documents to shards.
+    A document-scoped call goes to its shard only. A search over all
+    documents queries every shard in parallel and merges the top-k.
+
+    The unsharded collection (CHROMADB_COLLECTION or LOCAL_VECTOR_STORE_PATH)
+    stays readable: documents without a routing row are still there, until
+    split_collection moves them or they are written again. A move copies the
+    chunks, then adds the row, then deletes the old copies, so readers in
+    every process see the document whole at each step.
+    """
+
+    name = 'sharded'
+
+    def __init__(self, open_shard, legacy, key='hash', count=8, workers=8):
+        self.open_shard = open_shard
+        self.legacy = legacy
+        self.key = key
+        self.shard_count = count
+        self.name = f'sharded {legacy.name}'
+        self._lock = threading.Lock()
+        self._shards = {}  # name -> opened store
+        self._assigned = {}  # document_id -> shard name, valid while the ShardAssignment version stays the same
+        self._assigned_version = None
+        # Writes never go to the unsharded collection, so once empty it stays empty until a rebuild refills it
+        self._legacy_drained = False
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='shard-query')
+
+    @classmethod
+    def from_settings(cls, legacy):
+        backend = getattr(settings, 'VECTOR_STORE', 'chroma')
+        if backend == 'local':
+            root = str(legacy.path) + '_shards'
+
+            def open_shard(name):
+                return LocalStore(os.path.join(root, name), dim=legacy.dim, dtype=legacy.dtype,
+                                  rescore=legacy.rescore)
+        else:
+            prefix = getattr(settings, 'CHROMADB_COLLECTION', 'documents')
+
+            def open_shard(name):
+                return ChromaStore(path=getattr(settings, 'CHROMADB_PATH', './chromadb_data'),
+                                   collection_name=f"{prefix}_{name}")
+        return cls(
+            open_shard, legacy,
+            key=getattr(settings, 'SHARD_KEY', 'hash'),
+            count=getattr(settings, 'SHARD_COUNT', 8),
+            workers=getattr(settings, 'SHARD_QUERY_WORKERS', 8),
+        )
+
+    # -- routing -----------------------------------------------------------
+
+    def shard(self, name):
+        with self._lock:
+            store = self._shards.get(name)
+            if store is None:
+                store = self._shards[name] = self.open_shard(name)
+        return store
+
+    def _check_assignments(self):
+        """Drop the cached routing when the assignment table was reset (by rebuild_vector_index)"""
+        from .models import ShardAssignment
+
+        version = ShardAssignment.version()
+        with self._lock:
+            if version != self._assigned_version:
+                # The old shards went away with the reset too; reopen the ones assigned from now on
+                self._shards = {}
+                self._assigned = {}
+                self._assigned_version = version
+                self._legacy_drained = False
+
+    def _all_stores(self):
+        from .models import VectorShard
+
+        self._check_assignments()
+        stores = [self.shard(name) for name in VectorShard.objects.order_by('name').values_list('name', flat=True)]
+        if not self._legacy_drained:
+            if self.legacy.count():
+                stores.append(self.legacy)
+            else:
+                self._legacy_drained = True
+        return stores
+
+    def assigned(self, document_ids):
+        """{document_id: shard name} for the documents of document_ids that have a routing row"""
+        from .models import ShardAssignment
+
+        self._check_assignments()
+        missing = [document_id for document_id in document_ids if document_id not in self._assigned]
+        if missing:
+            for first in range(0, len(missing), 500):
+                self._assigned.update(ShardAssignment.objects.filter(document_id__in=missing[first:first + 500])
+                                      .values_list('document_id', 'shard'))
+        return {document_id: self._assigned[document_id] for document_id in document_ids
+                if document_id in self._assigned}
+
+    def _read_groups(self, document_ids):
+        """[(store, document ids)] holding the given documents"""
+        assigned = self.assigned(document_ids)
+        groups = {}
+        for document_id in document_ids:
+            name = assigned.get(document_id)
+            groups.setdefault(name, []).append(document_id)
+        return [(self.shard(name) if name is not None else self.legacy, ids) for name, ids in groups.items()]
+
+    def _target(self, document_id):
+        """Shard name to write a document to, moving its chunks out of the unsharded collection first"""
+        name = self.assigned([document_id]).get(document_id)
+        return name if name is not None else self.move(document_id)
+
+    def move(self, document_id, page_size=5000):
+        """Move a document from the unsharded collection to its shard and record the assignment.
+
+        Returns the shard name. Also used for documents not written yet, which only get their row.
+        """
+        from .models import Document, ShardAssignment, VectorShard
+
+        document_id = str(document_id)
+        tenant = ''
+        if self.key == 'tenant' and document_id.isdigit():
+            tenant = Document.objects.filter(id=document_id).values_list('tenant', flat=True).first() or ''
+        name = shard_name(document_id, self.key, self.shard_count, tenant)
+        target = self.shard(name)
+
+        moved = 0
+        if not self._legacy_drained:
+            while True:
+                page = self.legacy.get(where={"document_id": document_id},
+                                       include=['embeddings', 'documents', 'metadatas'],
+                                       limit=page_size, offset=moved)
+                if not page['ids']:
+                    break
+                target.upsert(page['ids'], [list(vector) for vector in page['embeddings']], page['documents'],
+                              page['metadatas'])
+                moved += len(page['ids'])
+                if len(page['ids']) < page_size:
+                    break
+            if moved:
+                target.flush(document_id)
+
+        VectorShard.objects.get_or_create(name=name)
+        ShardAssignment.objects.get_or_create(document_id=document_id, defaults={'shard': name})
+        self._assigned[document_id] = name
+        if moved:
+            self.legacy.delete(where={"document_id": document_id})
+            logger.debug("Moved %d chunks of document %s to shard %s", moved, document_id, name)
+        return name
+
+    # -- VectorStore API -------------------------------------------------
+
+    def _fan_out(self, calls):
+        """Run (fn, args) calls on the shard pool; a single call runs inline"""
+        if len(calls) == 1:
+            fn, args = calls[0]
+            return [fn(*args)]
+        return list(self._executor.map(lambda call: propagate(call[0])(*call[1]), calls))
+
+    def count(self):
+        return sum(store.count() for store in self._all_stores())
+
+    def get(self, ids=None, where=None, include=('metadatas', 'documents'), limit=None, offset=None):
+        calls = []
+        if ids is not None:
+            # Chunk ids are "<document_id>_<chunk_index>" (RAGEngine.chunk_id)
+            by_document = {}
+            for chunk_id in ids:
+                by_document.setdefault(str(chunk_id).rsplit('_', 1)[0], []).append(chunk_id)
+            for store, document_ids in self._read_groups(list(by_document)):
+                calls.append((store, [chunk_id for document_id in document_ids for chunk_id in by_document[document_id]],
+                              where))
+        else:
+            document_ids = _where_documents(where)
+            if document_ids is None:
+                calls = [(store, None, where) for store in self._all_stores()]
+            else:
+                calls = [(store, None, _restrict(where, group)) for store, group in self._read_groups(document_ids)]
+
+        merged = {'ids': [], 'embeddings': [] if 'embeddings' in include else None,
+                  'documents': [] if 'documents' in include else None,
+                  'metadatas': [] if 'metadatas' in include else None}
+        skip, remaining = offset or 0, limit
+        for store, store_ids, store_where in calls:
+            if remaining is not None and remaining <= 0:
+                break
+            if skip and store_ids is None and store_where is None:
+                # A whole shard can be skipped by its size
+                size = store.count()
+                if skip >= size:
+                    skip -= size
+                    continue
+                page = store.get(where=None, include=include, limit=remaining, offset=skip)
+                skip = 0
+            else:
+                page = store.get(ids=store_ids, where=store_where, include=include,
+                                 limit=None if remaining is None else remaining + skip)
+                dropped = min(skip, len(page['ids']))
+                page = {key: value[dropped:] if value is not None else None for key, value in page.items()
+                        if key in merged}
+                skip -= dropped
+            for key in merged:
+                if merged[key] is not None and page.get(key) is not None:
+                    merged[key].extend(page[key])
+            if remaining is not None:
+                remaining -= len(page['ids'])
+        return merged
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        by_shard = {}
+        for position, metadata in enumerate(metadatas):
+            document_id = str(metadata.get('document_id'))
+            by_shard.setdefault(self._target(document_id), []).append(position)
+        for name, positions in by_shard.items():
+            self.shard(name).upsert([ids[position] for position in positions],
+                                    [embeddings[position] for position in positions],
+                                    [documents[position] for position in positions],
+                                    [metadatas[position] for position in positions])
+
+    def delete(self, ids=None, where=None):
+        document_ids = _where_documents(where) if ids is None else None
+        if document_ids is None:
+            for store in self._all_stores():
+                store.delete(ids=ids, where=where)
+            return
+        for store, group in self._read_groups(document_ids):
+            store.delete(where=_restrict(where, group))
+
+    def query(self, query_embeddings, n_results=10, where=None,
+              include=('metadatas', 'documents', 'distances')):
+        document_ids = _where_documents(where)
+        if document_ids is None:
+            targets = [(store, where) for store in self._all_stores()]
+        else:
+            targets = [(store, _restrict(where, group)) for store, group in self._read_groups(document_ids)]
+        if not targets:
+            return {key: [[] for _ in query_embeddings] if key in ('ids', *include) else None for key in _RESULT_KEYS}
+        # Distances are needed for the merge even when the caller did not ask for them
+        fetch = tuple(include) if 'distances' in include else (*include, 'distances')
+        partials = self._fan_out([(store.query, (query_embeddings, n_results, store_where, fetch))
+                                  for store, store_where in targets])
+        if len(partials) == 1 and fetch == tuple(include):
+            return partials[0]
+
+        merged = {key: [] if key in ('ids', *include) else None for key in _RESULT_KEYS}
+        for position in range(len(query_embeddings)):
+            candidates = []
+            for partial in partials:
+                for rank, chunk_id in enumerate(partial['ids'][position]):
+                    candidates.append((partial['distances'][position][rank], chunk_id, partial, rank))
+            candidates.sort(key=lambda candidate: candidate[0])
+            seen = set()
+            best = []
+            for candidate in candidates:
+                # A document caught mid-move is in two collections for a moment
+                if candidate[1] not in seen:
+                    seen.add(candidate[1])
+                    best.append(candidate)
+                if len(best) == n_results:
+                    break
+            for key in merged:
+                if merged[key] is not None:
+                    merged[key].append([list(partial[key][position][rank]) if key == 'embeddings'
+                                        else partial[key][position][rank] for _, _, partial, rank in best])
+        return merged
+
+    def flush(self, document_id=None):
+        if document_id is None:
+            for store in self._all_stores():
+                store.flush()
+            return
+        for store, _ in self._read_groups([str(document_id)]):
+            store.flush(document_id)
@@ -0,0 +1,102 @@
+"""Helpers shared by the test modules.
+
+Tests run offline: the sentence encoder is the hashing encoder of the
+benchmarks (benchmarks.encoders) and generation goes to the fake Ollama
+server (benchmarks.fake_ollama). Every RAG data path points into a
+temporary directory per test, with the local vector store.
+"""
+import os
+import shutil
+import tempfile
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import override_settings
+
+from benchmarks.encoders import HashingEncoder
+from benchmarks.fake_ollama import FakeOllama
+from documents import registry
+
+
+class RAGTestMixin:
+    """Isolated RAG data per test, plus factories for engines, documents and the fake LLM"""
+
+    # Per-class overrides on top of the isolated paths
+    rag_settings = {}
+
+    def setUp(self):
+        super().setUp()
+        self.data_dir = tempfile.mkdtemp(prefix='docintell-test-')
+        self.addCleanup(shutil.rmtree, self.data_dir, ignore_errors=True)
+        data = os.path.join(self.data_dir, 'rag_data')
+        overrides = {
+            'MEDIA_ROOT': os.path.join(self.data_dir, 'media'),
+            'RAG_DATA_DIR': data,
+            'ANSWER_CACHE_PATH': os.path.join(data, 'answer_cache.sqlite3'),
+            'DOCUMENT_INDEX_PATH': os.path.join(data, 'document_index.sqlite3'),
+            'ROUTING_INDEX_PATH': os.path.join(data, 'document_router.sqlite3'),
+            'EMBEDDING_CACHE_PATH': os.path.join(data, 'embedding_cache.sqlite3'),
+            'LOCAL_VECTOR_STORE_PATH': os.path.join(data, 'local_index'),
+            'CHROMADB_PATH': os.path.join(self.data_dir, 'chromadb_data'),
+            'VECTOR_STORE': 'local',
+            'RAG_WARMUP': False,
+            # Nothing listens here unless a test starts the fake server
+            'OLLAMA_URL': 'http://127.0.0.1:9',
+            **self.rag_settings,
+        }
+        override = override_settings(**overrides)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def start_fake_ollama(self, **kwargs):
+        """Start the fake Ollama on a free port and point OLLAMA_URL at it"""
+        options = {'tokens_per_second': 0, 'first_token_ms': 0, 'response_tokens': 5, **kwargs}
+        fake = FakeOllama(port=0, **options).start()
+        self.addCleanup(fake.stop)
+        override = override_settings(OLLAMA_URL=fake.url)
+        override.enable()
+        self.addCleanup(override.disable)
+        return fake
+
+    def make_engine(self, **kwargs):
+        from documents.rag_engine import RAGEngine
+
+        engine = RAGEngine(**kwargs)
+        engine.encoder = HashingEncoder()
+        return engine
+
+    def use_engine(self, engine):
+        """Serve the views from engine instead of the process-wide one"""
+        previous = registry._engine
+        registry._engine = engine
+        self.addCleanup(setattr, registry, '_engine', previous)
+        return engine
+
+    def save_file(self, name, text):
+        """Write a file to default_storage; returns (storage path, absolute path)"""
+        path = default_storage.save(name, ContentFile(text.encode('utf-8')))
+        return path, default_storage.path(path)
+
+    def ingest(self, engine, text, name='doc.txt', **fields):
+        """Create a Document for text and process it synchronously; returns the document"""
+        from documents.models import Document
+
+        path, full_path = self.save_file(name, text)
+        document = Document.objects.create(title=name, file_path=path, file_type=name.rsplit('.', 1)[-1],
+                                           file_size=len(text), **fields)
+        records = []
+        success, message = engine.process_document(document.id, full_path, records=records)
+        if not success:
+            raise AssertionError(f"Ingestion failed: {message}")
+        Document.mark_completed(document.id, records, message)
+        document.refresh_from_db()
+        return document
+
+
+def paragraphs(topic, count=6, sentences=4):
+    """Deterministic multi-paragraph text about topic"""
+    return "\n\n".join(
+        " ".join(f"The {topic} report describes item {paragraph * sentences + sentence} of the {topic} study."
+                 for sentence in range(sentences))
+        for paragraph in range(count)
+    )
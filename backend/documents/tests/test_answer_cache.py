@@ -0,0 +1,162 @@
+import os
+import sqlite3
+import time
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase, TestCase
+
+from documents.answer_cache import ALL_DOCUMENTS, AnswerCache, normalize_question
+
+from .support import RAGTestMixin, paragraphs
+
+
+def unit(*values):
+    vector = np.zeros(8, dtype=np.float32)
+    vector[:len(values)] = values
+    return vector / np.linalg.norm(vector)
+
+
+class AnswerCacheTests(RAGTestMixin, SimpleTestCase):
+    def make_cache(self, **kwargs):
+        return AnswerCache(os.path.join(self.data_dir, 'answers.sqlite3'), **kwargs)
+
+    def test_questions_are_normalized(self):
+        self.assertEqual(normalize_question("  What   is RAG?? "), "what is rag")
+
+    def test_exact_hit_ignores_case_spacing_and_punctuation(self):
+        cache = self.make_cache()
+        cache.put("What is RAG?", unit(1), "Retrieval.", '1', sources=['1_0'])
+        self.assertEqual(cache.get_exact("what is  rag", '1'), ("Retrieval.", ['1_0']))
+        self.assertIsNone(cache.get_exact("what is rag", '2'))
+
+    def test_semantic_hit_needs_the_similarity_threshold(self):
+        cache = self.make_cache(similarity=0.9, semantic=True)
+        cache.put("What is RAG?", unit(1, 0.1), "Retrieval.", ALL_DOCUMENTS)
+        self.assertEqual(cache.get_similar(unit(1, 0.15), ALL_DOCUMENTS)[0], "Retrieval.")
+        self.assertIsNone(cache.get_similar(unit(1, 1), ALL_DOCUMENTS))
+
+    def test_writes_patch_only_their_own_scope_matrix(self):
+        cache = self.make_cache(semantic=True)
+        cache.put("First", unit(1), "1", '1')
+        cache.put("Other", unit(0, 1), "2", '2')
+        self.assertEqual(cache.get_similar(unit(1), '1')[0], "1")
+        self.assertEqual(cache.get_similar(unit(0, 1), '2')[0], "2")
+        other = cache._matrices['2']
+
+        cache.put("Second", unit(0, 0, 1), "3", '1')
+        self.assertIs(cache._matrices['2'], other)
+        # Patched in place rather than dropped, so the next lookup reads no rows
+        self.assertEqual(cache._matrices['1'][0], cache._version('1'))
+        self.assertEqual(len(cache._matrices['1'][1]), 2)
+        self.assertEqual(cache.get_similar(unit(0, 0, 1), '1')[0], "3")
+
+    def test_writes_from_another_process_are_picked_up(self):
+        cache = self.make_cache(semantic=True)
+        cache.put("First", unit(1), "1", '1')
+        self.assertIsNone(cache.get_similar(unit(0, 1), '1'))
+        self.make_cache(semantic=True).put("Second", unit(0, 1), "2", '1')
+        self.assertEqual(cache.get_similar(unit(0, 1), '1')[0], "2")
+
+    def test_hits_are_written_with_the_next_put(self):
+        cache = self.make_cache(semantic=True)
+        cache.put("First", unit(1), "1", '1')
+        path = os.path.join(self.data_dir, 'answers.sqlite3')
+
+        def accessed_at():
+            with sqlite3.connect(path) as conn:
+                return conn.execute("SELECT accessed_at FROM answers WHERE question = 'first'").fetchone()[0]
+
+        stored = accessed_at()
+        cache.get_exact("First", '1')
+        cache.get_similar(unit(1), '1')
+        self.assertEqual(accessed_at(), stored)
+        cache.put("Second", unit(0, 1), "2", '2')
+        self.assertGreater(accessed_at(), stored)
+
+    def test_semantic_lookups_are_off_by_default(self):
+        cache = self.make_cache()
+        cache.put("What is RAG?", unit(1), "Retrieval.", ALL_DOCUMENTS)
+        self.assertIsNone(cache.get_exact("What is retrieval augmented generation?", ALL_DOCUMENTS))
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertFalse(AnswerCache.from_settings().semantic)
+
+    def test_invalidate_drops_the_document_and_all_documents_scopes(self):
+        cache = self.make_cache()
+        for scope in ('1', '2', ALL_DOCUMENTS):
+            cache.put("Question", unit(1), f"Answer {scope}", scope)
+        cache.invalidate('1')
+        self.assertIsNone(cache.get_exact("Question", '1'))
+        self.assertIsNone(cache.get_exact("Question", ALL_DOCUMENTS))
+        self.assertEqual(cache.get_exact("Question", '2')[0], "Answer 2")
+
+    def test_answers_computed_before_an_invalidation_are_not_stored(self):
+        cache = self.make_cache()
+        generation = cache.generation('1')
+        cache.invalidate('1')
+        self.assertFalse(cache.put("Question", unit(1), "Old answer", '1', generation=generation))
+        self.assertIsNone(cache.get_exact("Question", '1'))
+        self.assertTrue(cache.put("Question", unit(1), "New answer", '1', generation=cache.generation('1')))
+
+    def test_expired_entries_miss(self):
+        cache = self.make_cache(ttl=60)
+        cache.put("Question", unit(1), "Answer", '1')
+        with mock.patch('documents.answer_cache.time.time', return_value=time.time() + 120):
+            self.assertIsNone(cache.get_exact("Question", '1'))
+            self.assertIsNone(cache.get_similar(unit(1), '1'))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = self.make_cache(max_entries=2)
+        cache.put("First", unit(1), "1", '1')
+        cache.put("Second", unit(0, 1), "2", '1')
+        cache.get_exact("First", '1')
+        cache.put("Third", unit(0, 0, 1), "3", '1')
+        self.assertIsNotNone(cache.get_exact("First", '1'))
+        self.assertIsNone(cache.get_exact("Second", '1'))
+        self.assertEqual(cache.stats()['entries'], 2)
+
+
+class EngineAnswerCacheTests(RAGTestMixin, TestCase):
+    rag_settings = {'CONFIDENCE_GATING_ENABLED': False}
+
+    def test_repeated_question_is_served_from_the_cache(self):
+        fake = self.start_fake_ollama()
+        engine = self.make_engine()
+        document = self.ingest(engine, paragraphs('glacier'))
+        question = "What does the glacier report describe?"
+        first = engine.query_documents(question, document.id)
+        self.assertEqual(engine.query_documents(question, document.id), first)
+        self.assertEqual(fake.generations, 1)
+
+    def test_paraphrases_are_not_looked_up_by_default(self):
+        self.start_fake_ollama()
+        engine = self.make_engine()
+        document = self.ingest(engine, paragraphs('glacier'))
+        with mock.patch.object(engine.answer_cache, 'get_similar') as get_similar:
+            engine.query_documents("What does the glacier report describe?", document.id)
+            list(engine.query_batch(["Where is the glacier?"], [document.id]))
+        get_similar.assert_not_called()
+
+    def test_answers_given_during_reingestion_do_not_outlive_it(self):
+        self.start_fake_ollama()
+        engine = self.make_engine()
+        document = self.ingest(engine, paragraphs('glacier'))
+        question = "What does the glacier report describe?"
+
+        # A question retrieves the old chunks, then the document is re-ingested before it is answered
+        early, prepared = engine.prepare_query(question, document.id)
+        self.assertIsNone(early)
+        engine.process_document(document.id, os.path.join(self.data_dir, 'media', document.file_path))
+        context, results, embedding, generation = prepared
+        engine.cache_answer(question, embedding, "Stale answer", document.id, results['ids'][0], generation)
+        self.assertIsNone(engine.answer_cache.get_exact(question, str(document.id)))
+
+    def test_answers_cached_mid_ingestion_are_dropped_when_it_finishes(self):
+        engine = self.make_engine()
+        document = self.ingest(engine, paragraphs('glacier'))
+        engine.invalidate_answers(document.id)  # Re-ingestion starts
+        engine.cache_answer("Question", None, "Partial answer", document.id,
+                            generation=engine.answer_generation(document.id))
+        self.assertIsNotNone(engine.answer_cache.get_exact("Question", str(document.id)))
+        engine.finish_document(document.id, engine.document_index.count(document.id))
+        self.assertIsNone(engine.answer_cache.get_exact("Question", str(document.id)))
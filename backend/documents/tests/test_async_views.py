@@ -0,0 +1,88 @@
+import json
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase
+
+from documents.models import Document
+
+from .support import RAGTestMixin, paragraphs
+
+
+async def read_events(response):
+    """(event, data) pairs of an async server-sent-events response"""
+    body = b"".join([chunk async for chunk in response.streaming_content]).decode()
+    events = []
+    for block in body.split("\n\n"):
+        if block.strip():
+            fields = dict(line.split(": ", 1) for line in block.splitlines())
+            events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+class AsyncViewTests(RAGTestMixin, TestCase):
+    rag_settings = {'ANSWER_CACHE_ENABLED': False, 'CONFIDENCE_GATING_ENABLED': False}
+
+    def setUp(self):
+        super().setUp()
+        self.fake = self.start_fake_ollama(response_tokens=4)
+        self.engine = self.use_engine(self.make_engine())
+        self.document = self.ingest(self.engine, paragraphs('lagoon'), name='lagoon.txt')
+
+    async def post(self, path, data):
+        return await self.async_client.post(f'/api/async/documents/{path}', data, content_type='application/json')
+
+    async def test_query_answers_like_the_sync_view(self):
+        data = {'question': 'What does the lagoon report describe?', 'document_id': self.document.id}
+        response = await self.post('query/', {**data, 'timings': True})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['answer'], "".join(self.fake._tokens()))
+        self.assertIn('llm_generate_ms', response.json()['timings'])
+
+        sync = await self.async_client.post('/api/documents/query/', data, content_type='application/json')
+        self.assertEqual(sync.json()['answer'], response.json()['answer'])
+
+    async def test_questions_are_encoded_on_the_event_loop(self):
+        dispatcher = self.engine.query_dispatcher
+        with mock.patch.object(dispatcher, 'aencode', wraps=dispatcher.aencode) as aencode, \
+                mock.patch.object(dispatcher, 'encode', wraps=dispatcher.encode) as encode:
+            response = await self.post('query/', {'question': 'What does the lagoon report describe?'})
+            await read_events(await self.post('query/stream/', {'question': 'Where is the lagoon?'}))
+        self.assertEqual(response.json()['answer'], "".join(self.fake._tokens()))
+        self.assertEqual(aencode.call_count, 2)
+        encode.assert_not_called()
+
+    async def test_stream_sends_sources_then_tokens(self):
+        response = await self.post('query/stream/', {'question': 'What does the lagoon report describe?'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = await read_events(response)
+        names = [event for event, _ in events]
+        self.assertEqual((names[0], names[-1], names.count('token')), ('sources', 'done', 4))
+        self.assertEqual(set(events[0][1]['document_ids']), {str(self.document.id)})
+
+    async def test_invalid_requests(self):
+        self.assertEqual((await self.post('query/', {})).status_code, 400)
+        self.assertEqual((await self.post('query/', {'question': 'q', 'timeout': 'soon'})).status_code, 400)
+        response = await self.async_client.post('/api/async/documents/query/', b'[1]', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((await self.async_client.get('/api/async/documents/query/')).status_code, 405)
+
+    async def test_status_and_etag(self):
+        url = f'/api/async/documents/{self.document.id}/status/'
+        response = await self.async_client.get(url)
+        self.assertEqual(response.json()['status'], 'completed')
+        not_modified = await self.async_client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual((await self.async_client.get('/api/async/documents/99999/status/')).status_code, 404)
+
+    async def test_upload_queues_the_document(self):
+        queue = mock.Mock(policy='queue')
+        queue.submit.return_value = True
+        with mock.patch('documents.async_views.get_ingestion_queue', return_value=queue):
+            response = await self.async_client.post('/api/async/documents/upload/', {
+                'file': SimpleUploadedFile('notes.txt', b'Some notes.'), 'tenant': 'acme',
+            })
+        self.assertEqual(response.status_code, 202)
+        document = await Document.objects.aget(id=response.json()['id'])
+        self.assertEqual((document.processing_status, document.tenant), ('pending', 'acme'))
+        queue.submit.assert_called_once_with(document.id)
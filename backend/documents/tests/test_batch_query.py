@@ -0,0 +1,83 @@
+import json
+from unittest import mock
+
+from django.test import TestCase
+
+from .support import RAGTestMixin, paragraphs
+
+
+class BatchQueryTests(RAGTestMixin, TestCase):
+    rag_settings = {'CONFIDENCE_GATING_ENABLED': False, 'BATCH_QUERY_MAX_QUESTIONS': 5}
+
+    def setUp(self):
+        super().setUp()
+        self.fake = self.start_fake_ollama()
+        self.engine = self.use_engine(self.make_engine())
+        self.river = self.ingest(self.engine, paragraphs('river'), name='river.txt')
+        self.mountain = self.ingest(self.engine, paragraphs('mountain'), name='mountain.txt')
+
+    def ask(self, questions, **data):
+        return self.client.post('/api/documents/query/batch/', {'questions': questions, **data},
+                                content_type='application/json')
+
+    def lines(self, response):
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+
+    def test_every_question_gets_one_result_line(self):
+        questions = ["What does the river report describe?",
+                     {"question": "What does the mountain report describe?", "document_id": self.mountain.id},
+                     ""]
+        results = sorted(self.lines(self.ask(questions)), key=lambda line: line['index'])
+
+        self.assertEqual([line['index'] for line in results], [0, 1, 2])
+        self.assertEqual(results[0]['answer'], "".join(self.fake._tokens()))
+        self.assertEqual(results[1]['document_id'], self.mountain.id)
+        self.assertTrue(all(source.startswith(f"{self.mountain.id}_") for source in results[1]['sources']))
+        self.assertEqual(results[2]['answer'], "Please provide a valid question.")
+
+    def test_questions_are_encoded_and_retrieved_together(self):
+        questions = [f"What is item {i} of the river study?" for i in range(4)]
+        with mock.patch.object(self.engine.encoder, 'encode', wraps=self.engine.encoder.encode) as encode, \
+                mock.patch.object(self.engine.store, 'query', wraps=self.engine.store.query) as query:
+            response = self.ask(questions, document_id=self.river.id, stream=False)
+
+        self.assertEqual(len(response.json()['results']), 4)
+        self.assertEqual(encode.call_count, 1)
+        self.assertEqual(query.call_count, 1)
+        self.assertEqual(len(query.call_args.kwargs['query_embeddings']), 4)
+
+    def test_one_failing_question_does_not_end_the_stream(self):
+        questions = [f"What is item {i} of the river study?" for i in range(3)]
+        gate_answer = self.engine.gate_answer
+
+        def failing_gate(question, *args):
+            if question == questions[1]:
+                raise RuntimeError("gate broke")
+            return gate_answer(question, *args)
+
+        with mock.patch.object(self.engine, 'gate_answer', side_effect=failing_gate):
+            results = sorted(self.lines(self.ask(questions, document_id=self.river.id)),
+                             key=lambda line: line['index'])
+
+        self.assertEqual([line['index'] for line in results], [0, 1, 2])
+        self.assertEqual(results[1]['answer'], "Error querying documents: gate broke")
+        self.assertEqual([results[0]['answer'], results[2]['answer']], ["".join(self.fake._tokens())] * 2)
+
+    def test_non_streaming_results_are_ordered(self):
+        response = self.ask(["river item", "mountain item", "river study"], stream=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['index'] for result in response.json()['results']], [0, 1, 2])
+
+    def test_cached_answers_skip_generation(self):
+        self.ask(["What does the river report describe?"], stream=False)
+        generations = self.fake.generations
+        results = self.ask(["What does the river report describe?"], stream=False).json()['results']
+        self.assertTrue(results[0]['cached'])
+        self.assertEqual(self.fake.generations, generations)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.ask([]).status_code, 400)
+        self.assertEqual(self.ask("not a list").status_code, 400)
+        self.assertEqual(self.ask([42]).status_code, 400)
+        self.assertEqual(self.ask(["q"] * 6).status_code, 400)
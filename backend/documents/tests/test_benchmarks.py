@@ -0,0 +1,78 @@
+import json
+import os
+import shutil
+import tempfile
+
+import requests
+from django.test import SimpleTestCase
+
+from benchmarks import corpus
+from benchmarks.fake_ollama import FakeOllama
+from benchmarks.suite import compare, flatten
+
+
+class CorpusTests(SimpleTestCase):
+    def generate(self, **kwargs):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        return directory, corpus.generate(directory, documents=5, kilobytes=1, questions=4, **kwargs)
+
+    def test_manifest_describes_the_written_files(self):
+        directory, manifest = self.generate()
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            self.assertEqual(json.load(f), manifest)
+        names = [entry['name'] for entry in manifest['documents']]
+        self.assertEqual(len(names), 5)
+        for entry in manifest['documents']:
+            self.assertIn(entry['topic'], corpus.TOPICS)
+            self.assertEqual(os.path.getsize(os.path.join(directory, entry['name'])), entry['size'])
+        self.assertEqual(len(manifest['questions']), 4)
+        self.assertTrue(all(question['source'] in names for question in manifest['questions']))
+
+    def test_the_same_seed_gives_the_same_corpus(self):
+        self.assertEqual(self.generate(seed=3)[1], self.generate(seed=3)[1])
+        self.assertNotEqual(self.generate(seed=3)[1], self.generate(seed=4)[1])
+
+
+class FakeOllamaTests(SimpleTestCase):
+    def setUp(self):
+        self.fake = FakeOllama(port=0, tokens_per_second=0, first_token_ms=0, response_tokens=3).start()
+        self.addCleanup(self.fake.stop)
+
+    def generate(self, **payload):
+        return requests.post(f"{self.fake.url}/api/generate", json={'model': 'fake', 'prompt': 'Hello', **payload},
+                             stream=payload.get('stream', True))
+
+    def test_tags_list_a_model(self):
+        self.assertEqual(requests.get(f"{self.fake.url}/api/tags").json()['models'][0]['name'], 'fake:latest')
+        self.assertEqual(requests.post(f"{self.fake.url}/api/chat", json={}).status_code, 404)
+
+    def test_generation_is_counted_before_the_answer(self):
+        response = self.generate(stream=False)
+        self.assertEqual(self.fake.generations, 1)
+        body = response.json()
+        self.assertEqual(body['response'], "".join(self.fake._tokens()))
+        self.assertEqual(body['eval_count'], 3)
+
+    def test_streamed_generation_ends_with_usage(self):
+        with self.generate() as response:
+            lines = [json.loads(line) for line in response.iter_lines() if line]
+        self.assertEqual([line['response'] for line in lines[:-1]], self.fake._tokens())
+        self.assertTrue(lines[-1]['done'])
+        self.assertEqual(lines[-1]['eval_count'], 3)
+        # active drops only after the last write, so the client may see it first
+        self.assertEqual((self.fake.generations, self.fake.peak_active), (1, 1))
+
+
+class SuiteComparisonTests(SimpleTestCase):
+    def test_flatten_keys_levels_by_concurrency(self):
+        results = {'query': {'levels': [{'concurrency': 8, 'p99_ms': 120.0, 'ok': True}], 'errors': 0},
+                   'label': 'run'}
+        self.assertEqual(flatten(results), {'query.levels.8.concurrency': 8, 'query.levels.8.p99_ms': 120.0,
+                                            'query.errors': 0})
+
+    def test_compare_reports_relative_change_of_shared_keys(self):
+        baseline = {'scenarios': {'ingest': {'seconds': 10.0, 'failed': 0}, 'old': {'value': 1}}}
+        current = {'scenarios': {'ingest': {'seconds': 8.0, 'failed': 2}, 'new': {'value': 1}}}
+        self.assertEqual(compare(baseline, current), [('ingest.failed', 0, 2, 0.0),
+                                                      ('ingest.seconds', 10.0, 8.0, -0.2)])
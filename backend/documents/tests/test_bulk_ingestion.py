@@ -0,0 +1,142 @@
+import io
+import tarfile
+import zipfile
+from datetime import timedelta
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase
+from django.utils import timezone
+
+from documents.bulk_ingestion import BulkIngestion, _spool_member, save_upload
+from documents.models import Document, DocumentChunk, IngestionBatch
+from documents.pipeline import IngestionError
+
+from .support import RAGTestMixin, paragraphs
+
+
+def zip_upload(members, name='upload.zip'):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for member_name, text in members.items():
+            archive.writestr(member_name, text)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+def tar_upload(members, name='upload.tar.gz'):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for member_name, text in members.items():
+            data = text.encode()
+            info = tarfile.TarInfo(member_name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+class SaveUploadTests(RAGTestMixin, TestCase):
+    def outcomes(self, upload, max_files=10, max_entry_size=1000):
+        return [outcome[:3] for outcome in save_upload(upload, max_files, max_entry_size)]
+
+    def test_archive_members_are_saved_and_unusable_ones_skipped(self):
+        for upload in (zip_upload({'a.txt': 'alpha', 'docs/b.txt': 'beta', '.hidden': 'x', 'empty.txt': '',
+                                   'big.txt': 'x' * 2000}),
+                       tar_upload({'a.txt': 'alpha', 'docs/b.txt': 'beta', '.hidden': 'x', 'empty.txt': '',
+                                   'big.txt': 'x' * 2000})):
+            outcomes = self.outcomes(upload)
+            saved = [outcome[1] for outcome in outcomes if outcome[0] == 'saved']
+            skipped = {outcome[1].split(':')[-1]: outcome[2] for outcome in outcomes if outcome[0] == 'skipped'}
+            self.assertEqual(saved, ['a.txt', 'b.txt'], upload.name)
+            self.assertEqual(skipped, {'empty.txt': 'File is empty', 'big.txt': 'Larger than 1000 bytes'})
+
+    def test_file_limit(self):
+        outcomes = self.outcomes(zip_upload({f'{i}.txt': 'text' for i in range(5)}), max_files=2)
+        self.assertEqual([outcome[0] for outcome in outcomes], ['saved', 'saved', 'skipped'])
+
+    def test_extracted_bytes_are_enforced_not_the_declared_size(self):
+        spool, size = _spool_member(io.BytesIO(b'x' * 5000), limit=4096, block_size=1000)
+        self.assertIsNone(spool)
+        self.assertGreater(size, 4096)
+
+        # A member that declares a small size but extracts to more is skipped
+        upload = zip_upload({'a.txt': 'alpha'})
+        with mock.patch('documents.bulk_ingestion._iter_zip_members',
+                        return_value=iter([('lying.txt', 10, io.BytesIO(b'x' * 2000))])):
+            self.assertEqual(self.outcomes(upload), [('skipped', 'upload.zip:lying.txt', 'Larger than 1000 bytes')])
+
+    def test_invalid_archive(self):
+        outcomes = self.outcomes(SimpleUploadedFile('broken.zip', b'not a zip'))
+        self.assertEqual(outcomes[0][0], 'skipped')
+        self.assertIn('Invalid archive', outcomes[0][2])
+
+
+class BulkIngestionTests(RAGTestMixin, TestCase):
+    rag_settings = {'ROUTING_ENABLED': False}
+
+    def setUp(self):
+        super().setUp()
+        self.engine = self.make_engine()
+        self.bulk = BulkIngestion(self.engine, workers=1, embed_batch_size=64)
+
+    def make_batch(self, texts):
+        batch = IngestionBatch.objects.create(total_files=len(texts))
+        for name, text in texts.items():
+            path, _ = self.save_file(name, text)
+            Document.objects.create(title=name, file_path=path, file_type='txt', file_size=len(text),
+                                    processing_status='processing', batch=batch)
+        return batch
+
+    def test_batch_documents_are_completed_with_shared_embedding_calls(self):
+        batch = self.make_batch({f'{topic}.txt': paragraphs(topic) for topic in ('river', 'forest', 'desert')}
+                                | {'empty.txt': ''})
+        summary = self.bulk.ingest(batch.id)
+
+        self.assertEqual((summary['completed'], summary['failed']), (3, 1))
+        self.assertLess(summary['embedding_batches'], 3)
+        for document in batch.documents.exclude(title='empty.txt'):
+            self.assertEqual(document.processing_status, 'completed')
+            rows = DocumentChunk.objects.filter(document=document).count()
+            self.assertGreater(rows, 0)
+            self.assertEqual(self.engine.document_index.count(document.id), rows)
+        self.assertEqual(batch.documents.get(title='empty.txt').status_message, 'File is empty')
+
+    def test_failing_to_clear_an_emptied_file_fails_only_that_file(self):
+        batch = self.make_batch({'river.txt': paragraphs('river'), 'empty.txt': ''})
+        with mock.patch.object(self.engine, 'clear_document', side_effect=IngestionError("store is read-only")):
+            summary = self.bulk.ingest(batch.id)
+
+        self.assertEqual((summary['completed'], summary['failed']), (1, 1))
+        self.assertEqual(batch.documents.get(title='river.txt').processing_status, 'completed')
+        empty = batch.documents.get(title='empty.txt')
+        self.assertEqual(empty.processing_status, 'failed')
+        self.assertIn("store is read-only", empty.status_message)
+
+    def test_unchanged_content_is_diffed_before_embedding(self):
+        batch = self.make_batch({'river.txt': paragraphs('river'), 'forest.txt': paragraphs('forest')})
+        self.bulk.ingest(batch.id)
+        batch.documents.update(processing_status='processing')
+
+        with mock.patch.object(self.engine, 'embed_chunks', wraps=self.engine.embed_chunks) as embed:
+            summary = self.bulk.ingest(batch.id)
+        self.assertEqual(summary['completed'], 2)
+        self.assertEqual(summary['embedded'], 0)
+        embed.assert_not_called()
+
+    def test_every_claimed_batch_gets_heartbeats(self):
+        running, waiting = self.make_batch({'a.txt': 'alpha'}), self.make_batch({'b.txt': 'beta'})
+        old = timezone.now() - timedelta(hours=1)
+        Document.objects.update(updated_at=old)
+        with mock.patch.object(self.bulk._executor, 'submit'), mock.patch('threading.Thread.start'):
+            self.bulk.submit(running.id)
+            self.bulk.submit(waiting.id)
+
+        self.bulk.keep_alive()
+        for batch in (running, waiting):
+            self.assertGreater(batch.documents.get().updated_at, old)
+
+        # A finished batch is no longer claimed
+        self.bulk._run(running.id)
+        Document.objects.update(updated_at=old)
+        self.bulk.keep_alive()
+        self.assertGreater(waiting.documents.get().updated_at, old)
+        self.assertEqual(running.documents.get().updated_at, old)
@@ -0,0 +1,101 @@
+from django.test import SimpleTestCase, TestCase
+
+from benchmarks.encoders import HashingEncoder
+from documents.confidence import ConfidenceGate
+from documents.metrics import ANSWER_PATHS, LLM_SECONDS_SAVED
+
+from .support import RAGTestMixin, paragraphs
+
+ENCODER = HashingEncoder(dimension=64)
+
+
+def results(texts, distance):
+    return {
+        'ids': [[f"1_{index}" for index in range(len(texts))]],
+        'documents': [texts],
+        'metadatas': [[{'document_id': '1', 'chunk_index': index} for index in range(len(texts))]],
+        'distances': [[distance + index * 0.01 for index in range(len(texts))]],
+    }
+
+
+class ConfidenceGateTests(SimpleTestCase):
+    def test_gating_is_off_by_default(self):
+        self.assertIsNone(ConfidenceGate.from_settings())
+
+    question = "When was the northern harbour wall rebuilt?"
+    chunks = ["The northern harbour wall was rebuilt in 1902. Fishing boats moored behind it.",
+              "Tides in the bay rise quickly. The northern harbour wall was rebuilt in 1902."]
+
+    def decide(self, gate, distance, llm_seconds=0.0, chunks=None):
+        return gate.decide(ENCODER.encode([self.question])[0], results(chunks or self.chunks, distance),
+                           ENCODER.encode, llm_seconds)
+
+    def test_unrelated_results_are_not_found(self):
+        self.assertEqual(self.decide(ConfidenceGate(), 1.9), ('not_found', None))
+
+    def test_middling_results_go_to_the_llm(self):
+        self.assertEqual(self.decide(ConfidenceGate(), 0.8), ('generate', None))
+
+    def test_close_results_are_answered_with_their_best_sentence(self):
+        gate = ConfidenceGate(sentence_similarity=0.5, max_sentences=1)
+        path, (answer, sources) = self.decide(gate, 0.1)
+        self.assertEqual(path, 'extractive')
+        self.assertEqual(answer, "The northern harbour wall was rebuilt in 1902. [document 1, chunk 0]")
+        self.assertEqual(sources, ['1_0'])
+
+    def test_close_chunks_without_a_close_sentence_go_to_the_llm(self):
+        gate = ConfidenceGate(sentence_similarity=0.99)
+        self.assertEqual(self.decide(gate, 0.1), ('generate', None))
+
+    def test_sentences_skip_repeats_and_fragments(self):
+        gate = ConfidenceGate()
+        sentences = gate.sentences(results(self.chunks + ["Too short. Yes."], 0.1))
+        self.assertEqual(sentences, [("The northern harbour wall was rebuilt in 1902.", 0),
+                                     ("Fishing boats moored behind it.", 0),
+                                     ("Tides in the bay rise quickly.", 1)])
+        self.assertEqual(len(ConfidenceGate(max_scored_sentences=2).sentences(results(self.chunks, 0.1))), 2)
+
+    def test_skipped_generations_are_counted_as_saved_time(self):
+        gate = ConfidenceGate(sentence_similarity=0.5)
+        before = {path: ANSWER_PATHS.value(path=path) for path in ConfidenceGate.PATHS}
+        saved = LLM_SECONDS_SAVED.value(path='not_found')
+        self.decide(gate, 1.9, llm_seconds=2.0)
+        self.decide(gate, 0.1, llm_seconds=2.0)
+        self.decide(gate, 0.8, llm_seconds=2.0)
+
+        stats = gate.stats()
+        self.assertEqual((stats['not_found'], stats['extractive'], stats['generate']), (1, 1, 1))
+        self.assertEqual(stats['llm_seconds_saved'], 4.0)
+        self.assertAlmostEqual(stats['llm_skipped_ratio'], 2 / 3)
+        self.assertEqual({path: ANSWER_PATHS.value(path=path) - before[path] for path in ConfidenceGate.PATHS},
+                         {'not_found': 1, 'extractive': 1, 'generate': 1})
+        self.assertEqual(LLM_SECONDS_SAVED.value(path='not_found') - saved, 2.0)
+
+
+class GatedQueryTests(RAGTestMixin, TestCase):
+    rag_settings = {'ANSWER_CACHE_ENABLED': False, 'CONFIDENCE_GATING_ENABLED': True,
+                    'CONFIDENCE_EXTRACTIVE_SIMILARITY': 0.5, 'CONFIDENCE_SENTENCE_SIMILARITY': 0.9}
+
+    def setUp(self):
+        super().setUp()
+        self.fake = self.start_fake_ollama()
+        self.engine = self.make_engine()
+        self.document = self.ingest(self.engine, paragraphs('harbour'), name='harbour.txt')
+
+    def test_extractive_answers_skip_generation(self):
+        answer = self.engine.query_documents("The harbour report describes item 7 of the harbour study.",
+                                             document_id=self.document.id)
+        self.assertIn("item 7 of the harbour study.", answer)
+        self.assertIn(f"[document {self.document.id}, chunk", answer)
+        self.assertEqual(self.fake.generations, 0)
+
+    def test_unrelated_questions_are_not_found_without_generation(self):
+        self.engine.confidence_gate.not_found_similarity = 0.99
+        answer = self.engine.query_documents("Which volcano erupted?", document_id=self.document.id)
+        self.assertTrue(answer.startswith(f"No relevant content found in document ID {self.document.id}"))
+        self.assertEqual(self.fake.generations, 0)
+
+    def test_other_questions_are_generated(self):
+        answer = self.engine.query_documents("Why does the harbour matter?", document_id=self.document.id)
+        self.assertEqual(answer, "".join(self.fake._tokens()))
+        self.assertEqual(self.fake.generations, 1)
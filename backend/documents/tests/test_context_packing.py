@@ -0,0 +1,100 @@
+from django.test import SimpleTestCase, TestCase
+
+from documents.context_packing import ContextPacker, merge_overlapping
+
+from .support import RAGTestMixin, paragraphs
+
+
+def results(chunks, embeddings=None):
+    """A single-query result from (document_id, chunk_index, text, content_hash) tuples"""
+    return {
+        'ids': [[f"{document_id}_{index}" for document_id, index, _, _ in chunks]],
+        'documents': [[text for _, _, text, _ in chunks]],
+        'metadatas': [[{'document_id': str(document_id), 'chunk_index': index, 'content_hash': content_hash}
+                       for document_id, index, _, content_hash in chunks]],
+        'distances': [[float(position) for position in range(len(chunks))]],
+        'embeddings': [embeddings] if embeddings is not None else None,
+    }
+
+
+class MergeOverlappingTests(SimpleTestCase):
+    def test_repeated_sentences_are_kept_once(self):
+        first = "One sentence here. Two sentence here. Three sentence here."
+        second = "Three sentence here. Four sentence here."
+        self.assertEqual(merge_overlapping(first, second),
+                         "One sentence here. Two sentence here. Three sentence here. Four sentence here.")
+
+    def test_chunks_without_overlap_are_joined(self):
+        self.assertEqual(merge_overlapping("First chunk text.", "Second chunk text."),
+                         "First chunk text.\nSecond chunk text.")
+
+
+class ContextPackerTests(SimpleTestCase):
+    def test_packing_is_off_by_default(self):
+        self.assertIsNone(ContextPacker.from_settings())
+
+    def test_mmr_prefers_a_diverse_chunk_over_a_redundant_one(self):
+        packer = ContextPacker(mmr_lambda=0.3, dedupe_similarity=1.1, merge_adjacent=False)
+        chunks = [(1, 0, "best", "a"), (1, 5, "near copy of best", "b"), (2, 0, "different", "c")]
+        embeddings = [[1.0, 0.0], [0.99, 0.14], [0.6, 0.8]]
+        _, packed = packer.pack([1.0, 0.0], results(chunks, embeddings), n_results=2)
+        self.assertEqual(packed['ids'], [['1_0', '2_0']])
+
+    def test_duplicates_use_up_their_slot(self):
+        packer = ContextPacker(merge_adjacent=False)
+        chunks = [(1, 0, "same text", "h"), (2, 0, "same text", "h"), (3, 0, "other", "o")]
+        _, packed = packer.pack(None, results(chunks), n_results=2)
+        self.assertEqual(packed['ids'], [['1_0']])
+
+        embeddings = [[1.0, 0.0], [1.0, 0.001], [0.0, 1.0]]
+        chunks = [(1, 0, "text", "a"), (2, 0, "text again", "b"), (3, 0, "other", "c")]
+        _, packed = packer.pack([1.0, 0.0], results(chunks, embeddings), n_results=2)
+        self.assertEqual(packed['ids'], [['1_0']])
+        self.assertEqual(packer.stats()['duplicates_dropped'], 2)
+
+    def test_consecutive_chunks_are_merged_into_one_passage(self):
+        packer = ContextPacker()
+        chunks = [(1, 4, "Beta sentence number two. Gamma sentence number three.", "b"), (2, 0, "Elsewhere.", "x"),
+                  (1, 3, "Alpha sentence number one. Beta sentence number two.", "a")]
+        context, packed = packer.pack(None, results(chunks), n_results=3)
+        self.assertEqual(context, "Alpha sentence number one. Beta sentence number two. Gamma sentence number three."
+                                  "\n\nElsewhere.")
+        self.assertEqual(packed['ids'], [['1_3', '1_4', '2_0']])
+        self.assertEqual(packer.stats()['chunks_merged'], 1)
+
+    def test_context_stays_within_the_token_budget(self):
+        packer = ContextPacker(max_tokens=11, chars_per_token=1, merge_adjacent=False)
+        chunks = [(1, 0, "x" * 8, "a"), (2, 0, "y" * 8, "b"), (3, 0, "z", "c")]
+        context, packed = packer.pack(None, results(chunks), n_results=3)
+        self.assertEqual(packed['ids'], [['1_0', '3_0']])
+        self.assertLessEqual(packer.count_tokens(context), 11)
+
+        # The best passage is cut rather than sending nothing
+        context, packed = packer.pack(None, results([(1, 0, "x" * 40, "a")]), n_results=1)
+        self.assertEqual(context, "x" * 11)
+        self.assertEqual(packer.stats()['chunks_truncated'], 1)
+
+    def test_stats_report_tokens_saved(self):
+        packer = ContextPacker(chars_per_token=1, merge_adjacent=False)
+        chunks = [(1, 0, "same", "h"), (2, 0, "same", "h")]
+        packer.pack(None, results(chunks), n_results=2)
+        stats = packer.stats()
+        self.assertEqual((stats['naive_tokens'], stats['packed_tokens']), (10, 4))
+        self.assertEqual(stats['tokens_saved'], 6)
+
+
+class PackedRetrievalTests(RAGTestMixin, TestCase):
+    rag_settings = {'CONTEXT_PACKING_ENABLED': True, 'CONFIDENCE_GATING_ENABLED': False, 'ROUTING_ENABLED': False}
+
+    def test_sources_are_the_chunks_sent_to_the_model(self):
+        engine = self.make_engine()
+        document = self.ingest(engine, paragraphs('river', count=12), name='river.txt')
+        early, prepared = engine.prepare_query("What does item 5 of the river study say?", document_id=document.id)
+        self.assertIsNone(early)
+        context, results, _, _ = prepared
+        self.assertLessEqual(engine.context_packer.count_tokens(context), engine.context_packer.max_tokens)
+        self.assertTrue(results['ids'][0])
+        for source in results['ids'][0]:
+            self.assertTrue(source.startswith(f"{document.id}_"))
+        for text in results['documents'][0]:
+            self.assertIn(text[-40:], context)
@@ -0,0 +1,71 @@
+import os
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from benchmarks.encoders import HashingEncoder
+from documents.embedding_cache import EmbeddingCache
+
+from .support import RAGTestMixin
+
+
+class CountingEncoder(HashingEncoder):
+    def __init__(self):
+        super().__init__(dimension=16)
+        self.encoded = []
+
+    def encode(self, texts, **kwargs):
+        self.encoded.extend(texts)
+        return super().encode(texts, **kwargs)
+
+
+class EmbeddingCacheTests(RAGTestMixin, SimpleTestCase):
+    def make_cache(self, model_name='model-a', **kwargs):
+        return EmbeddingCache(os.path.join(self.data_dir, 'embeddings.sqlite3'), model_name, **kwargs)
+
+    def test_only_misses_are_encoded(self):
+        cache, encoder = self.make_cache(), CountingEncoder()
+        first = cache.encode(["one", "two"], encoder)
+        second = cache.encode(["two", "three", "one"], encoder)
+
+        self.assertEqual(encoder.encoded, ["one", "two", "three"])
+        np.testing.assert_allclose(second[0], first[1])
+        np.testing.assert_allclose(second[2], first[0])
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.stats()['misses'], 3)
+
+    def test_duplicates_in_a_batch_are_encoded_once(self):
+        cache, encoder = self.make_cache(), CountingEncoder()
+        vectors = cache.encode(["same", "same", "other"], encoder)
+        self.assertEqual(encoder.encoded, ["same", "other"])
+        np.testing.assert_allclose(vectors[0], vectors[1])
+
+    def test_entries_persist_across_instances(self):
+        self.make_cache().encode(["kept"], CountingEncoder())
+        encoder = CountingEncoder()
+        self.make_cache().encode(["kept"], encoder)
+        self.assertEqual(encoder.encoded, [])
+
+    def test_entries_are_keyed_by_model(self):
+        self.make_cache('model-a').encode(["text"], CountingEncoder())
+        encoder = CountingEncoder()
+        self.make_cache('model-b').encode(["text"], encoder)
+        self.assertEqual(encoder.encoded, ["text"])
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = self.make_cache(max_entries=2)
+        vector = np.ones(4, dtype=np.float32)
+        with mock.patch('documents.embedding_cache.time.time', side_effect=[1.0, 2.0, 3.0, 4.0]):
+            cache.store(["old"], [vector])
+            cache.store(["used"], [vector])
+            cache.lookup(["old"])
+            cache.store(["new"], [vector])
+        self.assertEqual(sorted(cache.lookup(["old", "used", "new"])), [0, 2])
+        self.assertEqual(cache.stats()['entries'], 2)
+
+    def test_many_texts_are_looked_up_in_batches(self):
+        cache = self.make_cache()
+        texts = [f"text {i}" for i in range(EmbeddingCache.LOOKUP_BATCH * 2 + 1)]
+        cache.store(texts, np.ones((len(texts), 4), dtype=np.float32))
+        self.assertEqual(len(cache.lookup(texts)), len(texts))
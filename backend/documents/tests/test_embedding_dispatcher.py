@@ -0,0 +1,94 @@
+import asyncio
+import threading
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from benchmarks.encoders import HashingEncoder
+from documents.embedding_dispatcher import EmbeddingDispatcher
+
+
+class RecordingEncoder(HashingEncoder):
+    """Records each batch; the first one blocks until released, so later callers queue up behind it"""
+
+    def __init__(self, fail=False):
+        super().__init__(dimension=16)
+        self.batches = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.fail = fail
+
+    def encode(self, texts, **kwargs):
+        self.batches.append(list(texts))
+        self.started.set()
+        self.release.wait(5)
+        if self.fail:
+            raise RuntimeError("encoder failed")
+        return super().encode(texts, **kwargs)
+
+
+class EmbeddingDispatcherTests(SimpleTestCase):
+    def make_dispatcher(self, encoder, **kwargs):
+        return EmbeddingDispatcher(lambda: encoder, **kwargs)
+
+    def test_each_caller_gets_its_own_rows(self):
+        encoder = RecordingEncoder()
+        encoder.release.set()
+        dispatcher = self.make_dispatcher(encoder)
+        vectors = dispatcher.encode(["first", "second"])
+        np.testing.assert_allclose(vectors, HashingEncoder(dimension=16).encode(["first", "second"]), rtol=1e-6)
+
+    def test_callers_queued_behind_a_batch_share_the_next_one(self):
+        encoder = RecordingEncoder()
+        dispatcher = self.make_dispatcher(encoder, max_batch=8, max_wait=0.05)
+        first = dispatcher.submit(["blocking"])
+        encoder.started.wait(5)
+        futures = {text: dispatcher.submit([text]) for text in ("a", "b", "c")}
+        encoder.release.set()
+
+        expected = HashingEncoder(dimension=16)
+        for text, future in futures.items():
+            np.testing.assert_allclose(future.result(5)[0], expected.encode([text])[0], rtol=1e-6)
+        first.result(5)
+        self.assertEqual(encoder.batches, [["blocking"], ["a", "b", "c"]])
+        self.assertEqual(dispatcher.stats()['batches'], 2)
+
+    def test_batches_stay_within_max_batch(self):
+        encoder = RecordingEncoder()
+        dispatcher = self.make_dispatcher(encoder, max_batch=2, max_wait=0)
+        dispatcher.submit(["blocking"])
+        encoder.started.wait(5)
+        futures = [dispatcher.submit([f"text {i}"]) for i in range(5)]
+        encoder.release.set()
+        for future in futures:
+            future.result(5)
+        self.assertTrue(all(len(batch) <= 2 for batch in encoder.batches))
+        self.assertEqual(sum(len(batch) for batch in encoder.batches), 6)
+
+    def test_encoder_errors_reach_every_caller_of_the_batch(self):
+        encoder = RecordingEncoder(fail=True)
+        encoder.release.set()
+        dispatcher = self.make_dispatcher(encoder)
+        with self.assertRaises(RuntimeError):
+            dispatcher.encode(["question"])
+        with self.assertRaises(RuntimeError):
+            dispatcher.encode(["again"])
+
+    def test_cancelled_requests_are_not_encoded(self):
+        encoder = RecordingEncoder()
+        dispatcher = self.make_dispatcher(encoder, max_wait=0)
+        dispatcher.submit(["blocking"])
+        encoder.started.wait(5)
+        dispatcher.submit(["cancelled"]).cancel()
+        kept = dispatcher.submit(["kept"])
+        encoder.release.set()
+        kept.result(5)
+        self.assertNotIn("cancelled", [text for batch in encoder.batches for text in batch])
+
+    def test_empty_input_and_aencode(self):
+        encoder = RecordingEncoder()
+        encoder.release.set()
+        dispatcher = self.make_dispatcher(encoder)
+        self.assertEqual(dispatcher.encode([]).shape, (0, 0))
+        vectors = asyncio.run(dispatcher.aencode(["async question"]))
+        self.assertEqual(vectors.shape, (1, 16))
@@ -0,0 +1,92 @@
+import os
+
+from django.test import SimpleTestCase
+
+from documents import extractors
+from documents.extractors import DocxExtractor, PdfExtractor, TextExtractor, get_extractor, iter_file_chunks
+from documents.pipeline import CharChunker, IngestionError
+
+from .support import RAGTestMixin
+
+
+def write_pdf(path, pages):
+    """Write a minimal PDF with one line of text per page"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>",
+               "<< /Type /Pages /Kids [%s] /Count %d >>" % (
+                   " ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages))), len(pages)),
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    for i, text in enumerate(pages):
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += f"{number} 0 obj\n{body}\nendobj\n".encode('latin-1')
+    xref = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('latin-1')
+    data += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode('latin-1')
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode('latin-1')
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+class ExtractorTests(RAGTestMixin, SimpleTestCase):
+    def path(self, name):
+        return os.path.join(self.data_dir, name)
+
+    def write_text(self, name, text):
+        with open(self.path(name), 'w', encoding='utf-8') as f:
+            f.write(text)
+        return self.path(name)
+
+    def test_extractor_is_picked_by_suffix(self):
+        self.assertIsInstance(get_extractor('a.txt'), TextExtractor)
+        self.assertIsInstance(get_extractor('a.PDF'), PdfExtractor)
+        self.assertIsInstance(get_extractor('a.docx'), DocxExtractor)
+        self.assertEqual(get_extractor('a.md').errors, 'ignore')
+
+    def test_text_is_streamed_in_blocks(self):
+        path = self.write_text('a.txt', "x" * 2500)
+        progress = []
+        segments = list(TextExtractor(block_size=1000).iter_segments(path, progress=progress.append))
+        self.assertEqual([len(text) for _, text in segments], [1000, 1000, 500])
+        self.assertEqual({page for page, _ in segments}, {None})
+        self.assertEqual(progress[-1], 1.0)
+
+    def test_undecodable_text_is_an_ingestion_error(self):
+        with open(self.path('a.txt'), 'wb') as f:
+            f.write(b"\xff\xfe\xfa")
+        with self.assertRaises(IngestionError):
+            list(TextExtractor().iter_segments(self.path('a.txt')))
+
+    def test_pdf_pages_are_numbered(self):
+        write_pdf(self.path('a.pdf'), ["First page", "Second page"])
+        segments = list(PdfExtractor(workers=1).iter_segments(self.path('a.pdf')))
+        self.assertEqual([page for page, _ in segments], [1, 2])
+        self.assertIn("Second page", segments[1][1])
+
+    def test_parallel_pdf_extraction_keeps_page_order_and_reuses_its_pool(self):
+        write_pdf(self.path('a.pdf'), [f"Page number {i}" for i in range(1, 8)])
+        extractor = PdfExtractor(workers=2, parallel_min_pages=1, pages_per_task=2)
+        serial = list(PdfExtractor(workers=1).iter_segments(self.path('a.pdf')))
+
+        self.assertEqual(list(extractor.iter_segments(self.path('a.pdf'))), serial)
+        pool = extractors._pdf_pools[2]
+        self.assertEqual(pool._mp_context.get_start_method(), 'spawn')
+        self.assertEqual(list(extractor.iter_segments(self.path('a.pdf'))), serial)
+        self.assertIs(extractors._pdf_pools[2], pool)
+
+    def test_chunks_carry_their_page_and_offset(self):
+        write_pdf(self.path('a.pdf'), ["Alpha text.", "Beta text."])
+        chunks = list(iter_file_chunks(self.path('a.pdf'), CharChunker, extractor=PdfExtractor(workers=1)))
+        self.assertEqual([page for _, page, _ in chunks], [1])
+        self.assertEqual(chunks[0][2], 0)
+
+    def test_bad_pdf_is_an_ingestion_error(self):
+        path = self.write_text('a.pdf', "not a pdf")
+        with self.assertRaises(IngestionError):
+            list(PdfExtractor(workers=1).iter_segments(path))
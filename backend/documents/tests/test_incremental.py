@@ -0,0 +1,65 @@
+import re
+
+from django.core.files.storage import default_storage
+from django.test import TestCase
+
+from .support import RAGTestMixin
+
+
+def section(topic):
+    """A paragraph of roughly one chunk about topic"""
+    return " ".join(f"The {topic} section covers point {number} in detail." for number in range(8))
+
+
+class IncrementalIngestionTests(RAGTestMixin, TestCase):
+    rag_settings = {'CHUNKER': 'chars', 'ROUTING_ENABLED': False}
+
+    def setUp(self):
+        super().setUp()
+        self.engine = self.make_engine()
+        self.topics = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta']
+        self.document = self.ingest(self.engine, self.text(self.topics))
+
+    @staticmethod
+    def text(topics):
+        return "\n\n".join(section(topic) for topic in topics)
+
+    def reingest(self, topics):
+        """Rewrite the document file and process it again; returns the outcome counts"""
+        with open(default_storage.path(self.document.file_path), 'w') as f:
+            f.write(self.text(topics))
+        success, message = self.engine.process_document(self.document.id,
+                                                         default_storage.path(self.document.file_path))
+        self.assertTrue(success, message)
+        counts = re.search(r"\((\d+) embedded, (\d+) reused, (\d+) unchanged, (\d+) removed\)", message)
+        return dict(zip(('embedded', 'reused', 'unchanged', 'removed'), map(int, counts.groups())))
+
+    def stored(self):
+        return self.engine.store.get(where={"document_id": str(self.document.id)}, include=['documents'])
+
+    def test_unchanged_file_embeds_nothing(self):
+        counts = self.reingest(self.topics)
+        self.assertEqual(counts['embedded'], 0)
+        self.assertEqual(counts['reused'], 0)
+        self.assertEqual(counts['removed'], 0)
+        self.assertEqual(counts['unchanged'], len(self.stored()['ids']))
+
+    def test_edit_embeds_only_the_changed_content(self):
+        before = len(self.stored()['ids'])
+        counts = self.reingest(['alpha', 'beta', 'gamma', 'omega', 'epsilon', 'zeta'])
+        self.assertGreater(counts['embedded'], 0)
+        self.assertLess(counts['embedded'], before)
+        self.assertTrue(any('omega' in chunk for chunk in self.stored()['documents']))
+        self.assertFalse(any('delta' in chunk for chunk in self.stored()['documents']))
+
+    def test_shifted_content_reuses_stored_embeddings(self):
+        counts = self.reingest(['intro'] + self.topics)
+        self.assertGreater(counts['reused'], 0)
+
+    def test_shorter_file_removes_trailing_chunks(self):
+        before = len(self.stored()['ids'])
+        counts = self.reingest(self.topics[:2])
+        after = len(self.stored()['ids'])
+        self.assertEqual(counts['removed'], before - after)
+        self.assertGreater(counts['removed'], 0)
+        self.assertEqual(self.engine.document_index.count(self.document.id), after)
@@ -0,0 +1,122 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
+
+from documents.ingestion import IngestionQueue, QueueFull
+from documents.models import Document, DocumentChunk
+from documents.views import reprocess_document
+
+from .support import RAGTestMixin, paragraphs
+
+
+class IngestionQueueTests(RAGTestMixin, TestCase):
+    def make_document(self, status='pending', age=0, **fields):
+        document = Document.objects.create(title='doc.txt', file_path='doc.txt', file_type='txt', file_size=1,
+                                           processing_status=status, **fields)
+        if age:
+            Document.objects.filter(id=document.id).update(updated_at=timezone.now() - timedelta(seconds=age))
+        return document
+
+    def make_queue(self, **kwargs):
+        queue = IngestionQueue(self.make_engine(), **{'stale_after': 60, **kwargs})
+        self.addCleanup(queue._executor.shutdown, wait=False)
+        return queue
+
+    def test_sweep_requeues_jobs_abandoned_by_a_crashed_process(self):
+        abandoned = self.make_document('processing', age=120)
+        queue = self.make_queue()
+        with mock.patch.object(queue, 'submit', return_value=True) as submit:
+            queue.sweep()
+        abandoned.refresh_from_db()
+        self.assertEqual(abandoned.processing_status, 'pending')
+        submit.assert_called_once_with(abandoned.id)
+
+    def test_job_interrupted_just_before_a_restart_is_requeued_by_a_later_sweep(self):
+        interrupted = self.make_document('processing', age=5)
+        queue = self.make_queue()
+        with mock.patch.object(queue, 'submit', return_value=True):
+            queue.recover()
+            interrupted.refresh_from_db()
+            self.assertEqual(interrupted.processing_status, 'processing')
+
+            # No process refreshes it any more, so it goes stale
+            Document.objects.filter(id=interrupted.id).update(updated_at=timezone.now() - timedelta(seconds=120))
+            queue.sweep()
+        interrupted.refresh_from_db()
+        self.assertEqual(interrupted.processing_status, 'pending')
+
+    def test_sweep_refreshes_jobs_running_in_this_process(self):
+        running = self.make_document('processing', age=120)
+        queue = self.make_queue()
+        queue._active.add(running.id)
+        with mock.patch.object(queue, 'submit', return_value=True):
+            queue.sweep()
+        running.refresh_from_db()
+        self.assertEqual(running.processing_status, 'processing')
+        self.assertGreater(running.updated_at, timezone.now() - timedelta(seconds=60))
+
+    def test_reject_policy_raises_when_full(self):
+        queue = self.make_queue(max_queued=1, policy='reject')
+        with mock.patch.object(queue._executor, 'submit'):
+            self.assertTrue(queue.submit(1))
+            self.assertTrue(queue.submit(1))  # Already queued
+            with self.assertRaises(QueueFull):
+                queue.submit(2)
+
+    def test_queue_policy_defers_when_full(self):
+        queue = self.make_queue(max_queued=1, policy='queue')
+        with mock.patch.object(queue._executor, 'submit'):
+            self.assertTrue(queue.submit(1))
+            self.assertFalse(queue.submit(2))
+        self.assertTrue(queue.is_full())
+
+    def test_process_ingests_a_pending_document(self):
+        queue = self.make_queue()
+        path, _ = self.save_file('report.txt', paragraphs('harbour'))
+        document = Document.objects.create(title='report.txt', file_path=path, file_type='txt', file_size=1)
+        queue._process(document.id)
+        document.refresh_from_db()
+        self.assertEqual(document.processing_status, 'completed', document.status_message)
+        self.assertEqual(document.progress, 100)
+        self.assertGreater(DocumentChunk.objects.filter(document=document).count(), 0)
+
+    def test_process_leaves_jobs_claimed_elsewhere_alone(self):
+        queue = self.make_queue()
+        document = self.make_document('processing')
+        with mock.patch.object(queue.engine, 'process_document') as process:
+            queue._process(document.id)
+        process.assert_not_called()
+
+    def test_process_reports_failures(self):
+        queue = self.make_queue()
+        document = self.make_document('pending')
+        queue._process(document.id)  # Its file does not exist
+        document.refresh_from_db()
+        self.assertEqual(document.processing_status, 'failed')
+        self.assertIn('File not found', document.status_message)
+
+
+    def reprocess(self, document_id, queue):
+        request = RequestFactory().post(f'/api/documents/{document_id}/reprocess/')
+        with mock.patch('documents.views.get_ingestion_queue', return_value=queue):
+            return reprocess_document(request, document_id)
+
+    def test_reprocess_goes_through_the_queue(self):
+        document = self.make_document('completed', progress=100)
+        queue = self.make_queue()
+        with mock.patch.object(queue, 'submit', return_value=True) as submit:
+            response = self.reprocess(document.id, queue)
+        self.assertEqual(response.status_code, 202)
+        submit.assert_called_once_with(document.id)
+        document.refresh_from_db()
+        self.assertEqual((document.processing_status, document.progress), ('pending', 0))
+
+    def test_reprocess_refuses_documents_being_processed(self):
+        document = self.make_document('processing')
+        queue = self.make_queue()
+        with mock.patch.object(queue, 'submit') as submit:
+            self.assertEqual(self.reprocess(document.id, queue).status_code, 409)
+            self.assertEqual(self.reprocess(99999, queue).status_code, 404)
+        submit.assert_not_called()
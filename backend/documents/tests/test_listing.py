@@ -0,0 +1,112 @@
+from collections import Counter
+
+from django.db.models import Count
+from django.test import TestCase
+
+from documents.models import DOCUMENT_STATUSES, Document, DocumentCounter
+
+
+def create_documents(count, status='completed', prefix='doc'):
+    return [Document.objects.create(title=f"{prefix} {i}", file_path=f"{prefix}_{i}.txt", file_type='txt',
+                                    file_size=10, processing_status=status) for i in range(count)]
+
+
+class DocumentListingTests(TestCase):
+    def list(self, **params):
+        return self.client.get('/api/documents/', params)
+
+    def test_cursor_pages_cover_every_document_once(self):
+        documents = create_documents(7)
+        ids, params, pages = [], {'limit': 3}, 0
+        while True:
+            response = self.list(**params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['X-Total-Count'], '7')
+            ids.extend(row['id'] for row in response.json())
+            pages += 1
+            if 'X-Next-Cursor' not in response:
+                break
+            self.assertIn('rel="next"', response['Link'])
+            params = {'limit': 3, 'cursor': response['X-Next-Cursor']}
+
+        self.assertEqual(pages, 3)
+        expected = sorted(documents, key=lambda document: (document.created_at, document.id), reverse=True)
+        self.assertEqual(ids, [document.id for document in expected])
+
+        ascending = [row['id'] for row in self.list(order='asc', limit=10).json()]
+        self.assertEqual(ascending, ids[::-1])
+
+    def test_status_filter_fields_and_total(self):
+        create_documents(2, status='completed')
+        create_documents(3, status='failed', prefix='broken')
+        response = self.list(status='failed', fields='id,title,processing_status')
+        self.assertEqual(response['X-Total-Count'], '3')
+        self.assertEqual({row['processing_status'] for row in response.json()}, {'failed'})
+        self.assertEqual(set(response.json()[0]), {'id', 'title', 'processing_status'})
+        self.assertEqual(set(self.list().json()[0]), {'id', 'title', 'file_type', 'created_at'})
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.list(fields='id,secret').status_code, 400)
+        self.assertEqual(self.list(status='lost').status_code, 400)
+        self.assertEqual(self.list(limit='many').status_code, 400)
+        self.assertEqual(self.list(cursor='not-a-cursor').status_code, 400)
+
+    def test_etag_holds_until_a_document_changes(self):
+        document = create_documents(2)[0]
+        etag = self.list()['ETag']
+        self.assertEqual(self.client.get('/api/documents/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertNotEqual(self.list(limit=1)['ETag'], etag)
+
+        Document.objects.filter(id=document.id).update(title='Renamed')
+        response = self.client.get('/api/documents/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_status_endpoint_etag_follows_updated_at(self):
+        document = create_documents(1, status='processing')[0]
+        url = f'/api/documents/{document.id}/status/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Document.objects.filter(id=document.id).update(processing_status='completed', progress=100)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'completed')
+
+
+class DocumentCounterTests(TestCase):
+    def assertCountsExact(self):
+        actual = Counter(dict(Document.objects.values_list('processing_status').annotate(n=Count('id')).order_by()))
+        self.assertEqual(DocumentCounter.status_counts(), {status: actual[status] for status in DOCUMENT_STATUSES})
+
+    def test_counts_follow_every_kind_of_write(self):
+        version = DocumentCounter.version()
+        documents = create_documents(3, status='pending')
+        self.assertCountsExact()
+
+        documents[0].processing_status = 'processing'
+        documents[0].save()
+        self.assertCountsExact()
+
+        Document.objects.filter(id__in=[document.id for document in documents]).update(processing_status='completed')
+        self.assertCountsExact()
+
+        Document.objects.bulk_create([Document(title='bulk', file_path='bulk.txt', file_type='txt', file_size=1,
+                                               processing_status='failed')])
+        self.assertCountsExact()
+
+        documents[1].delete()
+        Document.objects.filter(processing_status='failed').delete()
+        self.assertCountsExact()
+        self.assertGreater(DocumentCounter.version(), version)
+
+    def test_updates_that_match_nothing_keep_the_version(self):
+        create_documents(1)
+        version = DocumentCounter.version()
+        Document.objects.filter(processing_status='failed').update(progress=0)
+        self.assertEqual(DocumentCounter.version(), version)
+
+    def test_reconcile_repairs_drifted_counts(self):
+        create_documents(2)
+        DocumentCounter.objects.filter(key=DocumentCounter.status_key('completed')).update(value=99)
+        DocumentCounter.reconcile()
+        self.assertCountsExact()
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import SimpleTestCase
+
+from benchmarks.fake_ollama import FakeOllama
+from documents.llm_client import FairSemaphore, LLMTimeout, LLMUnavailable, OllamaClient
+
+
+class OllamaClientTests(SimpleTestCase):
+    def start_fake(self, **kwargs):
+        fake = FakeOllama(port=0, **{'tokens_per_second': 0, 'first_token_ms': 0, 'response_tokens': 4, **kwargs})
+        fake.start()
+        self.addCleanup(fake.stop)
+        return fake
+
+    def make_client(self, fake, **kwargs):
+        return OllamaClient(fake.url if fake else 'http://127.0.0.1:9', 'fake', **kwargs)
+
+    def test_generate_returns_the_answer_and_records_usage(self):
+        fake = self.start_fake()
+        client = self.make_client(fake)
+        self.assertEqual(client.generate("Why?"), "".join(fake._tokens()))
+        stats = client.stats()
+        self.assertEqual(stats['generations'], 1)
+        self.assertEqual(stats['completion_tokens'], 4)
+
+    def test_stream_yields_tokens(self):
+        fake = self.start_fake()
+        self.assertEqual(list(self.make_client(fake).stream("Why?")), fake._tokens())
+
+    def test_in_flight_generations_are_limited(self):
+        fake = self.start_fake(first_token_ms=50, parallel=8)
+        client = self.make_client(fake, max_in_flight=2)
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            answers = list(pool.map(lambda i: client.generate(f"Question {i}"), range(6)))
+        self.assertEqual(len(answers), 6)
+        self.assertEqual(fake.generations, 6)
+        self.assertLessEqual(fake.peak_active, 2)
+
+    def test_identical_concurrent_requests_share_one_generation(self):
+        fake = self.start_fake(first_token_ms=500)
+        client = self.make_client(fake, max_in_flight=4)
+        ready = threading.Barrier(4)
+
+        def ask(_):
+            ready.wait()
+            return client.generate("Same question")
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            answers = set(pool.map(ask, range(4)))
+        self.assertEqual(len(answers), 1)
+        self.assertEqual(fake.generations, 1)
+
+    def test_waiting_for_a_slot_counts_against_the_deadline(self):
+        fake = self.start_fake(first_token_ms=500)
+        client = self.make_client(fake, max_in_flight=1)
+        first = threading.Thread(target=client.generate, args=("Slow question",))
+        first.start()
+        self.addCleanup(first.join)
+        while client._slots._value:
+            pass  # Until the first request holds the slot
+        with self.assertRaises(LLMTimeout):
+            client.generate("Another question", timeout=0.1)
+
+    def test_a_follower_outlives_a_leader_with_a_shorter_deadline(self):
+        fake = self.start_fake(first_token_ms=300)
+        client = self.make_client(fake)
+        leader = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(leader.shutdown)
+        short = leader.submit(client.generate, "Same question", timeout=0.1)
+        while not client._calls:
+            pass  # Until the short request leads the call
+        self.assertEqual(client.generate("Same question", timeout=5), "".join(fake._tokens()))
+        with self.assertRaises(LLMTimeout):
+            short.result()
+
+    def test_unreachable_server(self):
+        with self.assertRaises(LLMUnavailable):
+            self.make_client(None, connect_timeout=1).generate("Why?")
+
+    def test_agenerate_shares_identical_calls(self):
+        fake = self.start_fake(first_token_ms=200)
+        client = self.make_client(fake)
+
+        async def ask():
+            return await asyncio.gather(*(client.agenerate("Same question") for _ in range(3)))
+
+        self.assertEqual(len(set(asyncio.run(ask()))), 1)
+        self.assertEqual(fake.generations, 1)
+
+    def test_agenerate_follower_outlives_a_leader_with_a_shorter_deadline(self):
+        fake = self.start_fake(first_token_ms=300)
+        client = self.make_client(fake)
+
+        async def ask():
+            client._async_state()  # Creating the httpx client must not eat into the short deadline
+            short = asyncio.ensure_future(client.agenerate("Same question", timeout=0.1))
+            await asyncio.sleep(0)
+            self.assertTrue(client._async_state().calls)
+            return await asyncio.gather(short, client.agenerate("Same question", timeout=5), return_exceptions=True)
+
+        short, long = asyncio.run(ask())
+        self.assertIsInstance(short, LLMTimeout)
+        self.assertEqual(long, "".join(fake._tokens()))
+
+    def test_astream_yields_tokens(self):
+        fake = self.start_fake()
+        client = self.make_client(fake)
+
+        async def collect():
+            return [token async for token in client.astream("Why?")]
+
+        self.assertEqual(asyncio.run(collect()), fake._tokens())
+
+
+class FairSemaphoreTests(SimpleTestCase):
+    def test_slots_are_granted_in_arrival_order(self):
+        semaphore = FairSemaphore(1)
+        semaphore.acquire()
+        order = []
+        threads = []
+        for i in range(3):
+            thread = threading.Thread(target=lambda i=i: (semaphore.acquire(), order.append(i), semaphore.release()))
+            thread.start()
+            threads.append(thread)
+            while semaphore.waiting < i + 1:
+                pass
+        semaphore.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [0, 1, 2])
+
+    def test_acquire_times_out(self):
+        semaphore = FairSemaphore(1)
+        semaphore.acquire()
+        self.assertFalse(semaphore.acquire(timeout=0.01))
+        self.assertEqual(semaphore.waiting, 0)
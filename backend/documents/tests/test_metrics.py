@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import threading
+from unittest import mock
+
+from asgiref.sync import iscoroutinefunction
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.base import BaseHandler
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase
+
+from documents.metrics import (HTTP_REQUEST_SECONDS, STAGE_SECONDS, MetricsMiddleware, MetricsRegistry,
+                               SampledFilter, collect_timings, propagate, span, timed_iter)
+
+from .support import RAGTestMixin, paragraphs
+
+
+class FakeClock:
+    """Stands in for time.perf_counter; advance() moves it forward"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class RenderTests(SimpleTestCase):
+    def test_counters_and_histograms_render_in_prometheus_format(self):
+        registry = MetricsRegistry()
+        counter = registry.counter('test_total', 'A counter', ('kind',))
+        histogram = registry.histogram('test_seconds', 'A histogram', buckets=(0.1, 1.0))
+        counter.inc(2, kind='a "quoted"\nvalue')
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        self.assertEqual(registry.render().splitlines(), [
+            '# HELP test_total A counter',
+            '# TYPE test_total counter',
+            'test_total{kind="a \\"quoted\\"\\nvalue"} 2',
+            '# HELP test_seconds A histogram',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{le="0.1"} 1',
+            'test_seconds_bucket{le="1.0"} 2',
+            'test_seconds_bucket{le="+Inf"} 3',
+            'test_seconds_sum 5.55',
+            'test_seconds_count 3',
+        ])
+
+
+@mock.patch('documents.metrics.time.perf_counter', new_callable=FakeClock)
+class SpanTests(SimpleTestCase):
+    def test_nested_spans_report_exclusive_time(self, clock):
+        with collect_timings() as timings:
+            with span('outer'):
+                clock.advance(1)
+                with span('inner'):
+                    clock.advance(2)
+                clock.advance(0.5)
+        self.assertEqual(timings.stages, {'outer': 1.5, 'inner': 2})
+
+    def test_timed_iter_excludes_the_consumer(self, clock):
+        def produce():
+            for item in range(3):
+                clock.advance(0.25)
+                yield item
+
+        with collect_timings() as timings:
+            for _ in timed_iter(produce(), 'produce'):
+                clock.advance(10)  # The consumer's work is not the producer's
+        self.assertEqual(timings.stages, {'produce': 0.75})
+
+    def test_failures_count_as_errors_and_still_time_the_stage(self, clock):
+        from documents.metrics import ERRORS
+
+        errors = ERRORS.value(stage='failing')
+        count = STAGE_SECONDS.totals().get(('failing',), (0, 0))[1]
+        with self.assertRaises(ValueError), span('failing'):
+            raise ValueError
+        self.assertEqual(ERRORS.value(stage='failing'), errors + 1)
+        self.assertEqual(STAGE_SECONDS.totals()[('failing',)][1], count + 1)
+
+    def test_propagate_reports_into_the_callers_timings(self, clock):
+        def work():
+            with span('threaded'):
+                clock.advance(1)
+
+        with collect_timings() as timings, span('caller'):
+            thread = threading.Thread(target=propagate(work))
+            thread.start()
+            thread.join()
+        self.assertEqual(timings.stages['threaded'], 1)
+
+    def test_disabled_collection_yields_none(self, clock):
+        with collect_timings(enabled=False) as timings:
+            with span('anything'):
+                clock.advance(1)
+        self.assertIsNone(timings)
+
+
+class SampledFilterTests(SimpleTestCase):
+    def record(self, level):
+        return logging.LogRecord('documents', level, __file__, 1, 'message', (), None)
+
+    def test_warnings_always_pass_and_debug_is_sampled(self):
+        dropped = SampledFilter(rate=0)
+        self.assertTrue(dropped.filter(self.record(logging.WARNING)))
+        self.assertFalse(dropped.filter(self.record(logging.DEBUG)))
+        self.assertTrue(SampledFilter(rate=1).filter(self.record(logging.INFO)))
+        with mock.patch('documents.metrics.random.random', return_value=0.2):
+            self.assertTrue(SampledFilter(rate=0.5).filter(self.record(logging.INFO)))
+            self.assertFalse(SampledFilter(rate=0.1).filter(self.record(logging.INFO)))
+
+
+class MetricsEndpointTests(RAGTestMixin, TestCase):
+    rag_settings = {'CONFIDENCE_GATING_ENABLED': False}
+
+    def test_requests_are_labelled_by_route(self):
+        key = ('api/documents/<int:document_id>/status/', 'GET', '404')
+        before = HTTP_REQUEST_SECONDS.totals().get(key, (0, 0))[1]
+        self.client.get('/api/documents/12345/status/')
+        self.assertEqual(HTTP_REQUEST_SECONDS.totals()[key][1], before + 1)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('docintell_http_request_seconds_count{route="api/documents/<int:document_id>/status/",'
+                      'method="GET",status="404"}', response.content.decode())
+
+    def test_query_returns_timings_when_asked(self):
+        self.start_fake_ollama()
+        engine = self.use_engine(self.make_engine())
+        document = self.ingest(engine, paragraphs('river'), name='river.txt')
+        response = self.client.post('/api/documents/query/', {
+            'question': 'What does the river report describe?', 'document_id': document.id, 'timings': True,
+        }, content_type='application/json')
+        timings = response.json()['timings']
+        for stage in ('embed', 'retrieve', 'prompt_build', 'llm_generate'):
+            self.assertIn(f'{stage}_ms', timings)
+        self.assertGreaterEqual(timings['total_ms'], sum(value for name, value in timings.items()
+                                                         if name != 'total_ms') - 1)
+
+        plain = self.client.post('/api/documents/query/', {'question': 'Another question?'},
+                                 content_type='application/json')
+        self.assertNotIn('timings', plain.json())
+
+
+class AsyncMiddlewareTests(TestCase):
+    def test_async_handlers_are_awaited_without_adaptation(self):
+        async def view(request):
+            return HttpResponse(status=201)
+
+        middleware = MetricsMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        self.assertFalse(iscoroutinefunction(MetricsMiddleware(lambda request: HttpResponse())))
+
+        before = HTTP_REQUEST_SECONDS.totals().get(('unmatched', 'GET', '201'), (0, 0))[1]
+        response = asyncio.run(middleware(RequestFactory().get('/anywhere')))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(HTTP_REQUEST_SECONDS.totals()[('unmatched', 'GET', '201')][1], before + 1)
+
+    def test_asgi_handler_keeps_the_middleware_async(self):
+        with mock.patch.object(BaseHandler, 'adapt_method_mode', autospec=True,
+                               side_effect=BaseHandler.adapt_method_mode) as adapt:
+            ASGIHandler()
+        calls = [call for call in adapt.call_args_list
+                 if call.kwargs.get('name') == 'middleware documents.metrics.MetricsMiddleware']
+        self.assertEqual(len(calls), 1)
+        is_async, handler_is_async = calls[0].args[1], calls[0].args[3]
+        self.assertTrue(is_async)
+        self.assertTrue(handler_is_async)
+
+    async def test_async_views_are_labelled_by_route(self):
+        key = ('api/async/documents/<int:document_id>/status/', 'GET', '404')
+        before = HTTP_REQUEST_SECONDS.totals().get(key, (0, 0))[1]
+        response = await self.async_client.get('/api/async/documents/12345/status/')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(HTTP_REQUEST_SECONDS.totals()[key][1], before + 1)
@@ -0,0 +1,147 @@
+import random
+import re
+
+from django.core.files.storage import default_storage
+from django.test import SimpleTestCase, TestCase
+
+from documents.models import DocumentChunk
+from documents.pipeline import CharChunker, PageMap, TokenChunker, batched, iter_chunks, iter_section_pieces
+
+from .support import RAGTestMixin, paragraphs
+
+
+def feed_in_pieces(text, size, chunk_size=120):
+    chunker = CharChunker(chunk_size)
+    chunks = []
+    for start in range(0, len(text), size):
+        chunks.extend(chunker.feed(text[start:start + size]))
+    return chunks + chunker.finish()
+
+
+class WhitespaceTokenizer:
+    """Stands in for a fast tokenizer: one token per whitespace-separated word"""
+
+    def __call__(self, texts, add_special_tokens=False, return_offsets_mapping=False):
+        if isinstance(texts, str):
+            return {'offset_mapping': [match.span() for match in re.finditer(r'\S+', texts)]}
+        return {'input_ids': [text.split() for text in texts]}
+
+
+def token_chunks(text, pieces=1, **kwargs):
+    chunker = TokenChunker(WhitespaceTokenizer(), **kwargs)
+    size = -(-len(text) // pieces)
+    chunks = []
+    for start in range(0, len(text), size):
+        chunks.extend(chunker.feed(text[start:start + size]))
+    return chunks + chunker.finish()
+
+
+class PipelineTests(SimpleTestCase):
+    text = paragraphs('harbour', count=12, sentences=5)
+
+    def test_char_chunker_output_does_not_depend_on_piece_size(self):
+        whole = feed_in_pieces(self.text, len(self.text))
+        self.assertGreater(len(whole), 3)
+        for size in (1, 7, 64, 1000):
+            self.assertEqual(feed_in_pieces(self.text, size), whole)
+
+    def test_char_chunker_offsets_point_into_the_text(self):
+        for offset, chunk in feed_in_pieces(self.text, 50):
+            self.assertEqual(self.text[offset:offset + len(chunk)], chunk)
+
+    def test_sections_do_not_depend_on_block_size(self):
+        def sections(size):
+            blocks = (self.text[start:start + size] for start in range(0, len(self.text), size))
+            joined, result = '', []
+            for text, ends_section in iter_section_pieces(blocks):
+                joined += text
+                if ends_section:
+                    result.append(joined)
+                    joined = ''
+            return result
+
+        whole = sections(len(self.text))
+        self.assertEqual(''.join(whole), self.text)
+        self.assertEqual(sections(13), whole)
+
+    def test_an_edit_only_rechunks_its_own_section(self):
+        def chunks(text):
+            return [chunk for _, chunk in iter_chunks(iter_section_pieces([text]), CharChunker)]
+
+        edited = self.text.replace("item 0 of", "item zero of", 1)
+        before, after = chunks(self.text), chunks(edited)
+        self.assertGreater(len(set(before) & set(after)), len(before) // 2)
+
+    def test_batched(self):
+        self.assertEqual(list(batched(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(batched([], 2)), [])
+
+    def test_page_map(self):
+        pages = PageMap()
+        pages.add(0, 1)
+        pages.add(100, 2)
+        self.assertEqual([pages.page_at(offset) for offset in (0, 99, 100, 500)], [1, 1, 2, 2])
+
+
+class TokenChunkerTests(SimpleTestCase):
+    def random_text(self, seed):
+        rng = random.Random(seed)
+        return " ".join(" ".join(f"w{rng.randrange(1000)}" for _ in range(rng.randint(1, 14))) + "."
+                        for _ in range(200))
+
+    def test_chunks_stay_within_the_token_budget(self):
+        for seed in range(20):
+            text = self.random_text(seed)
+            for pieces in (1, 9):
+                chunks = token_chunks(text, pieces, max_tokens=20, overlap_tokens=8)
+                self.assertTrue(chunks)
+                for offset, chunk in chunks:
+                    self.assertLessEqual(len(chunk.split()), 20, chunk)
+                    self.assertEqual(text[offset:offset + len(chunk)], chunk)
+
+    def test_chunks_cover_the_text_in_order(self):
+        text = self.random_text(1)
+        chunks = token_chunks(text, max_tokens=20, overlap_tokens=0)
+        self.assertEqual(" ".join(chunk for _, chunk in chunks), text)
+
+    def test_consecutive_chunks_share_trailing_sentences(self):
+        text = " ".join(f"Sentence {i} has five words." for i in range(10))
+        chunks = [chunk for _, chunk in token_chunks(text, max_tokens=12, overlap_tokens=5)]
+        self.assertEqual(chunks[0], "Sentence 0 has five words. Sentence 1 has five words.")
+        self.assertEqual(chunks[1], "Sentence 1 has five words. Sentence 2 has five words.")
+
+    def test_overlap_is_dropped_when_the_next_sentence_needs_the_room(self):
+        text = "One two three four five six. Seven eight nine. " + " ".join(["long"] * 18) + "."
+        chunks = [chunk for _, chunk in token_chunks(text, max_tokens=20, overlap_tokens=8)]
+        self.assertEqual(chunks, ["One two three four five six. Seven eight nine.", " ".join(["long"] * 18) + "."])
+
+    def test_long_sentences_are_split_on_token_boundaries(self):
+        text = " ".join(f"t{i}" for i in range(50)) + "."
+        chunks = [chunk.split() for _, chunk in token_chunks(text, max_tokens=20, overlap_tokens=0)]
+        self.assertEqual([len(chunk) for chunk in chunks], [20, 20, 10])
+
+
+class ProcessDocumentTests(RAGTestMixin, TestCase):
+    rag_settings = {'ROUTING_ENABLED': False}
+
+    def test_missing_file_fails(self):
+        engine = self.make_engine()
+        success, message = engine.process_document(1, '/nonexistent/file.txt')
+        self.assertFalse(success)
+        self.assertIn("File not found", message)
+
+    def test_emptied_file_removes_the_old_content(self):
+        engine = self.make_engine()
+        document = self.ingest(engine, paragraphs('glacier'))
+        self.assertTrue(DocumentChunk.objects.filter(document=document).exists())
+        engine.cache_answer("What about the glacier?", None, "Old answer", document.id)
+
+        full_path = default_storage.path(document.file_path)
+        open(full_path, 'w').close()
+        success, message = engine.process_document(document.id, full_path)
+
+        self.assertEqual((success, message), (False, "File is empty"))
+        self.assertEqual(engine.store.get(where={"document_id": str(document.id)}, include=[])['ids'], [])
+        self.assertEqual(engine.document_index.count(document.id), 0)
+        self.assertFalse(DocumentChunk.objects.filter(document=document).exists())
+        self.assertIsNone(engine.lookup_cached_answer("What about the glacier?", document.id)[0])
@@ -0,0 +1,97 @@
+import io
+import shutil
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from benchmarks.encoders import HashingEncoder
+from documents.management.commands import rebuild_vector_index
+from documents.models import DocumentChunk
+from documents.vector_store import LocalStore
+
+from .support import RAGTestMixin, paragraphs
+
+
+def hashing_encoder(model_name, threads):
+    rebuild_vector_index._worker['encoder'] = HashingEncoder()
+
+
+@mock.patch.object(rebuild_vector_index, '_init_encoder', hashing_encoder)
+class RebuildVectorIndexTests(RAGTestMixin, TestCase):
+    rag_settings = {'ROUTING_ENABLED': False, 'EMBEDDING_CACHE_ENABLED': False}
+
+    def setUp(self):
+        super().setUp()
+        self.engine = self.make_engine()
+        self.documents = [self.ingest(self.engine, paragraphs(topic), name=f'{topic}.txt')
+                          for topic in ('canyon', 'meadow')]
+        self.dim = self.engine.encoder.get_sentence_embedding_dimension()
+
+    def rebuild(self, **options):
+        out = io.StringIO()
+        call_command('rebuild_vector_index', target='local', workers=1, stdout=out, stderr=out, **options)
+        return out.getvalue()
+
+    def open_store(self):
+        return LocalStore(settings.LOCAL_VECTOR_STORE_PATH, dim=self.dim)
+
+    def snapshot(self, store):
+        page = store.get(include=['documents', 'metadatas'])
+        return sorted(zip(page['ids'], page['documents'],
+                          [metadata['content_hash'] for metadata in page['metadatas']]))
+
+    def test_ingestion_persists_a_row_per_stored_chunk(self):
+        rows = sorted(DocumentChunk.objects.values_list('embedding_id', 'chunk_text', 'content_hash'))
+        self.assertEqual(rows, self.snapshot(self.engine.store))
+
+    def test_lost_index_is_rebuilt_from_the_rows(self):
+        expected = self.snapshot(self.engine.store)
+        question = self.engine.encode_questions(["What does the canyon report describe?"]).tolist()
+        top = self.engine.store.query(question, n_results=3)['ids']
+        self.engine.store = None
+        shutil.rmtree(settings.LOCAL_VECTOR_STORE_PATH)
+
+        output = self.rebuild(batch_size=3)
+        self.assertIn(f"with {len(expected)} chunks of 2 documents", output)
+        store = self.open_store()
+        self.assertEqual(self.snapshot(store), expected)
+        self.assertEqual(store.query(question, n_results=3)['ids'], top)
+
+    def test_interrupted_rebuild_resumes_from_its_checkpoint(self):
+        expected = self.snapshot(self.engine.store)
+        upsert = LocalStore.upsert
+        calls = []
+
+        def failing_upsert(store, *args, **kwargs):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError("disk full")
+            return upsert(store, *args, **kwargs)
+
+        with mock.patch.object(LocalStore, 'upsert', failing_upsert), self.assertRaises(RuntimeError):
+            self.rebuild(batch_size=3)
+        self.rebuild(batch_size=3, resume=True)
+        self.assertEqual(self.snapshot(self.open_store()), expected)
+
+        with self.assertRaises(CommandError):
+            self.rebuild(resume=True)
+
+    def test_documents_without_rows_are_left_out(self):
+        DocumentChunk.objects.filter(document=self.documents[0]).delete()
+        output = self.rebuild()
+        self.assertIn("1 completed documents have no chunk rows", output)
+        self.assertEqual(self.open_store().count(), DocumentChunk.objects.count())
+
+    def test_documents_without_rows_can_be_seeded_from_the_index(self):
+        canyon = self.documents[0]
+        rows = sorted(DocumentChunk.objects.filter(document=canyon).values_list('chunk_index', 'content_hash'))
+        DocumentChunk.objects.filter(document=canyon).delete()
+        self.engine.store = None
+
+        self.assertIn("Seeded chunk rows of 1 documents", self.rebuild(seed_from_store=True))
+        self.assertEqual(sorted(DocumentChunk.objects.filter(document=canyon)
+                                .values_list('chunk_index', 'content_hash')), rows)
+        self.assertEqual(self.open_store().count(), DocumentChunk.objects.count())
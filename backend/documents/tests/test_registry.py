@@ -0,0 +1,70 @@
+import os
+from unittest import mock
+
+from django.apps import apps
+from django.test import SimpleTestCase, override_settings
+
+from documents import registry
+from documents.registry import is_server_process, should_warm_up
+
+
+@mock.patch.dict(os.environ, {}, clear=False)
+class ServerProcessTests(SimpleTestCase):
+    def setUp(self):
+        os.environ.pop('RAG_SERVER_PROCESS', None)
+        os.environ.pop('RUN_MAIN', None)
+
+    def test_servers(self):
+        self.assertTrue(is_server_process(['manage.py', 'runserver', '--noreload']))
+        self.assertTrue(is_server_process(['/venv/bin/gunicorn', 'backend.wsgi']))
+        self.assertTrue(is_server_process(['/venv/bin/uvicorn', 'backend.asgi:application']))
+        self.assertTrue(is_server_process(['/venv/lib/python3.11/site-packages/uvicorn/__main__.py', 'backend.asgi']))
+
+    def test_runserver_reloader_parent_is_not_a_server(self):
+        self.assertFalse(is_server_process(['manage.py', 'runserver']))
+        os.environ['RUN_MAIN'] = 'true'
+        self.assertTrue(is_server_process(['manage.py', 'runserver']))
+
+    def test_commands_tests_and_scripts_are_not_servers(self):
+        for argv in (['manage.py', 'test'], ['manage.py', 'migrate'], ['/venv/bin/pytest'],
+                     ['/venv/bin/celery', 'worker'], ['script.py'], ['-c'], []):
+            self.assertFalse(is_server_process(argv), argv)
+
+    def test_environment_flag_overrides_the_guess(self):
+        os.environ['RAG_SERVER_PROCESS'] = '1'
+        self.assertTrue(is_server_process(['script.py']))
+        os.environ['RAG_SERVER_PROCESS'] = '0'
+        self.assertFalse(is_server_process(['/venv/bin/gunicorn']))
+
+    def test_warm_up_needs_the_setting_and_a_server(self):
+        with override_settings(RAG_WARMUP=True):
+            self.assertTrue(should_warm_up(['/venv/bin/gunicorn']))
+            self.assertFalse(should_warm_up(['/venv/bin/celery', 'worker']))
+        with override_settings(RAG_WARMUP=False):
+            self.assertFalse(should_warm_up(['/venv/bin/gunicorn']))
+
+    @mock.patch('documents.registry.start_warm_up')
+    @mock.patch('documents.registry.start_ingestion')
+    def test_ready_starts_recovery_in_servers_without_warm_up(self, start_ingestion, start_warm_up):
+        config = apps.get_app_config('documents')
+        with override_settings(RAG_WARMUP=False), mock.patch('sys.argv', ['/venv/bin/gunicorn']):
+            config.ready()
+        start_ingestion.assert_called_once_with()
+        start_warm_up.assert_not_called()
+
+        start_ingestion.reset_mock()
+        with override_settings(RAG_WARMUP=True), mock.patch('sys.argv', ['manage.py', 'test']):
+            config.ready()
+        start_ingestion.assert_not_called()
+        start_warm_up.assert_not_called()
+
+    @mock.patch('documents.registry.start_warm_up')
+    @mock.patch('documents.registry.start_ingestion')
+    def test_forked_workers_start_over(self, start_ingestion, start_warm_up):
+        queue, engine = object(), registry._engine
+        with mock.patch.object(registry, '_ingestion_queue', queue):
+            registry._reset_after_fork()
+            self.assertIsNone(registry._ingestion_queue)
+        registry._engine = engine
+        start_ingestion.assert_called_once_with()
+        start_warm_up.assert_not_called()
@@ -0,0 +1,74 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from .support import RAGTestMixin, paragraphs
+
+
+class RetrievalTests(RAGTestMixin, TestCase):
+    rag_settings = {'ROUTING_ENABLED': False}
+
+    def setUp(self):
+        super().setUp()
+        self.engine = self.make_engine()
+
+    def count_queries(self):
+        query = mock.patch.object(self.engine.store, 'query', wraps=self.engine.store.query)
+        self.addCleanup(query.stop)
+        return query.start()
+
+    def test_empty_collection(self):
+        results, message = self.engine.retrieve("What is in the report?")
+        self.assertIsNone(results)
+        self.assertIn("No documents have been uploaded", message)
+
+    def test_blank_question(self):
+        self.assertEqual(self.engine.retrieve("   "), (None, "Please provide a valid question."))
+
+    def test_unknown_document_is_answered_from_the_index(self):
+        self.ingest(self.engine, paragraphs('river'))
+        query = self.count_queries()
+        results, message = self.engine.retrieve("river study", document_id=999)
+        self.assertIsNone(results)
+        self.assertIn("Document ID 999 not found", message)
+        query.assert_not_called()
+
+    def test_scoped_retrieval_is_one_vector_query(self):
+        river = self.ingest(self.engine, paragraphs('river'), name='river.txt')
+        self.ingest(self.engine, paragraphs('mountain'), name='mountain.txt')
+        query = self.count_queries()
+
+        results, message = self.engine.retrieve("river study item", document_id=river.id, n_results=3)
+
+        self.assertIsNone(message)
+        self.assertEqual(query.call_count, 1)
+        self.assertEqual(query.call_args.kwargs['where'], {'document_id': str(river.id)})
+        metadatas = results['metadatas'][0]
+        self.assertTrue(metadatas)
+        self.assertEqual({metadata['document_id'] for metadata in metadatas}, {str(river.id)})
+
+    def test_retrieve_batch_shares_one_query_per_scope(self):
+        river = self.ingest(self.engine, paragraphs('river'), name='river.txt')
+        self.ingest(self.engine, paragraphs('mountain'), name='mountain.txt')
+        query = self.count_queries()
+
+        outcomes = self.engine.retrieve_batch(
+            ["river item", "river study", "mountain item", ""], [river.id, river.id, None, None])
+
+        self.assertEqual(query.call_count, 2)
+        self.assertEqual([message for _, message in outcomes[:3]], [None, None, None])
+        self.assertEqual(outcomes[3], (None, "Please provide a valid question."))
+        for results, _ in outcomes[:2]:
+            self.assertEqual(len(results['ids']), 1)
+            self.assertEqual({metadata['document_id'] for metadata in results['metadatas'][0]}, {str(river.id)})
+
+    def test_scope_without_matches_suggests_searching_all_documents(self):
+        river = self.ingest(self.engine, paragraphs('river'), name='river.txt')
+        self.ingest(self.engine, paragraphs('mountain'), name='mountain.txt')
+        empty = {'ids': [[]], 'documents': [[]], 'metadatas': [[]], 'distances': [[]]}
+        full = self.engine.store.query
+        with mock.patch.object(self.engine.store, 'query',
+                               side_effect=lambda **kwargs: empty if kwargs.get('where') else full(**kwargs)):
+            results, message = self.engine.retrieve("mountain item", document_id=river.id)
+        self.assertIsNone(results)
+        self.assertIn(f"No relevant content found in document ID {river.id}", message)
@@ -0,0 +1,63 @@
+from django.test import SimpleTestCase, TestCase
+
+from documents.document_router import DocumentRouter
+from documents.metrics import ROUTED_QUERIES
+
+from .support import RAGTestMixin, paragraphs
+
+TOPICS = ('glacier', 'harbour', 'orchard', 'volcano', 'library', 'railway', 'vineyard', 'lighthouse',
+          'quarry', 'monastery')
+
+
+class RoutingDefaultTests(SimpleTestCase):
+    def test_routing_is_off_by_default(self):
+        self.assertIsNone(DocumentRouter.from_settings())
+
+
+class RoutedRecallTests(RAGTestMixin, TestCase):
+    """Routed against exact search over a fixed corpus of one document per topic"""
+    rag_settings = {'ROUTING_ENABLED': True, 'ROUTING_MIN_DOCUMENTS': 0, 'ROUTING_TOP_DOCUMENTS': 3}
+
+    def setUp(self):
+        super().setUp()
+        self.engine = self.make_engine()
+        self.documents = {topic: self.ingest(self.engine, paragraphs(topic), name=f'{topic}.txt')
+                          for topic in TOPICS}
+        questions = [f"What does the {topic} report say about item {i} of the {topic} study?"
+                     for topic in TOPICS for i in (2, 9)]
+        self.sources = [topic for topic in TOPICS for _ in (2, 9)]
+        self.embeddings = [vector.tolist() for vector in self.engine.encode_questions(questions)]
+
+    def exact(self, n_results):
+        return self.engine.store.query(query_embeddings=self.embeddings, n_results=n_results,
+                                       include=['metadatas'])
+
+    def test_routed_results_match_exact_search(self):
+        routed_before = ROUTED_QUERIES.value(path='routed')
+        routed = self.engine.search_all(self.embeddings, 3, include=('metadatas',))
+        exact = self.exact(3)
+        self.assertEqual(ROUTED_QUERIES.value(path='routed') - routed_before, len(self.embeddings))
+
+        recall = sum(len(set(routed_ids) & set(exact_ids)) / len(exact_ids)
+                     for routed_ids, exact_ids in zip(routed['ids'], exact['ids'])) / len(self.embeddings)
+        self.assertEqual(recall, 1.0)
+        for topic, metadatas in zip(self.sources, routed['metadatas']):
+            self.assertIn(str(self.documents[topic].id), {metadata['document_id'] for metadata in metadatas})
+
+    def test_each_question_is_routed_to_its_document(self):
+        for topic, documents in zip(self.sources, self.engine.router.route(self.embeddings)):
+            self.assertIn(str(self.documents[topic].id), documents)
+
+    def test_short_routed_results_fall_back_to_exact_search(self):
+        self.engine.router.top_documents = 1
+        total = self.engine.store.count()
+        fallback_before = ROUTED_QUERIES.value(path='fallback')
+        routed = self.engine.search_all(self.embeddings[:2], total, include=('metadatas',))
+        self.assertEqual(ROUTED_QUERIES.value(path='fallback') - fallback_before, 2)
+        self.assertEqual([sorted(ids) for ids in routed['ids']], [sorted(ids) for ids in self.exact(total)['ids'][:2]])
+
+    def test_small_collections_are_searched_flat(self):
+        self.engine.router.min_documents = len(TOPICS) + 1
+        flat_before = ROUTED_QUERIES.value(path='flat')
+        self.engine.search_all(self.embeddings, 3, include=('metadatas',))
+        self.assertEqual(ROUTED_QUERIES.value(path='flat') - flat_before, len(self.embeddings))
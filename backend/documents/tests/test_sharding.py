@@ -0,0 +1,110 @@
+import os
+
+import numpy as np
+from django.test import SimpleTestCase, TestCase
+
+from documents.models import Document, ShardAssignment
+from documents.sharding import ShardedStore, _restrict, _where_documents
+from documents.vector_store import LocalStore
+
+from .support import RAGTestMixin
+
+DIM = 8
+
+
+def chunk(document_id, index):
+    vector = np.random.default_rng(int(document_id) * 100 + index).standard_normal(DIM).astype(np.float32)
+    metadata = {'document_id': str(document_id), 'chunk_index': index, 'content_hash': f"{document_id}:{index}"}
+    return f"{document_id}_{index}", vector.tolist(), f"Chunk {index} of {document_id}", metadata
+
+
+class WhereFilterTests(SimpleTestCase):
+    def test_document_ids_are_found_in_filters(self):
+        self.assertIsNone(_where_documents(None))
+        self.assertIsNone(_where_documents({'chunk_index': 3}))
+        self.assertEqual(_where_documents({'document_id': 4}), ['4'])
+        self.assertEqual(_where_documents({'document_id': {'$in': [1, '2']}}), ['1', '2'])
+        self.assertEqual(_where_documents({'$and': [{'chunk_index': {'$gte': 2}}, {'document_id': {'$eq': 7}}]}),
+                         ['7'])
+
+    def test_restrict_narrows_only_the_document_condition(self):
+        self.assertEqual(_restrict({'document_id': {'$in': ['1', '2', '3']}}, ['2']), {'document_id': '2'})
+        self.assertEqual(_restrict({'document_id': {'$in': ['1', '2', '3']}}, ['1', '3']),
+                         {'document_id': {'$in': ['1', '3']}})
+        where = {'$and': [{'document_id': {'$in': ['1', '2']}}, {'chunk_index': {'$gte': 5}}]}
+        self.assertEqual(_restrict(where, ['1']), {'$and': [{'document_id': '1'}, {'chunk_index': {'$gte': 5}}]})
+
+
+class ShardedStoreTests(RAGTestMixin, TestCase):
+    def make_store(self, key='hash', count=3):
+        root = os.path.join(self.data_dir, 'index')
+        legacy = LocalStore(os.path.join(root, 'legacy'), dim=DIM)
+        return ShardedStore(lambda name: LocalStore(os.path.join(root, 'shards', name), dim=DIM),
+                            legacy, key=key, count=count, workers=2)
+
+    def fill(self, store, documents=range(1, 9), chunks=3):
+        for document_id in documents:
+            rows = [chunk(document_id, index) for index in range(chunks)]
+            store.upsert(*map(list, zip(*rows)))
+
+    def test_documents_spread_over_shards(self):
+        store = self.make_store()
+        self.fill(store)
+        self.assertGreater(len(set(ShardAssignment.objects.values_list('shard', flat=True))), 1)
+        self.assertEqual(store.count(), 24)
+
+    def test_get_pages_with_offset_and_limit_across_shards(self):
+        store = self.make_store()
+        self.fill(store)
+        everything = store.get(include=[])['ids']
+        self.assertEqual(sorted(everything), sorted(f"{d}_{i}" for d in range(1, 9) for i in range(3)))
+
+        for limit in (1, 5, 7):
+            paged = []
+            for offset in range(0, 30, limit):
+                paged.extend(store.get(include=[], limit=limit, offset=offset)['ids'])
+            self.assertEqual(paged, everything, limit)
+
+        scoped = {'document_id': {'$in': ['1', '2', '3', '4']}}
+        expected = store.get(where=scoped, include=['documents'])
+        self.assertEqual(len(expected['ids']), 12)
+        page = store.get(where=scoped, include=['documents'], limit=4, offset=5)
+        self.assertEqual(page['ids'], expected['ids'][5:9])
+        self.assertEqual(page['documents'], expected['documents'][5:9])
+
+    def test_query_merges_the_shards_top_k(self):
+        store = self.make_store()
+        self.fill(store)
+        flat = LocalStore(os.path.join(self.data_dir, 'flat'), dim=DIM)
+        self.fill(flat)
+
+        questions = [np.random.default_rng(seed).standard_normal(DIM).tolist() for seed in range(5)]
+        for include in (('metadatas', 'documents', 'distances'), ('documents',)):
+            results, expected = store.query(questions, n_results=4, include=include), \
+                flat.query(questions, n_results=4, include=include)
+            self.assertEqual(results['ids'], expected['ids'])
+            self.assertEqual(results['documents'], expected['documents'])
+        np.testing.assert_allclose(store.query(questions, n_results=4, include=['distances'])['distances'],
+                                   flat.query(questions, n_results=4, include=['distances'])['distances'], rtol=1e-5)
+
+        scoped = store.query(questions, n_results=2, where={'document_id': {'$in': ['2', '5']}})
+        self.assertTrue(all(chunk_id.split('_')[0] in ('2', '5') for ids in scoped['ids'] for chunk_id in ids))
+
+    def test_reset_assignments_are_not_served_from_the_cache(self):
+        Document.objects.create(id=1, title='a', file_path='a.txt', file_type='txt', file_size=1, tenant='acme')
+        server = self.make_store(key='tenant')
+        self.fill(server, documents=[1])
+        self.assertEqual(server.assigned(['1']), {'1': 'acme'})
+
+        # rebuild_vector_index puts everything back in the unsharded collection and resets the table
+        ShardAssignment.reset()
+        server.legacy.upsert(*map(list, zip(*[chunk(1, index) for index in range(3)])))
+        Document.objects.filter(id=1).update(tenant='globex')
+        writer = self.make_store(key='tenant')
+        self.fill(writer, documents=[1])
+
+        self.assertEqual(server.assigned(['1']), {'1': 'globex'})
+        results = server.get(where={'document_id': '1'}, include=[])
+        self.assertEqual(sorted(results['ids']), ['1_0', '1_1', '1_2'])
+        self.assertEqual(server.count(), 3)
+
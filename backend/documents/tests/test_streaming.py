@@ -0,0 +1,64 @@
+import json
+
+from django.test import TestCase
+
+from .support import RAGTestMixin, paragraphs
+
+
+def read_events(response):
+    """(event, data) pairs of a server-sent-events response"""
+    body = b"".join(response.streaming_content).decode()
+    events = []
+    for block in body.split("\n\n"):
+        if not block.strip():
+            continue
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+class StreamingQueryTests(RAGTestMixin, TestCase):
+    rag_settings = {'ANSWER_CACHE_ENABLED': False, 'CONFIDENCE_GATING_ENABLED': False}
+
+    def ask(self, question, **data):
+        return self.client.post('/api/documents/query/stream/', {'question': question, **data},
+                                content_type='application/json')
+
+    def test_sources_come_before_tokens(self):
+        fake = self.start_fake_ollama(response_tokens=6)
+        engine = self.use_engine(self.make_engine())
+        document = self.ingest(engine, paragraphs('glacier'))
+
+        response = self.ask('What does the glacier report describe?', document_id=document.id)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = read_events(response)
+
+        names = [event for event, _ in events]
+        self.assertEqual(names[0], 'sources')
+        self.assertEqual(names[-1], 'done')
+        self.assertEqual(names.count('token'), 6)
+        sources = events[0][1]
+        self.assertTrue(sources['chunk_ids'])
+        self.assertEqual(set(sources['document_ids']), {str(document.id)})
+        answer = "".join(data['token'] for event, data in events if event == 'token')
+        self.assertEqual(answer, "".join(fake._tokens()))
+
+    def test_early_answer_is_a_single_event(self):
+        self.use_engine(self.make_engine())
+        events = read_events(self.ask('Anything there?'))
+        self.assertEqual([event for event, _ in events], ['sources', 'answer', 'done'])
+        self.assertIn('No documents have been uploaded', events[1][1]['answer'])
+
+    def test_generation_failure_is_an_error_event(self):
+        engine = self.use_engine(self.make_engine())  # OLLAMA_URL points at a closed port
+        self.ingest(engine, paragraphs('harbour'))
+        events = read_events(self.ask('What does the harbour report describe?'))
+        self.assertEqual(events[0][0], 'sources')
+        self.assertEqual(events[-1][0], 'error')
+        self.assertIn('Cannot connect to Ollama', events[-1][1]['error'])
+
+    def test_question_is_required(self):
+        self.assertEqual(self.ask('').status_code, 400)
+
+    def test_timeout_is_validated(self):
+        self.assertEqual(self.ask('Why?', timeout='soon').status_code, 400)
@@ -0,0 +1,158 @@
+import os
+import sqlite3
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from documents.vector_store import LocalStore
+
+from .support import RAGTestMixin
+
+DIM = 8
+
+
+def vectors(*seeds):
+    return [np.random.default_rng(seed).standard_normal(DIM).astype(np.float32) for seed in seeds]
+
+
+def chunks(document_id, indexes):
+    ids = [f"{document_id}_{index}" for index in indexes]
+    metadatas = [{'document_id': str(document_id), 'chunk_index': index, 'content_hash': f"h{index}"}
+                 for index in indexes]
+    return ids, [f"Chunk {index} of {document_id}" for index in indexes], metadatas
+
+
+class LocalStoreTests(RAGTestMixin, SimpleTestCase):
+    def make_store(self, **kwargs):
+        return LocalStore(os.path.join(self.data_dir, 'local_index'), dim=DIM, **kwargs)
+
+    def add(self, store, document_id, indexes, seed=0):
+        ids, documents, metadatas = chunks(document_id, indexes)
+        store.upsert(ids, vectors(*(seed + index for index in indexes)), documents, metadatas)
+
+    def rows(self, store):
+        return dict(store._conn.execute("SELECT id, row FROM chunks").fetchall())
+
+    def test_query_finds_the_nearest_chunk_within_the_filter(self):
+        store = self.make_store()
+        self.add(store, 1, range(4))
+        self.add(store, 2, range(4), seed=10)
+
+        results = store.query([vectors(2)[0].tolist()], n_results=2)
+        self.assertEqual(results['ids'][0][0], '1_2')
+        self.assertAlmostEqual(results['distances'][0][0], 0, places=4)
+
+        scoped = store.query([vectors(2)[0].tolist()], n_results=2, where={'document_id': '2'})
+        self.assertTrue(all(chunk_id.startswith('2_') for chunk_id in scoped['ids'][0]))
+
+    def test_get_and_delete_by_filter(self):
+        store = self.make_store()
+        self.add(store, 1, range(5))
+        stale = {'$and': [{'document_id': '1'}, {'chunk_index': {'$gte': 3}}]}
+        self.assertEqual(store.get(where=stale, include=[])['ids'], ['1_3', '1_4'])
+        store.delete(where=stale)
+        self.assertEqual(store.count(), 3)
+        self.assertEqual(store.get(where={'document_id': '1'}, include=['documents'])['documents'][-1],
+                         "Chunk 2 of 1")
+
+    def test_upserting_an_existing_id_keeps_its_row(self):
+        store = self.make_store()
+        self.add(store, 1, range(3))
+        before = self.rows(store)
+        store.upsert(['1_1'], vectors(99), ['Rewritten'], [{'document_id': '1', 'chunk_index': 1}])
+        self.assertEqual(self.rows(store), before)
+        self.assertEqual(store.get(ids=['1_1'], include=['documents'])['documents'], ['Rewritten'])
+        np.testing.assert_allclose(store.get(ids=['1_1'], include=['embeddings'])['embeddings'][0], vectors(99)[0])
+
+    def test_writers_sharing_the_store_never_reuse_a_row(self):
+        first, second = self.make_store(), self.make_store()
+        self.add(first, 1, range(3))
+        # second has not seen the first write yet when it allocates
+        self.add(second, 2, range(3), seed=10)
+        self.add(first, 3, range(3), seed=20)
+
+        rows = self.rows(first)
+        self.assertEqual(len(rows), 9)
+        self.assertEqual(len(set(rows.values())), 9)
+        for store in (first, second):
+            results = store.query([vectors(11)[0].tolist()], n_results=1)
+            self.assertEqual(results['ids'][0], ['2_1'])
+
+    def test_a_failed_upsert_leaves_the_store_unchanged(self):
+        store = self.make_store()
+        self.add(store, 1, range(2))
+        ids, documents, metadatas = chunks(2, [0, 0])
+        with self.assertRaises(sqlite3.IntegrityError):
+            store.upsert(ids, vectors(1, 2), documents, metadatas)
+        self.assertEqual(store.count(), 2)
+        self.add(store, 2, range(2))
+        self.assertEqual(store.count(), 4)
+
+    def test_flush_makes_a_rewritten_document_contiguous(self):
+        store = self.make_store()
+        self.add(store, 1, range(3))
+        self.add(store, 2, range(3))
+        self.add(store, 1, [3])
+        self.assertIsNone(store._as_slice(store._rows_for_document('1')))
+
+        store.flush('1')
+        rows = store._rows_for_document('1')
+        self.assertIsNotNone(store._as_slice(rows))
+        results = store.query([vectors(3)[0].tolist()], n_results=1, where={'document_id': '1'})
+        self.assertEqual(results['ids'][0], ['1_3'])
+
+    def test_compact_drops_dead_rows(self):
+        store = self.make_store()
+        self.add(store, 1, range(4))
+        self.add(store, 2, range(4), seed=10)
+        store.delete(where={'document_id': '1'})
+        store.compact()
+        self.assertEqual(sorted(self.rows(store).values()), [0, 1, 2, 3])
+        self.assertEqual(store._rows, 4)
+        results = store.query([vectors(12)[0].tolist()], n_results=1)
+        self.assertEqual(results['ids'][0], ['2_2'])
+
+
+class QuantizedStoreTests(RAGTestMixin, SimpleTestCase):
+    def make_store(self, name='local_index', **kwargs):
+        return LocalStore(os.path.join(self.data_dir, name), dim=DIM, **kwargs)
+
+    def fill(self, store):
+        ids, documents, metadatas = chunks(1, range(20))
+        store.upsert(ids, vectors(*range(20)), documents, metadatas)
+        return store
+
+    def test_only_ascending_contiguous_rows_are_a_slice(self):
+        as_slice = LocalStore._as_slice
+        self.assertEqual(as_slice(np.array([3, 4, 5, 6])), slice(3, 7))
+        self.assertEqual(as_slice(np.array([7])), slice(7, 8))
+        for rows in ([3, 5, 4, 6], [6, 5, 4, 3], [3, 4, 6], []):
+            self.assertIsNone(as_slice(np.array(rows, dtype=np.int64)), rows)
+
+    def test_quantized_stores_rank_like_float32(self):
+        exact = self.fill(self.make_store())
+        query = [vectors(100)[0].tolist()]
+        expected = exact.query(query, n_results=5)
+        for dtype in ('float16', 'int8'):
+            store = self.fill(self.make_store(dtype, dtype=dtype))
+            results = store.query(query, n_results=5)
+            self.assertEqual(results['ids'][0][0], expected['ids'][0][0], dtype)
+            np.testing.assert_allclose(results['distances'][0], expected['distances'][0], rtol=0.05, atol=0.05)
+
+    def test_rescoring_returns_exact_distances(self):
+        exact = self.fill(self.make_store())
+        store = self.fill(self.make_store('rescored', dtype='int8', rescore=4))
+        query = [vectors(100)[0].tolist()]
+        results, expected = store.query(query, n_results=5), exact.query(query, n_results=5)
+        self.assertEqual(results['ids'], expected['ids'])
+        np.testing.assert_allclose(results['distances'][0], expected['distances'][0], rtol=1e-5)
+        np.testing.assert_allclose(store.get(ids=['1_3'], include=['embeddings'])['embeddings'][0], vectors(3)[0])
+
+    def test_rows_cost_less_when_quantized(self):
+        self.assertEqual(self.make_store('a').row_bytes(), DIM * 4 + 4)
+        self.assertEqual(self.make_store('b', dtype='int8', rescore=4).row_bytes(), DIM + 8)
+
+    def test_a_store_is_not_reopened_with_another_dtype(self):
+        self.fill(self.make_store(dtype='int8'))
+        with self.assertRaises(ValueError):
+            self.make_store(dtype='float16')
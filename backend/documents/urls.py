@@ -1,10 +1,20 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path('documents/', views.get_documents),
     path('documents/upload/', views.upload_document),
+    path('documents/upload/bulk/', views.upload_documents_bulk),
+    path('documents/bulk/<int:batch_id>/status/', views.bulk_status),
+    path('documents/<int:document_id>/status/', views.document_status),
     path('documents/query/', views.query_document),
+    path('documents/query/stream/', views.query_document_stream),
+    path('documents/query/batch/', views.query_document_batch),
+    path('async/documents/upload/', async_views.upload_document),
+    path('async/documents/<int:document_id>/status/', async_views.document_status),
+    path('async/documents/query/', async_views.query_document),
+    path('async/documents/query/stream/', async_views.query_document_stream),
+    path('ready/', views.readiness_status),
     # path('debug/', views.debug_status),
 
 ]
@@ -0,0 +1,595 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class VectorStore:
+    """Storage for chunk embeddings, text and metadata.
+
+    The interface follows the subset of the Chroma collection API the engine
+    uses (get/upsert/delete/query/count with Chroma-shaped results and
+    `where` filters), so backends can be swapped without touching callers.
+    """
+
+    name = 'base'
+
+    def count(self):
+        raise NotImplementedError
+
+    def get(self, ids=None, where=None, include=('metadatas', 'documents'), limit=None, offset=None):
+        raise NotImplementedError
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        raise NotImplementedError
+
+    def delete(self, ids=None, where=None):
+        raise NotImplementedError
+
+    def query(self, query_embeddings, n_results=10, where=None,
+              include=('metadatas', 'documents', 'distances')):
+        raise NotImplementedError
+
+    def flush(self, document_id=None):
+        """Called once a document has been fully written"""
+
+
+class ChromaStore(VectorStore):
+    """The persistent ChromaDB collection"""
+
+    name = 'chroma'
+
+    def __init__(self, path, collection_name='documents'):
+        import chromadb
+
+        # Using persistent client instead of in-memory client
+        self.client = chromadb.PersistentClient(path=str(path))
+
+        # Getting or creating collection
+        try:
+            self.collection = self.client.get_collection(collection_name)
+            logger.info("Retrieved existing ChromaDB collection")
+        except Exception:
+            self.collection = self.client.create_collection(collection_name)
+            logger.info("Created new ChromaDB collection")
+
+    def count(self):
+        return self.collection.count()
+
+    def get(self, ids=None, where=None, include=('metadatas', 'documents'), limit=None, offset=None):
+        return self.collection.get(ids=ids, where=where, include=list(include), limit=limit, offset=offset)
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def delete(self, ids=None, where=None):
+        self.collection.delete(ids=ids, where=where)
+
+    def query(self, query_embeddings, n_results=10, where=None,
+              include=('metadatas', 'documents', 'distances')):
+        return self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            where=where,
+            include=list(include)
+        )
+
+
+# Metadata keys stored as indexed columns of the side table; the rest go to JSON
+_COLUMNS = {'document_id', 'chunk_index', 'content_hash'}
+_OPERATORS = {'$eq': '=', '$ne': '!=', '$gt': '>', '$gte': '>=', '$lt': '<', '$lte': '<='}
+
+
+def _where_sql(where):
+    """Translate a Chroma `where` filter into an SQL condition over the side table"""
+    if not where:
+        return '1', []
+
+    clauses = []
+    params = []
+    for key, condition in where.items():
+        if key in ('$and', '$or'):
+            parts = [_where_sql(item) for item in condition]
+            joiner = ' AND ' if key == '$and' else ' OR '
+            clauses.append('(' + joiner.join(sql for sql, _ in parts) + ')')
+            for _, part_params in parts:
+                params.extend(part_params)
+            continue
+
+        column = key if key in _COLUMNS else f"json_extract(metadata, '$.{key}')"
+        if not isinstance(condition, dict):
+            condition = {'$eq': condition}
+        for operator, value in condition.items():
+            if operator in ('$in', '$nin'):
+                values = list(value) or [None]
+                clauses.append(f"{column} {'IN' if operator == '$in' else 'NOT IN'} ({','.join('?' * len(values))})")
+                params.extend(values)
+            else:
+                clauses.append(f"{column} {_OPERATORS[operator]} ?")
+                params.append(value)
+    return ' AND '.join(clauses) or '1', params
+
+
+# Storage dtypes for LocalStore vectors, with the code recorded in the store's meta table
+DTYPES = {'float32': 0, 'float16': 1, 'int8': 2}
+
+
+class LocalStore(VectorStore):
+    """In-process vector store: a memory-mapped embedding matrix plus an SQLite side table.
+
+    Row i of the matrix belongs to the side-table row with `row = i`. Rows of
+    a document are kept contiguous and ordered by chunk_index (documents
+    rewritten in place are moved to the end as one block in flush()), so a
+    document-scoped top-k is a single dot product over a slice of the matrix.
+    Deleted rows are reclaimed by compact().
+
+    Vectors are stored as float32, float16 or int8 (symmetric scalar
+    quantization with one scale per vector) and scored on the stored matrix
+    directly. With rescore > 0 a float32 copy is also kept on disk and the
+    best n_results * rescore candidates are re-ranked exactly; only those
+    rows of the copy are ever paged in.
+    """
+
+    name = 'local'
+    SCORE_BLOCK = 65536  # Rows converted to float32 at a time while scoring
+
+    def __init__(self, path, dim=384, dtype='float32', rescore=0, compact_ratio=0.3):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported local vector store dtype: {dtype}")
+        self.path = str(path)
+        self.dim = dim
+        self.dtype = dtype
+        self.rescore = rescore
+        self.compact_ratio = compact_ratio
+        os.makedirs(self.path, exist_ok=True)
+
+        # (file name, dtype, values per row) of the per-row arrays
+        self._layout = [('vectors', np.dtype(dtype), dim), ('norms', np.dtype(np.float32), 1)]
+        if dtype == 'int8':
+            self._layout.append(('scales', np.dtype(np.float32), 1))
+        if rescore:
+            self._layout.append(('exact', np.dtype(np.float32), dim))
+
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(self.path, 'chunks.sqlite3'), check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                id TEXT PRIMARY KEY,
+                row INTEGER NOT NULL UNIQUE,
+                document_id TEXT,
+                chunk_index INTEGER,
+                content_hash TEXT,
+                document TEXT,
+                metadata TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_document ON chunks (document_id, chunk_index);
+            CREATE INDEX IF NOT EXISTS chunks_hash ON chunks (document_id, content_hash);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('rows', 0);
+        """)
+        self._check_layout()
+        self._conn.commit()
+
+        self._version = None
+        self._arrays = {}
+        self._doc_rows = {}
+        self._live_rows = None
+        self._refresh()
+
+    # -- storage ---------------------------------------------------------
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _meta(self, key):
+        return self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0]
+
+    def _set_meta(self, key, value):
+        self._conn.execute("UPDATE meta SET value = ? WHERE key = ?", (value, key))
+
+    def _bump_version(self):
+        self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        self._version = self._meta('version')
+
+    @contextmanager
+    def _write(self):
+        """Write transaction that holds SQLite's write lock from the start.
+
+        In-memory state is reloaded under the lock, so rows allocated and
+        read inside are current even when other processes write the store.
+        """
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._refresh()
+            yield
+            self._conn.commit()
+        except BaseException:
+            self._conn.rollback()
+            self._version = None  # In-memory state may be ahead of the rolled-back tables
+            raise
+
+    def _allocate_rows(self, count):
+        """First of count new rows at the end of the matrix; only inside _write()"""
+        start = max(self._meta('rows'),
+                    self._conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM chunks").fetchone()[0])
+        self._rows = start + count
+        self._set_meta('rows', self._rows)
+        self._ensure_capacity(self._rows)
+        return start
+
+    def _check_layout(self):
+        """Refuse to open a store written with another dtype or rescore setting"""
+        layout = DTYPES[self.dtype] * 2 + bool(self.rescore)
+        stored = self._conn.execute("SELECT value FROM meta WHERE key = 'layout'").fetchone()
+        if stored is None or self._meta('rows') == 0:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('layout', ?)", (layout,))
+        elif stored[0] != layout:
+            dtype = {code: name for name, code in DTYPES.items()}[stored[0] // 2]
+            raise ValueError(
+                f"Local vector store at {self.path} holds {dtype} vectors "
+                f"({'with' if stored[0] % 2 else 'without'} float32 copies); "
+                f"run 'python manage.py build_local_index' to convert it"
+            )
+
+    def _open_arrays(self, capacity):
+        """Map the per-row array files, growing them to hold `capacity` rows"""
+        capacity = max(capacity, 1)
+        for name, dtype, width in self._layout:
+            needed = capacity * width * dtype.itemsize
+            file_path = self._file(f'{name}.bin')
+            if not os.path.exists(file_path) or os.path.getsize(file_path) < needed:
+                with open(file_path, 'ab') as f:
+                    f.truncate(needed)
+            shape = (capacity, width) if width > 1 else (capacity,)
+            self._arrays[name] = np.memmap(file_path, dtype=dtype, mode='r+', shape=shape)
+
+        self._matrix = self._arrays['vectors']
+        self._norms = self._arrays['norms']
+        self._scales = self._arrays.get('scales')
+        self._exact = self._arrays.get('exact')
+
+    def _flush_arrays(self):
+        for array in self._arrays.values():
+            array.flush()
+
+    def _refresh(self):
+        """Reload in-memory state if another process (or compaction) changed the store"""
+        version = self._meta('version')
+        if version == self._version:
+            return
+        self._version = version
+        self._rows = self._meta('rows')
+        self._open_arrays(max(self._rows, 1024))
+        self._doc_rows = {}
+        self._live_rows = None
+
+    def _ensure_capacity(self, rows):
+        if rows > self._matrix.shape[0]:
+            self._flush_arrays()
+            self._open_arrays(max(rows, self._matrix.shape[0] * 2))
+
+    def _encode_vectors(self, embeddings):
+        return np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+
+    def _write_rows(self, rows, vectors):
+        if self._scales is not None:
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1
+            self._scales[rows] = scales
+            self._matrix[rows] = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        else:
+            self._matrix[rows] = vectors.astype(self._matrix.dtype)
+        self._norms[rows] = np.einsum('ij,ij->i', vectors, vectors)
+        if self._exact is not None:
+            self._exact[rows] = vectors
+
+    def _read_rows(self, rows):
+        """Vectors of the given rows as float32 (exact when float32 copies are kept)"""
+        if self._exact is not None:
+            return np.asarray(self._exact[rows], dtype=np.float32)
+        vectors = np.asarray(self._matrix[rows], dtype=np.float32)
+        if self._scales is not None:
+            vectors *= self._scales[rows][:, None]
+        return vectors
+
+    def row_bytes(self):
+        """Bytes per chunk that scoring reads; the float32 copies are only touched when rescoring"""
+        return sum(dtype.itemsize * width for name, dtype, width in self._layout if name != 'exact')
+
+    # -- row lookups -----------------------------------------------------
+
+    def _rows_for_document(self, document_id):
+        rows = self._doc_rows.get(document_id)
+        if rows is None:
+            rows = np.fromiter(
+                (row for (row,) in self._conn.execute(
+                    "SELECT row FROM chunks WHERE document_id = ? ORDER BY chunk_index", (document_id,))),
+                dtype=np.int64
+            )
+            self._doc_rows[document_id] = rows
+        return rows
+
+    def _all_live_rows(self):
+        if self._live_rows is None:
+            self._live_rows = np.fromiter(
+                (row for (row,) in self._conn.execute("SELECT row FROM chunks ORDER BY row")), dtype=np.int64
+            )
+        return self._live_rows
+
+    def _candidate_rows(self, where):
+        if not where:
+            return self._all_live_rows()
+        if set(where) == {'document_id'} and not isinstance(where['document_id'], dict):
+            return self._rows_for_document(str(where['document_id']))
+        if set(where) == {'document_id'} and set(where['document_id']) == {'$in'}:
+            # Routed searches: a union of cached per-document row sets, no SQL
+            rows = [self._rows_for_document(str(document_id)) for document_id in where['document_id']['$in']]
+            return np.sort(np.concatenate(rows)) if rows else np.empty(0, dtype=np.int64)
+        sql, params = _where_sql(where)
+        return np.fromiter(
+            (row for (row,) in self._conn.execute(f"SELECT row FROM chunks WHERE {sql} ORDER BY row", params)),
+            dtype=np.int64
+        )
+
+    @staticmethod
+    def _as_slice(rows):
+        """A contiguous ascending row set can be read as a view instead of a gather"""
+        if len(rows) and np.all(np.diff(rows) == 1):
+            return slice(int(rows[0]), int(rows[-1]) + 1)
+        return None
+
+    def _invalidate(self, document_ids):
+        for document_id in document_ids:
+            self._doc_rows.pop(document_id, None)
+        self._live_rows = None
+
+    # -- VectorStore API -------------------------------------------------
+
+    def count(self):
+        with self._lock:
+            self._refresh()
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def _fetch(self, rows_sql, params, include):
+        records = self._conn.execute(
+            f"SELECT id, row, document, metadata FROM chunks WHERE {rows_sql}", params
+        ).fetchall()
+        result = {'ids': [record[0] for record in records]}
+        result['documents'] = [record[2] for record in records] if 'documents' in include else None
+        result['metadatas'] = [json.loads(record[3]) for record in records] if 'metadatas' in include else None
+        if 'embeddings' in include:
+            rows = np.array([record[1] for record in records], dtype=np.int64)
+            result['embeddings'] = self._read_rows(rows).tolist() if len(rows) else []
+        else:
+            result['embeddings'] = None
+        return result
+
+    def get(self, ids=None, where=None, include=('metadatas', 'documents'), limit=None, offset=None):
+        with self._lock:
+            self._refresh()
+            sql, params = _where_sql(where)
+            if ids is not None:
+                ids = list(ids)
+                sql = f"id IN ({','.join('?' * len(ids)) or 'NULL'}) AND {sql}"
+                params = ids + params
+            sql += " ORDER BY row"
+            if limit is not None or offset:
+                sql += " LIMIT ? OFFSET ?"
+                params = params + [limit if limit is not None else -1, offset or 0]
+            return self._fetch(sql, params, include)
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        if not ids:
+            return
+        vectors = self._encode_vectors(embeddings)
+        with self._lock, self._write():
+            existing = dict(self._conn.execute(
+                f"SELECT id, row FROM chunks WHERE id IN ({','.join('?' * len(ids))})", list(ids)
+            ).fetchall())
+
+            # Rows of new ids come from the shared high-water mark; a plain INSERT
+            # makes any collision with another writer fail instead of overwriting
+            next_row = self._allocate_rows(sum(chunk_id not in existing for chunk_id in ids))
+            rows = []
+            for chunk_id in ids:
+                if chunk_id in existing:
+                    rows.append(existing[chunk_id])
+                else:
+                    rows.append(next_row)
+                    next_row += 1
+            self._write_rows(np.array(rows, dtype=np.int64), vectors)
+
+            values = [(str(metadata.get('document_id')), metadata.get('chunk_index'), metadata.get('content_hash'),
+                       document, json.dumps(metadata), chunk_id, row)
+                      for chunk_id, row, document, metadata in zip(ids, rows, documents, metadatas)]
+            self._conn.executemany(
+                "UPDATE chunks SET document_id = ?, chunk_index = ?, content_hash = ?, document = ?, metadata = ? "
+                "WHERE id = ? AND row = ?",
+                [value for value in values if value[5] in existing]
+            )
+            self._conn.executemany(
+                "INSERT INTO chunks (document_id, chunk_index, content_hash, document, metadata, id, row) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [value for value in values if value[5] not in existing]
+            )
+            self._bump_version()
+            self._invalidate({str(metadata.get('document_id')) for metadata in metadatas})
+
+    def delete(self, ids=None, where=None):
+        with self._lock, self._write():
+            sql, params = _where_sql(where)
+            if ids is not None:
+                ids = list(ids)
+                sql = f"id IN ({','.join('?' * len(ids)) or 'NULL'}) AND {sql}"
+                params = ids + params
+            document_ids = {row[0] for row in self._conn.execute(
+                f"SELECT DISTINCT document_id FROM chunks WHERE {sql}", params)}
+            self._conn.execute(f"DELETE FROM chunks WHERE {sql}", params)
+            self._bump_version()
+            self._invalidate(document_ids)
+
+    def query(self, query_embeddings, n_results=10, where=None,
+              include=('metadatas', 'documents', 'distances')):
+        with self._lock:
+            self._refresh()
+            rows = self._candidate_rows(where)
+            queries = self._encode_vectors(query_embeddings)
+            result = {'ids': [], 'documents': [], 'metadatas': [], 'distances': [], 'embeddings': None}
+            if not len(rows):
+                for _ in queries:
+                    for key in ('ids', 'documents', 'metadatas', 'distances'):
+                        result[key].append([])
+                return result
+
+            top = self._top_k(rows, queries, n_results)
+
+            for top_rows, distances in top:
+                by_row = {}
+                placeholders = ','.join('?' * len(top_rows))
+                for record in self._conn.execute(
+                        f"SELECT row, id, document, metadata FROM chunks WHERE row IN ({placeholders})",
+                        [int(row) for row in top_rows]):
+                    by_row[record[0]] = record
+                ordered = [by_row[int(row)] for row in top_rows]
+                result['ids'].append([record[1] for record in ordered])
+                result['documents'].append([record[2] for record in ordered])
+                result['metadatas'].append([json.loads(record[3]) for record in ordered])
+                result['distances'].append([float(distance) for distance in distances])
+                if 'embeddings' in include:
+                    result['embeddings'] = result['embeddings'] or []
+                    result['embeddings'].append(self._read_rows(top_rows).tolist())
+
+            for key in ('documents', 'metadatas', 'distances'):
+                if key not in include:
+                    result[key] = None
+            return result
+
+    def _distances(self, rows, queries):
+        """Squared L2 distances (Chroma's default metric), scored on the stored matrix"""
+        index = self._as_slice(rows)
+        if index is None:
+            index = rows
+        matrix = self._matrix[index]
+        scores = np.empty((len(rows), len(queries)), dtype=np.float32)
+        for start in range(0, len(rows), self.SCORE_BLOCK):
+            block = np.asarray(matrix[start:start + self.SCORE_BLOCK], dtype=np.float32)
+            scores[start:start + len(block)] = block @ queries.T
+        if self._scales is not None:
+            scores *= self._scales[index][:, None]
+        return self._norms[index][:, None] + np.einsum('ij,ij->i', queries, queries)[None, :] - 2 * scores
+
+    @staticmethod
+    def _smallest(distances, k):
+        best = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(len(distances))
+        return best[np.argsort(distances[best])]
+
+    def _top_k(self, rows, queries, n_results):
+        distances = self._distances(rows, queries)
+        k = min(n_results, len(rows))
+        shortlist = min(k * self.rescore, len(rows)) if self._exact is not None else k
+        top = []
+        for column, query in enumerate(queries):
+            best = self._smallest(distances[:, column], shortlist)
+            best_distances = distances[best, column]
+            if self._exact is not None:
+                # Re-rank the shortlist on the float32 copies
+                best_distances = ((self._exact[rows[best]] - query) ** 2).sum(axis=1)
+                keep = self._smallest(best_distances, k)
+                best, best_distances = best[keep], best_distances[keep]
+            top.append((rows[best], np.maximum(best_distances, 0)))
+        return top
+
+    def flush(self, document_id=None):
+        """Keep the written document contiguous and reclaim space when enough rows are dead"""
+        with self._lock:
+            if document_id is not None:
+                with self._write():
+                    rows = self._rows_for_document(str(document_id))
+                    if len(rows) > 1 and self._as_slice(rows) is None:
+                        self._relocate(str(document_id), rows)
+
+            live = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+            if self._rows > 1024 and (self._rows - live) > self.compact_ratio * self._rows:
+                self.compact()
+            self._flush_arrays()
+
+    def _relocate(self, document_id, rows):
+        """Copy a fragmented document to the end of the matrix as one block; only inside _write()"""
+        start = self._allocate_rows(len(rows))
+        new_rows = np.arange(start, start + len(rows))
+        for array in self._arrays.values():
+            array[new_rows] = array[rows]
+        self._conn.executemany(
+            "UPDATE chunks SET row = ? WHERE row = ?",
+            [(int(new_row), int(old_row)) for new_row, old_row in zip(new_rows, rows)]
+        )
+        self._bump_version()
+        self._invalidate({document_id})
+
+    def compact(self):
+        """Rewrite live rows grouped by document and chunk order, dropping dead rows"""
+        with self._lock:
+            # The write lock is held throughout, so no other process adds rows that the rewrite would miss
+            with self._write():
+                records = self._conn.execute("SELECT id, row FROM chunks ORDER BY document_id, chunk_index").fetchall()
+                old_rows = np.array([row for _, row in records], dtype=np.int64)
+
+                capacity = max(len(records), 1024)
+                for name, array in self._arrays.items():
+                    target = np.memmap(self._file(f'{name}.bin.tmp'), dtype=array.dtype, mode='w+',
+                                       shape=(capacity,) + array.shape[1:])
+                    for start in range(0, len(old_rows), 65536):
+                        batch = old_rows[start:start + 65536]
+                        target[start:start + len(batch)] = array[batch]
+                    target.flush()
+                    del target
+
+                # Shift rows out of the way first so the UNIQUE(row) constraint holds while renumbering
+                self._conn.execute("UPDATE chunks SET row = -row - 1")
+                self._conn.executemany(
+                    "UPDATE chunks SET row = ? WHERE id = ?",
+                    [(new_row, chunk_id) for new_row, (chunk_id, _) in enumerate(records)]
+                )
+                self._arrays = {}
+                self._matrix = self._norms = self._scales = self._exact = None
+                for name, _, _ in self._layout:
+                    os.replace(self._file(f'{name}.bin.tmp'), self._file(f'{name}.bin'))
+                self._set_meta('rows', len(records))
+                self._bump_version()
+            self._version = None
+            self._refresh()
+            logger.info("Compacted local vector store to %d rows", len(records))
+
+
+def create_vector_store():
+    """Build the vector store selected by the VECTOR_STORE setting, split into shards with SHARDING_ENABLED"""
+    store = _create_unsharded_store()
+    if getattr(settings, 'SHARDING_ENABLED', False):
+        from .sharding import ShardedStore
+        return ShardedStore.from_settings(store)
+    return store
+
+
+def _create_unsharded_store():
+    backend = getattr(settings, 'VECTOR_STORE', 'chroma')
+    if backend == 'local':
+        return LocalStore(
+            path=getattr(settings, 'LOCAL_VECTOR_STORE_PATH', os.path.join(settings.BASE_DIR, 'rag_data', 'local_index')),
+            dim=getattr(settings, 'EMBEDDING_DIM', 384),
+            dtype=getattr(settings, 'LOCAL_VECTOR_STORE_DTYPE', 'float32'),
+            rescore=getattr(settings, 'LOCAL_VECTOR_STORE_RESCORE', 0),
+        )
+    if backend == 'chroma':
+        return ChromaStore(
+            path=getattr(settings, 'CHROMADB_PATH', './chromadb_data'),
+            collection_name=getattr(settings, 'CHROMADB_COLLECTION', 'documents'),
+        )
+    raise ValueError(f"Unknown VECTOR_STORE backend: {backend}")
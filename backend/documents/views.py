@@ -1,91 +1,317 @@
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
+from django.conf import settings
 from django.core.files.storage import default_storage
-from .models import Document
-from .rag_engine import RAGEngine
+from django.db import transaction
+from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import parse_etags, urlencode, urlsafe_base64_decode, urlsafe_base64_encode
+from .models import DOCUMENT_STATUSES, Document, DocumentCounter, IngestionBatch
+from .bulk_ingestion import QUEUED_MESSAGE, save_upload
+from .ingestion import QueueFull
+from .metrics import REGISTRY, collect_timings, span
+from .registry import get_bulk_ingestion, get_engine, get_ingestion_queue, readiness
 from django.views.decorators.csrf import csrf_exempt
 import os
-rag_engine = RAGEngine()
+import json
+import hashlib
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Fields a listing may select with ?fields=; the default keeps the original response shape
+LISTING_FIELDS = ('id', 'title', 'file_type', 'file_size', 'processing_status', 'progress',
+                  'status_message', 'tenant', 'created_at', 'updated_at', 'batch_id')
+DEFAULT_LISTING_FIELDS = ('id', 'title', 'file_type', 'created_at')
+
+
+def _encode_cursor(created_at, document_id):
+    return urlsafe_base64_encode(f"{created_at.isoformat()}|{document_id}".encode())
+
+
+def _decode_cursor(cursor):
+    try:
+        created_at, document_id = urlsafe_base64_decode(cursor).decode().split('|')
+        return datetime.fromisoformat(created_at), int(document_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _not_modified(request, etag):
+    """Whether the client's If-None-Match already names etag"""
+    tags = parse_etags(request.headers.get('If-None-Match', ''))
+    return '*' in tags or etag in tags
+
 
 @csrf_exempt
 @api_view(['GET'])
 def get_documents(request):
+    """List documents newest first, one page at a time.
+
+    Query parameters: limit, cursor (from the previous page's X-Next-Cursor or
+    Link header), status (comma-separated processing_status values), fields
+    (comma-separated, from LISTING_FIELDS) and order=asc for oldest first.
+    The body stays a plain list; paging details travel in headers. Responses
+    carry an ETag derived from the document change counter, so polling with
+    If-None-Match costs one primary-key lookup until something changes.
+    """
+    fields = [field for field in request.query_params.get('fields', '').split(',') if field] \
+        or list(DEFAULT_LISTING_FIELDS)
+    unknown = sorted(set(fields) - set(LISTING_FIELDS))
+    if unknown:
+        return Response({'error': f"Unknown fields: {', '.join(unknown)}"}, status=400)
+    statuses = [status for status in request.query_params.get('status', '').split(',') if status]
+    if set(statuses) - set(DOCUMENT_STATUSES):
+        return Response({'error': f"status must be among: {', '.join(DOCUMENT_STATUSES)}"}, status=400)
+    try:
+        limit = int(request.query_params.get('limit', getattr(settings, 'DOCUMENT_PAGE_SIZE', 100)))
+    except ValueError:
+        return Response({'error': 'limit must be an integer'}, status=400)
+    limit = max(1, min(limit, getattr(settings, 'DOCUMENT_PAGE_MAX_SIZE', 1000)))
+    ascending = request.query_params.get('order') == 'asc'
+    cursor = request.query_params.get('cursor')
+    position = _decode_cursor(cursor) if cursor else None
+    if cursor and position is None:
+        return Response({'error': 'Invalid cursor'}, status=400)
+
+    # Everything the page depends on: the data version and the normalized query
+    query = json.dumps([fields, sorted(statuses), limit, ascending, cursor])
+    etag = f'"{DocumentCounter.version()}-{hashlib.sha1(query.encode()).hexdigest()[:16]}"'
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if _not_modified(request, etag):
+        return Response(status=304, headers=headers)
+
     documents = Document.objects.all()
-    data = [{
-        'id': doc.pk,
-        'title': doc.title,
-        'file_type': doc.file_type,
-        'created_at': doc.created_at
-    } for doc in documents]
-    return Response(data)
+    if statuses:
+        documents = documents.filter(processing_status__in=statuses)
+    if position:
+        created_at, document_id = position
+        if ascending:
+            documents = documents.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=document_id))
+        else:
+            documents = documents.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=document_id))
+    order = ('created_at', 'id') if ascending else ('-created_at', '-id')
+    # One extra row tells whether there is a next page
+    rows = list(documents.order_by(*order).values(*set(fields) | {'id', 'created_at'})[:limit + 1])
+    page = rows[:limit]
+    data = [{field: row[field] for field in fields} for row in page]
+
+    counts = DocumentCounter.status_counts()
+    headers['X-Total-Count'] = str(sum(count for status, count in counts.items() if not statuses or status in statuses))
+    if len(rows) > limit:
+        next_cursor = _encode_cursor(page[-1]['created_at'], page[-1]['id'])
+        params = {key: value for key, value in request.query_params.items() if key != 'cursor'}
+        params['cursor'] = next_cursor
+        headers['X-Next-Cursor'] = next_cursor
+        headers['Link'] = f'<{request.build_absolute_uri(request.path)}?{urlencode(params)}>; rel="next"'
+    return Response(data, headers=headers)
 
 @api_view(['POST'])
 def upload_document(request):
-    """Upload and process document"""
+    """Upload a document and queue it for background processing"""
     try:
         file = request.FILES.get('file')
         if not file:
             return Response({'error': 'No file provided'}, status=400)
         
-        print(f"DEBUG: Received file: {file.name}, size: {file.size}")
+        logger.debug("Received file: %s, size: %s", file.name, file.size)
+        
+        ingestion_queue = get_ingestion_queue()
+        if ingestion_queue.policy == 'reject' and ingestion_queue.is_full():
+            return Response({'error': 'Ingestion queue is full, please retry later'},
+                            status=503, headers={'Retry-After': '30'})
         
         # Save file
-        file_path = default_storage.save(file.name, file)
-        full_file_path = default_storage.path(file_path)
+        with span('read'):
+            file_path = default_storage.save(file.name, file)
         
-        print(f"DEBUG: Saved to: {full_file_path}")
-        print(f"DEBUG: File exists: {os.path.exists(full_file_path)}")
+        logger.debug("Saved to: %s", file_path)
         
-        # Create document record
+        # Create document record; the row doubles as the ingestion job
         document = Document.objects.create(
             title=file.name,
             file_path=file_path,
             file_type=file.name.split('.')[-1],
             file_size=file.size,
-            processing_status='processing'
+            processing_status='pending',
+            tenant=str(request.data.get('tenant', ''))[:64]
         )
         
-        print(f"DEBUG: Created document record ID: {document.id}")
-        
-        # Process document
-        success, message = rag_engine.process_document(document.id, full_file_path)
+        logger.info("Created document record ID: %s", document.id)
         
-        print(f"DEBUG: Processing result - Success: {success}")
-        print(f"DEBUG: Processing message: {message}")
+        try:
+            scheduled = ingestion_queue.submit(document.id)
+        except QueueFull as e:
+            document.delete()
+            default_storage.delete(file_path)
+            return Response({'error': str(e)}, status=503, headers={'Retry-After': '30'})
         
-        if success:
-            document.processing_status = 'completed'
-            document.save()
-            
-            # Double-check ChromaDB
-            collection_count = rag_engine.collection.count()
-            print(f"DEBUG: ChromaDB count after processing: {collection_count}")
-            
-            return Response({
-                'id': document.id,
-                'status': 'uploaded',
-                'message': message,
-                'chromadb_count': collection_count
-            })
-        else:
-            # Mark as failed and return the actual error
-            document.processing_status = 'failed'
-            document.save()
-            
-            print(f"DEBUG: Processing failed: {message}")
-            
-            return Response({
-                'error': f'Processing failed: {message}'
-            }, status=500)
+        return Response({
+            'id': document.id,
+            'job_id': document.id,
+            'status': document.processing_status,
+            'queued': scheduled,
+            'status_url': f'/api/documents/{document.id}/status/'
+        }, status=202)
             
     except Exception as e:
-        print(f"DEBUG: Upload error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Upload error: %s", e)
         return Response({'error': f'Upload failed: {str(e)}'}, status=500)
 
 
+@api_view(['POST'])
+def upload_documents_bulk(request):
+    """Upload many files and/or zip/tar archives and ingest them together as one batch"""
+    try:
+        uploads = request.FILES.getlist('files') + request.FILES.getlist('file') + request.FILES.getlist('archive')
+        if not uploads:
+            return Response({'error': 'No files provided'}, status=400)
+        
+        max_files = getattr(settings, 'BULK_UPLOAD_MAX_FILES', 5000)
+        max_file_size = getattr(settings, 'BULK_UPLOAD_MAX_FILE_SIZE', 100 * 1024 * 1024)
+        
+        # Archives are streamed member by member straight to storage
+        saved = []
+        skipped = []
+        for upload in uploads:
+            if len(saved) >= max_files:
+                skipped.append({'name': upload.name, 'reason': f'File limit of {max_files} reached'})
+                continue
+            for outcome in save_upload(upload, max_files - len(saved), max_file_size):
+                if outcome[0] == 'saved':
+                    saved.append(outcome[1:])
+                else:
+                    skipped.append({'name': outcome[1], 'reason': outcome[2]})
+        
+        logger.info("Bulk upload saved %d files, skipped %d", len(saved), len(skipped))
+        if not saved:
+            return Response({'error': 'No files could be read from the upload', 'skipped': skipped}, status=400)
+        
+        # The rows are claimed by the batch right away, so the regular ingestion queue skips them
+        tenant = str(request.data.get('tenant', ''))[:64]
+        with transaction.atomic():
+            batch = IngestionBatch.objects.create(total_files=len(saved))
+            Document.objects.bulk_create([
+                Document(
+                    title=name,
+                    file_path=file_path,
+                    file_type=name.split('.')[-1][:10],
+                    file_size=size,
+                    processing_status='processing',
+                    status_message=QUEUED_MESSAGE,
+                    tenant=tenant,
+                    batch=batch
+                )
+                for name, file_path, size in saved
+            ], batch_size=500)
+        
+        get_bulk_ingestion().submit(batch.id)
+        
+        return Response({
+            'batch_id': batch.id,
+            'files': len(saved),
+            'documents': list(batch.documents.order_by('id').values('id', 'title')),
+            'skipped': skipped,
+            'status_url': f'/api/documents/bulk/{batch.id}/status/'
+        }, status=202)
+    
+    except Exception as e:
+        logger.exception("Bulk upload error: %s", e)
+        return Response({'error': f'Upload failed: {str(e)}'}, status=500)
+
+
+@csrf_exempt
+@api_view(['GET'])
+def bulk_status(request, batch_id):
+    """Per-file outcomes of a bulk upload, with aggregate throughput"""
+    try:
+        batch = IngestionBatch.objects.get(id=batch_id)
+    except IngestionBatch.DoesNotExist:
+        return Response({'error': 'Batch not found'}, status=404)
+    
+    documents = [{
+        'id': doc['id'],
+        'title': doc['title'],
+        'status': doc['processing_status'],
+        'progress': doc['progress'],
+        'message': doc['status_message']
+    } for doc in batch.documents.order_by('id').values(
+        'id', 'title', 'processing_status', 'progress', 'status_message')]
+    
+    counts = {'pending': 0, 'processing': 0, 'completed': 0, 'failed': 0}
+    for doc in documents:
+        counts[doc['status']] = counts.get(doc['status'], 0) + 1
+    # Documents re-queued after a restart finish through the regular queue
+    finished = counts['pending'] == 0 and counts['processing'] == 0
+    
+    throughput = batch.summary or None
+    if not throughput and batch.started_at:
+        elapsed = max((timezone.now() - batch.started_at).total_seconds(), 1e-9)
+        throughput = {
+            'seconds': round(elapsed, 3),
+            'files_per_second': round(counts['completed'] / elapsed, 2)
+        }
+    
+    return Response({
+        'batch_id': batch.id,
+        'status': 'completed' if finished else 'processing',
+        'files': batch.total_files,
+        'counts': counts,
+        'throughput': throughput,
+        'created_at': batch.created_at,
+        'started_at': batch.started_at,
+        'finished_at': batch.finished_at,
+        'documents': documents
+    })
+
+
+@csrf_exempt
+@api_view(['GET'])
+def document_status(request, document_id):
+    """Poll the ingestion status of a document"""
+    document = (Document.objects.filter(id=document_id)
+                .values('id', 'processing_status', 'progress', 'status_message', 'updated_at').first())
+    if document is None:
+        return Response({'error': 'Document not found'}, status=404)
+    
+    # Every status write refreshes updated_at
+    etag = f'"{document["id"]}-{document["updated_at"].timestamp()}"'
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if _not_modified(request, etag):
+        return Response(status=304, headers=headers)
+    return Response({
+        'id': document['id'],
+        'job_id': document['id'],
+        'status': document['processing_status'],
+        'progress': document['progress'],
+        'message': document['status_message'],
+        'updated_at': document['updated_at']
+    }, headers=headers)
+
+
+def _parse_timeout(data):
+    """Read the optional per-request deadline (seconds) from the request body"""
+    timeout = data.get('timeout')
+    if timeout in (None, ''):
+        return None, None
+    try:
+        timeout = float(timeout)
+    except (TypeError, ValueError):
+        return None, 'timeout must be a number of seconds'
+    if timeout <= 0:
+        return None, 'timeout must be positive'
+    return min(timeout, getattr(settings, 'OLLAMA_MAX_TIMEOUT', 300)), None
+
+
+def _wants_timings(request):
+    """Whether the client asked for the per-stage timing breakdown (body "timings" or ?timings=1)"""
+    value = request.data.get('timings', request.query_params.get('timings', False))
+    return str(value).lower() in ('true', '1', 'yes')
+
+
 @csrf_exempt
 @api_view(['POST'])
 def query_document(request):
@@ -95,35 +321,142 @@ def query_document(request):
     if not question:
         return Response({'error': 'Question required'}, status=400)
     
-    answer = rag_engine.query_documents(question, document_id)
-    print(f"Answer generated: {answer}")
+    timeout, error = _parse_timeout(request.data)
+    if error:
+        return Response({'error': error}, status=400)
+    
+    with collect_timings(_wants_timings(request)) as timings:
+        answer = get_engine().query_documents(question, document_id, timeout=timeout)
+    logger.debug("Answer generated: %s", answer)
+    if timings:
+        return Response({'answer': answer, 'timings': timings.as_dict()})
     return Response({'answer': answer})
 
+@csrf_exempt
+@api_view(['POST'])
+def query_document_stream(request):
+    """Stream the answer as server-sent events: sources first, then tokens"""
+    document_id = request.data.get('document_id')
+    question = request.data.get('question')
+    
+    if not question:
+        return Response({'error': 'Question required'}, status=400)
+    
+    timeout, error = _parse_timeout(request.data)
+    if error:
+        return Response({'error': error}, status=400)
+    
+    def event_stream():
+        # When the client disconnects the server closes this generator, which
+        # closes the Ollama stream and cancels the generation upstream.
+        events = get_engine().stream_query(question, document_id, timeout=timeout)
+        try:
+            for event, data in events:
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            events.close()
+    
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@csrf_exempt
+@api_view(['POST'])
+def query_document_batch(request):
+    """Answer a list of questions; results are streamed as NDJSON lines as each one is ready"""
+    items = request.data.get('questions')
+    default_document_id = request.data.get('document_id')
+    
+    if not isinstance(items, list) or not items:
+        return Response({'error': 'questions must be a non-empty list'}, status=400)
+    
+    max_questions = getattr(settings, 'BATCH_QUERY_MAX_QUESTIONS', 100)
+    if len(items) > max_questions:
+        return Response({'error': f'At most {max_questions} questions per request'}, status=400)
+    
+    questions = []
+    document_ids = []
+    for item in items:
+        # Either a plain question or {"question": ..., "document_id": ...}
+        if isinstance(item, dict):
+            question = item.get('question')
+            document_id = item.get('document_id', default_document_id)
+        else:
+            question, document_id = item, default_document_id
+        if not isinstance(question, str):
+            return Response({'error': 'Each question must be a string'}, status=400)
+        questions.append(question)
+        document_ids.append(document_id)
+    
+    timeout, error = _parse_timeout(request.data)
+    if error:
+        return Response({'error': error}, status=400)
+    
+    results = get_engine().query_batch(questions, document_ids, timeout=timeout)
+    
+    if str(request.data.get('stream', True)).lower() in ('false', '0'):
+        ordered = [None] * len(questions)
+        with collect_timings(_wants_timings(request)) as timings:
+            for index, result in results:
+                ordered[index] = {'index': index, **result}
+        if timings:
+            return Response({'results': ordered, 'timings': timings.as_dict()})
+        return Response({'results': ordered})
+    
+    def result_stream():
+        # Closing the generator on disconnect cancels generations not started yet
+        try:
+            for index, result in results:
+                yield json.dumps({'index': index, **result}) + "\n"
+        finally:
+            results.close()
+    
+    response = StreamingHttpResponse(result_stream(), content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@csrf_exempt
+@api_view(['GET'])
+def readiness_status(request):
+    """Readiness probe: 200 once the embedding model is loaded and warm, 503 before"""
+    status_info = readiness()
+    return Response(status_info, status=200 if status_info['ready'] else 503)
+
 @csrf_exempt
 @api_view(['GET'])
 def debug_status(request):
     """Debug endpoint to check system status"""
     try:
-        # Check database
-        documents = Document.objects.all()
-        db_count = documents.count()
-        
-        # Check ChromaDB
-        collection_count = rag_engine.collection.count()
-        
-        # Get document details
-        doc_details = []
-        for doc in documents:
-            doc_details.append({
-                'id': doc.id,
-                'title': doc.title,
-                'status': doc.processing_status,
-                'file_path': doc.file_path
-            })
+        # Cached counts; the table is not scanned
+        status_counts = DocumentCounter.status_counts()
+        
+        # Chunk count from the local document index rather than the vector store
+        rag_engine = get_engine()
+        collection_count = rag_engine.document_index.total()
+        
+        # Most recent documents only; page through /api/documents/ for the rest
+        doc_details = [{
+            'id': doc['id'],
+            'title': doc['title'],
+            'status': doc['processing_status'],
+            'file_path': doc['file_path']
+        } for doc in Document.objects.order_by('-created_at', '-id')
+            .values('id', 'title', 'processing_status', 'file_path')[:getattr(settings, 'DEBUG_STATUS_DOCUMENTS', 50)]]
         
         return Response({
-            'database_documents': db_count,
+            'database_documents': sum(status_counts.values()),
+            'document_counts': status_counts,
             'chromadb_items': collection_count,
+            'vector_store': rag_engine.store.name,
+            'answer_cache': rag_engine.answer_cache.stats() if rag_engine.answer_cache else None,
+            'embedding_cache': rag_engine.embedding_cache.stats() if rag_engine.embedding_cache else None,
+            'query_batching': rag_engine.query_dispatcher.stats() if rag_engine.query_dispatcher else None,
+            'context_packing': rag_engine.context_packer.stats() if rag_engine.context_packer else None,
+            'confidence_gating': rag_engine.confidence_gate.stats() if rag_engine.confidence_gate else None,
+            'llm': rag_engine.llm.stats(),
+            'readiness': readiness(),
             'documents': doc_details
         })
     except Exception as e:
@@ -132,30 +465,43 @@ def debug_status(request):
 @csrf_exempt
 @api_view(['POST'])
 def reprocess_document(request, document_id):
-    """Reprocess a specific document"""
+    """Queue a document for processing again; a run already in progress is refused with 409"""
     try:
-        document = Document.objects.get(id=document_id)
-        full_file_path = default_storage.path(document.file_path)
-        
-        document.processing_status = 'processing'
-        document.save()
+        if not Document.objects.filter(id=document_id).exists():
+            return Response({'error': 'Document not found'}, status=404)
         
-        success, message = rag_engine.process_document(document.id, full_file_path)
+        ingestion_queue = get_ingestion_queue()
+        if ingestion_queue.policy == 'reject' and ingestion_queue.is_full():
+            return Response({'error': 'Ingestion queue is full, please retry later'},
+                            status=503, headers={'Retry-After': '30'})
         
-        if success:
-            document.processing_status = 'completed'
-        else:
-            document.processing_status = 'failed'
+        # Conditional, so a worker claiming the row at the same time cannot be run over
+        requeued = Document.objects.filter(id=document_id).exclude(processing_status='processing').update(
+            processing_status='pending',
+            progress=0,
+            status_message=''
+        )
+        if not requeued:
+            return Response({'error': 'Document is already being processed'}, status=409)
         
-        document.save()
+        try:
+            scheduled = ingestion_queue.submit(document_id)
+        except QueueFull as e:
+            # The row stays pending and is picked up by a later sweep
+            scheduled = False
+            logger.warning("Reprocess of document %s deferred: %s", document_id, e)
         
         return Response({
-            'success': success,
-            'message': message,
-            'chromadb_count': rag_engine.collection.count()
-        })
+            'id': document_id,
+            'job_id': document_id,
+            'status': 'pending',
+            'queued': scheduled,
+            'status_url': f'/api/documents/{document_id}/status/'
+        }, status=202)
         
-    except Document.DoesNotExist:
-        return Response({'error': 'Document not found'}, status=404)
     except Exception as e:
         return Response({'error': str(e)}, status=500)
+
+def metrics(request):
+    """Prometheus scrape endpoint for this process's counters and histograms"""
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')